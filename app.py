@@ -1,13 +1,47 @@
 import streamlit as st
 
 # 仅非登录界面时设置宽屏
-if 'logged_in' in st.session_state and st.session_state.get('logged_in', False):
+if st.session_state.get('identity') is not None:
     st.set_page_config(layout="wide")
 
+import os
 import sqlite3
 import pandas as pd
 from datetime import date
 from io import BytesIO
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from app.models.database import db, SCHEMA_VERSION
+from app.models.master_data import master_data
+from app.models.permissions import permission_cache
+from app.utils.export import EXPORT_FORMATS, export_query, remove_export
+from app.utils.logger import log_stats, set_log_context
+from app.models.query_stats import query_stats
+from app.utils.profiler import page_profiler
+from app.utils.money import format_amount, sum_cents
+from app.controllers.auth import (
+    LoginBusyError, authenticate, change_password, hash_new_password, invalidate_users, refresh_identity
+)
+from app.controllers.expense import submit_expense
+from app.controllers.budget import BudgetExceededError, budget_report, save_budgets
+from app.controllers.booking import BookingError, save_voucher
+from app.controllers.sap_posting import (
+    POSTING_STATUS_LABELS, failed_postings_query, posting_of, posting_summary, retry_failed, sap_worker,
+    start_background_posting
+)
+from app.controllers.auto_booking import GROUP_KEYS, GROUP_LABELS, default_group_by, plan_auto_booking, post_auto_booking
+from app.controllers.master_data_import import ImportFormatError, content_hash, import_master_data
+from app.controllers.attachment import (
+    add_attachment, attachment_counts, attachments_of, delete_attachment, preview_of, thumbnail_of
+)
+from app.utils.attachment_store import ALLOWED_EXTENSIONS, AttachmentError, attachment_store
+from app.controllers.notification import mail_sender, outbox_summary, retry_failed_mail, start_background_mail
+from app.controllers.master_data_sync import MasterDataSyncError, sync_master_data, sync_scheduler, sync_state
+from app.utils.sap_client import SapError
+from app.models.queries import (
+    build_expense_search, build_expense_summary, build_entry_search, is_selective_keyword,
+    build_pending_search, build_pending_ids, build_pending_by_ids, build_spend_summary, build_trial_balance,
+    SUMMARY_PERIODS_SQL
+)
 
 # 创建Excel模板下载函数
 def create_excel_template(columns):
@@ -18,193 +52,150 @@ def create_excel_template(columns):
     output.seek(0)
     return output
 
-# 初始化数据库
-conn = sqlite3.connect('expenses.db', check_same_thread=False)
-c = conn.cursor()
+# 导出控件：点击“生成导出文件”才执行查询，结果分块写入临时文件；下载按钮只在生成的这次运行中出现，
+# 按钮读完文件即删除，之后的页面重跑不再读文件
+def export_controls(key, query, params, file_stem, sheet_name):
+    if not has_permission('expense.export'):
+        return
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        fmt = st.selectbox("导出格式", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f][0],
+                           key=f"{key}_export_format")
+    with col2:
+        if st.button("📤 生成导出文件", key=f"{key}_export_build"):
+            with st.spinner("正在生成导出文件..."):
+                path, count = export_query(conn, query, params, fmt=fmt, sheet_name=sheet_name)
+            try:
+                with open(path, 'rb') as f:
+                    st.download_button(
+                        label=f"📥 下载导出文件（{count} 行）",
+                        data=f,
+                        file_name=f"{file_stem}.{fmt}",
+                        mime=EXPORT_FORMATS[fmt][1],
+                        key=f"{key}_export_download"
+                    )
+            finally:
+                remove_export(path)
+
+# 主数据Excel导入：同一文件（按内容哈希）只导入一次，页面重跑时直接显示上次结果
+def import_controls(key, uploaded_file):
+    if uploaded_file is None:
+        return
+    data = uploaded_file.getvalue()
+    digest = content_hash(data)
+    imported = st.session_state.setdefault('master_data_imports', {})
+    if imported.get(key, (None,))[0] != digest:
+        try:
+            with st.spinner("正在导入..."):
+                imported[key] = (digest, import_master_data(key, data))
+        except ImportFormatError as e:
+            st.error(str(e))
+            return
+        except Exception as e:
+            st.error(f"导入失败：{str(e)}")
+            return
+    result = imported[key][1]
+    st.success(f"Excel数据导入成功！共 {result.total} 行，新增 {result.inserted} 行，"
+               f"已存在 {result.skipped} 行，拒绝 {len(result.rejects)} 行（耗时 {result.elapsed:.2f} 秒）")
+    if not result.rejects.empty:
+        st.warning("以下行未导入：")
+        st.dataframe(result.rejects, use_container_width=True)
+
+# 票据附件：上传的文件分块写入附件存储，不读成bytes、不放进会话状态；
+# 保存后换一个上传控件的key，Streamlit随即释放它缓存的上传内容
+def receipt_uploader(key, label="票据附件"):
+    generation = st.session_state.setdefault(f"{key}_generation", 0)
+    return st.file_uploader(label, type=ALLOWED_EXTENSIONS, accept_multiple_files=True, key=f"{key}_{generation}",
+                            help=f"PDF、PNG或JPEG，单个文件不超过 {attachment_store.max_size // (1024 * 1024)}MB")
 
-# 创建费用记录表
-c.execute('''
-    CREATE TABLE IF NOT EXISTS expenses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        expense_date DATE,
-        department TEXT,
-        company TEXT,
-        budget_item TEXT,
-        employee TEXT,
-        amount REAL,
-        description TEXT,
-        status TEXT DEFAULT 'pending'
-    )
-''')
+def save_receipts(key, expense_id, files, uploaded_by):
+    saved = 0
+    for file in files or []:
+        try:
+            add_attachment(expense_id, file, file.name, uploaded_by)
+            saved += 1
+        except AttachmentError as e:
+            st.error(f"{file.name}：{str(e)}")
+    if saved:
+        st.success(f"已上传 {saved} 个附件")
+    st.session_state[f"{key}_generation"] += 1
+    return saved
 
-# 创建配置表
-c.execute('''
-    CREATE TABLE IF NOT EXISTS config (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        key TEXT NOT NULL,
-        code TEXT NOT NULL,
-        description TEXT NOT NULL,
-        sap_code TEXT NOT NULL,
-        sap_description TEXT NOT NULL,
-        UNIQUE(key, code, description)
-    )
-''')
+def format_size(size):
+    return f"{size / (1024 * 1024):.1f}MB" if size >= 1024 * 1024 else f"{max(size // 1024, 1)}KB"
 
-# 创建角色表
-c.execute('''
-    CREATE TABLE IF NOT EXISTS roles (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        role_name TEXT NOT NULL,
-        description TEXT,
-        UNIQUE(role_name)
-    )
-''')
+# 报销看板：从汇总表按维度取数，主数据编码换成描述
+def spend_summary(dimensions, filters):
+    query, params = build_spend_summary(dimensions, **filters)
+    df = pd.read_sql_query(query, db.connection(), params=params)
+    for key in dimensions:
+        if key in ('company', 'department', 'budget_item'):
+            df[key] = [master_data.description_of(key, code) or code or '（空）' for code in df[key]]
+    return df
 
-# 创建权限表
-c.execute('''
-    CREATE TABLE IF NOT EXISTS permissions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        module_name TEXT NOT NULL,
-        permission_name TEXT NOT NULL,
-        description TEXT,
-        UNIQUE(module_name, permission_name)
-    )
-''')
+# 权限：登录时按角色解析成位图存入会话身份，鉴权只做位运算
+def has_permission(required_permission):
+    return st.session_state.identity.has_permission(required_permission)
 
-# 创建角色权限关联表
-c.execute('''
-    CREATE TABLE IF NOT EXISTS role_permissions (
-        role_id INTEGER,
-        permission_id INTEGER,
-        FOREIGN KEY (role_id) REFERENCES roles (id),
-        FOREIGN KEY (permission_id) REFERENCES permissions (id),
-        PRIMARY KEY (role_id, permission_id)
-    )
-''')
+# 本次重跑已创建的控件数，页面性能分析用
+def widget_count():
+    ctx = get_script_run_ctx()
+    return len(ctx.widget_ids_this_run) if ctx is not None else 0
 
-# 创建用户表
-c.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        user_name TEXT NOT NULL,
-        password TEXT NOT NULL,
-        role_id INTEGER,
-        company_code TEXT,
-        department_code TEXT,
-        FOREIGN KEY (role_id) REFERENCES roles (id),
-        UNIQUE(user_id)
-    )
-''')
+# 各页面需要的权限（具备其一即可访问）
+PAGE_PERMISSIONS = {
+    "报销采集": ('expense.create',),
+    "报销查看": ('expense.view',),
+    "主数据管理": ('master_data.manage',),
+    "用户角色管理": ('role.manage', 'user.manage'),
+    "报销记账": ('expense.book',),
+    "记账查看": ('expense.book',),
+    "报销看板": ('expense.view',),
+    # 不对应具体权限，仅管理员可见
+    "系统诊断": (),
+}
 
-# 创建记账记录表（如未存在）
-c.execute('''
-    CREATE TABLE IF NOT EXISTS expense_bookings (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        expense_id INTEGER,
-        booking_date DATE,
-        sap_account_code TEXT,
-        sap_account_desc TEXT,
-        sap_cost_center_code TEXT,
-        sap_cost_center_desc TEXT,
-        debit_amount REAL,
-        credit_amount REAL,
-        sap_employee_code TEXT,
-        sap_employee_desc TEXT,
-        FOREIGN KEY (expense_id) REFERENCES expenses (id)
-    )
-''')
+# 建表、老库升级和默认数据初始化按结构版本每个进程只执行一次，页面重跑不再执行DDL或写操作
+@st.cache_resource
+def init_database(schema_version):
+    db.bootstrap()
+    return schema_version
 
-# 创建entry表（如未存在）
-c.execute('''
-    CREATE TABLE IF NOT EXISTS entry (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        voucher_no INTEGER,
-        expense_id INTEGER,
-        entry_type TEXT,
-        booking_date DATE,
-        sap_account_code TEXT,
-        sap_account_desc TEXT,
-        sap_cost_center_code TEXT,
-        sap_cost_center_desc TEXT,
-        debit_amount REAL,
-        credit_amount REAL,
-        sap_employee_code TEXT,
-        sap_employee_desc TEXT,
-        voucher_date DATE,
-        post_date DATE
-    )
-''')
+init_database(SCHEMA_VERSION)
 
-# 确保expenses表有status字段（兼容老库自动升级）
-try:
-    c.execute("SELECT status FROM expenses LIMIT 1")
-except Exception:
-    c.execute("ALTER TABLE expenses ADD COLUMN status TEXT DEFAULT 'pending'")
-    conn.commit()
+# SAP过账发送线程每个进程启动一次；保存凭证只写过账队列，不等待SAP
+@st.cache_resource
+def init_sap_posting():
+    return start_background_posting()
 
-# 确保users表有company_code和department_code字段（兼容老库自动升级）
-try:
-    c.execute("SELECT company_code FROM users LIMIT 1")
-except Exception:
-    c.execute("ALTER TABLE users ADD COLUMN company_code TEXT")
-    conn.commit()
-try:
-    c.execute("SELECT department_code FROM users LIMIT 1")
-except Exception:
-    c.execute("ALTER TABLE users ADD COLUMN department_code TEXT")
-    conn.commit()
+init_sap_posting()
 
-# 初始化默认权限
-default_permissions = [
-    ('expense', 'create', '创建报销记录'),
-    ('expense', 'view', '查看报销记录'),
-    ('expense', 'export', '导出报销记录'),
-    ('expense', 'book', '报销记账'),
-    ('master_data', 'manage', '管理主数据'),
-    ('user', 'manage', '管理用户'),
-    ('role', 'manage', '管理角色')
-]
+# 邮件通知发送线程每个进程启动一次；提交和记账只写通知事件，不连接邮件服务器
+@st.cache_resource
+def init_mail_sender():
+    return start_background_mail()
 
-for module, perm, desc in default_permissions:
-    c.execute("INSERT OR IGNORE INTO permissions (module_name, permission_name, description) VALUES (?, ?, ?)",
-             (module, perm, desc))
+init_mail_sender()
 
-# 确保至少有一个管理员角色
-admin_role = c.execute("SELECT id FROM roles WHERE role_name='admin'").fetchone()
-if not admin_role:
-    c.execute("INSERT INTO roles (role_name, description) VALUES (?, ?)", 
-             ("admin", "系统管理员"))
-    admin_role_id = c.execute("SELECT id FROM roles WHERE role_name='admin'").fetchone()[0]
-    # 为管理员角色分配所有权限
-    for perm_id in c.execute("SELECT id FROM permissions").fetchall():
-        c.execute("INSERT OR IGNORE INTO role_permissions (role_id, permission_id) VALUES (?, ?)",
-                 (admin_role_id, perm_id[0]))
+@st.cache_resource
+def init_master_data_sync():
+    return sync_scheduler.start()
 
-# 确保至少有一个管理员用户
-admin_user = c.execute("SELECT id FROM users WHERE user_id='admin'").fetchone()
-if not admin_user:
-    admin_role_id = c.execute("SELECT id FROM roles WHERE role_name='admin'").fetchone()[0]
-    c.execute("INSERT INTO users (user_id, user_name, password, role_id) VALUES (?, ?, ?, ?)", 
-             ("admin", "管理员", "admin123", admin_role_id))
+init_master_data_sync()
 
-conn.commit()
+# 初始化数据库（连接池按脚本线程分配WAL模式连接，本次运行结束后自动回收）
+conn = db.connection()
+c = conn.cursor()
 
 # 初始化 session state
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
+if 'identity' not in st.session_state:
+    st.session_state.identity = None
 
-if 'user_id' not in st.session_state:
-    st.session_state.user_id = ""
-    
-if 'user_role' not in st.session_state:
-    st.session_state.user_role = ""
-    
 if 'current_page' not in st.session_state:
     st.session_state.current_page = "报销采集"
 
 # 登录界面
-if not st.session_state.logged_in:
+if st.session_state.identity is None:
     st.title("🔐 登录系统")
     
     with st.form("login_form"):
@@ -213,34 +204,71 @@ if not st.session_state.logged_in:
         submitted = st.form_submit_button("登录")
         
         if submitted:
-            user = c.execute("SELECT user_id, user_name, role_id FROM users WHERE user_id=? AND password=?", 
-                           (user_id, password)).fetchone()
+            # bcrypt校验在登录线程池中进行，不在脚本线程里占用CPU
+            try:
+                user = authenticate(user_id, password)
+            except LoginBusyError as e:
+                user = None
+                st.warning(str(e))
+            else:
+                if user is None:
+                    st.error("用户ID或密码错误！")
             if user:
-                st.session_state.logged_in = True
-                st.session_state.user_id = user[0]
-                st.session_state.user_role = c.execute("SELECT role_name FROM roles WHERE id=?", (user[2],)).fetchone()[0]
-                st.success(f"欢迎回来，{user[1]}！")
+                st.session_state.identity = user
+                st.success(f"欢迎回来，{user.user_name}！")
                 st.experimental_rerun()
-            else:
-                st.error("用户ID或密码错误！")
     
-    st.info("默认管理员账号: admin / 密码: admin123")
+    st.info("新安装时管理员账号为 admin，初始密码见环境变量 ADMIN_INITIAL_PASSWORD 或应用日志，首次登录后须修改")
+    st.stop()
+
+# 会话身份在登录时解析一次；用户、角色权限或主数据修改后才从缓存和数据库重新解析
+identity = refresh_identity(st.session_state.identity)
+if identity is None:
+    # 用户已被删除
+    st.session_state.identity = None
+    st.experimental_rerun()
+st.session_state.identity = identity
+
+# 初始密码或默认密码：修改之前不进入任何页面
+if identity.must_change_password:
+    st.title("🔑 修改初始密码")
+    st.warning("当前账号仍在使用初始密码，请先修改密码")
+    with st.form("change_password_form"):
+        new_password = st.text_input("新密码", type="password")
+        confirm_password = st.text_input("确认新密码", type="password")
+        if st.form_submit_button("修改密码"):
+            if len(new_password) < 8:
+                st.error("新密码至少8位！")
+            elif new_password != confirm_password:
+                st.error("两次输入的密码不一致！")
+            else:
+                try:
+                    change_password(identity, new_password)
+                except LoginBusyError as e:
+                    st.error(str(e))
+                else:
+                    st.session_state.identity = refresh_identity(identity)
+                    st.experimental_rerun()
     st.stop()
 
 # 页面选择
 st.sidebar.title("导航")
-st.sidebar.write(f"当前用户: {st.session_state.user_id}")
+st.sidebar.write(f"当前用户: {identity.user_id}")
 
 # 登出按钮
 if st.sidebar.button("登出"):
-    st.session_state.logged_in = False
-    st.session_state.user_id = ""
-    st.session_state.user_role = ""
+    st.session_state.identity = None
     st.experimental_rerun()
 
 # 创建导航按钮（每行2个，等高等宽，均匀分布）
-nav_labels = ["📝 报销采集", "🔍 报销查看", "📊 主数据管理", "👥 用户角色管理", "📖 报销记账", "📑 记账查看"]
-nav_pages = ["报销采集", "报销查看", "主数据管理", "用户角色管理", "报销记账", "记账查看"]
+nav_labels = ["📝 报销采集", "🔍 报销查看", "📊 主数据管理", "👥 用户角色管理", "📖 报销记账", "📑 记账查看", "📈 报销看板",
+              "🩺 系统诊断"]
+nav_pages = ["报销采集", "报销查看", "主数据管理", "用户角色管理", "报销记账", "记账查看", "报销看板", "系统诊断"]
+# 只显示有权限的页面
+allowed = [(label, page) for label, page in zip(nav_labels, nav_pages)
+           if (any(has_permission(p) for p in PAGE_PERMISSIONS[page]) if PAGE_PERMISSIONS[page] else identity.is_admin)]
+nav_labels = [label for label, _ in allowed]
+nav_pages = [page for _, page in allowed]
 nav_pairs = [nav_labels[i:i+2] for i in range(0, len(nav_labels), 2)]
 nav_page_pairs = [nav_pages[i:i+2] for i in range(0, len(nav_pages), 2)]
 for pair_labels, pair_pages in zip(nav_pairs, nav_page_pairs):
@@ -250,808 +278,1127 @@ for pair_labels, pair_pages in zip(nav_pairs, nav_page_pairs):
             st.session_state.current_page = page
 st.sidebar.markdown('---')
 
-# 根据 session state 显示对应页面
-if st.session_state.current_page == "报销采集":
-    st.title("➕ 报销采集")
-    with st.form("expense_form"):
-        expense_date = st.date_input("日期", value=date.today())
-        department = st.selectbox("部门", 
-            [row[1] for row in c.execute("SELECT code, description FROM config WHERE key='department'")])
-        company = st.selectbox("公司", 
-            [row[1] for row in c.execute("SELECT code, description FROM config WHERE key='company'")])
-        budget_item = st.selectbox("预算科目", 
-            [row[1] for row in c.execute("SELECT code, description FROM config WHERE key='budget_item'")])
-        # 报销人逻辑
-        if st.session_state.user_role == 'admin':
-            employee = st.selectbox("报销人", 
-                [row[1] for row in c.execute("SELECT code, description FROM config WHERE key='employee'")])
-        else:
-            # 普通用户只能选自己
-            user_info = c.execute("SELECT user_name FROM users WHERE user_id=?", (st.session_state.user_id,)).fetchone()
-            employee = user_info[0] if user_info else ""
-            st.text_input("报销人", value=employee, disabled=True)
-        amount = st.number_input("金额", min_value=0.00, step=0.00)
-        description = st.text_input("摘要 / 说明")
-        submitted = st.form_submit_button("提交")
-        if submitted:
-            dept_code = c.execute("SELECT code FROM config WHERE key='department' AND description=?", (department,)).fetchone()[0]
-            comp_code = c.execute("SELECT code FROM config WHERE key='company' AND description=?", (company,)).fetchone()[0]
-            budget_code = c.execute("SELECT code FROM config WHERE key='budget_item' AND description=?", (budget_item,)).fetchone()[0]
-            if st.session_state.user_role == 'admin':
-                emp_code = c.execute("SELECT code FROM config WHERE key='employee' AND description=?", (employee,)).fetchone()[0]
-            else:
-                # 普通用户自动用自己
-                emp_code = c.execute("SELECT code FROM config WHERE key='employee' AND description=?", (employee,)).fetchone()[0]
-            c.execute('''
-                INSERT INTO expenses (expense_date, department, company, budget_item, employee, amount, description, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, 'pending')
-            ''', (expense_date, dept_code, comp_code, budget_code, emp_code, amount, description))
-            conn.commit()
-            st.success("✅ 记录已保存！")
+if not nav_pages:
+    st.warning("当前角色没有任何页面的访问权限，请联系管理员")
+    st.stop()
+if st.session_state.current_page not in nav_pages:
+    st.session_state.current_page = nav_pages[0]
+# 本次重跑的日志带上用户和页面
+set_log_context(user=identity.user_id, page=st.session_state.current_page)
 
-elif st.session_state.current_page == "报销查看":
-    st.title("📊 报销记录查看")
-    # 筛选条件
-    col1, col2 = st.columns(2)
-    with col1:
-        filter_department = st.selectbox("筛选部门", [""] + 
-            [row[1] for row in c.execute("SELECT code, description FROM config WHERE key='department'")])
-        filter_employee = st.selectbox("筛选报销人", [""] + 
-            [row[1] for row in c.execute("SELECT code, description FROM config WHERE key='employee'")])
-    with col2:
-        filter_company = st.selectbox("筛选公司", [""] + 
-            [row[1] for row in c.execute("SELECT code, description FROM config WHERE key='company'")])
-        filter_budget = st.selectbox("筛选预算科目", [""] + 
-            [row[1] for row in c.execute("SELECT code, description FROM config WHERE key='budget_item'")])
-    amount_col1, amount_col2 = st.columns(2)
-    with amount_col1:
-        min_amount = st.number_input("金额范围（从）", value=0.0, step=100.0)
-    with amount_col2:
-        max_amount = st.number_input("金额范围（至）", value=0.0, step=100.0)
-    if max_amount > 0 and max_amount < min_amount:
-        st.warning("最大金额不能小于最小金额")
-        max_amount = min_amount
-    search_clicked = st.button("🔍 执行搜索")
-    if search_clicked:
-        query = "SELECT e.expense_date as '日期', \
-                d.description as '部门', \
-                c.description as '公司', \
-                b.description as '预算科目', \
-                em.description as '报销人', \
-                e.amount as '金额', \
-                e.description as '摘要' \
-                FROM expenses e \
-                LEFT JOIN config d ON e.department = d.code AND d.key = 'department' \
-                LEFT JOIN config c ON e.company = c.code AND c.key = 'company' \
-                LEFT JOIN config b ON e.budget_item = b.code AND b.key = 'budget_item' \
-                LEFT JOIN config em ON e.employee = em.code AND em.key = 'employee'"
-        where_clauses = []
-        if st.session_state.user_role != 'admin':
-            # 普通用户只能看自己
-            user_info = c.execute("SELECT user_name FROM users WHERE user_id=?", (st.session_state.user_id,)).fetchone()
-            if user_info:
-                emp_code = c.execute("SELECT code FROM config WHERE key='employee' AND description=?", (user_info[0],)).fetchone()[0]
-                where_clauses.append(f"e.employee='{emp_code}'")
-        if filter_department:
-            dept_code = c.execute("SELECT code FROM config WHERE key='department' AND description=?", 
-                                (filter_department,)).fetchone()[0]
-            where_clauses.append(f"e.department='{dept_code}'")
-        if filter_company:
-            comp_code = c.execute("SELECT code FROM config WHERE key='company' AND description=?", 
-                                (filter_company,)).fetchone()[0]
-            where_clauses.append(f"e.company='{comp_code}'")
-        if filter_employee:
-            emp_code = c.execute("SELECT code FROM config WHERE key='employee' AND description=?", 
-                                (filter_employee,)).fetchone()[0]
-            where_clauses.append(f"e.employee='{emp_code}'")
-        if filter_budget:
-            budget_code = c.execute("SELECT code FROM config WHERE key='budget_item' AND description=?", 
-                                (filter_budget,)).fetchone()[0]
-            where_clauses.append(f"e.budget_item='{budget_code}'")
-        if min_amount > 0:
-            where_clauses.append(f"e.amount >= {min_amount}")
-        if max_amount > 0:
-            where_clauses.append(f"e.amount <= {max_amount}")
-        if where_clauses:
-            query += " WHERE " + " AND ".join(where_clauses)
-        query += " ORDER BY expense_date DESC"
-        df = pd.read_sql_query(query, conn)
-        st.dataframe(df)
-        # 导出功能
-        from io import BytesIO
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Expenses')
-        output.seek(0)
-        st.download_button(
-            label="📥 导出为 Excel",
-            data=output,
-            file_name='expenses.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+# 页面性能分析开启时记录本次重跑的总耗时、数据库耗时、控件数和会话状态大小
+with page_profiler.profile(st.session_state.current_page, identity.user_id, st.session_state, widget_count):
+    # 根据 session state 显示对应页面
+    if st.session_state.current_page == "报销采集":
+        st.title("➕ 报销采集")
+        with st.form("expense_form"):
+            expense_date = st.date_input("日期", value=date.today())
+            department = st.selectbox("部门", master_data.descriptions('department'))
+            company = st.selectbox("公司", master_data.descriptions('company'))
+            budget_item = st.selectbox("预算科目", master_data.descriptions('budget_item'))
+            # 报销人逻辑
+            if identity.is_admin:
+                employee = st.selectbox("报销人", master_data.descriptions('employee'))
+            else:
+                # 普通用户只能选自己，显示用户对应员工的主数据姓名
+                employee = master_data.description_of('employee', identity.employee_code) if identity.employee_code else None
+                st.text_input("报销人", value=employee or "（未指定员工编码）", disabled=True)
+            amount = st.number_input("金额", min_value=0.00, step=0.00)
+            description = st.text_input("摘要 / 说明")
+            receipts = receipt_uploader("expense_receipts")
+            submitted = st.form_submit_button("提交")
+            if submitted and not identity.is_admin and not identity.employee_code:
+                st.error("❌ 当前用户未指定员工编码，无法提交报销，请联系管理员在用户管理中设置")
+            elif submitted:
+                dept_code = master_data.code_of('department', department)
+                comp_code = master_data.code_of('company', company)
+                budget_code = master_data.code_of('budget_item', budget_item)
+                # 管理员按所选报销人，普通用户自动用自己
+                emp_code = master_data.code_of('employee', employee) if identity.is_admin else identity.employee_code
+                try:
+                    expense_id, budget_check = submit_expense(expense_date, dept_code, comp_code, budget_code,
+                                                              emp_code, amount, description)
+                    st.success("✅ 记录已保存！")
+                    if receipts:
+                        save_receipts("expense_receipts", expense_id, receipts, identity.user_id)
+                    if budget_check is not None and budget_check.exceeded:
+                        st.warning(f"⚠️ 已超出预算：{budget_check.message()}")
+                except BudgetExceededError as e:
+                    st.error(f"❌ {e}，记录未保存")
+                except ValueError as e:
+                    st.error(f"❌ {e}，记录未保存")
 
-elif st.session_state.current_page == "主数据管理":
-    st.title("📊 主数据管理")
-    config_tabs = st.tabs(["部门", "公司", "预算科目", "报销人"])
-    
-    with config_tabs[0]:
-        st.subheader("部门管理")
-        # 手动添加部分
+    elif st.session_state.current_page == "报销查看":
+        st.title("📊 报销记录查看")
+        # 筛选条件
         col1, col2 = st.columns(2)
         with col1:
-            code = st.text_input("部门编码")
-            sap_code = st.text_input("SAP成本中心", value=code)
-        with col2:
-            desc = st.text_input("部门描述")
-            sap_desc = st.text_input("SAP成本中心描述", value=desc)
-        if st.button("添加部门") and code and desc:
-            try:
-                c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", 
-                        ("department", code, desc, sap_code, sap_desc))
-                conn.commit()
-                st.success(f"部门 '{desc}({code})' 已添加！")
-            except sqlite3.IntegrityError:
-                st.warning(f"部门编码 {code} 或描述 {desc} 已存在！")
-        
-        # Excel导入部分
-        st.divider()
-        st.subheader("批量导入")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"], key="department_uploader")
+            filter_department = st.selectbox("筛选部门", [""] + master_data.descriptions('department'))
+            filter_employee = st.selectbox("筛选报销人", [""] + master_data.descriptions('employee'))
         with col2:
-            dept_template = create_excel_template(["部门编码", "部门描述", "SAP成本中心", "SAP成本中心描述"])
-            st.download_button(
-                label="📥 下载模板",
-                data=dept_template,
-                file_name="部门导入模板.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        if uploaded_file is not None:
-            try:
-                df = pd.read_excel(uploaded_file)
-                if all(col in df.columns for col in ["部门编码", "部门描述", "SAP成本中心", "SAP成本中心描述"]):
-                    for _, row in df.iterrows():
-                        try:
-                            c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
-                                    ("department", row["部门编码"], row["部门描述"], row["SAP成本中心"], row["SAP成本中心描述"]))
-                        except sqlite3.IntegrityError:
-                            continue
+            filter_company = st.selectbox("筛选公司", [""] + master_data.descriptions('company'))
+            filter_budget = st.selectbox("筛选预算科目", [""] + master_data.descriptions('budget_item'))
+        amount_col1, amount_col2 = st.columns(2)
+        with amount_col1:
+            min_amount = st.number_input("金额范围（从）", value=0.0, step=100.0)
+        with amount_col2:
+            max_amount = st.number_input("金额范围（至）", value=0.0, step=100.0)
+        if max_amount > 0 and max_amount < min_amount:
+            st.warning("最大金额不能小于最小金额")
+            max_amount = min_amount
+        keyword = st.text_input("摘要关键字", key="expense_keyword")
+        page_size = st.selectbox("每页条数", [20, 50, 100, 200], index=1, key="expense_page_size")
+        search_clicked = st.button("🔍 执行搜索")
+        if search_clicked:
+            owner = None
+            if not identity.is_admin:
+                # 普通用户只能看自己
+                owner = identity.employee_code or ''
+            # 保存筛选条件，翻页时沿用；游标栈记录每一页的起点，None 为第一页
+            st.session_state.expense_search = {
+                'owner': owner,
+                'employee': master_data.code_of('employee', filter_employee) if filter_employee else None,
+                'department': master_data.code_of('department', filter_department) if filter_department else None,
+                'company': master_data.code_of('company', filter_company) if filter_company else None,
+                'budget_item': master_data.code_of('budget_item', filter_budget) if filter_budget else None,
+                'min_amount': min_amount,
+                'max_amount': max_amount,
+                'keyword': keyword,
+            }
+            # 命中少的关键字改由全文索引驱动，每次搜索探测一次
+            st.session_state.expense_selective = is_selective_keyword(conn, keyword)
+            st.session_state.expense_cursors = [None]
+            st.session_state.expense_summary = None
+        if st.session_state.get('expense_search') is not None:
+            filters = st.session_state.expense_search
+            cursors = st.session_state.expense_cursors
+            # 多取一行判断是否还有下一页
+            query, params = build_expense_search(after=cursors[-1], limit=page_size + 1,
+                                                 selective=st.session_state.get('expense_selective', False), **filters)
+            page_df = pd.read_sql_query(query, conn, params=params)
+            has_next = len(page_df) > page_size
+            page_df = page_df.head(page_size)
+            # 附件数按本页的报销id分组统计，走 (expense_id, sha256) 索引
+            counts = attachment_counts(conn, page_df['id'])
+            page_df['附件'] = [counts.get(int(expense_id), 0) for expense_id in page_df['id']]
+            st.dataframe(page_df.drop(columns=['id']), use_container_width=True)
+
+            nav_col1, nav_col2, nav_col3 = st.columns([1, 1, 4])
+            with nav_col1:
+                if st.button("⬅️ 上一页", disabled=len(cursors) == 1):
+                    cursors.pop()
+                    st.experimental_rerun()
+            with nav_col2:
+                if st.button("下一页 ➡️", disabled=not has_next):
+                    last = page_df.iloc[-1]
+                    cursors.append((last['日期'], int(last['id'])))
+                    st.experimental_rerun()
+            with nav_col3:
+                st.write(f"第 {len(cursors)} 页")
+
+            # 汇总单独查询，每次搜索只算一次，翻页不重复统计
+            if st.session_state.get('expense_summary') is None:
+                summary_sql, summary_params = build_expense_summary(**filters)
+                count, total = c.execute(summary_sql, summary_params).fetchone()
+                st.session_state.expense_summary = (count, total)
+            count, total = st.session_state.expense_summary
+            st.markdown(f"**共 {count} 条，金额合计：{total:.2f}**")
+
+            with st.expander("票据附件"):
+                # 只能选本页的报销，普通用户本页只有自己的记录；页面上只放缩略图和当前选中的一个附件
+                expense_options = {int(row['id']): f"{row['日期']}  {row['报销人']}  {row['金额']:.2f}  {row['摘要'] or ''}"
+                                   for _, row in page_df.iterrows()}
+                selected_expense = st.selectbox("报销记录", list(expense_options), format_func=expense_options.get,
+                                                key="attachment_expense")
+                if selected_expense is not None:
+                    attachments = attachments_of(conn, selected_expense)
+                    if attachments:
+                        thumb_cols = st.columns(4)
+                        for i, row in enumerate(attachments):
+                            with thumb_cols[i % 4]:
+                                thumbnail = thumbnail_of(row)
+                                if thumbnail:
+                                    st.image(thumbnail)
+                                st.caption(f"{row['file_name']}（{format_size(row['size'])}）")
+                        attachment_labels = {row['id']: row for row in attachments}
+                        selected_attachment = st.selectbox("查看附件", list(attachment_labels),
+                                                           format_func=lambda i: attachment_labels[i]['file_name'],
+                                                           key="attachment_selected")
+                        row = attachment_labels[selected_attachment]
+                        preview = preview_of(row)
+                        if preview:
+                            st.image(preview)
+                        else:
+                            st.info("该附件无法预览，请下载查看")
+                        action_col1, action_col2 = st.columns(2)
+                        with action_col1:
+                            # 点了下载才读文件生成下载按钮，翻页、切换报销的重跑不读附件内容
+                            if st.button("下载", key="attachment_prepare_download"):
+                                with attachment_store.open(row['sha256']) as attachment_file:
+                                    st.download_button("保存附件", attachment_file, file_name=row['file_name'],
+                                                       mime=row['content_type'], key="attachment_download")
+                        with action_col2:
+                            if (identity.is_admin or row['uploaded_by'] == identity.user_id) and st.button("删除附件"):
+                                delete_attachment(row['id'])
+                                st.experimental_rerun()
+                    else:
+                        st.caption("该报销还没有附件")
+                    more_receipts = receipt_uploader("more_receipts", "补充附件")
+                    if more_receipts and st.button("上传附件"):
+                        # 全部上传成功时刷新列表，有失败的保留错误提示
+                        if save_receipts("more_receipts", selected_expense, more_receipts, identity.user_id) == len(more_receipts):
+                            st.experimental_rerun()
+
+            # 导出功能
+            export_query_sql, export_params = build_expense_search(with_id=False, **filters)
+            export_controls('expense', export_query_sql, export_params, 'expenses', 'Expenses')
+
+    elif st.session_state.current_page == "主数据管理":
+        st.title("📊 主数据管理")
+        with st.expander("SAP主数据同步"):
+            # 只拉取上次水位之后的变更，按SAP代码更新成本中心、核算科目、公司代码和员工
+            state = sync_state(conn)
+            if state is None:
+                st.caption("尚未同步过，首次同步会拉取SAP全部主数据")
+            else:
+                st.caption(f"上次同步：{state['synced_at']}，水位 {state['watermark']}")
+                if state['last_result']:
+                    st.json(state['last_result'])
+            if sync_scheduler.running:
+                st.caption(f"定时同步运行中，间隔 {sync_scheduler.interval:g} 秒")
+            if sync_scheduler.last_error:
+                st.warning(f"上次定时同步失败：{sync_scheduler.last_error}")
+            if st.button("立即同步"):
+                try:
+                    with st.spinner("正在同步..."):
+                        result = sync_master_data()
+                    st.success(f"同步完成：收到 {result.received} 条变更，更新 {result.updated} 条，"
+                               f"新增 {result.inserted} 条，未映射 {result.unmapped} 条")
+                except (SapError, MasterDataSyncError) as e:
+                    st.error(f"同步失败：{str(e)}")
+        config_tabs = st.tabs(["部门", "公司", "预算科目", "报销人", "预算"])
+    
+        with config_tabs[0]:
+            st.subheader("部门管理")
+            # 手动添加部分
+            col1, col2 = st.columns(2)
+            with col1:
+                code = st.text_input("部门编码")
+                sap_code = st.text_input("SAP成本中心", value=code)
+            with col2:
+                desc = st.text_input("部门描述")
+                sap_desc = st.text_input("SAP成本中心描述", value=desc)
+            if st.button("添加部门") and code and desc:
+                try:
+                    c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", 
+                            ("department", code, desc, sap_code, sap_desc))
                     conn.commit()
-                    st.success("Excel数据导入成功！")
-                else:
-                    st.error("Excel文件格式不正确！请确保包含：部门编码、部门描述、SAP成本中心、SAP成本中心描述")
-            except Exception as e:
-                st.error(f"导入失败：{str(e)}")
+                    master_data.invalidate()
+                    st.success(f"部门 '{desc}({code})' 已添加！")
+                except sqlite3.IntegrityError:
+                    st.warning(f"部门编码 {code} 或描述 {desc} 已存在！")
         
-        # 显示部门列表
-        st.divider()
-        st.subheader("部门列表")
-        dept_df = pd.read_sql_query("SELECT code AS 编码, description AS 描述, sap_code AS 'SAP成本中心', sap_description AS 'SAP成本中心描述' FROM config WHERE key='department' ORDER BY code", conn)
-        st.dataframe(dept_df)
-
-    with config_tabs[1]:
-        st.subheader("公司管理")
-        # 手动添加部分
-        col1, col2 = st.columns(2)
-        with col1:
-            code = st.text_input("公司编码")
-            sap_code = st.text_input("SAP公司代码", value=code)
-        with col2:
-            desc = st.text_input("公司描述")
-            sap_desc = st.text_input("SAP公司描述", value=desc)
-        if st.button("添加公司") and code and desc:
-            try:
-                c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", 
-                        ("company", code, desc, sap_code, sap_desc))
-                conn.commit()
-                st.success(f"公司 '{desc}({code})' 已添加！")
-            except sqlite3.IntegrityError:
-                st.warning(f"公司编码 {code} 或描述 {desc} 已存在！")
+            # Excel导入部分
+            st.divider()
+            st.subheader("批量导入")
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"], key="department_uploader")
+            with col2:
+                dept_template = create_excel_template(["部门编码", "部门描述", "SAP成本中心", "SAP成本中心描述"])
+                st.download_button(
+                    label="📥 下载模板",
+                    data=dept_template,
+                    file_name="部门导入模板.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+            import_controls('department', uploaded_file)
         
-        # Excel导入部分
-        st.divider()
-        st.subheader("批量导入")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"], key="company_uploader")
-        with col2:
-            comp_template = create_excel_template(["公司编码", "公司描述", "SAP公司代码", "SAP公司描述"])
-            st.download_button(
-                label="📥 下载模板",
-                data=comp_template,
-                file_name="公司导入模板.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        if uploaded_file is not None:
-            try:
-                df = pd.read_excel(uploaded_file)
-                if all(col in df.columns for col in ["公司编码", "公司描述", "SAP公司代码", "SAP公司描述"]):
-                    for _, row in df.iterrows():
-                        try:
-                            c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
-                                    ("company", row["公司编码"], row["公司描述"], row["SAP公司代码"], row["SAP公司描述"]))
-                        except sqlite3.IntegrityError:
-                            continue
+            # 显示部门列表
+            st.divider()
+            st.subheader("部门列表")
+            dept_df = pd.DataFrame(master_data.entries('department'), columns=['编码', '描述', 'SAP成本中心', 'SAP成本中心描述'])
+            st.dataframe(dept_df)
+
+        with config_tabs[1]:
+            st.subheader("公司管理")
+            # 手动添加部分
+            col1, col2 = st.columns(2)
+            with col1:
+                code = st.text_input("公司编码")
+                sap_code = st.text_input("SAP公司代码", value=code)
+            with col2:
+                desc = st.text_input("公司描述")
+                sap_desc = st.text_input("SAP公司描述", value=desc)
+            if st.button("添加公司") and code and desc:
+                try:
+                    c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", 
+                            ("company", code, desc, sap_code, sap_desc))
                     conn.commit()
-                    st.success("Excel数据导入成功！")
-                else:
-                    st.error("Excel文件格式不正确！请确保包含：公司编码、公司描述、SAP公司代码、SAP公司描述")
-            except Exception as e:
-                st.error(f"导入失败：{str(e)}")
+                    master_data.invalidate()
+                    st.success(f"公司 '{desc}({code})' 已添加！")
+                except sqlite3.IntegrityError:
+                    st.warning(f"公司编码 {code} 或描述 {desc} 已存在！")
         
-        # 显示公司列表
-        st.divider()
-        st.subheader("公司列表")
-        comp_df = pd.read_sql_query("SELECT code AS 编码, description AS 描述, sap_code AS 'SAP公司代码', sap_description AS 'SAP公司描述' FROM config WHERE key='company' ORDER BY code", conn)
-        st.dataframe(comp_df)
-
-    with config_tabs[2]:
-        st.subheader("预算科目管理")
-        # 手动添加部分
-        col1, col2 = st.columns(2)
-        with col1:
-            code = st.text_input("预算科目编码")
-            sap_code = st.text_input("SAP核算科目", value=code)
-        with col2:
-            desc = st.text_input("预算科目描述")
-            sap_desc = st.text_input("SAP核算科目描述", value=desc)
-        if st.button("添加预算科目") and code and desc:
-            try:
-                c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", 
-                        ("budget_item", code, desc, sap_code, sap_desc))
-                conn.commit()
-                st.success(f"预算科目 '{desc}({code})' 已添加！")
-            except sqlite3.IntegrityError:
-                st.warning(f"预算科目编码 {code} 或描述 {desc} 已存在！")
+            # Excel导入部分
+            st.divider()
+            st.subheader("批量导入")
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"], key="company_uploader")
+            with col2:
+                comp_template = create_excel_template(["公司编码", "公司描述", "SAP公司代码", "SAP公司描述"])
+                st.download_button(
+                    label="📥 下载模板",
+                    data=comp_template,
+                    file_name="公司导入模板.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+            import_controls('company', uploaded_file)
         
-        # Excel导入部分
-        st.divider()
-        st.subheader("批量导入")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"], key="budget_uploader")
-        with col2:
-            budget_template = create_excel_template(["预算科目编码", "预算科目描述", "SAP核算科目", "SAP核算科目描述"])
-            st.download_button(
-                label="📥 下载模板",
-                data=budget_template,
-                file_name="预算科目导入模板.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        if uploaded_file is not None:
-            try:
-                df = pd.read_excel(uploaded_file)
-                if all(col in df.columns for col in ["预算科目编码", "预算科目描述", "SAP核算科目", "SAP核算科目描述"]):
-                    for _, row in df.iterrows():
-                        try:
-                            c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
-                                    ("budget_item", row["预算科目编码"], row["预算科目描述"], row["SAP核算科目"], row["SAP核算科目描述"]))
-                        except sqlite3.IntegrityError:
-                            continue
+            # 显示公司列表
+            st.divider()
+            st.subheader("公司列表")
+            comp_df = pd.DataFrame(master_data.entries('company'), columns=['编码', '描述', 'SAP公司代码', 'SAP公司描述'])
+            st.dataframe(comp_df)
+
+        with config_tabs[2]:
+            st.subheader("预算科目管理")
+            # 手动添加部分
+            col1, col2 = st.columns(2)
+            with col1:
+                code = st.text_input("预算科目编码")
+                sap_code = st.text_input("SAP核算科目", value=code)
+            with col2:
+                desc = st.text_input("预算科目描述")
+                sap_desc = st.text_input("SAP核算科目描述", value=desc)
+            if st.button("添加预算科目") and code and desc:
+                try:
+                    c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", 
+                            ("budget_item", code, desc, sap_code, sap_desc))
                     conn.commit()
-                    st.success("Excel数据导入成功！")
-                else:
-                    st.error("Excel文件格式不正确！请确保包含：预算科目编码、预算科目描述、SAP核算科目、SAP核算科目描述")
-            except Exception as e:
-                st.error(f"导入失败：{str(e)}")
+                    master_data.invalidate()
+                    st.success(f"预算科目 '{desc}({code})' 已添加！")
+                except sqlite3.IntegrityError:
+                    st.warning(f"预算科目编码 {code} 或描述 {desc} 已存在！")
         
-        # 显示预算科目列表
-        st.divider()
-        st.subheader("预算科目列表")
-        budget_df = pd.read_sql_query("SELECT code AS 编码, description AS 描述, sap_code AS 'SAP核算科目', sap_description AS 'SAP核算科目描述' FROM config WHERE key='budget_item' ORDER BY code", conn)
-        st.dataframe(budget_df)
-
-    with config_tabs[3]:
-        st.subheader("报销人管理")
-        # 手动添加部分
-        col1, col2 = st.columns(2)
-        with col1:
-            code = st.text_input("报销人编码")
-            sap_code = st.text_input("SAP员工代码", value=code)
-        with col2:
-            desc = st.text_input("报销人姓名")
-            sap_desc = st.text_input("SAP员工姓名", value=desc)
-        if st.button("添加报销人") and code and desc:
-            try:
-                c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", 
-                        ("employee", code, desc, sap_code, sap_desc))
-                conn.commit()
-                st.success(f"报销人 '{desc}({code})' 已添加！")
-            except sqlite3.IntegrityError:
-                st.warning(f"报销人编码 {code} 或描述 {desc} 已存在！")
+            # Excel导入部分
+            st.divider()
+            st.subheader("批量导入")
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"], key="budget_uploader")
+            with col2:
+                budget_template = create_excel_template(["预算科目编码", "预算科目描述", "SAP核算科目", "SAP核算科目描述"])
+                st.download_button(
+                    label="📥 下载模板",
+                    data=budget_template,
+                    file_name="预算科目导入模板.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+            import_controls('budget_item', uploaded_file)
         
-        # Excel导入部分
-        st.divider()
-        st.subheader("批量导入")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"], key="employee_uploader")
-        with col2:
-            emp_template = create_excel_template(["报销人编码", "报销人姓名", "SAP员工代码", "SAP员工姓名"])
-            st.download_button(
-                label="📥 下载模板",
-                data=emp_template,
-                file_name="报销人导入模板.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        if uploaded_file is not None:
-            try:
-                df = pd.read_excel(uploaded_file)
-                if all(col in df.columns for col in ["报销人编码", "报销人姓名", "SAP员工代码", "SAP员工姓名"]):
-                    for _, row in df.iterrows():
-                        try:
-                            c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
-                                    ("employee", row["报销人编码"], row["报销人姓名"], row["SAP员工代码"], row["SAP员工姓名"]))
-                        except sqlite3.IntegrityError:
-                            continue
+            # 显示预算科目列表
+            st.divider()
+            st.subheader("预算科目列表")
+            budget_df = pd.DataFrame(master_data.entries('budget_item'), columns=['编码', '描述', 'SAP核算科目', 'SAP核算科目描述'])
+            st.dataframe(budget_df)
+
+        with config_tabs[3]:
+            st.subheader("报销人管理")
+            # 手动添加部分
+            col1, col2 = st.columns(2)
+            with col1:
+                code = st.text_input("报销人编码")
+                sap_code = st.text_input("SAP员工代码", value=code)
+            with col2:
+                desc = st.text_input("报销人姓名")
+                sap_desc = st.text_input("SAP员工姓名", value=desc)
+            if st.button("添加报销人") and code and desc:
+                try:
+                    c.execute("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", 
+                            ("employee", code, desc, sap_code, sap_desc))
                     conn.commit()
-                    st.success("Excel数据导入成功！")
-                else:
-                    st.error("Excel文件格式不正确！请确保包含：报销人编码、报销人姓名、SAP员工代码、SAP员工姓名")
-            except Exception as e:
-                st.error(f"导入失败：{str(e)}")
+                    master_data.invalidate()
+                    st.success(f"报销人 '{desc}({code})' 已添加！")
+                except sqlite3.IntegrityError:
+                    st.warning(f"报销人编码 {code} 或描述 {desc} 已存在！")
         
-        # 显示报销人列表
-        st.divider()
-        st.subheader("报销人列表")
-        emp_df = pd.read_sql_query("SELECT code AS 编码, description AS 姓名, sap_code AS 'SAP员工代码', sap_description AS 'SAP员工姓名' FROM config WHERE key='employee' ORDER BY code", conn)
-        st.dataframe(emp_df)
-
-elif st.session_state.current_page == "用户角色管理":
-    st.title("👥 用户及角色管理")
-    user_role_tabs = st.tabs(["角色管理", "用户管理"])
-    
-    with user_role_tabs[0]:
-        st.subheader("角色管理")
+            # Excel导入部分
+            st.divider()
+            st.subheader("批量导入")
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"], key="employee_uploader")
+            with col2:
+                emp_template = create_excel_template(["报销人编码", "报销人姓名", "SAP员工代码", "SAP员工姓名"])
+                st.download_button(
+                    label="📥 下载模板",
+                    data=emp_template,
+                    file_name="报销人导入模板.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+            import_controls('employee', uploaded_file)
         
-        # 创建新角色
-        with st.expander("创建新角色", expanded=True):
+            # 显示报销人列表
+            st.divider()
+            st.subheader("报销人列表")
+            emp_df = pd.DataFrame(master_data.entries('employee'), columns=['编码', '姓名', 'SAP员工代码', 'SAP员工姓名'])
+            st.dataframe(emp_df)
+
+        with config_tabs[4]:
+            st.subheader("预算维护")
             col1, col2 = st.columns(2)
             with col1:
-                new_role_name = st.text_input("角色名称")
-                new_role_desc = st.text_area("角色描述")
+                budget_period = st.text_input("预算期间（YYYY-MM）", value=date.today().strftime("%Y-%m"), key="budget_period")
+            with col2:
+                budget_department = st.selectbox("部门", master_data.descriptions('department'), key="budget_department")
+            budget_dept_code = master_data.code_of('department', budget_department)
+            if budget_dept_code:
+                report = budget_report(budget_period, budget_dept_code).set_index('预算科目')
+                items = master_data.entries('budget_item')
+                budget_df = pd.DataFrame({
+                    'code': [item.code for item in items],
+                    '预算科目': [item.description for item in items],
+                })
+                budget_df['预算'] = budget_df['预算科目'].map(report['预算'])
+                budget_df['已占用'] = budget_df['预算科目'].map(report['待记账'] + report['已记账']).fillna(0.0)
+                # 预算金额可编辑，清空即删除该科目的预算；占用由系统维护，只读
+                edited_budget = st.data_editor(
+                    budget_df,
+                    column_order=['预算科目', '预算', '已占用'],
+                    column_config={'预算': st.column_config.NumberColumn("预算", min_value=0.0, step=100.0)},
+                    disabled=['预算科目', '已占用'],
+                    hide_index=True,
+                    use_container_width=True,
+                    key=f"budget_editor_{budget_period}_{budget_dept_code}"
+                )
+                if st.button("保存预算"):
+                    changes = {}
+                    for code, old_amount, new_amount in zip(edited_budget['code'], budget_df['预算'], edited_budget['预算']):
+                        old_amount = None if pd.isna(old_amount) else float(old_amount)
+                        new_amount = None if pd.isna(new_amount) else float(new_amount)
+                        if old_amount != new_amount:
+                            changes[code] = new_amount
+                    if len(budget_period) != 7 or budget_period[4] != '-':
+                        st.error("预算期间格式应为 YYYY-MM")
+                    elif changes:
+                        save_budgets(budget_period, budget_dept_code, changes)
+                        st.success(f"已保存 {len(changes)} 项预算")
+                    else:
+                        st.info("预算没有变化")
+
+            st.divider()
+            st.subheader("预算执行")
+            execution = budget_report(budget_period)
+            if execution.empty:
+                st.info("该期间没有预算或报销")
+            else:
+                st.dataframe(execution.style.format({'执行率': '{:.1%}'}, na_rep='-', precision=2),
+                             use_container_width=True)
+
+    elif st.session_state.current_page == "用户角色管理":
+        st.title("👥 用户及角色管理")
+        user_role_tabs = st.tabs(["角色管理", "用户管理"])
+    
+        with user_role_tabs[0]:
+            if not has_permission('role.manage'):
+                st.info("没有管理角色的权限")
+            else:
+                st.subheader("角色管理")
+        
+                # 创建新角色
+                with st.expander("创建新角色", expanded=True):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        new_role_name = st.text_input("角色名称")
+                        new_role_desc = st.text_area("角色描述")
             
-            # 权限选择
-            st.subheader("权限设置")
-            permissions = c.execute("SELECT id, module_name, permission_name, description FROM permissions ORDER BY module_name, permission_name").fetchall()
+                    # 权限选择
+                    st.subheader("权限设置")
+                    permissions = c.execute("SELECT id, module_name, permission_name, description FROM permissions ORDER BY module_name, permission_name").fetchall()
             
-            # 按模块分组显示权限
-            modules = {}
-            for perm in permissions:
-                if perm[1] not in modules:
-                    modules[perm[1]] = []
-                modules[perm[1]].append(perm)
+                    # 按模块分组显示权限
+                    modules = {}
+                    for perm in permissions:
+                        if perm[1] not in modules:
+                            modules[perm[1]] = []
+                        modules[perm[1]].append(perm)
             
-            for module_name, perms in modules.items():
-                st.write(f"**{module_name}**")
-                cols = st.columns(3)
-                for i, perm in enumerate(perms):
-                    with cols[i % 3]:
-                        st.checkbox(f"{perm[3]}", key=f"perm_{perm[0]}")
+                    for module_name, perms in modules.items():
+                        st.write(f"**{module_name}**")
+                        cols = st.columns(3)
+                        for i, perm in enumerate(perms):
+                            with cols[i % 3]:
+                                st.checkbox(f"{perm[3]}", key=f"perm_{perm[0]}")
             
-            if st.button("创建角色"):
-                if new_role_name:
-                    try:
-                        c.execute("INSERT INTO roles (role_name, description) VALUES (?, ?)",
-                                (new_role_name, new_role_desc))
-                        role_id = c.execute("SELECT id FROM roles WHERE role_name=?", (new_role_name,)).fetchone()[0]
+                    if st.button("创建角色"):
+                        if new_role_name:
+                            try:
+                                c.execute("INSERT INTO roles (role_name, description) VALUES (?, ?)",
+                                        (new_role_name, new_role_desc))
+                                role_id = c.execute("SELECT id FROM roles WHERE role_name=?", (new_role_name,)).fetchone()[0]
                         
-                        # 添加选中的权限
-                        for perm in permissions:
-                            if st.session_state.get(f"perm_{perm[0]}"):
-                                c.execute("INSERT INTO role_permissions (role_id, permission_id) VALUES (?, ?)",
-                                        (role_id, perm[0]))
+                                # 添加选中的权限
+                                for perm in permissions:
+                                    if st.session_state.get(f"perm_{perm[0]}"):
+                                        c.execute("INSERT INTO role_permissions (role_id, permission_id) VALUES (?, ?)",
+                                                (role_id, perm[0]))
                         
-                        conn.commit()
-                        st.success(f"角色 '{new_role_name}' 创建成功！")
-                        st.experimental_rerun()
-                    except sqlite3.IntegrityError:
-                        st.error("角色名称已存在！")
-                else:
-                    st.warning("请输入角色名称！")
+                                conn.commit()
+                                permission_cache.invalidate()
+                                st.success(f"角色 '{new_role_name}' 创建成功！")
+                                st.experimental_rerun()
+                            except sqlite3.IntegrityError:
+                                st.error("角色名称已存在！")
+                        else:
+                            st.warning("请输入角色名称！")
         
-        # 显示现有角色
-        st.divider()
-        st.subheader("现有角色")
-        roles_df = pd.read_sql_query("""
-            SELECT r.role_name AS 角色名称, 
-                   r.description AS 角色描述,
-                   GROUP_CONCAT(p.description) AS 权限列表
-            FROM roles r
-            LEFT JOIN role_permissions rp ON r.id = rp.role_id
-            LEFT JOIN permissions p ON rp.permission_id = p.id
-            GROUP BY r.id
-            ORDER BY r.role_name
-        """, conn)
-        st.dataframe(roles_df)
+                # 显示现有角色
+                st.divider()
+                st.subheader("现有角色")
+                roles_df = pd.read_sql_query("""
+                    SELECT r.role_name AS 角色名称, 
+                           r.description AS 角色描述,
+                           GROUP_CONCAT(p.description) AS 权限列表
+                    FROM roles r
+                    LEFT JOIN role_permissions rp ON r.id = rp.role_id
+                    LEFT JOIN permissions p ON rp.permission_id = p.id
+                    GROUP BY r.id
+                    ORDER BY r.role_name
+                """, conn)
+                st.dataframe(roles_df)
         
-        # 编辑角色
-        st.divider()
-        st.subheader("编辑角色")
-        role_to_edit = st.selectbox("选择要编辑的角色", 
-            [row[0] for row in c.execute("SELECT role_name FROM roles WHERE role_name != 'admin'")])
+                # 编辑角色
+                st.divider()
+                st.subheader("编辑角色")
+                role_to_edit = st.selectbox("选择要编辑的角色", 
+                    [row[0] for row in c.execute("SELECT role_name FROM roles WHERE role_name != 'admin'")])
         
-        if role_to_edit:
-            role_data = c.execute("SELECT id, description FROM roles WHERE role_name=?", (role_to_edit,)).fetchone()
-            role_perms = c.execute("""
-                SELECT permission_id FROM role_permissions 
-                WHERE role_id=?
-            """, (role_data[0],)).fetchall()
-            role_perms = [p[0] for p in role_perms]
+                if role_to_edit:
+                    role_data = c.execute("SELECT id, description FROM roles WHERE role_name=?", (role_to_edit,)).fetchone()
+                    role_perms = c.execute("""
+                        SELECT permission_id FROM role_permissions 
+                        WHERE role_id=?
+                    """, (role_data[0],)).fetchall()
+                    role_perms = [p[0] for p in role_perms]
             
-            new_desc = st.text_area("修改角色描述", value=role_data[1])
+                    new_desc = st.text_area("修改角色描述", value=role_data[1])
             
-            st.write("修改权限设置")
-            for module_name, perms in modules.items():
-                st.write(f"**{module_name}**")
-                cols = st.columns(3)
-                for i, perm in enumerate(perms):
-                    with cols[i % 3]:
-                        st.checkbox(f"{perm[3]}", 
-                                  value=perm[0] in role_perms,
-                                  key=f"edit_perm_{perm[0]}")
+                    st.write("修改权限设置")
+                    for module_name, perms in modules.items():
+                        st.write(f"**{module_name}**")
+                        cols = st.columns(3)
+                        for i, perm in enumerate(perms):
+                            with cols[i % 3]:
+                                st.checkbox(f"{perm[3]}", 
+                                          value=perm[0] in role_perms,
+                                          key=f"edit_perm_{perm[0]}")
             
-            if st.button("保存修改"):
-                c.execute("UPDATE roles SET description=? WHERE id=?", (new_desc, role_data[0]))
+                    if st.button("保存修改"):
+                        c.execute("UPDATE roles SET description=? WHERE id=?", (new_desc, role_data[0]))
                 
-                # 更新权限
-                c.execute("DELETE FROM role_permissions WHERE role_id=?", (role_data[0],))
-                for perm in permissions:
-                    if st.session_state.get(f"edit_perm_{perm[0]}"):
-                        c.execute("INSERT INTO role_permissions (role_id, permission_id) VALUES (?, ?)",
-                                (role_data[0], perm[0]))
+                        # 更新权限
+                        c.execute("DELETE FROM role_permissions WHERE role_id=?", (role_data[0],))
+                        for perm in permissions:
+                            if st.session_state.get(f"edit_perm_{perm[0]}"):
+                                c.execute("INSERT INTO role_permissions (role_id, permission_id) VALUES (?, ?)",
+                                        (role_data[0], perm[0]))
                 
-                conn.commit()
-                st.success("角色更新成功！")
-                st.experimental_rerun()
-    
-    with user_role_tabs[1]:
-        st.subheader("用户管理")
-        
-        # 创建新用户
-        with st.expander("创建新用户", expanded=True):
-            col1, col2 = st.columns(2)
-            with col1:
-                new_user_id = st.text_input("用户ID")
-                new_user_name = st.text_input("用户姓名")
-                # 所属公司
-                company_options = [row for row in c.execute("SELECT code, description FROM config WHERE key='company'")]
-                new_user_company = st.selectbox("所属公司", options=[f"{code} | {desc}" for code, desc in company_options], index=0 if company_options else None)
-                # 所属部门
-                dept_options = [row for row in c.execute("SELECT code, description FROM config WHERE key='department'")]
-                new_user_dept = st.selectbox("所属部门", options=[f"{code} | {desc}" for code, desc in dept_options], index=0 if dept_options else None)
-            with col2:
-                new_user_password = st.text_input("密码", type="password")
-                new_user_role = st.selectbox("分配角色", 
-                    [row[0] for row in c.execute("SELECT role_name FROM roles ORDER BY role_name")])
-            if st.button("创建用户"):
-                if new_user_id and new_user_name and new_user_password:
-                    try:
-                        role_id = c.execute("SELECT id FROM roles WHERE role_name=?", (new_user_role,)).fetchone()[0]
-                        company_code = new_user_company.split(" | ")[0] if new_user_company else None
-                        dept_code = new_user_dept.split(" | ")[0] if new_user_dept else None
-                        c.execute("INSERT INTO users (user_id, user_name, password, role_id, company_code, department_code) VALUES (?, ?, ?, ?, ?, ?)",
-                                (new_user_id, new_user_name, new_user_password, role_id, company_code, dept_code))
                         conn.commit()
-                        st.success(f"用户 '{new_user_name}' 创建成功！")
+                        permission_cache.invalidate()
+                        st.success("角色更新成功！")
                         st.experimental_rerun()
-                    except sqlite3.IntegrityError:
-                        st.error("用户ID已存在！")
-                else:
-                    st.warning("请填写所有必填字段！")
+    
+        with user_role_tabs[1]:
+            if not has_permission('user.manage'):
+                st.info("没有管理用户的权限")
+            else:
+                st.subheader("用户管理")
+        
+                # 创建新用户
+                with st.expander("创建新用户", expanded=True):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        new_user_id = st.text_input("用户ID")
+                        new_user_name = st.text_input("用户姓名")
+                        # 所属公司
+                        company_options = master_data.options('company')
+                        new_user_company = st.selectbox("所属公司", options=[f"{code} | {desc}" for code, desc in company_options], index=0 if company_options else None)
+                        # 所属部门
+                        dept_options = master_data.options('department')
+                        new_user_dept = st.selectbox("所属部门", options=[f"{code} | {desc}" for code, desc in dept_options], index=0 if dept_options else None)
+                    with col2:
+                        new_user_password = st.text_input("密码", type="password")
+                        new_user_email = st.text_input("邮箱", help="用于接收报销提交、记账的通知邮件")
+                        new_user_employee = st.text_input("员工编码", help="对应的员工主数据编码，决定本人可见的报销记录和通知邮件")
+                        new_user_role = st.selectbox("分配角色", 
+                            [row[0] for row in c.execute("SELECT role_name FROM roles ORDER BY role_name")])
+                    if st.button("创建用户"):
+                        if new_user_employee.strip() and master_data.get('employee', new_user_employee.strip()) is None:
+                            st.error("员工编码在员工主数据中不存在！")
+                        elif new_user_id and new_user_name and new_user_password:
+                            try:
+                                role_id = c.execute("SELECT id FROM roles WHERE role_name=?", (new_user_role,)).fetchone()[0]
+                                company_code = new_user_company.split(" | ")[0] if new_user_company else None
+                                dept_code = new_user_dept.split(" | ")[0] if new_user_dept else None
+                                c.execute("INSERT INTO users (user_id, user_name, password, role_id, company_code, department_code, email, employee_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        (new_user_id, new_user_name, hash_new_password(new_user_password), role_id, company_code, dept_code,
+                                         new_user_email.strip() or None, new_user_employee.strip() or None))
+                                conn.commit()
+                                st.success(f"用户 '{new_user_name}' 创建成功！")
+                                st.experimental_rerun()
+                            except LoginBusyError as e:
+                                st.error(str(e))
+                            except sqlite3.IntegrityError:
+                                st.error("用户ID已存在！")
+                        else:
+                            st.warning("请填写所有必填字段！")
         
-        # 显示用户列表
-        st.divider()
-        st.subheader("用户列表")
-        users_df = pd.read_sql_query("""
-            SELECT u.user_id AS 用户ID, 
-                   u.user_name AS 用户姓名,
-                   r.role_name AS 角色
-            FROM users u
-            JOIN roles r ON u.role_id = r.id
-            ORDER BY u.user_id
-        """, conn)
-        st.dataframe(users_df)
+                # 显示用户列表
+                st.divider()
+                st.subheader("用户列表")
+                users_df = pd.read_sql_query("""
+                    SELECT u.user_id AS 用户ID, 
+                           u.user_name AS 用户姓名,
+                           u.employee_code AS 员工编码,
+                           u.email AS 邮箱,
+                           r.role_name AS 角色
+                    FROM users u
+                    JOIN roles r ON u.role_id = r.id
+                    ORDER BY u.user_id
+                """, conn)
+                st.dataframe(users_df)
         
-        # 编辑用户
-        st.divider()
-        st.subheader("编辑用户")
-        user_to_edit = st.selectbox("选择要编辑的用户", 
-            [row[0] for row in c.execute("SELECT user_id FROM users WHERE user_id != 'admin'")])
-        if user_to_edit:
-            user_data = c.execute("""
-                SELECT u.id, u.user_name, u.role_id, r.role_name, u.company_code, u.department_code
-                FROM users u
-                JOIN roles r ON u.role_id = r.id
-                WHERE u.user_id=?
-            """, (user_to_edit,)).fetchone()
-            new_name = st.text_input("修改用户姓名", value=user_data[1])
-            new_password = st.text_input("修改密码", type="password")
-            new_role = st.selectbox("修改角色", 
-                [row[0] for row in c.execute("SELECT role_name FROM roles ORDER BY role_name")],
-                index=[row[0] for row in c.execute("SELECT role_name FROM roles ORDER BY role_name")].index(user_data[3]))
-            # 所属公司
-            company_options = [row for row in c.execute("SELECT code, description FROM config WHERE key='company'")]
-            company_display = [f"{code} | {desc}" for code, desc in company_options]
-            company_index = 0
-            for idx, (code, _) in enumerate(company_options):
-                if code == user_data[4]:
-                    company_index = idx
-                    break
-            new_company = st.selectbox("所属公司", options=company_display, index=company_index if company_options else 0)
-            # 所属部门
-            dept_options = [row for row in c.execute("SELECT code, description FROM config WHERE key='department'")]
-            dept_display = [f"{code} | {desc}" for code, desc in dept_options]
-            dept_index = 0
-            for idx, (code, _) in enumerate(dept_options):
-                if code == user_data[5]:
-                    dept_index = idx
-                    break
-            new_dept = st.selectbox("所属部门", options=dept_display, index=dept_index if dept_options else 0)
-            if st.button("保存用户修改"):
-                try:
-                    role_id = c.execute("SELECT id FROM roles WHERE role_name=?", (new_role,)).fetchone()[0]
-                    company_code = new_company.split(" | ")[0] if new_company else None
-                    dept_code = new_dept.split(" | ")[0] if new_dept else None
-                    if new_password:
-                        c.execute("""
-                            UPDATE users 
-                            SET user_name=?, password=?, role_id=?, company_code=?, department_code=?
-                            WHERE id=?
-                        """, (new_name, new_password, role_id, company_code, dept_code, user_data[0]))
-                    else:
-                        c.execute("""
-                            UPDATE users 
-                            SET user_name=?, role_id=?, company_code=?, department_code=?
-                            WHERE id=?
-                        """, (new_name, role_id, company_code, dept_code, user_data[0]))
-                    conn.commit()
-                    st.success("用户信息更新成功！")
-                    st.experimental_rerun()
-                except Exception as e:
-                    st.error(f"更新失败：{str(e)}")
+                # 编辑用户
+                st.divider()
+                st.subheader("编辑用户")
+                user_to_edit = st.selectbox("选择要编辑的用户", 
+                    [row[0] for row in c.execute("SELECT user_id FROM users WHERE user_id != 'admin'")])
+                if user_to_edit:
+                    user_data = c.execute("""
+                        SELECT u.id, u.user_name, u.role_id, r.role_name, u.company_code, u.department_code, u.email,
+                               u.employee_code
+                        FROM users u
+                        JOIN roles r ON u.role_id = r.id
+                        WHERE u.user_id=?
+                    """, (user_to_edit,)).fetchone()
+                    new_name = st.text_input("修改用户姓名", value=user_data[1])
+                    new_password = st.text_input("修改密码", type="password")
+                    new_email = st.text_input("修改邮箱", value=user_data[6] or "")
+                    new_employee = st.text_input("修改员工编码", value=user_data[7] or "",
+                                                 help="对应的员工主数据编码，姓名改动不影响")
+                    new_role = st.selectbox("修改角色", 
+                        [row[0] for row in c.execute("SELECT role_name FROM roles ORDER BY role_name")],
+                        index=[row[0] for row in c.execute("SELECT role_name FROM roles ORDER BY role_name")].index(user_data[3]))
+                    # 所属公司
+                    company_options = master_data.options('company')
+                    company_display = [f"{code} | {desc}" for code, desc in company_options]
+                    company_index = 0
+                    for idx, (code, _) in enumerate(company_options):
+                        if code == user_data[4]:
+                            company_index = idx
+                            break
+                    new_company = st.selectbox("所属公司", options=company_display, index=company_index if company_options else 0)
+                    # 所属部门
+                    dept_options = master_data.options('department')
+                    dept_display = [f"{code} | {desc}" for code, desc in dept_options]
+                    dept_index = 0
+                    for idx, (code, _) in enumerate(dept_options):
+                        if code == user_data[5]:
+                            dept_index = idx
+                            break
+                    new_dept = st.selectbox("所属部门", options=dept_display, index=dept_index if dept_options else 0)
+                    if st.button("保存用户修改"):
+                        if new_employee.strip() and master_data.get('employee', new_employee.strip()) is None:
+                            st.error("员工编码在员工主数据中不存在！")
+                        else:
+                            try:
+                                role_id = c.execute("SELECT id FROM roles WHERE role_name=?", (new_role,)).fetchone()[0]
+                                company_code = new_company.split(" | ")[0] if new_company else None
+                                dept_code = new_dept.split(" | ")[0] if new_dept else None
+                                if new_password:
+                                    c.execute("""
+                                        UPDATE users 
+                                        SET user_name=?, password=?, role_id=?, company_code=?, department_code=?, email=?,
+                                            employee_code=?
+                                        WHERE id=?
+                                    """, (new_name, hash_new_password(new_password), role_id, company_code, dept_code,
+                                          new_email.strip() or None, new_employee.strip() or None, user_data[0]))
+                                else:
+                                    c.execute("""
+                                        UPDATE users 
+                                        SET user_name=?, role_id=?, company_code=?, department_code=?, email=?, employee_code=?
+                                        WHERE id=?
+                                    """, (new_name, role_id, company_code, dept_code, new_email.strip() or None,
+                                          new_employee.strip() or None, user_data[0]))
+                                conn.commit()
+                                invalidate_users()
+                                st.success("用户信息更新成功！")
+                                st.experimental_rerun()
+                            except LoginBusyError as e:
+                                st.error(str(e))
+                            except Exception as e:
+                                st.error(f"更新失败：{str(e)}")
 
-elif st.session_state.current_page == "报销记账":
-    st.title("📖 报销记账")
-    
-    # 获取未记账的报销记录
-    unbooked_expenses = pd.read_sql_query("""
-        SELECT e.id, e.expense_date, e.amount, e.description,
-               d.description as department,
-               c.description as company,
-               b.description as budget_item,
-               em.description as employee,
-               b.sap_code as sap_account_code,
-               b.sap_description as sap_account_desc,
-               d.sap_code as sap_cost_center_code,
-               d.sap_description as sap_cost_center_desc,
-               em.sap_code as sap_employee_code,
-               em.sap_description as sap_employee_desc
-        FROM expenses e
-        LEFT JOIN config d ON e.department = d.code AND d.key = 'department'
-        LEFT JOIN config c ON e.company = c.code AND c.key = 'company'
-        LEFT JOIN config b ON e.budget_item = b.code AND b.key = 'budget_item'
-        LEFT JOIN config em ON e.employee = em.code AND em.key = 'employee'
-        WHERE e.status='pending'
-        ORDER BY e.expense_date DESC
-    """, conn)
+    elif st.session_state.current_page == "报销记账":
+        st.title("📖 报销记账")
     
-    if unbooked_expenses.empty:
-        st.info("没有待记账的报销记录")
-    else:
-        st.subheader("待记账报销记录（可多选）")
-        # 自定义表格+checkbox
-        selected_ids = []
-        columns_to_show = ["expense_date", "department", "company", "budget_item", "employee", "amount", "description"]
-        header_cols = st.columns([0.5] + [1]*len(columns_to_show))
-        with header_cols[0]:
-            st.markdown("**选择**")
-        for i, col in enumerate(columns_to_show):
-            with header_cols[i+1]:
-                st.markdown(f"**{col}**")
-        for idx, row in unbooked_expenses.iterrows():
-            row_cols = st.columns([0.5] + [1]*len(columns_to_show))
-            with row_cols[0]:
-                checked = st.checkbox("", key=f"select_exp_{row['id']}")
-                if checked:
-                    selected_ids.append(row['id'])
-            for i, col in enumerate(columns_to_show):
-                with row_cols[i+1]:
-                    st.write(row[col])
-        selected_rows = unbooked_expenses[unbooked_expenses['id'].isin(selected_ids)]
-        if not selected_rows.empty:
-            # 记账成功弹窗（form外部，且只显示弹窗不显示表单）
-            if st.session_state.get('voucher_modal', False):
-                st.success(f"记账成功，凭证号{st.session_state.voucher_no}已经生成")
-                if st.button("确认"):
-                    st.session_state.voucher_modal = False
-                    st.session_state.booking_rows = []
-                    st.session_state.last_selected_ids = []
+        # 筛选条件在数据库端过滤，列表每次只取一页
+        # date_input 不支持空值（value=None 即今天），期间筛选须显式勾选，默认列出全部待记账记录
+        booking_by_period = st.checkbox("按期间筛选", key="booking_by_period")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            booking_company = st.selectbox("公司", [""] + master_data.descriptions('company'), key="booking_company")
+        with col2:
+            booking_department = st.selectbox("部门", [""] + master_data.descriptions('department'), key="booking_department")
+        with col3:
+            booking_date_from = st.date_input("期间从", value=date.today().replace(day=1), key="booking_date_from",
+                                              disabled=not booking_by_period)
+        with col4:
+            booking_date_to = st.date_input("期间至", value=date.today(), key="booking_date_to",
+                                            disabled=not booking_by_period)
+        booking_filters = {
+            'company': master_data.code_of('company', booking_company) if booking_company else None,
+            'department': master_data.code_of('department', booking_department) if booking_department else None,
+            'date_from': booking_date_from if booking_by_period else None,
+            'date_to': booking_date_to if booking_by_period else None,
+        }
+        if st.session_state.get('booking_filters') != booking_filters:
+            # 筛选条件变化后回到第一页，已选记录保留
+            st.session_state.booking_filters = booking_filters
+            st.session_state.booking_cursors = [None]
+        if 'booking_selected' not in st.session_state:
+            st.session_state.booking_selected = set()
+            st.session_state.booking_grid_version = 0
+        selected_ids = st.session_state.booking_selected
+        cursors = st.session_state.booking_cursors
+
+        with st.expander("⚙️ 批量自动记账"):
+            st.caption("按上方公司/部门/期间筛选全部待记账记录，按分组维度每组生成一张凭证，贷方按员工记其他应付款")
+            auto_col1, auto_col2 = st.columns(2)
+            with auto_col1:
+                auto_group_by = st.multiselect(
+                    "分组维度", list(GROUP_KEYS), default=list(default_group_by()),
+                    format_func=GROUP_LABELS.get, key="auto_group_by"
+                )
+            with auto_col2:
+                auto_posting_date = st.date_input("凭证日期", value=date.today(), key="auto_posting_date")
+            auto_request = (booking_filters, tuple(auto_group_by), auto_posting_date)
+            dry_col, run_col = st.columns(2)
+            with dry_col:
+                if st.button("试运行", disabled=not auto_group_by):
+                    st.session_state.auto_booking_plan = (auto_request, plan_auto_booking(
+                        booking_filters['company'], booking_filters['date_from'], booking_filters['date_to'],
+                        auto_group_by, auto_posting_date, department=booking_filters['department']
+                    ))
+            auto_plan = st.session_state.get('auto_booking_plan')
+            if auto_plan is not None and auto_plan[0] != auto_request:
+                # 条件变了，之前的试运行结果作废
+                auto_plan = st.session_state.auto_booking_plan = None
+            if auto_plan is not None:
+                plan = auto_plan[1]
+                st.markdown(f"**待生成凭证 {len(plan.vouchers)} 张，{plan.lines} 行，{plan.expenses} 笔报销，"
+                            f"金额合计：{plan.amount:.2f}**")
+                st.dataframe(plan.report(), use_container_width=True)
+                if plan.skipped:
+                    st.warning(f"{len(plan.skipped)} 笔报销缺少SAP映射，不会自动记账")
+                    st.dataframe(plan.skipped_report(), use_container_width=True)
+            with run_col:
+                run_auto = st.button("执行自动记账", disabled=auto_plan is None or not auto_plan[1].vouchers)
+            if run_auto:
+                progress_bar = st.progress(0.0)
+                try:
+                    result = post_auto_booking(
+                        auto_plan[1], progress=lambda done, total: progress_bar.progress(done / total)
+                    )
+                    st.success(f"自动记账完成：生成凭证 {result.vouchers} 张（{result.first_voucher_no} - "
+                               f"{result.last_voucher_no}），{result.expenses} 笔报销，耗时 {result.elapsed:.2f} 秒")
+                except BookingError as e:
+                    st.error(str(e))
+                st.session_state.auto_booking_plan = None
+                selected_ids.clear()
+                st.session_state.booking_grid_version += 1
+                cursors[:] = [None]
+        page_size = st.selectbox("每页条数", [20, 50, 100, 200], index=1, key="booking_page_size")
+        query, params = build_pending_search(after=cursors[-1], limit=page_size + 1, **booking_filters)
+        page_df = pd.read_sql_query(query, conn, params=params)
+        has_next = len(page_df) > page_size
+        page_df = page_df.head(page_size)
+
+        if page_df.empty and len(cursors) == 1 and not selected_ids and not st.session_state.get('voucher_modal', False):
+            st.info("没有待记账的报销记录")
+        else:
+            st.subheader("待记账报销记录（可多选）")
+            columns_to_show = ["expense_date", "department", "company", "budget_item", "employee", "amount", "description"]
+            column_labels = ["日期", "部门", "公司", "预算科目", "报销人", "金额", "摘要"]
+            page_df.insert(0, 'selected', page_df['id'].isin(selected_ids))
+            # 一个表格组件承载整页勾选；全选/清空后换key，丢弃表格里残留的勾选状态
+            edited_df = st.data_editor(
+                page_df,
+                column_order=['selected'] + columns_to_show,
+                column_config=dict(zip(columns_to_show, column_labels),
+                                   selected=st.column_config.CheckboxColumn("选择")),
+                disabled=columns_to_show,
+                hide_index=True,
+                use_container_width=True,
+                key=f"booking_grid_{len(cursors)}_{st.session_state.booking_grid_version}"
+            )
+            selected_ids.difference_update(int(i) for i in page_df['id'])
+            selected_ids.update(int(i) for i in edited_df.loc[edited_df['selected'].astype(bool), 'id'])
+
+            nav_col1, nav_col2, nav_col3, nav_col4 = st.columns([1, 1, 1, 1])
+            with nav_col1:
+                if st.button("⬅️ 上一页", disabled=len(cursors) == 1):
+                    cursors.pop()
+                    st.experimental_rerun()
+            with nav_col2:
+                if st.button("下一页 ➡️", disabled=not has_next):
+                    last = page_df.iloc[-1]
+                    cursors.append((last['expense_date'], int(last['id'])))
                     st.experimental_rerun()
+            with nav_col3:
+                if st.button("全选筛选结果"):
+                    # 直接在数据库里取符合条件的全部id，不经过表格
+                    ids_sql, ids_params = build_pending_ids(**booking_filters)
+                    selected_ids.update(row[0] for row in c.execute(ids_sql, ids_params))
+                    st.session_state.booking_grid_version += 1
+                    st.experimental_rerun()
+            with nav_col4:
+                if st.button("清空选择"):
+                    selected_ids.clear()
+                    st.session_state.booking_grid_version += 1
+                    st.experimental_rerun()
+
+            if selected_ids:
+                selected_sql, selected_params = build_pending_by_ids(selected_ids)
+                selected_rows = pd.read_sql_query(selected_sql, conn, params=selected_params)
+                # 已被别人记账的记录不再算作已选
+                selected_ids.intersection_update(int(i) for i in selected_rows['id'])
             else:
-                # 初始化借方行（每条报销一行）
-                if 'booking_rows' not in st.session_state or st.session_state.get('last_selected_ids', []) != list(selected_rows['id']):
-                    st.session_state.booking_rows = []
-                    for _, row in selected_rows.iterrows():
-                        st.session_state.booking_rows.append({
-                            'type': 'debit',
-                            'sap_account_code': row['sap_account_code'],
-                            'sap_account_desc': row['sap_account_desc'],
-                            'sap_cost_center_code': row['sap_cost_center_code'],
-                            'sap_cost_center_desc': row['sap_cost_center_desc'],
-                            'debit_amount': float(row['amount']),
-                            'credit_amount': 0.0,
-                            'sap_employee_code': row['sap_employee_code'],
-                            'sap_employee_desc': row['sap_employee_desc'],
-                            'voucher_date': date.today(),
-                            'post_date': date.today(),
-                            'expense_id': row['id']
-                        })
-                    st.session_state.last_selected_ids = list(selected_rows['id'])
-                rows = st.session_state.booking_rows
-                with st.form("booking_form", clear_on_submit=False):
-                    st.subheader("记账信息")
-                    for i, row in enumerate(rows):
-                        with st.container():
-                            st.markdown(f"#### 行项目 {i+1}")
-                            col1, col2, col3 = st.columns([1,1,1])
-                            with col1:
-                                row_type = st.selectbox("借贷方", ["借方", "贷方"], index=0 if row['type']=="debit" else 1, key=f"row_type_{i}")
-                            with col2:
-                                voucher_date = st.date_input("凭证日期", value=row.get('voucher_date', date.today()), key=f"voucher_date_{i}")
-                            with col3:
-                                post_date = st.date_input("过账日期", value=row.get('post_date', date.today()), key=f"post_date_{i}")
-                            col4, col5 = st.columns([2,2])
-                            with col4:
-                                sap_account_code = st.text_input("SAP科目", value=row['sap_account_code'], key=f"sap_account_code_{i}")
-                                sap_account_desc = st.text_input("SAP核算科目描述", value=row['sap_account_desc'], key=f"sap_account_desc_{i}")
-                            with col5:
-                                sap_cost_center_code = st.text_input("成本中心", value=row['sap_cost_center_code'], key=f"sap_cost_center_code_{i}")
-                                sap_cost_center_desc = st.text_input("成本中心描述", value=row['sap_cost_center_desc'], key=f"sap_cost_center_desc_{i}")
-                            col6, col7, col8 = st.columns([1,1,2])
-                            with col6:
-                                if row_type == "借方":
-                                    debit_amount = st.number_input("借方金额", value=row['debit_amount'], min_value=0.0, key=f"debit_amount_{i}", disabled=False)
-                                    credit_amount = 0.0
-                                else:
-                                    debit_amount = 0.0
-                                    credit_amount = st.number_input("贷方金额", value=row['credit_amount'], min_value=0.0, key=f"credit_amount_{i}", disabled=False)
-                            with col7:
-                                sap_employee_code = st.text_input("SAP员工代码", value=row['sap_employee_code'], key=f"sap_employee_code_{i}")
-                            with col8:
-                                sap_employee_desc = st.text_input("SAP员工姓名", value=row['sap_employee_desc'], key=f"sap_employee_desc_{i}")
-                    remove_idx = None
-                    if len(rows) > len(selected_rows):
-                        remove_options = [f"第{i+1}行" for i in range(len(selected_rows), len(rows))]
-                        remove_choice = st.selectbox("选择要删除的贷方行", remove_options, key="remove_row_select")
-                        remove_btn = st.form_submit_button("删除选中行")
-                        if remove_btn:
-                            remove_idx = int(remove_choice.replace("第", "").replace("行", "")) - 1
-                    for i, row in enumerate(rows):
-                        row_type = st.session_state.get(f"row_type_{i}", "借方")
-                        rows[i]['type'] = 'debit' if row_type == "借方" else 'credit'
-                        rows[i]['voucher_date'] = st.session_state.get(f"voucher_date_{i}", date.today())
-                        rows[i]['post_date'] = st.session_state.get(f"post_date_{i}", date.today())
-                        rows[i]['sap_account_code'] = st.session_state.get(f"sap_account_code_{i}", "")
-                        rows[i]['sap_account_desc'] = st.session_state.get(f"sap_account_desc_{i}", "")
-                        rows[i]['sap_cost_center_code'] = st.session_state.get(f"sap_cost_center_code_{i}", "")
-                        rows[i]['sap_cost_center_desc'] = st.session_state.get(f"sap_cost_center_desc_{i}", "")
-                        rows[i]['debit_amount'] = st.session_state.get(f"debit_amount_{i}", 0.0)
-                        rows[i]['credit_amount'] = st.session_state.get(f"credit_amount_{i}", 0.0)
-                        rows[i]['sap_employee_code'] = st.session_state.get(f"sap_employee_code_{i}", "")
-                        rows[i]['sap_employee_desc'] = st.session_state.get(f"sap_employee_desc_{i}", "")
-                    if remove_idx is not None:
-                        del rows[remove_idx]
-                        st.session_state.booking_rows = rows
-                        st.experimental_rerun()
-                    total_debit = sum(r['debit_amount'] for r in rows)
-                    total_credit = sum(r['credit_amount'] for r in rows)
-                    st.markdown(f"**借方合计：{total_debit:.2f}    贷方合计：{total_credit:.2f}**")
-                    col_btn1, col_btn2 = st.columns(2)
-                    with col_btn1:
-                        add_row = st.form_submit_button("添加贷方行")
-                    with col_btn2:
-                        save = st.form_submit_button("保存")
-                    if add_row:
-                        rows.append({
-                            'type': 'credit',
-                            'sap_account_code': '',
-                            'sap_account_desc': '',
-                            'sap_cost_center_code': '',
-                            'sap_cost_center_desc': '',
-                            'debit_amount': 0.0,
-                            'credit_amount': 0.0,
-                            'sap_employee_code': '',
-                            'sap_employee_desc': '',
-                            'voucher_date': date.today(),
-                            'post_date': date.today(),
-                            'expense_id': None
-                        })
-                        st.session_state.booking_rows = rows
+                selected_rows = page_df.iloc[0:0]
+            st.write(f"第 {len(cursors)} 页，已选择 {len(selected_rows)} 条，"
+                     f"金额合计：{format_amount(selected_rows['amount_cents'].sum())}")
+            if st.session_state.get('voucher_modal', False) or not selected_rows.empty:
+                # 记账成功弹窗（form外部，且只显示弹窗不显示表单）
+                if st.session_state.get('voucher_modal', False):
+                    st.success(f"记账成功，凭证号{st.session_state.voucher_no}已经生成")
+                    voucher_result = st.session_state.get('voucher_result')
+                    if voucher_result is not None:
+                        st.caption(f"共 {voucher_result.lines} 行，{voucher_result.expenses} 笔报销，"
+                                   f"耗时 {voucher_result.elapsed * 1000:.1f} 毫秒")
+                    if st.button("确认"):
+                        st.session_state.voucher_modal = False
+                        st.session_state.booking_rows = []
+                        st.session_state.last_selected_ids = []
+                        selected_ids.clear()
+                        st.session_state.booking_grid_version += 1
                         st.experimental_rerun()
-                    if save:
-                        if total_debit != total_credit:
-                            st.error("借贷不平请检查！")
-                        else:
+                else:
+                    # 初始化借方行（每条报销一行）
+                    if 'booking_rows' not in st.session_state or st.session_state.get('last_selected_ids', []) != list(selected_rows['id']):
+                        st.session_state.booking_rows = []
+                        for _, row in selected_rows.iterrows():
+                            st.session_state.booking_rows.append({
+                                'type': 'debit',
+                                'sap_account_code': row['sap_account_code'],
+                                'sap_account_desc': row['sap_account_desc'],
+                                'sap_cost_center_code': row['sap_cost_center_code'],
+                                'sap_cost_center_desc': row['sap_cost_center_desc'],
+                                'debit_amount': float(row['amount']),
+                                'credit_amount': 0.0,
+                                'sap_employee_code': row['sap_employee_code'],
+                                'sap_employee_desc': row['sap_employee_desc'],
+                                'voucher_date': date.today(),
+                                'post_date': date.today(),
+                                'expense_id': row['id']
+                            })
+                        st.session_state.last_selected_ids = list(selected_rows['id'])
+                    rows = st.session_state.booking_rows
+                    with st.form("booking_form", clear_on_submit=False):
+                        st.subheader("记账信息")
+                        for i, row in enumerate(rows):
+                            with st.container():
+                                st.markdown(f"#### 行项目 {i+1}")
+                                col1, col2, col3 = st.columns([1,1,1])
+                                with col1:
+                                    row_type = st.selectbox("借贷方", ["借方", "贷方"], index=0 if row['type']=="debit" else 1, key=f"row_type_{i}")
+                                with col2:
+                                    voucher_date = st.date_input("凭证日期", value=row.get('voucher_date', date.today()), key=f"voucher_date_{i}")
+                                with col3:
+                                    post_date = st.date_input("过账日期", value=row.get('post_date', date.today()), key=f"post_date_{i}")
+                                col4, col5 = st.columns([2,2])
+                                with col4:
+                                    sap_account_code = st.text_input("SAP科目", value=row['sap_account_code'], key=f"sap_account_code_{i}")
+                                    sap_account_desc = st.text_input("SAP核算科目描述", value=row['sap_account_desc'], key=f"sap_account_desc_{i}")
+                                with col5:
+                                    sap_cost_center_code = st.text_input("成本中心", value=row['sap_cost_center_code'], key=f"sap_cost_center_code_{i}")
+                                    sap_cost_center_desc = st.text_input("成本中心描述", value=row['sap_cost_center_desc'], key=f"sap_cost_center_desc_{i}")
+                                col6, col7, col8 = st.columns([1,1,2])
+                                with col6:
+                                    if row_type == "借方":
+                                        debit_amount = st.number_input("借方金额", value=row['debit_amount'], min_value=0.0, key=f"debit_amount_{i}", disabled=False)
+                                        credit_amount = 0.0
+                                    else:
+                                        debit_amount = 0.0
+                                        credit_amount = st.number_input("贷方金额", value=row['credit_amount'], min_value=0.0, key=f"credit_amount_{i}", disabled=False)
+                                with col7:
+                                    sap_employee_code = st.text_input("SAP员工代码", value=row['sap_employee_code'], key=f"sap_employee_code_{i}")
+                                with col8:
+                                    sap_employee_desc = st.text_input("SAP员工姓名", value=row['sap_employee_desc'], key=f"sap_employee_desc_{i}")
+                        remove_idx = None
+                        if len(rows) > len(selected_rows):
+                            remove_options = [f"第{i+1}行" for i in range(len(selected_rows), len(rows))]
+                            remove_choice = st.selectbox("选择要删除的贷方行", remove_options, key="remove_row_select")
+                            remove_btn = st.form_submit_button("删除选中行")
+                            if remove_btn:
+                                remove_idx = int(remove_choice.replace("第", "").replace("行", "")) - 1
+                        for i, row in enumerate(rows):
+                            row_type = st.session_state.get(f"row_type_{i}", "借方")
+                            rows[i]['type'] = 'debit' if row_type == "借方" else 'credit'
+                            rows[i]['voucher_date'] = st.session_state.get(f"voucher_date_{i}", date.today())
+                            rows[i]['post_date'] = st.session_state.get(f"post_date_{i}", date.today())
+                            rows[i]['sap_account_code'] = st.session_state.get(f"sap_account_code_{i}", "")
+                            rows[i]['sap_account_desc'] = st.session_state.get(f"sap_account_desc_{i}", "")
+                            rows[i]['sap_cost_center_code'] = st.session_state.get(f"sap_cost_center_code_{i}", "")
+                            rows[i]['sap_cost_center_desc'] = st.session_state.get(f"sap_cost_center_desc_{i}", "")
+                            rows[i]['debit_amount'] = st.session_state.get(f"debit_amount_{i}", 0.0)
+                            rows[i]['credit_amount'] = st.session_state.get(f"credit_amount_{i}", 0.0)
+                            rows[i]['sap_employee_code'] = st.session_state.get(f"sap_employee_code_{i}", "")
+                            rows[i]['sap_employee_desc'] = st.session_state.get(f"sap_employee_desc_{i}", "")
+                        if remove_idx is not None:
+                            del rows[remove_idx]
+                            st.session_state.booking_rows = rows
+                            st.experimental_rerun()
+                        total_debit = sum_cents(r['debit_amount'] for r in rows)
+                        total_credit = sum_cents(r['credit_amount'] for r in rows)
+                        st.markdown(f"**借方合计：{format_amount(total_debit)}    贷方合计：{format_amount(total_credit)}**")
+                        col_btn1, col_btn2 = st.columns(2)
+                        with col_btn1:
+                            add_row = st.form_submit_button("添加贷方行")
+                        with col_btn2:
+                            save = st.form_submit_button("保存")
+                        if add_row:
+                            rows.append({
+                                'type': 'credit',
+                                'sap_account_code': '',
+                                'sap_account_desc': '',
+                                'sap_cost_center_code': '',
+                                'sap_cost_center_desc': '',
+                                'debit_amount': 0.0,
+                                'credit_amount': 0.0,
+                                'sap_employee_code': '',
+                                'sap_employee_desc': '',
+                                'voucher_date': date.today(),
+                                'post_date': date.today(),
+                                'expense_id': None
+                            })
+                            st.session_state.booking_rows = rows
+                            st.experimental_rerun()
+                        if save:
                             try:
-                                last_voucher = c.execute('SELECT MAX(voucher_no) FROM entry').fetchone()[0]
-                                voucher_no = 100000 if last_voucher is None else last_voucher + 1
-                                booking_date = date.today()
-                                booked_expense_ids = set()
-                                for r in rows:
-                                    c.execute('''
-                                        INSERT INTO expense_bookings (
-                                            expense_id, booking_date, sap_account_code, sap_account_desc,
-                                            sap_cost_center_code, sap_cost_center_desc, debit_amount,
-                                            credit_amount, sap_employee_code, sap_employee_desc
-                                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                    ''', (
-                                        r['expense_id'], booking_date,
-                                        r['sap_account_code'], r['sap_account_desc'],
-                                        r['sap_cost_center_code'], r['sap_cost_center_desc'],
-                                        r['debit_amount'], r['credit_amount'],
-                                        r['sap_employee_code'], r['sap_employee_desc']
-                                    ))
-                                    c.execute('''
-                                        INSERT INTO entry (
-                                            voucher_no, expense_id, entry_type, booking_date, sap_account_code, sap_account_desc,
-                                            sap_cost_center_code, sap_cost_center_desc, debit_amount, credit_amount, sap_employee_code, sap_employee_desc,
-                                            voucher_date, post_date
-                                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                    ''', (
-                                        voucher_no, r['expense_id'], r['type'], booking_date, r['sap_account_code'], r['sap_account_desc'],
-                                        r['sap_cost_center_code'], r['sap_cost_center_desc'], r['debit_amount'], r['credit_amount'],
-                                        r['sap_employee_code'], r['sap_employee_desc'], r['voucher_date'], r['post_date']
-                                    ))
-                                    if r['expense_id']:
-                                        booked_expense_ids.add(r['expense_id'])
-                                for eid in booked_expense_ids:
-                                    c.execute("UPDATE expenses SET status='booked' WHERE id=?", (eid,))
-                                conn.commit()
+                                result = save_voucher(rows)
                                 st.session_state.voucher_modal = True
-                                st.session_state.voucher_no = voucher_no
+                                st.session_state.voucher_no = result.voucher_no
+                                st.session_state.voucher_result = result
+                            except BookingError as e:
+                                st.error(str(e))
                             except Exception as e:
                                 st.error(f"保存失败：{str(e)}")
 
-elif st.session_state.current_page == "记账查看":
-    st.title("📑 记账凭证查看")
-    st.subheader("筛选条件")
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        voucher_no = st.text_input("凭证号")
-        sap_account_code = st.text_input("SAP科目")
-    with col2:
-        min_amount = st.number_input("金额范围（从）", value=0.0, step=100.0)
-        max_amount = st.number_input("金额范围（至）", value=0.0, step=100.0)
-    with col3:
-        employee = st.text_input("员工姓名")
-        date_from = st.date_input("日期从", value=None, key="entry_date_from")
-        date_to = st.date_input("日期至", value=None, key="entry_date_to")
-    if st.button("🔍 查询"):
-        query = "SELECT CAST(voucher_no AS TEXT) as '凭证号', entry_type as '借贷方', booking_date as '记账日期', sap_account_code as 'SAP科目', sap_account_desc as '科目描述', sap_cost_center_code as '成本中心', sap_cost_center_desc as '成本中心描述', debit_amount as '借方金额', credit_amount as '贷方金额', sap_employee_code as '员工代码', sap_employee_desc as '员工姓名', voucher_date as '凭证日期', post_date as '过账日期' FROM entry WHERE 1=1"
-        params = []
-        if voucher_no:
-            query += " AND voucher_no=?"
-            params.append(voucher_no)
-        if sap_account_code:
-            query += " AND sap_account_code LIKE ?"
-            params.append(f"%{sap_account_code}%")
-        if min_amount > 0:
-            query += " AND (debit_amount >= ? OR credit_amount >= ?)"
-            params.extend([min_amount, min_amount])
-        if max_amount > 0:
-            query += " AND (debit_amount <= ? OR credit_amount <= ?)"
-            params.extend([max_amount, max_amount])
-        if employee:
-            query += " AND sap_employee_desc LIKE ?"
-            params.append(f"%{employee}%")
-        if date_from:
-            query += " AND booking_date >= ?"
-            params.append(str(date_from))
-        if date_to:
-            query += " AND booking_date <= ?"
-            params.append(str(date_to))
-        query += " ORDER BY voucher_no DESC, id ASC"
-        df = pd.read_sql_query(query, conn, params=params)
-        st.dataframe(df, use_container_width=True)
+    elif st.session_state.current_page == "记账查看":
+        st.title("📑 记账凭证查看")
+        st.subheader("筛选条件")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            voucher_no = st.text_input("凭证号")
+            sap_account_code = st.text_input("SAP科目")
+        with col2:
+            min_amount = st.number_input("金额范围（从）", value=0.0, step=100.0)
+            max_amount = st.number_input("金额范围（至）", value=0.0, step=100.0)
+        with col3:
+            employee = st.text_input("员工姓名")
+            date_from = st.date_input("日期从", value=None, key="entry_date_from")
+            date_to = st.date_input("日期至", value=None, key="entry_date_to")
+        entry_keyword = st.text_input("关键字（SAP科目/科目描述/员工姓名，按相关度排序）", key="entry_keyword")
+        if st.button("🔍 查询"):
+            # 保存筛选条件供导出使用
+            st.session_state.entry_search = {
+                'voucher_no': voucher_no,
+                'sap_account_code': sap_account_code,
+                'min_amount': min_amount,
+                'max_amount': max_amount,
+                'employee': employee,
+                'date_from': date_from,
+                'date_to': date_to,
+                'keyword': entry_keyword,
+            }
+            query, params = build_entry_search(**st.session_state.entry_search)
+            df = pd.read_sql_query(query, conn, params=params)
+            st.dataframe(df, use_container_width=True)
+            if voucher_no.strip().isdigit():
+                posting = posting_of(conn, int(voucher_no))
+                if posting is not None:
+                    st.caption(f"SAP过账：{POSTING_STATUS_LABELS.get(posting['status'], posting['status'])}"
+                               + (f"，SAP凭证号 {posting['sap_document']}" if posting['sap_document'] else "")
+                               + (f"，{posting['last_error']}" if posting['last_error'] else ""))
+        if st.session_state.get('entry_search') is not None:
+            query, params = build_entry_search(**st.session_state.entry_search)
+            export_controls('entry', query, params, 'entries', 'Entries')
+
+        with st.expander("SAP过账"):
+            # 凭证保存后由后台线程分批发送到SAP，这里只看未完成和失败的
+            summary = posting_summary(conn)
+            posting_cols = st.columns(4)
+            posting_cols[0].metric("待发送", summary['pending'])
+            posting_cols[1].metric("发送中", summary['sending'])
+            posting_cols[2].metric("失败", summary['failed'])
+            posting_cols[3].metric("发送线程", "运行中" if sap_worker.running else "未启动")
+            if summary['oldest']:
+                st.caption(f"最早未过账的凭证入队于 {summary['oldest']}")
+            if summary['failed']:
+                query, params = failed_postings_query()
+                st.dataframe(pd.read_sql_query(query, conn, params=params), use_container_width=True)
+                if st.button("重新发送失败的凭证"):
+                    st.success(f"{retry_failed()} 张凭证已重新排队")
+
+        with st.expander("科目余额表"):
+            # 按分在SQL中汇总，借贷合计精确相等
+            tb_col1, tb_col2 = st.columns(2)
+            with tb_col1:
+                tb_date_from = st.date_input("记账日期从", value=date.today().replace(day=1), key="trial_balance_from")
+            with tb_col2:
+                tb_date_to = st.date_input("记账日期至", value=date.today(), key="trial_balance_to")
+            if st.button("生成科目余额表"):
+                query, params = build_trial_balance(tb_date_from, tb_date_to)
+                trial_balance = pd.read_sql_query(query, conn, params=params)
+                if trial_balance.empty:
+                    st.info("该期间没有凭证")
+                else:
+                    st.dataframe(trial_balance.drop(columns=['debit_cents', 'credit_cents']), use_container_width=True)
+                    total_debit = int(trial_balance['debit_cents'].sum())
+                    total_credit = int(trial_balance['credit_cents'].sum())
+                    st.markdown(f"**借方合计：{format_amount(total_debit)}    贷方合计：{format_amount(total_credit)}**")
+                    if total_debit != total_credit:
+                        st.error(f"借贷不平，差额 {format_amount(total_debit - total_credit)}")
+
+    elif st.session_state.current_page == "报销看板":
+        st.title("📈 报销看板")
+        # 看板只读 expense_summary 汇总表，不关联也不扫描报销明细
+        periods = [row[0] for row in c.execute(SUMMARY_PERIODS_SQL)]
+        if not periods:
+            st.info("暂无报销数据")
+        else:
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                period_from = st.selectbox("期间从", periods, index=min(11, len(periods) - 1), key="dashboard_period_from")
+            with col2:
+                period_to = st.selectbox("期间至", periods, index=0, key="dashboard_period_to")
+            with col3:
+                dashboard_company = st.selectbox("公司", [""] + master_data.descriptions('company'), key="dashboard_company")
+            with col4:
+                dashboard_department = st.selectbox("部门", [""] + master_data.descriptions('department'),
+                                                    key="dashboard_department")
+            summary_filters = {
+                'period_from': min(period_from, period_to),
+                'period_to': max(period_from, period_to),
+                'company': master_data.code_of('company', dashboard_company) if dashboard_company else None,
+                'department': master_data.code_of('department', dashboard_department) if dashboard_department else None,
+            }
+
+            status_labels = {'pending': '待记账', 'booked': '已记账'}
+            by_status = spend_summary(('status',), summary_filters).set_index('status')
+            metric_cols = st.columns(4)
+            metric_cols[0].metric("报销笔数", f"{int(by_status['笔数'].sum())}")
+            metric_cols[1].metric("金额合计", f"{by_status['金额'].sum():,.2f}")
+            for col, status in zip(metric_cols[2:], status_labels):
+                amount = by_status['金额'].get(status, 0.0)
+                col.metric(f"{status_labels[status]}金额", f"{amount:,.2f}")
+
+            st.subheader("按月趋势")
+            by_period = spend_summary(('period', 'status'), summary_filters)
+            by_period['status'] = by_period['status'].map(lambda s: status_labels.get(s, s))
+            st.bar_chart(by_period.pivot_table(index='period', columns='status', values='金额', aggfunc='sum', fill_value=0))
+
+            st.subheader("部门 × 预算科目")
+            by_item = spend_summary(('department', 'budget_item'), summary_filters)
+            pivot = by_item.pivot_table(index='department', columns='budget_item', values='金额', aggfunc='sum',
+                                        fill_value=0, margins=True, margins_name='合计')
+            st.dataframe(pivot.rename_axis(index='部门', columns='预算科目').round(2), use_container_width=True)
+
+    elif st.session_state.current_page == "系统诊断":
+        st.title("🩺 系统诊断")
+        # 本进程启动（或上次清空）以来的查询统计，按语句聚合；本页自身的查询也计入
+        report = query_stats.report()
+        metric_cols = st.columns(4)
+        metric_cols[0].metric("语句数", f"{len(report)}")
+        metric_cols[1].metric("执行次数", f"{int(report['调用次数'].sum())}")
+        metric_cols[2].metric("总耗时(毫秒)", f"{report['总耗时(毫秒)'].sum():,.1f}")
+        metric_cols[3].metric("慢查询阈值(毫秒)", f"{query_stats.slow_ms:g}")
+        st.caption(f"统计开始于 {query_stats.started:%Y-%m-%d %H:%M:%S}")
+        if st.button("清空统计"):
+            query_stats.reset()
+            st.experimental_rerun()
+
+        st.subheader("语句耗时")
+        top_n = st.selectbox("显示条数", [20, 50, 200], key="diagnostics_top_n")
+        st.dataframe(report.head(top_n), use_container_width=True)
+        if not report.empty:
+            statement = st.selectbox("耗时分布", report['语句'].head(top_n).tolist(), key="diagnostics_statement")
+            st.bar_chart(query_stats.histogram(statement))
+
+        st.subheader("最近的慢查询")
+        slow = query_stats.slow_queries()
+        if slow.empty:
+            st.info("没有超过阈值的查询")
+        else:
+            st.dataframe(slow, use_container_width=True)
+
+        st.subheader("页面性能")
+        # 开关对本进程所有会话生效，从下一次重跑开始记录
+        profile_cols = st.columns(3)
+        page_profiler.enabled = profile_cols[0].checkbox("记录页面重跑", value=page_profiler.enabled,
+                                                         key="diagnostics_profile")
+        page_profiler.capture = profile_cols[1].checkbox("采集 cProfile", value=page_profiler.capture,
+                                                         key="diagnostics_capture",
+                                                         disabled=not page_profiler.enabled)
+        if profile_cols[2].button("清空记录"):
+            page_profiler.reset()
+            st.experimental_rerun()
+        runs = page_profiler.runs()
+        if runs.empty:
+            st.info("暂无重跑记录，打开“记录页面重跑”后切换页面或操作控件即可看到")
+        else:
+            st.dataframe(page_profiler.summary(), use_container_width=True)
+            st.caption("最近的重跑")
+            st.dataframe(runs.head(100), use_container_width=True)
+        profile_files = page_profiler.profile_files()
+        if profile_files:
+            profile_file = st.selectbox("cProfile 结果", profile_files, key="diagnostics_profile_file")
+            profile_sort = st.radio("排序", ['cumulative', 'tottime', 'ncalls'], horizontal=True,
+                                    key="diagnostics_profile_sort")
+            st.code(page_profiler.top_functions(profile_file, sort=profile_sort))
+            # 下载后可用 snakeviz、flameprof 等工具查看调用图或火焰图
+            with open(page_profiler.profile_path(profile_file), 'rb') as f:
+                st.download_button("下载 .pstats", f.read(), file_name=profile_file,
+                                   mime="application/octet-stream")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.subheader("数据库连接池")
+            st.json(db.pool_stats())
+        with col2:
+            st.subheader("日志队列")
+            st.json(log_stats())
+        st.subheader("SAP过账发送")
+        st.json(sap_worker.stats())
+        st.subheader("邮件通知")
+        mail_summary = outbox_summary(conn)
+        mail_cols = st.columns(4)
+        mail_cols[0].metric("待汇总通知", mail_summary['events'])
+        mail_cols[1].metric("待发送邮件", mail_summary['pending'] + mail_summary['sending'])
+        mail_cols[2].metric("发送失败", mail_summary['failed'])
+        mail_cols[3].metric("发送线程", "运行中" if mail_sender.running else "未启动")
+        st.json(mail_sender.stats())
+        if mail_summary['failed'] and st.button("重新发送失败的邮件"):
+            st.success(f"{retry_failed_mail()} 封邮件已重新排队")
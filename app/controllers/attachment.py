@@ -0,0 +1,129 @@
+import os
+import time
+from app.models.database import db
+from app.utils.attachment_store import attachment_store
+from app.utils.logger import logger
+
+ATTACHMENTS_OF_SQL = """
+    SELECT id, expense_id, sha256, file_name, content_type, size, uploaded_by, created_at
+    FROM expense_attachments
+    WHERE expense_id = ?
+    ORDER BY id
+"""
+
+ATTACHMENT_SQL = """
+    SELECT id, expense_id, sha256, file_name, content_type, size, uploaded_by, created_at
+    FROM expense_attachments
+    WHERE id = ?
+"""
+
+ATTACHMENT_COUNTS_SQL = """
+    SELECT expense_id, COUNT(*) FROM expense_attachments
+    WHERE expense_id IN ({placeholders})
+    GROUP BY expense_id
+"""
+
+# 同一报销重复上传相同内容时保留原记录
+INSERT_SQL = """
+    INSERT INTO expense_attachments (expense_id, sha256, file_name, content_type, size, uploaded_by)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (expense_id, sha256) DO NOTHING
+"""
+
+REFERENCED_SQL = "SELECT EXISTS (SELECT 1 FROM expense_attachments WHERE sha256 = ?)"
+
+
+def add_attachment(expense_id, stream, file_name, uploaded_by=None):
+    """把上传的文件分块写入附件存储并关联到报销，返回附件id
+
+    stream 为可分块读取的文件对象（如 Streamlit 的 UploadedFile），文件内容不进数据库；
+    哈希和写临时文件在事务外完成，写锁内只做一条INSERT和文件移动。
+    """
+    start = time.perf_counter()
+    staged = attachment_store.stage(stream)
+    created = False
+    try:
+        with db.get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("SELECT 1 FROM expenses WHERE id = ?", (int(expense_id),)).fetchone() is None:
+                    raise ValueError(f"报销 {expense_id} 不存在")
+                conn.execute(INSERT_SQL, (int(expense_id), staged.sha256, os.path.basename(file_name),
+                                          staged.content_type, staged.size, uploaded_by))
+                attachment_id = conn.execute(
+                    "SELECT id FROM expense_attachments WHERE expense_id = ? AND sha256 = ?",
+                    (int(expense_id), staged.sha256)
+                ).fetchone()[0]
+                # INSERT成功后才移动文件；提交失败时删掉本次新写入的文件，不留下没有记录引用的文件
+                created = attachment_store.commit(staged)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                if created:
+                    attachment_store.remove(staged.sha256)
+                raise
+    finally:
+        attachment_store.discard(staged)
+    elapsed = time.perf_counter() - start
+    logger.info(f"报销 {expense_id} 上传附件 {file_name}（{staged.size} 字节，"
+                f"{'新文件' if created else '与已有文件相同，未重复存储'}）",
+                extra={'duration_ms': round(elapsed * 1000, 1)})
+    return attachment_id
+
+
+def attachments_of(conn, expense_id):
+    """一笔报销的全部附件元数据"""
+    return conn.execute(ATTACHMENTS_OF_SQL, (int(expense_id),)).fetchall()
+
+
+def get_attachment(conn, attachment_id):
+    """按id取附件元数据，不存在返回 None"""
+    return conn.execute(ATTACHMENT_SQL, (int(attachment_id),)).fetchone()
+
+
+def attachment_counts(conn, expense_ids):
+    """一组报销各自的附件数，{报销id: 附件数}，没有附件的不出现"""
+    expense_ids = [int(expense_id) for expense_id in expense_ids]
+    if not expense_ids:
+        return {}
+    sql = ATTACHMENT_COUNTS_SQL.format(placeholders=', '.join('?' * len(expense_ids)))
+    return dict(conn.execute(sql, expense_ids).fetchall())
+
+
+def delete_attachment(attachment_id):
+    """删除附件记录，文件已无其他报销引用时一并删除；返回是否删除了记录"""
+    with db.get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = get_attachment(conn, attachment_id)
+            if row is None:
+                conn.rollback()
+                return False
+            conn.execute("DELETE FROM expense_attachments WHERE id = ?", (row['id'],))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        # 记录提交后才删文件，回滚不会留下指向已删文件的记录；重新持写锁确认无引用，
+        # 期间相同内容的上传无法提交，不会删掉刚被引用的文件
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not conn.execute(REFERENCED_SQL, (row['sha256'],)).fetchone()[0]:
+                attachment_store.remove(row['sha256'])
+        except OSError as e:
+            # 记录已删除，文件删不掉只是多占空间
+            logger.warning(f"附件文件 {row['sha256'][:12]} 删除失败: {str(e)}")
+        finally:
+            conn.rollback()
+    logger.info(f"报销 {row['expense_id']} 的附件 {row['file_name']} 已删除")
+    return True
+
+
+def thumbnail_of(row):
+    """附件缩略图路径，首次访问时生成；无法生成时返回 None"""
+    return attachment_store.rendition(row['sha256'], row['content_type'], 'thumbnail')
+
+
+def preview_of(row):
+    """附件预览图路径，首次访问时生成；无法生成时返回 None"""
+    return attachment_store.rendition(row['sha256'], row['content_type'], 'preview')
@@ -0,0 +1,195 @@
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from config import config
+from app.models.database import db
+from app.models.permissions import permission_cache
+from app.utils.logger import logger
+from app.utils.security import check_permission, hash_password, is_password_hash, needs_rehash, verify_password
+
+
+class LoginBusyError(Exception):
+    """登录高峰时密码校验排队超时"""
+
+
+@dataclass
+class SessionIdentity:
+    """已登录会话的身份：登录时解析一次存入会话，页面重跑直接使用，不再查 users 表
+
+    stamp 记录解析时用户和角色权限两份缓存的版本，任一版本变化后由 refresh_identity 重新解析。
+    """
+    id: int
+    user_id: str
+    user_name: str
+    role_id: int
+    role_name: str
+    company_code: str = None
+    department_code: str = None
+    employee_code: str = None
+    permissions: int = 0
+    must_change_password: bool = False
+    stamp: tuple = ()
+
+    @property
+    def is_admin(self):
+        return self.role_name == 'admin'
+
+    def has_permission(self, required_permission):
+        return check_permission(self.permissions, required_permission)
+
+
+USER_LOGIN_SQL = """
+    SELECT u.id, u.user_id, u.user_name, u.password, u.role_id, r.role_name, u.company_code, u.department_code,
+           u.employee_code, u.must_change_password
+    FROM users u
+    LEFT JOIN roles r ON r.id = u.role_id
+    WHERE u.user_id = ?
+"""
+
+USER_IDENTITY_SQL = """
+    SELECT u.id, u.user_id, u.user_name, u.role_id, r.role_name, u.company_code, u.department_code,
+           u.employee_code, u.must_change_password
+    FROM users u
+    LEFT JOIN roles r ON r.id = u.role_id
+    WHERE u.id = ?
+"""
+
+_lock = threading.Lock()
+_executor = None
+_dummy_lock = threading.Lock()
+_dummy_hash = None
+_users_lock = threading.Lock()
+_users_version = 0
+
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # bcrypt计算时释放GIL，固定大小的线程池把登录高峰的CPU占用限制在 LOGIN_WORKERS 个核以内，
+            # 其余登录排队，不拖慢其他会话的页面重跑
+            _executor = ThreadPoolExecutor(max_workers=config['default'].LOGIN_WORKERS,
+                                           thread_name_prefix='login')
+        return _executor
+
+
+def run_bounded(fn, *args):
+    """在登录线程池中执行bcrypt计算并等待结果，排队超过 LOGIN_TIMEOUT 秒抛出 LoginBusyError"""
+    future = _pool().submit(fn, *args)
+    try:
+        return future.result(timeout=config['default'].LOGIN_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise LoginBusyError("登录人数较多，请稍后重试")
+
+
+def _unknown_user_hash():
+    global _dummy_hash
+    with _dummy_lock:
+        if _dummy_hash is None:
+            _dummy_hash = hash_password('unknown-user')
+        return _dummy_hash
+
+
+def _check_password(stored, password):
+    """在登录线程池中执行，返回 (是否通过, 需要写回的新哈希或None)"""
+    if stored is None:
+        # 用户不存在也做一次同等成本的校验，不能从响应时间判断用户ID是否存在
+        verify_password(password, _unknown_user_hash())
+        return False, None
+    if is_password_hash(stored):
+        if not verify_password(password, stored):
+            return False, None
+        return True, hash_password(password) if needs_rehash(stored) else None
+    # 老版本遗留的明文密码：常量时间比较，通过后换成哈希
+    if not hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8')):
+        return False, None
+    return True, hash_password(password)
+
+
+def invalidate_users():
+    """修改 users 表（姓名、角色、公司、部门、员工编码）提交后调用，已登录会话在下次重跑时重新解析身份"""
+    global _users_version
+    with _users_lock:
+        _users_version += 1
+
+
+def _identity_stamp():
+    return (_users_version, permission_cache.version)
+
+
+def _identity(row, stamp):
+    # 报销人取用户上保存的员工编码，不随姓名变化；权限位图取自角色权限缓存，只在解析身份时计算一次
+    return SessionIdentity(
+        id=row['id'],
+        user_id=row['user_id'],
+        user_name=row['user_name'],
+        role_id=row['role_id'],
+        role_name=row['role_name'],
+        company_code=row['company_code'],
+        department_code=row['department_code'],
+        employee_code=row['employee_code'],
+        permissions=permission_cache.mask_of(row['role_id']),
+        must_change_password=bool(row['must_change_password']),
+        stamp=stamp,
+    )
+
+
+def load_identity(user_pk):
+    """按 users.id 解析会话身份，用户已删除时返回None"""
+    # 先取版本再查库，解析期间发生的修改会在下次重跑时再解析一次
+    stamp = _identity_stamp()
+    with db.get_connection() as conn:
+        row = conn.execute(USER_IDENTITY_SQL, (user_pk,)).fetchone()
+    return _identity(row, stamp) if row else None
+
+
+def refresh_identity(identity):
+    """缓存版本未变时原样返回会话身份，否则重新解析"""
+    if identity.stamp == _identity_stamp():
+        return identity
+    logger.debug(f"用户 {identity.user_id} 的会话身份已重新解析")
+    return load_identity(identity.id)
+
+
+def authenticate(user_id, password):
+    """校验用户ID和密码，成功返回 SessionIdentity，失败返回None
+
+    密码校验在登录线程池中进行，等待期间不占用数据库连接；明文密码或成本因子与配置不一致的哈希
+    在登录成功后重算并写回。
+    """
+    stamp = _identity_stamp()
+    with db.get_connection() as conn:
+        row = conn.execute(USER_LOGIN_SQL, (user_id,)).fetchone()
+    stored = row['password'] if row else None
+    ok, new_hash = run_bounded(_check_password, stored, password)
+    if not ok:
+        logger.warning(f"登录失败：{user_id}")
+        return None
+    with db.get_connection() as conn:
+        if new_hash:
+            # 只在密码未被他人同时修改时写回
+            conn.execute("UPDATE users SET password=?, last_login=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP "
+                         "WHERE id=? AND password=?", (new_hash, row['id'], stored))
+            logger.info(f"用户 {user_id} 的密码哈希已{'重算' if is_password_hash(stored) else '由明文迁移'}")
+        else:
+            conn.execute("UPDATE users SET last_login=CURRENT_TIMESTAMP WHERE id=?", (row['id'],))
+        conn.commit()
+    return _identity(row, stamp)
+
+
+def hash_new_password(password):
+    """新建或修改用户时计算密码哈希，同样在登录线程池中执行"""
+    return run_bounded(hash_password, password)
+
+
+def change_password(identity, password):
+    """用户修改自己的密码并清除“须修改密码”标记；哈希在登录线程池中计算，繁忙时抛出 LoginBusyError"""
+    hashed = hash_new_password(password)
+    with db.get_connection() as conn:
+        conn.execute("UPDATE users SET password=?, must_change_password=0, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                     (hashed, identity.id))
+        conn.commit()
+    invalidate_users()
+    logger.info(f"用户 {identity.user_id} 已修改密码")
@@ -0,0 +1,194 @@
+import time
+from dataclasses import dataclass, field
+from datetime import date
+import pandas as pd
+from config import config
+from app.models.database import db
+from app.models.master_data import master_data
+from app.models.queries import build_auto_booking_source
+from app.controllers.booking import BookingError, next_voucher_no, write_vouchers
+from app.controllers.sap_posting import sap_worker
+from app.utils.money import sum_cents, to_cents, to_yuan
+from app.utils.logger import logger
+
+# 可用的凭证分组维度
+GROUP_KEYS = ('company', 'department', 'employee', 'budget_item')
+
+GROUP_LABELS = {'company': '公司', 'department': '部门', 'employee': '报销人', 'budget_item': '预算科目'}
+
+
+@dataclass
+class AutoBookingPlan:
+    """自动记账方案：待生成的凭证和不能记账的报销记录，试运行只生成方案不写库"""
+    group_by: tuple
+    posting_date: date
+    # [(分组编码元组, 行项目列表)]
+    vouchers: list = field(default_factory=list)
+    # [(报销id, 日期, 金额（元）, 原因)]
+    skipped: list = field(default_factory=list)
+
+    @property
+    def lines(self):
+        return sum(len(rows) for _, rows in self.vouchers)
+
+    @property
+    def expenses(self):
+        return sum(1 for _, rows in self.vouchers for r in rows if r['expense_id'])
+
+    @property
+    def amount(self):
+        return float(to_yuan(sum_cents(r['debit_amount'] for _, rows in self.vouchers for r in rows)))
+
+    def report(self):
+        """按凭证汇总的试运行报告"""
+        records = []
+        for group, rows in self.vouchers:
+            record = {GROUP_LABELS[key]: master_data.description_of(key, code) or code
+                      for key, code in zip(self.group_by, group)}
+            record['行数'] = len(rows)
+            record['报销笔数'] = sum(1 for r in rows if r['expense_id'])
+            record['金额'] = float(to_yuan(sum_cents(r['debit_amount'] for r in rows)))
+            records.append(record)
+        columns = [GROUP_LABELS[key] for key in self.group_by] + ['行数', '报销笔数', '金额']
+        return pd.DataFrame(records, columns=columns)
+
+    def skipped_report(self):
+        """不能自动记账的报销记录及原因"""
+        return pd.DataFrame(self.skipped, columns=['报销ID', '日期', '金额', '原因'])
+
+
+@dataclass
+class AutoBookingResult:
+    vouchers: int
+    lines: int
+    expenses: int
+    first_voucher_no: int
+    last_voucher_no: int
+    elapsed: float
+
+
+def parse_group_by(value):
+    """'company,employee' 形式的分组配置转成元组"""
+    keys = tuple(key.strip() for key in value.split(',') if key.strip()) if isinstance(value, str) else tuple(value)
+    unknown = [key for key in keys if key not in GROUP_KEYS]
+    if not keys or unknown:
+        raise ValueError(f"分组维度只能是 {', '.join(GROUP_KEYS)}")
+    return keys
+
+
+def default_group_by():
+    """配置中的默认分组维度"""
+    return parse_group_by(config['default'].AUTO_BOOKING_GROUP_BY)
+
+
+def _debit_line(expense, posting_date):
+    account = master_data.get('budget_item', expense['budget_item'])
+    if account is None or not account.sap_code:
+        return None, '预算科目缺少SAP核算科目'
+    employee = master_data.get('employee', expense['employee'])
+    if employee is None or not employee.sap_code:
+        return None, '报销人缺少SAP员工代码'
+    cost_center_code, cost_center_desc = master_data.sap_of('department', expense['department'])
+    return {
+        'type': 'debit',
+        'sap_account_code': account.sap_code,
+        'sap_account_desc': account.sap_description,
+        'sap_cost_center_code': cost_center_code or '',
+        'sap_cost_center_desc': cost_center_desc or '',
+        'debit_amount': float(to_yuan(expense['amount_cents'])),
+        'credit_amount': 0.0,
+        'sap_employee_code': employee.sap_code,
+        'sap_employee_desc': employee.sap_description,
+        'voucher_date': posting_date,
+        'post_date': posting_date,
+        'expense_id': int(expense['id']),
+    }, None
+
+
+def _credit_lines(debits, posting_date, settings):
+    """贷方按员工汇总记其他应付款，按分累加，保证每张凭证借贷平衡"""
+    totals = {}
+    for line in debits:
+        key = (line['sap_employee_code'], line['sap_employee_desc'])
+        totals[key] = totals.get(key, 0) + to_cents(line['debit_amount'])
+    return [{
+        'type': 'credit',
+        'sap_account_code': settings.AUTO_BOOKING_CREDIT_ACCOUNT,
+        'sap_account_desc': settings.AUTO_BOOKING_CREDIT_ACCOUNT_DESC,
+        'sap_cost_center_code': '',
+        'sap_cost_center_desc': '',
+        'debit_amount': 0.0,
+        'credit_amount': float(to_yuan(cents)),
+        'sap_employee_code': employee_code,
+        'sap_employee_desc': employee_desc,
+        'voucher_date': posting_date,
+        'post_date': posting_date,
+        'expense_id': None,
+    } for (employee_code, employee_desc), cents in totals.items()]
+
+
+def plan_auto_booking(company=None, date_from=None, date_to=None, group_by=None, posting_date=None, department=None):
+    """读取公司/部门/期间内全部待记账记录，按分组维度生成凭证方案（不写库）"""
+    settings = config['default']
+    group_by = parse_group_by(group_by) if group_by else default_group_by()
+    posting_date = posting_date or date.today()
+    plan = AutoBookingPlan(group_by, posting_date)
+    groups = {}
+    query, params = build_auto_booking_source(company=company, department=department,
+                                              date_from=date_from, date_to=date_to)
+    with db.get_connection() as conn:
+        for expense in conn.execute(query, params):
+            line, reason = _debit_line(expense, posting_date)
+            if line is None:
+                amount = float(to_yuan(expense['amount_cents']))
+                plan.skipped.append((expense['id'], expense['expense_date'], amount, reason))
+                continue
+            groups.setdefault(tuple(expense[key] for key in group_by), []).append(line)
+    for group, debits in groups.items():
+        rows = debits + _credit_lines(debits, posting_date, settings)
+        plan.vouchers.append((group, rows))
+    logger.info(f"自动记账方案：{len(plan.vouchers)} 张凭证，{plan.expenses} 笔报销，"
+                f"金额 {plan.amount:.2f}，跳过 {len(plan.skipped)} 笔")
+    return plan
+
+
+def post_auto_booking(plan, batch_size=None, progress=None):
+    """按方案过账
+
+    每 batch_size 张凭证一个 BEGIN IMMEDIATE 事务；某批失败时该批整体回滚并中止，之前的批次保持已提交。
+    progress(已完成凭证数, 凭证总数) 在每批提交后回调。
+    """
+    batch_size = batch_size or config['default'].AUTO_BOOKING_BATCH_SIZE
+    booking_date = str(date.today())
+    total = len(plan.vouchers)
+    posted = expenses = lines = 0
+    first_voucher_no = last_voucher_no = None
+    start = time.perf_counter()
+    with db.get_connection() as conn:
+        for offset in range(0, total, batch_size):
+            batch = plan.vouchers[offset:offset + batch_size]
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                voucher_no = next_voucher_no(conn)
+                numbered = [(voucher_no + i, rows) for i, (_, rows) in enumerate(batch)]
+                expenses += write_vouchers(conn, numbered, booking_date)
+                conn.commit()
+            except BookingError as e:
+                conn.rollback()
+                raise BookingError(f"已过账 {posted} 张凭证后中止：{e}") from e
+            except Exception:
+                conn.rollback()
+                raise
+            posted += len(batch)
+            lines += sum(len(rows) for _, rows in batch)
+            first_voucher_no = numbered[0][0] if first_voucher_no is None else first_voucher_no
+            last_voucher_no = numbered[-1][0]
+            sap_worker.notify()
+            if progress:
+                progress(posted, total)
+    elapsed = time.perf_counter() - start
+    rate = posted / elapsed if elapsed > 0 else 0
+    logger.info(f"自动记账完成：{posted} 张凭证（{first_voucher_no} - {last_voucher_no}），{lines} 行，"
+                f"{expenses} 笔报销，耗时 {elapsed:.2f}秒（{rate:.0f} 张/秒）",
+                extra={'duration_ms': round(elapsed * 1000, 1)})
+    return AutoBookingResult(posted, lines, expenses, first_voucher_no, last_voucher_no, elapsed)
@@ -0,0 +1,132 @@
+import time
+from dataclasses import dataclass
+from datetime import date
+from app.models.database import db
+from app.models.queries import LAST_VOUCHER_SQL, UNBALANCED_VOUCHERS_SQL
+from app.controllers.sap_posting import enqueue_vouchers, sap_worker
+from app.controllers.notification import record_booked
+from app.utils.money import format_amount, sum_cents, to_cents
+from app.utils.logger import logger
+
+# 首张凭证的凭证号
+FIRST_VOUCHER_NO = 100000
+
+BOOKING_INSERT_SQL = """
+    INSERT INTO expense_bookings (
+        expense_id, booking_date, sap_account_code, sap_account_desc,
+        sap_cost_center_code, sap_cost_center_desc, debit_cents,
+        credit_cents, sap_employee_code, sap_employee_desc
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+ENTRY_INSERT_SQL = """
+    INSERT INTO entry (
+        voucher_no, expense_id, entry_type, booking_date, sap_account_code, sap_account_desc,
+        sap_cost_center_code, sap_cost_center_desc, debit_cents, credit_cents, sap_employee_code, sap_employee_desc,
+        voucher_date, post_date
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# 按凭证号区间一次性更新本批凭证涉及的全部报销记录
+MARK_BOOKED_SQL = """
+    UPDATE expenses SET status='booked'
+    WHERE status='pending'
+      AND id IN (SELECT expense_id FROM entry WHERE voucher_no BETWEEN ? AND ? AND expense_id IS NOT NULL)
+"""
+
+
+class BookingError(ValueError):
+    """凭证不能保存（借贷不平、报销记录已被记账等）"""
+
+
+@dataclass
+class VoucherResult:
+    voucher_no: int
+    lines: int
+    expenses: int
+    elapsed: float
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def check_balance(rows):
+    """借贷平衡检查（按分精确比较），不平时抛出 BookingError"""
+    if not rows:
+        raise BookingError("凭证没有行项目")
+    if sum_cents(r['debit_amount'] for r in rows) != sum_cents(r['credit_amount'] for r in rows):
+        raise BookingError("借贷不平请检查！")
+
+
+def next_voucher_no(conn):
+    """下一个凭证号，必须在写事务内调用"""
+    last_voucher = conn.execute(LAST_VOUCHER_SQL).fetchone()[0]
+    return FIRST_VOUCHER_NO if last_voucher is None else last_voucher + 1
+
+
+def write_vouchers(conn, vouchers, booking_date):
+    """在调用方的事务中写入一批凭证并更新报销状态，返回涉及的报销笔数
+
+    vouchers 为 [(凭证号, 行项目列表)]，凭证号须连续递增；行项目中的 expense_id 须为int或None，
+    金额以元计、写入时换算为分。写入后由SQL按凭证汇总核对借贷，任何一张不平都抛出 BookingError。
+    凭证同时加入SAP过账队列、记录报销人的记账通知，调用方提交事务后调用 sap_worker.notify()。
+    """
+    expense_ids = {r['expense_id'] for _, rows in vouchers for r in rows if r['expense_id']}
+    conn.executemany(BOOKING_INSERT_SQL, [(
+        r['expense_id'], booking_date,
+        r['sap_account_code'], r['sap_account_desc'],
+        r['sap_cost_center_code'], r['sap_cost_center_desc'],
+        to_cents(r['debit_amount']), to_cents(r['credit_amount']),
+        r['sap_employee_code'], r['sap_employee_desc']
+    ) for _, rows in vouchers for r in rows])
+    conn.executemany(ENTRY_INSERT_SQL, [(
+        voucher_no, r['expense_id'], r['type'], booking_date,
+        r['sap_account_code'], r['sap_account_desc'],
+        r['sap_cost_center_code'], r['sap_cost_center_desc'],
+        to_cents(r['debit_amount']), to_cents(r['credit_amount']),
+        r['sap_employee_code'], r['sap_employee_desc'],
+        _text(r['voucher_date']), _text(r['post_date'])
+    ) for voucher_no, rows in vouchers for r in rows])
+    unbalanced = conn.execute(UNBALANCED_VOUCHERS_SQL, (vouchers[0][0], vouchers[-1][0])).fetchone()
+    if unbalanced is not None:
+        raise BookingError(f"凭证 {unbalanced['voucher_no']} 借贷不平：借方 {format_amount(unbalanced['debit_cents'])}，"
+                           f"贷方 {format_amount(unbalanced['credit_cents'])}")
+    updated = conn.execute(MARK_BOOKED_SQL, (vouchers[0][0], vouchers[-1][0])).rowcount
+    if updated != len(expense_ids):
+        raise BookingError("部分报销记录已被记账或不存在，请刷新后重试")
+    # 与分录同一事务进入SAP过账队列，由后台线程发送
+    enqueue_vouchers(conn, [voucher_no for voucher_no, _ in vouchers])
+    record_booked(conn, vouchers[0][0], vouchers[-1][0])
+    return updated
+
+
+def save_voucher(rows, booking_date=None):
+    """保存一张凭证
+
+    rows 为记账页面的行项目（字典，字段同 booking_rows）。凭证号分配、分录写入和报销状态更新
+    在同一个 BEGIN IMMEDIATE 事务中完成，任何一步失败都整体回滚。
+    """
+    check_balance(rows)
+    booking_date = str(booking_date or date.today())
+    # 页面上的id来自DataFrame，可能是numpy整数，统一转成int再绑定
+    rows = [dict(r, expense_id=int(r['expense_id']) if r['expense_id'] else None) for r in rows]
+
+    start = time.perf_counter()
+    with db.get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 写锁内取号，并发保存不会拿到同一个凭证号
+            voucher_no = next_voucher_no(conn)
+            expenses = write_vouchers(conn, [(voucher_no, rows)], booking_date)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    sap_worker.notify()
+    elapsed = time.perf_counter() - start
+    rate = len(rows) / elapsed if elapsed > 0 else 0
+    logger.info(f"凭证 {voucher_no} 保存成功：{len(rows)} 行，{expenses} 笔报销，"
+                f"耗时 {elapsed * 1000:.1f}毫秒（{rate:.0f} 行/秒）",
+                extra={'duration_ms': round(elapsed * 1000, 1)})
+    return VoucherResult(voucher_no, len(rows), expenses, elapsed)
@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+import pandas as pd
+from app.models.database import db
+from app.models.master_data import master_data
+from app.models.queries import BUDGET_CHECK_SQL, build_budget_report
+from app.utils.logger import logger
+from app.utils.money import format_amount, to_cents
+
+# 预算控制方式
+BUDGET_CONTROL_MODES = ('off', 'warn', 'block')
+
+
+@dataclass
+class BudgetCheck:
+    """预算校验结果，金额均以分计"""
+    period: str
+    budget: int
+    consumed: int
+    amount: int
+
+    @property
+    def remaining(self):
+        return self.budget - self.consumed
+
+    @property
+    def exceeded(self):
+        return self.consumed + self.amount > self.budget
+
+    def message(self):
+        return (f"{self.period} 预算 {format_amount(self.budget)}，已占用 {format_amount(self.consumed)}，"
+                f"剩余 {format_amount(self.remaining)}，本次 {format_amount(self.amount)}")
+
+
+class BudgetExceededError(ValueError):
+    """超预算且预算控制为 block"""
+
+    def __init__(self, check):
+        super().__init__(f"超出预算：{check.message()}")
+        self.check = check
+
+
+def period_of(value):
+    """日期所属的预算期间（YYYY-MM）"""
+    return str(value)[:7]
+
+
+def check_budget(conn, period, department, budget_item, amount):
+    """查询预算余额，没有设置预算时返回None
+
+    只按主键读取预算和占用计数各一行，不扫描报销明细；amount 为本次报销金额（元）。
+    """
+    row = conn.execute(BUDGET_CHECK_SQL, (period, department or '', budget_item or '')).fetchone()
+    if row is None:
+        return None
+    return BudgetCheck(period, row[0], row[1], to_cents(amount))
+
+
+def save_budgets(period, department, amounts):
+    """保存某期间某部门各预算科目的预算金额
+
+    amounts 为 {预算科目编码: 金额（元）}，金额为None表示删除该科目的预算。
+    """
+    upserts = [(period, department, item, to_cents(amount)) for item, amount in amounts.items() if amount is not None]
+    deletes = [(period, department, item) for item, amount in amounts.items() if amount is None]
+    with db.get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("""
+                INSERT INTO budgets (period, department, budget_item, amount_cents) VALUES (?, ?, ?, ?)
+                ON CONFLICT (period, department, budget_item) DO UPDATE SET
+                    amount_cents = excluded.amount_cents, updated_at = CURRENT_TIMESTAMP
+            """, upserts)
+            conn.executemany("DELETE FROM budgets WHERE period = ? AND department = ? AND budget_item = ?", deletes)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    logger.info(f"预算已保存：{period} {department}，更新 {len(upserts)} 项，删除 {len(deletes)} 项")
+
+
+def budget_report(period, department=None):
+    """预算执行表：预算、待记账、已记账、剩余和执行率"""
+    query, params = build_budget_report(period, department)
+    with db.get_connection() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    df['department'] = [master_data.description_of('department', code) or code for code in df['department']]
+    df['budget_item'] = [master_data.description_of('budget_item', code) or code for code in df['budget_item']]
+    return df.rename(columns={
+        'department': '部门', 'budget_item': '预算科目', 'budget': '预算', 'pending': '待记账',
+        'booked': '已记账', 'remaining': '剩余', 'rate': '执行率',
+    })
@@ -0,0 +1,43 @@
+from config import config
+from app.models.database import db
+from app.controllers.budget import BudgetExceededError, check_budget, period_of
+from app.controllers.notification import record_submitted
+from app.utils.logger import logger
+from app.utils.money import to_cents
+
+
+def submit_expense(expense_date, department, company, budget_item, employee, amount, description, control=None):
+    """提交一笔报销，返回 (报销id, 预算校验结果)
+
+    预算校验与写入在同一个 BEGIN IMMEDIATE 事务中，并发提交不会同时挤占同一笔预算余额；
+    control 为 block 时超预算抛出 BudgetExceededError，不写库；报销人为空时抛出 ValueError。amount 以元计，按分入库。
+    """
+    if not employee:
+        # 没有报销人的记录谁也查不到，也发不出通知
+        raise ValueError("报销人不能为空")
+    control = control or config['default'].BUDGET_CONTROL
+    with db.get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            check = None
+            if control != 'off':
+                check = check_budget(conn, period_of(expense_date), department, budget_item, amount)
+            if check is not None and check.exceeded and control == 'block':
+                # 业务拒绝不是连接错误，出了连接上下文再抛出
+                conn.rollback()
+            else:
+                cursor = conn.execute('''
+                    INSERT INTO expenses (expense_date, department, company, budget_item, employee, amount_cents, description, status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 'pending')
+                ''', (str(expense_date), department, company, budget_item, employee, to_cents(amount), description))
+                # 只写一条通知事件，邮件由后台线程汇总发送
+                record_submitted(conn, cursor.lastrowid, employee)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if check is not None and check.exceeded and control == 'block':
+        raise BudgetExceededError(check)
+    if check is not None and check.exceeded:
+        logger.warning(f"报销 {cursor.lastrowid} 超出预算：{department}/{budget_item} {check.message()}")
+    return cursor.lastrowid, check
@@ -0,0 +1,119 @@
+import hashlib
+import time
+from io import BytesIO
+from dataclasses import dataclass
+import pandas as pd
+from openpyxl import load_workbook
+from app.models.database import db
+from app.models.master_data import master_data
+from app.utils.logger import logger
+
+# 各类主数据导入模板的列：编码、描述、SAP代码、SAP描述
+IMPORT_COLUMNS = {
+    'department': ["部门编码", "部门描述", "SAP成本中心", "SAP成本中心描述"],
+    'company': ["公司编码", "公司描述", "SAP公司代码", "SAP公司描述"],
+    'budget_item': ["预算科目编码", "预算科目描述", "SAP核算科目", "SAP核算科目描述"],
+    'employee': ["报销人编码", "报销人姓名", "SAP员工代码", "SAP员工姓名"],
+}
+
+FIELDS = ['code', 'description', 'sap_code', 'sap_description']
+
+
+class ImportFormatError(ValueError):
+    """导入文件格式不正确"""
+
+
+@dataclass
+class ImportResult:
+    total: int
+    inserted: int
+    skipped: int
+    rejects: pd.DataFrame
+    elapsed: float
+
+
+def content_hash(data):
+    """上传文件内容的哈希，用于避免同一文件重复导入"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Excel中的纯数字编码会被读成浮点数
+        value = int(value)
+    return str(value).strip()
+
+
+def read_excel_rows(file):
+    """以只读模式逐行读取第一个工作表，返回DataFrame（全部为文本）"""
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [_cell_text(value) for value in next(rows, ())]
+        data = [tuple(_cell_text(value) for value in row) for row in rows if any(v is not None for v in row)]
+    finally:
+        workbook.close()
+    width = len(header)
+    data = [row[:width] + ('',) * (width - len(row)) for row in data]
+    df = pd.DataFrame(data, columns=header, dtype=object)
+    # Excel行号：第1行是表头
+    df.index = pd.RangeIndex(2, len(df) + 2, name='行号')
+    return df
+
+
+def validate_rows(key, df, existing):
+    """校验并拆分为待写入行和拒绝行
+
+    existing 为库中该类主数据 {编码: 描述}。返回 (待写入DataFrame, 已存在行数, 拒绝DataFrame)。
+    """
+    columns = IMPORT_COLUMNS[key]
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise ImportFormatError(f"Excel文件格式不正确！请确保包含：{'、'.join(columns)}")
+    rows = df[columns].copy()
+    rows.columns = FIELDS
+
+    reason = pd.Series('', index=rows.index, dtype=object)
+    blank = rows.eq('').any(axis=1)
+    reason[blank] = '必填项为空'
+    duplicated = ~blank & rows.duplicated(subset=['code'], keep='first')
+    reason[duplicated & reason.eq('')] = '文件内编码重复'
+
+    existing_desc = rows['code'].map(existing)
+    known = existing_desc.notna()
+    conflict = known & existing_desc.ne(rows['description'])
+    reason[conflict & reason.eq('')] = '编码已存在且描述不同'
+    same = known & ~conflict & reason.eq('')
+
+    rejects = df.loc[reason.ne(''), columns].copy()
+    rejects.insert(0, '原因', reason[reason.ne('')])
+    accepted = rows[reason.eq('') & ~same]
+    return accepted, int(same.sum()), rejects.reset_index()
+
+
+def import_master_data(key, data):
+    """把上传的Excel内容批量导入config表，单事务 executemany 写入"""
+    start = time.perf_counter()
+    df = read_excel_rows(BytesIO(data))
+    existing = {entry.code: entry.description for entry in master_data.entries(key)}
+    accepted, skipped, rejects = validate_rows(key, df, existing)
+    with db.get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
+                ((key, *row) for row in accepted.itertuples(index=False, name=None))
+            )
+            inserted = conn.total_changes - before
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    master_data.invalidate()
+    elapsed = time.perf_counter() - start
+    logger.info(f"主数据导入 {key}：共 {len(df)} 行，新增 {inserted}，已存在 {skipped}，拒绝 {len(rejects)}，"
+                f"耗时 {elapsed:.2f}秒", extra={'duration_ms': round(elapsed * 1000, 1)})
+    return ImportResult(len(df), inserted, skipped + len(accepted) - inserted, rejects, elapsed)
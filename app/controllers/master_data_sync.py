@@ -0,0 +1,246 @@
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass
+from config import config
+from app.models.database import db
+from app.models.master_data import MasterDataEntry, master_data
+from app.utils.logger import logger
+from app.utils.sap_client import SapClient, SapError
+
+# SAP主数据对象 -> 本地主数据类型（config.key）
+SYNC_OBJECTS = {
+    'cost_center': 'department',
+    'gl_account': 'budget_item',
+    'company_code': 'company',
+    'employee': 'employee',
+}
+
+SYNC_SOURCE = 'sap_master_data'
+
+# 按SAP代码查找本地记录时每条语句的参数个数
+LOOKUP_CHUNK = 500
+
+WATERMARK_SQL = "SELECT watermark FROM sync_state WHERE source = ?"
+
+SAVE_WATERMARK_SQL = """
+    INSERT INTO sync_state (source, watermark, synced_at, last_result) VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+    ON CONFLICT(source) DO UPDATE SET watermark = excluded.watermark, synced_at = excluded.synced_at,
+                                      last_result = excluded.last_result
+"""
+
+SYNC_STATE_SQL = "SELECT watermark, synced_at, last_result FROM sync_state WHERE source = ?"
+
+MAPPED_SQL = "SELECT DISTINCT sap_code FROM config WHERE key = ? AND sap_code IN ({placeholders})"
+
+# 描述没变的记录不写，SAP重复推送同一变更时不产生写入
+UPDATE_SQL = """
+    UPDATE config SET sap_description = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE key = ? AND sap_code = ? AND sap_description <> ?
+"""
+
+# 本地编码取SAP代码；同编码已手工维护过的不重复建。updated_at 显式写入，老库补的字段没有默认值，
+# 其他进程的主数据缓存按它找出新建的记录
+INSERT_SQL = """
+    INSERT INTO config (key, code, description, sap_code, sap_description, updated_at)
+    SELECT ?, ?, ?, ?, ?, CURRENT_TIMESTAMP
+    WHERE NOT EXISTS (SELECT 1 FROM config WHERE key = ? AND code = ?)
+"""
+
+CHANGED_ROWS_SQL = """
+    SELECT code, description, sap_code, sap_description FROM config
+    WHERE key = ? AND sap_code IN ({placeholders})
+"""
+
+
+class MasterDataSyncError(Exception):
+    """主数据同步无法进行（未配置SAP接口等）"""
+
+
+@dataclass
+class SyncResult:
+    pages: int = 0
+    received: int = 0
+    updated: int = 0
+    inserted: int = 0
+    unmapped: int = 0
+    deleted: int = 0
+    watermark: str = ''
+    elapsed: float = 0.0
+
+
+def _chunks(items, size=LOOKUP_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def sync_state(conn):
+    """上次同步的水位、时间和结果，从未同步过时返回 None"""
+    row = conn.execute(SYNC_STATE_SQL, (SYNC_SOURCE,)).fetchone()
+    if row is None:
+        return None
+    return {'watermark': row['watermark'], 'synced_at': row['synced_at'],
+            'last_result': json.loads(row['last_result']) if row['last_result'] else None}
+
+
+def apply_changes(conn, records, creatable=()):
+    """在调用方的事务中按SAP代码批量更新config，返回 (计数, {key: 变更后的记录})
+
+    同一页中同一对象的多次变更只取最后一次。SAP中删除或冻结的对象不删本地主数据
+    （历史报销和凭证仍引用），只计数；没有本地映射的对象，creatable 中的类型按SAP代码新建，其余计为未映射。
+    """
+    latest = {}
+    for record in records:
+        key = SYNC_OBJECTS.get(record.get('object'))
+        code = str(record.get('code') or '').strip()
+        if key is None or not code:
+            continue
+        latest.setdefault(key, {})[code] = record
+    counts = {'updated': 0, 'inserted': 0, 'unmapped': 0, 'deleted': 0}
+    changed = {}
+    for key, items in latest.items():
+        codes = list(items)
+        mapped = set()
+        for chunk in _chunks(codes):
+            sql = MAPPED_SQL.format(placeholders=', '.join('?' * len(chunk)))
+            mapped.update(row[0] for row in conn.execute(sql, [key] + chunk))
+        updates, inserts = [], []
+        for code, record in items.items():
+            description = str(record.get('description') or '').strip()
+            if record.get('deleted'):
+                counts['deleted'] += 1
+            elif code in mapped:
+                updates.append((description, key, code, description))
+            elif key in creatable and description:
+                inserts.append((key, code, description, code, description, key, code))
+            else:
+                counts['unmapped'] += 1
+        if updates:
+            counts['updated'] += conn.executemany(UPDATE_SQL, updates).rowcount
+        if inserts:
+            counts['inserted'] += conn.executemany(INSERT_SQL, inserts).rowcount
+        touched = [row[2] for row in updates] + [row[1] for row in inserts]
+        for chunk in _chunks(touched):
+            sql = CHANGED_ROWS_SQL.format(placeholders=', '.join('?' * len(chunk)))
+            changed.setdefault(key, []).extend(MasterDataEntry(*tuple(row)) for row in conn.execute(sql, [key] + chunk))
+    return counts, changed
+
+
+def _settings_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def sync_master_data(client=None, page_size=None, objects=None, creatable=None):
+    """从SAP增量拉取上次水位之后的主数据变更并写入config，返回 SyncResult
+
+    每页变更和新水位在同一事务中提交，中途失败时下次从已提交的水位继续；
+    提交后把变更的记录合并进主数据缓存，不重新加载整张config表。
+    """
+    settings = config['default']
+    client = client or _default_client()
+    if client is None:
+        raise MasterDataSyncError("未配置 SAP_HOST，无法同步主数据")
+    page_size = page_size or settings.SAP_SYNC_PAGE_SIZE
+    objects = objects or _settings_list(settings.SAP_SYNC_OBJECTS)
+    creatable = set(_settings_list(settings.SAP_SYNC_CREATE) if creatable is None else creatable)
+    start = time.perf_counter()
+    result = SyncResult()
+    with _sync_lock:
+        with db.get_connection() as conn:
+            row = conn.execute(WATERMARK_SQL, (SYNC_SOURCE,)).fetchone()
+        watermark = row[0] if row else ''
+        while True:
+            records, next_watermark, has_more = client.master_data_changes(watermark, objects, page_size)
+            with db.get_connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute(WATERMARK_SQL, (SYNC_SOURCE,)).fetchone()
+                    if (row[0] if row else '') != watermark:
+                        # 其他进程已同步过这一段，以它提交的水位为准
+                        conn.rollback()
+                        logger.warning("SAP主数据水位已被其他进程推进，本次同步结束")
+                        break
+                    counts, changed = apply_changes(conn, records, creatable)
+                    result.pages += 1
+                    result.received += len(records)
+                    for name, value in counts.items():
+                        setattr(result, name, getattr(result, name) + value)
+                    result.watermark = next_watermark
+                    result.elapsed = round(time.perf_counter() - start, 3)
+                    conn.execute(SAVE_WATERMARK_SQL, (SYNC_SOURCE, next_watermark,
+                                                      json.dumps(asdict(result), ensure_ascii=False)))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            for key, entries in changed.items():
+                master_data.merge(key, entries)
+            watermark = next_watermark
+            if not has_more or not records:
+                break
+    result.watermark = watermark
+    result.elapsed = round(time.perf_counter() - start, 3)
+    logger.info(f"SAP主数据同步完成：收到 {result.received} 条变更，更新 {result.updated} 条，"
+                f"新增 {result.inserted} 条，未映射 {result.unmapped} 条，水位 {result.watermark}",
+                extra={'duration_ms': round(result.elapsed * 1000, 1)})
+    return result
+
+
+class MasterDataSyncScheduler:
+    """应用进程内按固定间隔执行增量同步的后台线程"""
+
+    def __init__(self, interval=0):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.last_error = ''
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """间隔为0或未配置SAP接口时不启动；返回是否在运行"""
+        with self._lock:
+            if self.interval <= 0 or not config['default'].SAP_HOST:
+                return False
+            if not self.running:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='sap-master-data-sync', daemon=True)
+                self._thread.start()
+                logger.info(f"SAP主数据定时同步已启动，间隔 {self.interval:g} 秒")
+            return True
+
+    def stop(self, timeout=None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                sync_master_data()
+                self.last_error = ''
+            except (SapError, MasterDataSyncError) as e:
+                self.last_error = str(e)
+                logger.warning(f"SAP主数据同步失败，下次定时重试：{str(e)}")
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"SAP主数据同步出错: {str(e)}")
+            self._stopping.wait(self.interval)
+
+
+def _default_client():
+    settings = config['default']
+    if not settings.SAP_HOST:
+        return None
+    return SapClient(settings.SAP_HOST, settings.SAP_USER, settings.SAP_PASSWORD, settings.SAP_TIMEOUT)
+
+
+_sync_lock = threading.Lock()
+
+# 创建全局主数据定时同步
+sync_scheduler = MasterDataSyncScheduler(config['default'].SAP_SYNC_INTERVAL)
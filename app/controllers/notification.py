@@ -0,0 +1,454 @@
+import random
+import smtplib
+import ssl
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+from config import config
+from app.models.database import db
+from app.models.master_data import master_data
+from app.utils.logger import logger
+from app.utils.money import format_amount
+
+EVENT_LABELS = {
+    'submitted': '已提交',
+    'booked': '已记账',
+}
+
+MAIL_STATUS_LABELS = {
+    'pending': '待发送',
+    'sending': '发送中',
+    'sent': '已发送',
+    'failed': '失败',
+}
+
+SUBMITTED_EVENT_SQL = """
+    INSERT INTO mail_events (kind, employee, expense_id, created_at) VALUES ('submitted', ?, ?, ?)
+"""
+
+# 一张凭证的借方按报销逐行记账，同一笔报销只记一条事件
+BOOKED_EVENTS_SQL = """
+    INSERT INTO mail_events (kind, employee, expense_id, voucher_no, created_at)
+    SELECT 'booked', x.employee, x.id, MIN(en.voucher_no), ?
+    FROM entry en
+    JOIN expenses x ON x.id = en.expense_id
+    WHERE en.voucher_no BETWEEN ? AND ?
+    GROUP BY x.id
+"""
+
+# 事件按自增id写入，第一条即最早的一条
+OLDEST_EVENT_SQL = "SELECT id, created_at FROM mail_events ORDER BY id LIMIT 1"
+
+DIGEST_EVENTS_SQL = """
+    SELECT ev.kind, ev.employee, ev.voucher_no, x.expense_date, x.budget_item, x.amount_cents, x.description
+    FROM mail_events ev
+    LEFT JOIN expenses x ON x.id = ev.expense_id
+    WHERE ev.id <= ?
+    ORDER BY ev.employee, ev.id
+"""
+
+RECIPIENTS_SQL = """
+    SELECT employee_code, email FROM users
+    WHERE employee_code IS NOT NULL AND email IS NOT NULL AND email <> ''
+    ORDER BY id
+"""
+
+OUTBOX_INSERT_SQL = "INSERT INTO mail_outbox (recipient, subject, body, next_attempt_at) VALUES (?, ?, ?, ?)"
+
+HAS_DUE_SQL = """
+    SELECT EXISTS (SELECT 1 FROM mail_outbox WHERE status = 'pending' AND next_attempt_at <= ?)
+        OR EXISTS (SELECT 1 FROM mail_outbox WHERE status = 'sending' AND next_attempt_at <= ?)
+"""
+
+RELEASE_EXPIRED_SQL = """
+    UPDATE mail_outbox SET status = 'pending' WHERE status = 'sending' AND next_attempt_at <= ?
+"""
+
+DUE_MESSAGES_SQL = """
+    SELECT id, recipient, subject, body, attempts FROM mail_outbox
+    WHERE status = 'pending' AND next_attempt_at <= ?
+    ORDER BY next_attempt_at
+    LIMIT ?
+"""
+
+CLAIM_SQL = """
+    UPDATE mail_outbox SET status = 'sending', claim = ?, attempts = attempts + 1, next_attempt_at = ? WHERE id = ?
+"""
+
+# 只回写本次领取的邮件，租约过期后被其他批次重新领取的不覆盖
+MARK_SENT_SQL = """
+    UPDATE mail_outbox SET status = 'sent', last_error = NULL, sent_at = CURRENT_TIMESTAMP
+    WHERE id = ? AND claim = ? AND status = 'sending'
+"""
+
+MARK_FAILED_SQL = """
+    UPDATE mail_outbox SET status = ?, next_attempt_at = ?, last_error = ?
+    WHERE id = ? AND claim = ? AND status = 'sending'
+"""
+
+STATUS_COUNT_SQL = "SELECT COUNT(*) FROM mail_outbox WHERE status = ?"
+
+# 租约时长：发送中超过该秒数未回写结果时重新发送
+LEASE_SECONDS = 300
+
+
+def notifications_enabled():
+    """配置了邮件服务器时才记录通知事件"""
+    return bool(config['default'].MAIL_SERVER)
+
+
+def record_submitted(conn, expense_id, employee):
+    """在提交报销的事务中记录一条通知事件"""
+    if notifications_enabled() and employee:
+        conn.execute(SUBMITTED_EVENT_SQL, (employee, expense_id, time.time()))
+
+
+def record_booked(conn, first_voucher_no, last_voucher_no):
+    """在保存凭证的事务中为这批凭证涉及的每笔报销记录一条通知事件"""
+    if notifications_enabled():
+        conn.execute(BOOKED_EVENTS_SQL, (time.time(), first_voucher_no, last_voucher_no))
+
+
+def _digest_section(kind, rows, max_items):
+    total = sum(row['amount_cents'] or 0 for row in rows)
+    lines = [f"以下 {len(rows)} 笔报销{EVENT_LABELS[kind]}，合计 {format_amount(total)} 元："]
+    for row in rows[:max_items]:
+        item = master_data.description_of('budget_item', row['budget_item']) or row['budget_item'] or ''
+        voucher = f"  凭证 {row['voucher_no']}" if row['voucher_no'] else ''
+        lines.append(f"  {row['expense_date'] or ''}  {item}  {format_amount(row['amount_cents'])}{voucher}  "
+                     f"{row['description'] or ''}".rstrip())
+    if len(rows) > max_items:
+        lines.append(f"  另有 {len(rows) - max_items} 笔未列出")
+    return lines
+
+
+def compose_digest(name, rows, max_items=20):
+    """一个报销人的摘要邮件，返回 (主题, 正文)"""
+    by_kind = {}
+    for row in rows:
+        by_kind.setdefault(row['kind'], []).append(row)
+    kinds = [kind for kind in ('booked', 'submitted') if kind in by_kind]
+    subject = "报销通知：" + "，".join(f"{len(by_kind[kind])} 笔{EVENT_LABELS[kind]}" for kind in kinds)
+    body = [f"{name}，您好：", ""]
+    for kind in kinds:
+        body.extend(_digest_section(kind, by_kind[kind], max_items))
+        body.append("")
+    body.append("此邮件由报销系统自动发送，请勿回复。")
+    return subject, "\n".join(body)
+
+
+def build_digests(conn, max_items=20, now=None):
+    """把全部未汇总的通知事件按报销人汇总成摘要邮件写入发件箱，返回 (邮件数, 事件数)
+
+    报销人按用户上保存的员工编码对应到用户，没有对应用户或邮箱的只丢弃事件，不生成邮件。
+    """
+    now = time.time() if now is None else now
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last = conn.execute("SELECT MAX(id) FROM mail_events").fetchone()[0]
+        if last is None:
+            conn.rollback()
+            return 0, 0
+        emails = {}
+        for row in conn.execute(RECIPIENTS_SQL):
+            emails.setdefault(row['employee_code'], row['email'])
+        grouped = {}
+        events = 0
+        for row in conn.execute(DIGEST_EVENTS_SQL, (last,)):
+            grouped.setdefault(row['employee'], []).append(row)
+            events += 1
+        messages = []
+        for employee, rows in grouped.items():
+            if employee in emails:
+                name = master_data.description_of('employee', employee) or employee
+                subject, body = compose_digest(name, rows, max_items)
+                messages.append((emails[employee], subject, body, now))
+        conn.executemany(OUTBOX_INSERT_SQL, messages)
+        conn.execute("DELETE FROM mail_events WHERE id <= ?", (last,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"已生成 {len(messages)} 封报销通知摘要，汇总 {events} 条通知事件")
+    return len(messages), events
+
+
+def claim_messages(conn, batch_size, now=None):
+    """领取一批到期的待发送邮件并标记为发送中，返回 [(id, 收件人, 主题, 正文, 第几次发送, 领取标记)]"""
+    now = time.time() if now is None else now
+    if not conn.execute(HAS_DUE_SQL, (now, now)).fetchone()[0]:
+        return []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(RELEASE_EXPIRED_SQL, (now,))
+        rows = conn.execute(DUE_MESSAGES_SQL, (now, batch_size)).fetchall()
+        claim = uuid.uuid4().hex
+        conn.executemany(CLAIM_SQL, [(claim, now + LEASE_SECONDS, row['id']) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [(row['id'], row['recipient'], row['subject'], row['body'], row['attempts'] + 1, claim) for row in rows]
+
+
+def outbox_summary(conn):
+    """发件箱各状态的邮件数（已发送的量大，不统计）和未汇总的通知事件数"""
+    summary = {status: conn.execute(STATUS_COUNT_SQL, (status,)).fetchone()[0]
+               for status in ('pending', 'sending', 'failed')}
+    summary['events'] = conn.execute("SELECT COUNT(*) FROM mail_events").fetchone()[0]
+    return summary
+
+
+class MailSender:
+    """邮件通知后台发送：定时生成摘要邮件，按批领取发件箱并复用同一个SMTP连接发送
+
+    提交报销、保存凭证只写通知事件，不连接邮件服务器。发送失败按指数退避重试，
+    收件人被拒绝或超过 max_attempts 次的标记为失败；连接空闲超过 idle_timeout 秒后断开。
+    """
+
+    def __init__(self, server='', port=587, use_tls=True, username='', password='', sender='', timeout=30,
+                 batch_size=50, digest_interval=3600, digest_max_items=20, max_attempts=5, retry_base=60,
+                 poll_interval=10, idle_timeout=60, smtp_factory=None):
+        self.server = server
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.digest_interval = digest_interval
+        self.digest_max_items = digest_max_items
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.smtp_factory = smtp_factory or (smtplib.SMTP_SSL if port == 465 else smtplib.SMTP)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._smtp = None
+        self._smtp_used_at = 0
+        self._stats = {'digests': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'stale': 0, 'connections': 0,
+                       'last_error': ''}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动发送线程，未配置邮件服务器时不启动；返回是否在运行"""
+        with self._lock:
+            if not self.server:
+                return False
+            if not self.running:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='mail-sender', daemon=True)
+                self._thread.start()
+                logger.info(f"邮件通知发送已启动：{self.server}:{self.port}，摘要间隔 {self.digest_interval:g} 秒")
+            return True
+
+    def stop(self, timeout=None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            thread.join(timeout)
+
+    def notify(self):
+        """发件箱有新邮件，唤醒发送线程"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                busy = self._tick()
+            except Exception as e:
+                logger.error(f"邮件通知发送出错: {str(e)}")
+                busy = False
+            if not busy:
+                self._close_if_idle()
+                self._wake.wait(self.poll_interval)
+        self._close()
+
+    def _tick(self, now=None):
+        now = time.time() if now is None else now
+        self.digest_if_due(now)
+        with db.get_connection() as conn:
+            messages = claim_messages(conn, self.batch_size, now)
+        if messages:
+            self.send(messages)
+        return bool(messages)
+
+    def digest_if_due(self, now=None, force=False):
+        """最早一条未汇总的事件已等待 digest_interval 秒（或 force）时生成摘要邮件，返回生成的邮件数"""
+        now = time.time() if now is None else now
+        with db.get_connection() as conn:
+            oldest = conn.execute(OLDEST_EVENT_SQL).fetchone()
+            if oldest is None or (not force and oldest['created_at'] > now - self.digest_interval):
+                return 0
+            count, _ = build_digests(conn, self.digest_max_items, now)
+        with self._lock:
+            self._stats['digests'] += count
+        return count
+
+    def run_once(self, force_digest=False):
+        """在当前线程中生成到期的摘要并把发件箱中到期的邮件全部发送一遍，返回发送的邮件数"""
+        now = time.time()
+        self.digest_if_due(now, force_digest)
+        count = 0
+        try:
+            while True:
+                with db.get_connection() as conn:
+                    messages = claim_messages(conn, self.batch_size, now)
+                if not messages:
+                    return count
+                count += len(messages)
+                self.send(messages)
+        finally:
+            self._close()
+
+    def _connection(self):
+        if self._smtp is not None and time.time() - self._smtp_used_at > self.idle_timeout:
+            self._close()
+        if self._smtp is None:
+            smtp = self.smtp_factory(self.server, self.port, timeout=self.timeout)
+            try:
+                if self.use_tls and self.smtp_factory is not smtplib.SMTP_SSL:
+                    smtp.starttls(context=ssl.create_default_context())
+                if self.username:
+                    smtp.login(self.username, self.password)
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+            with self._lock:
+                self._stats['connections'] += 1
+        self._smtp_used_at = time.time()
+        return self._smtp
+
+    def _close(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+    def _close_if_idle(self):
+        if self._smtp is not None and time.time() - self._smtp_used_at > self.idle_timeout:
+            self._close()
+
+    def _retry_at(self, attempts, now):
+        return now + self.retry_base * 2 ** (attempts - 1) * random.uniform(0.5, 1.0)
+
+    def _message(self, recipient, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content(body)
+        return message
+
+    def send(self, messages):
+        """用同一个SMTP连接发送一批邮件并逐封回写结果，返回 (成功数, 未成功数)"""
+        start = time.perf_counter()
+        sent, failed = [], []
+        error = None
+        try:
+            smtp = self._connection()
+        except (smtplib.SMTPException, OSError) as e:
+            smtp, error = None, f"连接邮件服务器失败: {str(e)}"
+        now = time.time()
+        for message_id, recipient, subject, body, attempts, claim in messages:
+            if smtp is not None:
+                try:
+                    smtp.send_message(self._message(recipient, subject, body))
+                    sent.append((message_id, claim))
+                    continue
+                except smtplib.SMTPRecipientsRefused as e:
+                    # 收件人地址被拒绝，重发也不会成功
+                    failed.append(('failed', now, f"收件人被拒绝: {str(e)}", message_id, claim))
+                    continue
+                except smtplib.SMTPResponseException as e:
+                    if e.smtp_code >= 500:
+                        failed.append(('failed', now, f"邮件服务器拒绝: {e.smtp_code}", message_id, claim))
+                        continue
+                    error = f"邮件服务器暂时拒绝: {e.smtp_code}"
+                except (smtplib.SMTPException, OSError) as e:
+                    # 连接已断开，本批剩下的邮件稍后用新连接重发
+                    self._close()
+                    smtp, error = None, f"发送失败: {str(e)}"
+            status = 'failed' if attempts >= self.max_attempts else 'pending'
+            failed.append((status, self._retry_at(attempts, now), error, message_id, claim))
+        with db.get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 逐封回写并检查影响行数，租约已被其他批次接管的邮件不计入本批结果
+                owned_sent = [row for row in sent if conn.execute(MARK_SENT_SQL, row).rowcount]
+                owned_failed = [row for row in failed if conn.execute(MARK_FAILED_SQL, row).rowcount]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        stale = len(sent) + len(failed) - len(owned_sent) - len(owned_failed)
+        sent, failed = owned_sent, owned_failed
+        retried = sum(1 for row in failed if row[0] == 'pending')
+        with self._lock:
+            self._stats['stale'] += stale
+            self._stats['sent'] += len(sent)
+            self._stats['failed'] += len(failed) - retried
+            self._stats['retried'] += retried
+            if error:
+                self._stats['last_error'] = error
+        elapsed = time.perf_counter() - start
+        if stale:
+            logger.warning(f"邮件通知：{stale} 封邮件的租约已过期并被重新领取，本批结果未回写")
+        logger.info(f"邮件通知：{len(sent)} 封已发送，{len(failed)} 封未发送" + (f"（{error}）" if error else ""),
+                    extra={'duration_ms': round(elapsed * 1000, 1)})
+        return len(sent), len(failed)
+
+    def stats(self):
+        """发送线程的运行统计"""
+        with self._lock:
+            return dict(self._stats, running=self.running, connected=self._smtp is not None)
+
+
+def retry_failed_mail():
+    """把失败的邮件重新放回待发送，返回数量"""
+    with db.get_connection() as conn:
+        count = conn.execute("UPDATE mail_outbox SET status = 'pending', attempts = 0, next_attempt_at = ?, "
+                             "last_error = NULL WHERE status = 'failed'", (time.time(),)).rowcount
+        conn.commit()
+    if count:
+        logger.info(f"{count} 封发送失败的通知邮件已重新排队")
+        mail_sender.notify()
+    return count
+
+
+def start_background_mail():
+    """在应用进程内启动发送线程（未配置 MAIL_SERVER 或关闭 MAIL_WORKER_IN_APP 时不启动）"""
+    return mail_sender.start() if config['default'].MAIL_WORKER_IN_APP else False
+
+
+# 创建全局邮件通知发送器
+mail_sender = MailSender(
+    config['default'].MAIL_SERVER,
+    port=config['default'].MAIL_PORT,
+    use_tls=config['default'].MAIL_USE_TLS,
+    username=config['default'].MAIL_USERNAME,
+    password=config['default'].MAIL_PASSWORD,
+    sender=config['default'].MAIL_SENDER,
+    timeout=config['default'].MAIL_TIMEOUT,
+    batch_size=config['default'].MAIL_BATCH_SIZE,
+    digest_interval=config['default'].MAIL_DIGEST_INTERVAL,
+    digest_max_items=config['default'].MAIL_DIGEST_MAX_ITEMS,
+    max_attempts=config['default'].MAIL_MAX_ATTEMPTS,
+    retry_base=config['default'].MAIL_RETRY_BASE,
+    poll_interval=config['default'].MAIL_POLL_INTERVAL,
+    idle_timeout=config['default'].MAIL_IDLE_TIMEOUT,
+)
@@ -0,0 +1,395 @@
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from config import config
+from app.models.database import db
+from app.models.master_data import master_data
+from app.utils.logger import logger
+from app.utils.money import to_yuan
+from app.utils.sap_client import SapClient, SapError
+
+POSTING_STATUS_LABELS = {
+    'pending': '待发送',
+    'sending': '发送中',
+    'posted': '已过账',
+    'failed': '失败',
+}
+
+# 入队时间作为首次发送时间，待发送凭证沿 (status, next_attempt_at) 索引按到期先后取出
+ENQUEUE_SQL = "INSERT OR IGNORE INTO sap_postings (voucher_no, next_attempt_at) VALUES (?, ?)"
+
+HAS_DUE_SQL = """
+    SELECT EXISTS (SELECT 1 FROM sap_postings WHERE status = 'pending' AND next_attempt_at <= ?)
+        OR EXISTS (SELECT 1 FROM sap_postings WHERE status = 'sending' AND next_attempt_at <= ?)
+"""
+
+# 发送中超过租约仍未回写结果（进程中途退出等），退回待发送；幂等键保证重发不会重复过账
+RELEASE_EXPIRED_SQL = """
+    UPDATE sap_postings SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+    WHERE status = 'sending' AND next_attempt_at <= ?
+"""
+
+DUE_POSTINGS_SQL = """
+    SELECT voucher_no, attempts FROM sap_postings
+    WHERE status = 'pending' AND next_attempt_at <= ?
+    ORDER BY next_attempt_at
+    LIMIT ?
+"""
+
+CLAIM_SQL = """
+    UPDATE sap_postings SET status = 'sending', batch_id = ?, attempts = attempts + 1, next_attempt_at = ?,
+                            updated_at = CURRENT_TIMESTAMP
+    WHERE voucher_no = ?
+"""
+
+DOCUMENT_LINES_SQL = """
+    SELECT e.voucher_no, e.booking_date, e.voucher_date, e.post_date,
+           e.sap_account_code, e.sap_cost_center_code, e.sap_employee_code, e.debit_cents, e.credit_cents,
+           x.company
+    FROM entry e
+    LEFT JOIN expenses x ON x.id = e.expense_id
+    WHERE e.voucher_no IN ({placeholders})
+    ORDER BY e.voucher_no, e.id
+"""
+
+# 只回写本批次仍持有的凭证，租约过期后已被重新领取的不覆盖；
+# 迟到的过账结果丢弃后由新批次重发，SAP按幂等键返回同一张凭证，不会重复过账
+MARK_POSTED_SQL = """
+    UPDATE sap_postings SET status = 'posted', sap_document = ?, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+    WHERE voucher_no = ? AND batch_id = ? AND status = 'sending'
+"""
+
+MARK_FAILED_SQL = """
+    UPDATE sap_postings SET status = ?, next_attempt_at = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE voucher_no = ? AND batch_id = ? AND status = 'sending'
+"""
+
+STATUS_COUNT_SQL = "SELECT COUNT(*) FROM sap_postings WHERE status = ?"
+
+OLDEST_PENDING_SQL = "SELECT MIN(created_at) FROM sap_postings WHERE status IN ('pending', 'sending')"
+
+FAILED_POSTINGS_SQL = """
+    SELECT CAST(voucher_no AS TEXT) AS '凭证号', attempts AS '发送次数', last_error AS '错误信息',
+           updated_at AS '更新时间'
+    FROM sap_postings
+    WHERE status = 'failed'
+    ORDER BY voucher_no DESC
+    LIMIT ?
+"""
+
+POSTING_OF_SQL = "SELECT status, attempts, sap_document, last_error FROM sap_postings WHERE voucher_no = ?"
+
+
+@dataclass
+class PostingBatch:
+    batch_id: str
+    attempts: dict  # 凭证号 -> 本次是第几次发送
+
+
+def idempotency_key(voucher_no):
+    """凭证的幂等键：同一张凭证无论重发多少次都相同，SAP据此去重"""
+    return f"{config['default'].SAP_SOURCE_SYSTEM}-{voucher_no}"
+
+
+def enqueue_vouchers(conn, voucher_nos):
+    """在调用方的事务中把凭证加入SAP过账队列"""
+    now = time.time()
+    conn.executemany(ENQUEUE_SQL, [(voucher_no, now) for voucher_no in voucher_nos])
+
+
+def claim_batch(conn, batch_size, lease_seconds, now=None):
+    """领取一批到期的待发送凭证并标记为发送中，没有到期凭证时返回 None"""
+    now = time.time() if now is None else now
+    # 先不加写锁检查，队列空闲时轮询不和保存凭证争锁
+    if not conn.execute(HAS_DUE_SQL, (now, now)).fetchone()[0]:
+        return None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(RELEASE_EXPIRED_SQL, (now,))
+        rows = conn.execute(DUE_POSTINGS_SQL, (now, batch_size)).fetchall()
+        batch_id = uuid.uuid4().hex
+        conn.executemany(CLAIM_SQL, [(batch_id, now + lease_seconds, row[0]) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if not rows:
+        return None
+    return PostingBatch(batch_id, {row[0]: row[1] + 1 for row in rows})
+
+
+def _amount(cents):
+    return str(to_yuan(cents))
+
+
+def build_documents(conn, voucher_nos):
+    """按凭证号读取分录，组装成SAP会计凭证，返回 {凭证号: 凭证}"""
+    voucher_nos = list(voucher_nos)
+    if not voucher_nos:
+        return {}
+    sql = DOCUMENT_LINES_SQL.format(placeholders=', '.join('?' * len(voucher_nos)))
+    settings = config['default']
+    documents = {}
+    for row in conn.execute(sql, voucher_nos):
+        document = documents.get(row['voucher_no'])
+        if document is None:
+            document = documents[row['voucher_no']] = {
+                'idempotency_key': idempotency_key(row['voucher_no']),
+                'reference': str(row['voucher_no']),
+                'company_code': None,
+                'document_date': row['voucher_date'] or row['booking_date'],
+                'posting_date': row['post_date'] or row['booking_date'],
+                'currency': settings.SAP_CURRENCY,
+                'lines': [],
+            }
+        if document['company_code'] is None and row['company']:
+            # 公司代码取第一行关联报销的公司，有SAP代码时用SAP代码
+            document['company_code'] = master_data.sap_of('company', row['company'])[0] or row['company']
+        document['lines'].append({
+            'account': row['sap_account_code'],
+            'cost_center': row['sap_cost_center_code'],
+            'employee': row['sap_employee_code'],
+            'debit': _amount(row['debit_cents']),
+            'credit': _amount(row['credit_cents']),
+        })
+    return documents
+
+
+class SapPostingWorker:
+    """SAP过账后台发送：调度线程按批领取待发送凭证，交给固定大小的线程池并发发送
+
+    同时在途的请求不超过 workers 个；调用失败的凭证按指数退避重试，超过 max_attempts 次标记为失败。
+    保存凭证只写队列并调用 notify()，不等待SAP。
+    """
+
+    def __init__(self, client=None, batch_size=200, workers=4, max_attempts=8, retry_base=10, retry_max=1800,
+                 poll_interval=5, lease_seconds=300):
+        self.client = client
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._slots = threading.Semaphore(workers)
+        self._thread = None
+        self._executor = None
+        self._stats = {'batches': 0, 'in_flight': 0, 'posted': 0, 'rejected': 0, 'retried': 0, 'stale': 0,
+                       'errors': 0, 'last_error': ''}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动调度线程，未配置SAP接口时不启动；返回是否在运行"""
+        with self._lock:
+            if self.client is None:
+                return False
+            if not self.running:
+                self._stopping.clear()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sap-posting')
+                self._thread = threading.Thread(target=self._run, name='sap-posting-dispatcher', daemon=True)
+                self._thread.start()
+                logger.info(f"SAP过账发送已启动：{getattr(self.client, 'url', '')}，"
+                            f"每批 {self.batch_size} 张，并发 {self.workers}")
+            return True
+
+    def stop(self, timeout=None):
+        """停止领取新批次并等待在途请求完成"""
+        with self._lock:
+            thread, executor = self._thread, self._executor
+            self._thread = self._executor = None
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        thread.join(timeout)
+        executor.shutdown(wait=True)
+
+    def notify(self):
+        """有新凭证入队，唤醒调度线程"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if not self._slots.acquire(timeout=self.poll_interval):
+                continue
+            # 先清除唤醒标记再领取，领取期间到达的通知不会丢
+            self._wake.clear()
+            try:
+                batch = self._claim()
+            except Exception as e:
+                logger.error(f"领取SAP过账批次失败: {str(e)}")
+                batch = None
+            if batch is None:
+                self._slots.release()
+                self._wake.wait(self.poll_interval)
+                continue
+            self._executor.submit(self._send_and_release, batch)
+
+    def _send_and_release(self, batch):
+        try:
+            self.send(batch)
+        except Exception as e:
+            # 回写失败时批次保持发送中，租约到期后重发
+            logger.error(f"SAP过账批次 {batch.batch_id} 处理失败: {str(e)}")
+        finally:
+            self._slots.release()
+
+    def _claim(self, now=None):
+        with db.get_connection() as conn:
+            return claim_batch(conn, self.batch_size, self.lease_seconds, now)
+
+    def run_once(self):
+        """在当前线程中把此刻已到期的凭证全部发送一遍（命令行和测试用），返回处理的凭证数"""
+        # 固定领取时间点，本轮失败后重新排队的凭证不会在本轮再次领到
+        now = time.time()
+        count = 0
+        while True:
+            batch = self._claim(now)
+            if batch is None:
+                return count
+            count += len(batch.attempts)
+            self.send(batch)
+
+    def _retry_at(self, attempts, now):
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        # 加随机抖动，SAP恢复时积压的批次不会同时重发
+        return now + delay * random.uniform(0.5, 1.0)
+
+    def send(self, batch):
+        """发送一批凭证并逐张回写结果"""
+        start = time.perf_counter()
+        with self._lock:
+            self._stats['in_flight'] += 1
+        try:
+            with db.get_connection() as conn:
+                documents = build_documents(conn, batch.attempts)
+            error = None
+            try:
+                results = self.client.post(batch.batch_id, list(documents.values())) if documents else {}
+            except SapError as e:
+                error, results = str(e), {}
+            posted, failed = [], []
+            now = time.time()
+            for voucher_no, attempts in batch.attempts.items():
+                result = results.get(idempotency_key(voucher_no))
+                if voucher_no not in documents:
+                    failed.append(('failed', now, '凭证没有分录', voucher_no, batch.batch_id))
+                elif result is not None and result.get('status') == 'posted':
+                    posted.append((result.get('document_no'), voucher_no, batch.batch_id))
+                elif result is not None:
+                    # SAP拒绝（科目、成本中心不合法等）重发也不会成功，等人工处理后重试
+                    failed.append(('failed', now, result.get('message') or 'SAP拒绝过账', voucher_no, batch.batch_id))
+                else:
+                    status = 'failed' if attempts >= self.max_attempts else 'pending'
+                    failed.append((status, self._retry_at(attempts, now), error or 'SAP未返回该凭证的结果',
+                                   voucher_no, batch.batch_id))
+            with db.get_connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # 逐张回写并检查影响行数，租约已被其他批次接管的凭证不计入本批结果
+                    owned_posted = [row for row in posted if conn.execute(MARK_POSTED_SQL, row).rowcount]
+                    owned_failed = [row for row in failed if conn.execute(MARK_FAILED_SQL, row).rowcount]
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        finally:
+            with self._lock:
+                self._stats['in_flight'] -= 1
+        elapsed = time.perf_counter() - start
+        stale = len(posted) + len(failed) - len(owned_posted) - len(owned_failed)
+        posted, failed = owned_posted, owned_failed
+        retried = sum(1 for row in failed if row[0] == 'pending')
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['stale'] += stale
+            self._stats['posted'] += len(posted)
+            self._stats['rejected'] += len(failed) - retried
+            self._stats['retried'] += retried
+            if error:
+                self._stats['errors'] += 1
+                self._stats['last_error'] = error
+        if stale:
+            logger.warning(f"SAP过账批次 {batch.batch_id}：{stale} 张凭证的租约已过期并被重新领取，本批结果未回写")
+        if error:
+            logger.warning(f"SAP过账批次 {batch.batch_id} 发送失败，{len(batch.attempts)} 张凭证稍后重试：{error}",
+                           extra={'duration_ms': round(elapsed * 1000, 1)})
+        else:
+            logger.info(f"SAP过账批次 {batch.batch_id}：{len(posted)} 张已过账，{len(failed)} 张未过账",
+                        extra={'duration_ms': round(elapsed * 1000, 1)})
+        return len(posted), len(failed)
+
+    def stats(self):
+        """发送线程的运行统计"""
+        with self._lock:
+            return dict(self._stats, running=self.running)
+
+
+def posting_summary(conn):
+    """过账队列概况：各状态凭证数（已过账的量大，不统计）和最早未过账凭证的入队时间"""
+    summary = {status: conn.execute(STATUS_COUNT_SQL, (status,)).fetchone()[0]
+               for status in ('pending', 'sending', 'failed')}
+    summary['oldest'] = conn.execute(OLDEST_PENDING_SQL).fetchone()[0]
+    return summary
+
+
+def failed_postings_query(limit=200):
+    """失败凭证列表的查询，返回 (sql, params)"""
+    return FAILED_POSTINGS_SQL, [limit]
+
+
+def posting_of(conn, voucher_no):
+    """单张凭证的过账状态，不在队列中时返回 None"""
+    return conn.execute(POSTING_OF_SQL, (voucher_no,)).fetchone()
+
+
+def retry_failed(voucher_nos=None):
+    """把失败的凭证（默认全部）重新放回待发送，返回数量"""
+    sql = ("UPDATE sap_postings SET status = 'pending', attempts = 0, next_attempt_at = ?, last_error = NULL, "
+           "updated_at = CURRENT_TIMESTAMP WHERE status = 'failed'")
+    params = [time.time()]
+    if voucher_nos:
+        sql += f" AND voucher_no IN ({', '.join('?' * len(voucher_nos))})"
+        params.extend(int(voucher_no) for voucher_no in voucher_nos)
+    with db.get_connection() as conn:
+        count = conn.execute(sql, params).rowcount
+        conn.commit()
+    if count:
+        logger.info(f"{count} 张SAP过账失败的凭证已重新排队")
+        sap_worker.notify()
+    return count
+
+
+def start_background_posting():
+    """在应用进程内启动发送线程（未配置 SAP_HOST 或关闭 SAP_WORKER_IN_APP 时不启动）"""
+    return sap_worker.start() if config['default'].SAP_WORKER_IN_APP else False
+
+
+def _default_client():
+    settings = config['default']
+    if not settings.SAP_HOST:
+        return None
+    return SapClient(settings.SAP_HOST, settings.SAP_USER, settings.SAP_PASSWORD, settings.SAP_TIMEOUT)
+
+
+# 创建全局SAP过账发送器
+sap_worker = SapPostingWorker(
+    _default_client(),
+    batch_size=config['default'].SAP_BATCH_SIZE,
+    workers=config['default'].SAP_WORKERS,
+    max_attempts=config['default'].SAP_MAX_ATTEMPTS,
+    retry_base=config['default'].SAP_RETRY_BASE,
+    retry_max=config['default'].SAP_RETRY_MAX,
+    poll_interval=config['default'].SAP_POLL_INTERVAL,
+    lease_seconds=config['default'].SAP_LEASE_SECONDS,
+)
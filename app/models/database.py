@@ -1,7 +1,545 @@
+import secrets
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
 from config import config
+from app.models.query_stats import connection_factory
 from app.utils.logger import logger
+from app.utils.security import hash_password, is_password_hash, verify_password
+
+# 数据库结构版本：表结构、升级字段或默认数据变化时递增
+SCHEMA_VERSION = 15
+
+# 默认权限
+DEFAULT_PERMISSIONS = [
+    ('expense', 'create', '创建报销记录'),
+    ('expense', 'view', '查看报销记录'),
+    ('expense', 'export', '导出报销记录'),
+    ('expense', 'book', '报销记账'),
+    ('master_data', 'manage', '管理主数据'),
+    ('user', 'manage', '管理用户'),
+    ('role', 'manage', '管理角色')
+]
+
+# 热点查询索引（与 migrations/versions 中的迁移保持一致）
+INDEXES = [
+    # 报销记账：WHERE status='pending' ORDER BY expense_date DESC
+    "CREATE INDEX IF NOT EXISTS idx_expenses_status_date ON expenses (status, expense_date)",
+    # 报销查看：按日期倒序，以及各筛选条件下的倒序
+    "CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (expense_date)",
+    "CREATE INDEX IF NOT EXISTS idx_expenses_employee_date ON expenses (employee, expense_date)",
+    "CREATE INDEX IF NOT EXISTS idx_expenses_department_date ON expenses (department, expense_date)",
+    "CREATE INDEX IF NOT EXISTS idx_expenses_company_date ON expenses (company, expense_date)",
+    "CREATE INDEX IF NOT EXISTS idx_expenses_budget_item_date ON expenses (budget_item, expense_date)",
+    # 四路LEFT JOIN config：覆盖索引，关联时不回表
+    "CREATE INDEX IF NOT EXISTS idx_config_lookup ON config (key, code, description, sap_code, sap_description)",
+    # 描述转编码
+    "CREATE INDEX IF NOT EXISTS idx_config_key_description ON config (key, description, code)",
+    # 记账查看：凭证号筛选与排序、MAX(voucher_no)
+    "CREATE INDEX IF NOT EXISTS idx_entry_voucher ON entry (voucher_no DESC, id)",
+    "CREATE INDEX IF NOT EXISTS idx_entry_booking_date ON entry (booking_date)",
+    "CREATE INDEX IF NOT EXISTS idx_entry_expense ON entry (expense_id)",
+    "CREATE INDEX IF NOT EXISTS idx_expense_bookings_expense ON expense_bookings (expense_id)",
+]
+
+# 汇总维度：期间(YYYY-MM)×公司×部门×预算科目×状态，空值统一记为''
+_SUMMARY_KEYS = "(period, company, department, budget_item, status)"
+
+
+def _summary_key(row):
+    return (f"substr({row}.expense_date, 1, 7), COALESCE({row}.company, ''), COALESCE({row}.department, ''), "
+            f"COALESCE({row}.budget_item, ''), COALESCE({row}.status, 'pending')")
+
+
+def _summary_add(row):
+    return f"""
+        INSERT INTO expense_summary {_SUMMARY_KEYS[:-1]}, expense_count, total_cents)
+        VALUES ({_summary_key(row)}, 1, COALESCE({row}.amount_cents, 0))
+        ON CONFLICT {_SUMMARY_KEYS} DO UPDATE SET
+            expense_count = expense_count + 1,
+            total_cents = total_cents + excluded.total_cents;"""
+
+
+def _summary_subtract(row):
+    return f"""
+        UPDATE expense_summary SET
+            expense_count = expense_count - 1,
+            total_cents = total_cents - COALESCE({row}.amount_cents, 0)
+        WHERE {_SUMMARY_KEYS} = ({_summary_key(row)});"""
+
+
+# 报销汇总表及维护触发器：expenses 的任何增删改都在同一事务内同步到汇总表，看板只读汇总表
+SUMMARY_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS expense_summary (
+        period TEXT NOT NULL,
+        company TEXT NOT NULL,
+        department TEXT NOT NULL,
+        budget_item TEXT NOT NULL,
+        status TEXT NOT NULL,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        total_cents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, company, department, budget_item, status)
+    ) WITHOUT ROWID
+    """,
+    "CREATE TRIGGER IF NOT EXISTS trg_expense_summary_insert AFTER INSERT ON expenses BEGIN"
+    + _summary_add('NEW') + "\n    END",
+    "CREATE TRIGGER IF NOT EXISTS trg_expense_summary_delete AFTER DELETE ON expenses BEGIN"
+    + _summary_subtract('OLD') + "\n    END",
+    "CREATE TRIGGER IF NOT EXISTS trg_expense_summary_update "
+    "AFTER UPDATE OF expense_date, company, department, budget_item, status, amount_cents ON expenses BEGIN"
+    + _summary_subtract('OLD') + _summary_add('NEW') + "\n    END",
+]
+
+# 按明细重算汇总表（建表后首次填充，或数据被绕过触发器修改后的修复）
+SUMMARY_REBUILD_SQL = [
+    "DELETE FROM expense_summary",
+    f"""
+    INSERT INTO expense_summary {_SUMMARY_KEYS[:-1]}, expense_count, total_cents)
+    SELECT {_summary_key('e')}, COUNT(*), COALESCE(SUM(e.amount_cents), 0)
+    FROM expenses e
+    GROUP BY 1, 2, 3, 4, 5
+    """,
+]
+
+# 预算占用：期间×部门×预算科目，待记账与已记账分别累计
+_CONSUMPTION_KEYS = "(period, department, budget_item)"
+
+
+def _consumption_key(row):
+    return (f"substr({row}.expense_date, 1, 7), COALESCE({row}.department, ''), "
+            f"COALESCE({row}.budget_item, '')")
+
+
+def _consumption_amounts(row):
+    return (f"CASE WHEN {row}.status = 'booked' THEN 0 ELSE COALESCE({row}.amount_cents, 0) END, "
+            f"CASE WHEN {row}.status = 'booked' THEN COALESCE({row}.amount_cents, 0) ELSE 0 END")
+
+
+def _consumption_add(row):
+    return f"""
+        INSERT INTO budget_consumption {_CONSUMPTION_KEYS[:-1]}, pending_cents, booked_cents)
+        VALUES ({_consumption_key(row)}, {_consumption_amounts(row)})
+        ON CONFLICT {_CONSUMPTION_KEYS} DO UPDATE SET
+            pending_cents = pending_cents + excluded.pending_cents,
+            booked_cents = booked_cents + excluded.booked_cents;"""
+
+
+def _consumption_subtract(row):
+    return f"""
+        UPDATE budget_consumption SET
+            pending_cents = pending_cents - CASE WHEN {row}.status = 'booked' THEN 0 ELSE COALESCE({row}.amount_cents, 0) END,
+            booked_cents = booked_cents - CASE WHEN {row}.status = 'booked' THEN COALESCE({row}.amount_cents, 0) ELSE 0 END
+        WHERE {_CONSUMPTION_KEYS} = ({_consumption_key(row)});"""
+
+
+# 预算表和预算占用计数：占用由触发器在报销提交、记账、修改、删除时增量维护，提交时校验只查一行
+BUDGET_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS budgets (
+        period TEXT NOT NULL,
+        department TEXT NOT NULL,
+        budget_item TEXT NOT NULL,
+        amount_cents INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (period, department, budget_item)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS budget_consumption (
+        period TEXT NOT NULL,
+        department TEXT NOT NULL,
+        budget_item TEXT NOT NULL,
+        pending_cents INTEGER NOT NULL DEFAULT 0,
+        booked_cents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, department, budget_item)
+    ) WITHOUT ROWID
+    """,
+    "CREATE TRIGGER IF NOT EXISTS trg_budget_consumption_insert AFTER INSERT ON expenses BEGIN"
+    + _consumption_add('NEW') + "\n    END",
+    "CREATE TRIGGER IF NOT EXISTS trg_budget_consumption_delete AFTER DELETE ON expenses BEGIN"
+    + _consumption_subtract('OLD') + "\n    END",
+    "CREATE TRIGGER IF NOT EXISTS trg_budget_consumption_update "
+    "AFTER UPDATE OF expense_date, department, budget_item, status, amount_cents ON expenses BEGIN"
+    + _consumption_subtract('OLD') + _consumption_add('NEW') + "\n    END",
+]
+
+# 按明细重算预算占用
+CONSUMPTION_REBUILD_SQL = [
+    "DELETE FROM budget_consumption",
+    f"""
+    INSERT INTO budget_consumption {_CONSUMPTION_KEYS[:-1]}, pending_cents, booked_cents)
+    SELECT {_consumption_key('e')},
+           COALESCE(SUM(CASE WHEN e.status = 'booked' THEN 0 ELSE e.amount_cents END), 0),
+           COALESCE(SUM(CASE WHEN e.status = 'booked' THEN e.amount_cents ELSE 0 END), 0)
+    FROM expenses e
+    GROUP BY 1, 2, 3
+    """,
+]
+
+# 全文检索：trigram 分词支持中文任意子串，外部内容表不重复存储正文，由触发器随原表同步
+SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+        description, content='expenses', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_insert AFTER INSERT ON expenses BEGIN
+        INSERT INTO expenses_fts (rowid, description) VALUES (NEW.id, NEW.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_delete AFTER DELETE ON expenses BEGIN
+        INSERT INTO expenses_fts (expenses_fts, rowid, description) VALUES ('delete', OLD.id, OLD.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_update AFTER UPDATE OF description ON expenses BEGIN
+        INSERT INTO expenses_fts (expenses_fts, rowid, description) VALUES ('delete', OLD.id, OLD.description);
+        INSERT INTO expenses_fts (rowid, description) VALUES (NEW.id, NEW.description);
+    END
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS entry_fts USING fts5(
+        sap_account_code, sap_account_desc, sap_employee_desc,
+        content='entry', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_entry_fts_insert AFTER INSERT ON entry BEGIN
+        INSERT INTO entry_fts (rowid, sap_account_code, sap_account_desc, sap_employee_desc)
+        VALUES (NEW.id, NEW.sap_account_code, NEW.sap_account_desc, NEW.sap_employee_desc);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_entry_fts_delete AFTER DELETE ON entry BEGIN
+        INSERT INTO entry_fts (entry_fts, rowid, sap_account_code, sap_account_desc, sap_employee_desc)
+        VALUES ('delete', OLD.id, OLD.sap_account_code, OLD.sap_account_desc, OLD.sap_employee_desc);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_entry_fts_update
+    AFTER UPDATE OF sap_account_code, sap_account_desc, sap_employee_desc ON entry BEGIN
+        INSERT INTO entry_fts (entry_fts, rowid, sap_account_code, sap_account_desc, sap_employee_desc)
+        VALUES ('delete', OLD.id, OLD.sap_account_code, OLD.sap_account_desc, OLD.sap_employee_desc);
+        INSERT INTO entry_fts (rowid, sap_account_code, sap_account_desc, sap_employee_desc)
+        VALUES (NEW.id, NEW.sap_account_code, NEW.sap_account_desc, NEW.sap_employee_desc);
+    END
+    """,
+]
+
+# 按原表重建全文索引
+SEARCH_REBUILD_SQL = [
+    "INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')",
+    "INSERT INTO entry_fts (entry_fts) VALUES ('rebuild')",
+]
+
+# SAP过账队列：保存凭证时在同一事务中写入，后台线程按批发送并逐张记录过账状态
+# status: pending 待发送，sending 发送中（next_attempt_at 为租约到期时间），posted 已过账，failed 失败待处理
+SAP_POSTING_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS sap_postings (
+        voucher_no INTEGER PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        batch_id TEXT,
+        sap_document TEXT,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_sap_postings_due ON sap_postings (status, next_attempt_at)",
+]
+
+# 外部数据增量同步的水位：每个来源一行，水位与本页变更在同一事务中提交
+# 主数据按SAP代码匹配本地记录，(key, sap_code, sap_description) 索引供同步时批量查找和跳过未变的记录
+SYNC_STATE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS sync_state (
+        source TEXT PRIMARY KEY,
+        watermark TEXT NOT NULL DEFAULT '',
+        synced_at TIMESTAMP,
+        last_result TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_config_sap_code ON config (key, sap_code, sap_description)",
+]
+
+# 邮件通知：提交、记账时在同一事务中写一条事件（只有一次INSERT，不连邮件服务器），
+# 发送线程按间隔把事件按报销人汇总成摘要邮件写入发件箱，再复用一个SMTP连接分批发送
+# mail_outbox.status: pending 待发送，sending 发送中（next_attempt_at 为租约到期时间），sent 已发送，failed 失败
+# claim 为最近一次领取的标记，回写结果时核对，租约过期被重新领取后旧批次的结果不再回写
+MAIL_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS mail_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        employee TEXT,
+        expense_id INTEGER,
+        voucher_no INTEGER,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS mail_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipient TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        claim TEXT,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_mail_outbox_due ON mail_outbox (status, next_attempt_at)",
+]
+
+# 报销票据附件：这里只存元数据，文件本身按SHA-256存放在 UPLOAD_FOLDER 下（见 app/utils/attachment_store.py），
+# 同一报销重复上传相同内容只记一条；(expense_id, sha256) 索引用于按报销取附件，sha256 索引用于删除时判断是否仍有引用
+ATTACHMENT_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS expense_attachments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        expense_id INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        content_type TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        uploaded_by TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (expense_id) REFERENCES expenses (id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_expense_attachments_expense ON expense_attachments (expense_id, sha256)",
+    "CREATE INDEX IF NOT EXISTS idx_expense_attachments_sha256 ON expense_attachments (sha256)",
+]
+
+# 金额字段由REAL（元）改为INTEGER（分）：(表, 原字段, 新字段)
+MONEY_COLUMNS = [
+    ('expenses', 'amount', 'amount_cents'),
+    ('expense_bookings', 'debit_amount', 'debit_cents'),
+    ('expense_bookings', 'credit_amount', 'credit_cents'),
+    ('entry', 'debit_amount', 'debit_cents'),
+    ('entry', 'credit_amount', 'credit_cents'),
+    ('budgets', 'amount', 'amount_cents'),
+]
+
+# 引用原金额字段的汇总对象，转换前删除，之后按新定义重建并重算
+MONEY_DERIVED_DROP_SQL = [
+    "DROP TRIGGER IF EXISTS trg_expense_summary_insert",
+    "DROP TRIGGER IF EXISTS trg_expense_summary_delete",
+    "DROP TRIGGER IF EXISTS trg_expense_summary_update",
+    "DROP TRIGGER IF EXISTS trg_budget_consumption_insert",
+    "DROP TRIGGER IF EXISTS trg_budget_consumption_delete",
+    "DROP TRIGGER IF EXISTS trg_budget_consumption_update",
+    "DROP TABLE IF EXISTS expense_summary",
+    "DROP TABLE IF EXISTS budget_consumption",
+]
+
+
+def money_column_sql(table, old, new):
+    """把一个以元计的REAL字段换成以分计的INTEGER字段的语句
+
+    先按两位小数四舍五入再乘100，与 app.utils.money.to_cents 的换算一致。
+    """
+    return [
+        f"ALTER TABLE {table} ADD COLUMN {new} INTEGER NOT NULL DEFAULT 0",
+        f"UPDATE {table} SET {new} = COALESCE(CAST(ROUND(ROUND({old}, 2) * 100) AS INTEGER), 0)",
+        f"ALTER TABLE {table} DROP COLUMN {old}",
+    ]
+
+
+# 老库用户按姓名对应员工主数据，升级时只回填姓名唯一对应一个员工的，重名的留空由管理员指定
+EMPLOYEE_CODE_BACKFILL_SQL = """
+    UPDATE users SET employee_code = (
+        SELECT c.code FROM config c WHERE c.key = 'employee' AND c.description = users.user_name
+    )
+    WHERE employee_code IS NULL
+      AND (SELECT COUNT(*) FROM config c WHERE c.key = 'employee' AND c.description = users.user_name) = 1
+"""
+
+# 老版本预置的管理员密码，升级时仍未修改的强制修改
+LEGACY_ADMIN_PASSWORD = 'admin123'
+
+# 老库缺失时需要补齐的字段：(表, 字段, 定义)
+UPGRADE_COLUMNS = [
+    ('expenses', 'status', "TEXT DEFAULT 'pending'"),
+    ('users', 'company_code', 'TEXT'),
+    ('users', 'department_code', 'TEXT'),
+    ('users', 'last_login', 'TIMESTAMP'),
+    ('users', 'updated_at', 'TIMESTAMP'),
+    ('users', 'email', 'TEXT'),
+    ('config', 'updated_at', 'TIMESTAMP'),
+    ('users', 'must_change_password', 'INTEGER NOT NULL DEFAULT 0'),
+    ('users', 'employee_code', 'TEXT'),
+    ('mail_outbox', 'claim', 'TEXT'),
+]
+
+
+class PoolExhaustedError(Exception):
+    """连接池在等待时间内没有可用连接"""
+
+
+class ConnectionPool:
+    """SQLite连接池
+
+    连接统一配置为WAL日志模式，读写互不阻塞；写锁冲突时按busy_timeout等待。
+    connection() 把连接绑定到当前线程（Streamlit每次脚本运行占用一个线程），
+    线程结束后连接自动回收到空闲队列；acquire()/release() 用于短时借用。
+    """
+
+    def __init__(self, db_path, max_size=20, timeout=30, busy_timeout=5000,
+                 cache_size=-20000, mmap_size=256 * 1024 * 1024, factory=sqlite3.Connection):
+        self.db_path = db_path
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self._uri = False
+        if db_path == ':memory:':
+            # 内存库需要共享缓存，否则池里每个连接都是一个独立的空库
+            self.db_path = f"file:expense_app_{id(self)}?mode=memory&cache=shared"
+            self._uri = True
+        self._idle = []
+        self._bound = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'reclaimed': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'closed': 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            uri=self._uri,
+            factory=self.factory,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _reclaim_dead_threads(self):
+        # 调用方需持有锁
+        for thread in [t for t in self._bound if not t.is_alive()]:
+            conn = self._bound.pop(thread)
+            self._reset(conn)
+            self._idle.append(conn)
+            self._stats['reclaimed'] += 1
+
+    @staticmethod
+    def _reset(conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+    def _checkout(self):
+        # 调用方需持有锁
+        if self._closed:
+            raise PoolExhaustedError("连接池已关闭")
+        self._reclaim_dead_threads()
+        deadline = time.monotonic() + self.timeout
+        while not self._idle and self._size >= self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._stats['timeouts'] += 1
+                raise PoolExhaustedError(f"{self.timeout}秒内没有可用的数据库连接")
+            self._stats['waits'] += 1
+            # 线程退出不会发通知，定期醒来回收其连接
+            self._cond.wait(min(remaining, 0.5))
+            self._reclaim_dead_threads()
+        if self._idle:
+            self._stats['reused'] += 1
+            return self._idle.pop()
+        self._size += 1
+        try:
+            conn = self._connect()
+        except Exception:
+            self._size -= 1
+            raise
+        self._stats['created'] += 1
+        return conn
+
+    def acquire(self):
+        """借出一个连接，用完必须调用 release()"""
+        with self._cond:
+            return self._checkout()
+
+    def release(self, conn):
+        """归还连接，未提交的事务会被回滚"""
+        try:
+            self._reset(conn)
+        except sqlite3.Error:
+            with self._cond:
+                self._size -= 1
+                self._stats['closed'] += 1
+                self._cond.notify()
+            conn.close()
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def connection(self):
+        """返回绑定到当前线程的连接，线程结束后自动回收"""
+        thread = threading.current_thread()
+        with self._cond:
+            conn = self._bound.get(thread)
+            if conn is None:
+                conn = self._checkout()
+                self._bound[thread] = conn
+            return conn
+
+    def stats(self):
+        """连接池运行统计"""
+        with self._cond:
+            self._reclaim_dead_threads()
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'thread_bound': len(self._bound),
+                **self._stats,
+            }
+
+    def close_all(self):
+        """关闭所有空闲连接，借出中的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            for conn in self._idle + list(self._bound.values()):
+                conn.close()
+                self._stats['closed'] += 1
+            self._size -= len(self._idle) + len(self._bound)
+            self._idle = []
+            self._bound = {}
+            self._cond.notify_all()
+
 
 class Database:
     _instance = None
@@ -13,159 +551,363 @@ class Database:
         return cls._instance
     
     def _initialize(self):
-        self.db_path = config['default'].DATABASE_URL.replace('sqlite:///', '')
-        self._create_tables()
+        settings = config['default']
+        self.db_path = settings.DATABASE_URL.replace('sqlite:///', '')
+        if getattr(self, 'pool', None) is not None:
+            self.pool.close_all()
+        self.pool = ConnectionPool(
+            self.db_path,
+            max_size=settings.DB_POOL_SIZE,
+            timeout=settings.DB_POOL_TIMEOUT,
+            busy_timeout=settings.DB_BUSY_TIMEOUT,
+            cache_size=settings.DB_CACHE_SIZE,
+            mmap_size=settings.DB_MMAP_SIZE,
+            factory=connection_factory(),
+        )
+        self._schema_version = None
+        self.bootstrap()
     
     @contextmanager
     def get_connection(self):
         conn = None
         try:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
+            conn = self.pool.acquire()
             yield conn
         except Exception as e:
             logger.error(f"数据库连接错误: {str(e)}")
             raise
         finally:
             if conn:
-                conn.close()
+                self.pool.release(conn)
+    
+    def connection(self):
+        """获取当前线程独占的连接，供Streamlit脚本在整次运行中使用"""
+        return self.pool.connection()
     
-    def _create_tables(self):
+    def pool_stats(self):
+        """连接池统计信息"""
+        return self.pool.stats()
+    
+    def bootstrap(self):
+        """初始化数据库结构和默认数据
+
+        进程内只执行一次；数据库已是当前结构版本时不执行任何DDL或写操作。
+        返回本次是否实际执行了初始化。
+        """
+        if self._schema_version == SCHEMA_VERSION:
+            return False
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # 创建费用记录表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS expenses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    expense_date DATE,
-                    department TEXT,
-                    company TEXT,
-                    budget_item TEXT,
-                    employee TEXT,
-                    amount REAL,
-                    description TEXT,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 创建配置表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS config (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    key TEXT NOT NULL,
-                    code TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    sap_code TEXT NOT NULL,
-                    sap_description TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(key, code, description)
-                )
-            ''')
-            
-            # 创建角色表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS roles (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    role_name TEXT NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(role_name)
-                )
-            ''')
-            
-            # 创建权限表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS permissions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    module_name TEXT NOT NULL,
-                    permission_name TEXT NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(module_name, permission_name)
-                )
-            ''')
-            
-            # 创建角色权限关联表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS role_permissions (
-                    role_id INTEGER,
-                    permission_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (role_id) REFERENCES roles (id),
-                    FOREIGN KEY (permission_id) REFERENCES permissions (id),
-                    PRIMARY KEY (role_id, permission_id)
-                )
-            ''')
-            
-            # 创建用户表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    user_name TEXT NOT NULL,
-                    password TEXT NOT NULL,
-                    role_id INTEGER,
-                    company_code TEXT,
-                    department_code TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP,
-                    FOREIGN KEY (role_id) REFERENCES roles (id),
-                    UNIQUE(user_id)
-                )
-            ''')
-            
-            # 创建记账记录表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS expense_bookings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    expense_id INTEGER,
-                    booking_date DATE,
-                    sap_account_code TEXT,
-                    sap_account_desc TEXT,
-                    sap_cost_center_code TEXT,
-                    sap_cost_center_desc TEXT,
-                    debit_amount REAL,
-                    credit_amount REAL,
-                    sap_employee_code TEXT,
-                    sap_employee_desc TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (expense_id) REFERENCES expenses (id)
-                )
-            ''')
-            
-            # 创建entry表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS entry (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    voucher_no INTEGER,
-                    expense_id INTEGER,
-                    entry_type TEXT,
-                    booking_date DATE,
-                    sap_account_code TEXT,
-                    sap_account_desc TEXT,
-                    sap_cost_center_code TEXT,
-                    sap_cost_center_desc TEXT,
-                    debit_amount REAL,
-                    credit_amount REAL,
-                    sap_employee_code TEXT,
-                    sap_employee_desc TEXT,
-                    voucher_date DATE,
-                    post_date DATE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            conn.commit()
-            logger.info("数据库表创建成功")
+            applied = self._apply_schema(conn)
+        self._schema_version = SCHEMA_VERSION
+        return applied
+    
+    def _apply_schema(self, conn):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return False
+        # 加写锁后再确认一次版本，避免多个进程同时升级
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            conn.rollback()
+            return False
+        self._create_tables(conn)
+        self._upgrade_columns(conn)
+        self._backfill_employee_codes(conn)
+        self._convert_money_columns(conn)
+        self._create_indexes(conn)
+        self._create_summaries(conn)
+        self._create_budgets(conn)
+        self._create_search_index(conn)
+        self._create_sap_postings(conn)
+        self._create_sync_state(conn)
+        self._create_mail_queue(conn)
+        self._create_attachments(conn)
+        self._seed_defaults(conn)
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        conn.commit()
+        logger.info(f"数据库结构已初始化到版本 {SCHEMA_VERSION}")
+        return True
+    
+    def _create_tables(self, conn):
+        cursor = conn.cursor()
+        
+        # 创建费用记录表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS expenses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                expense_date DATE,
+                department TEXT,
+                company TEXT,
+                budget_item TEXT,
+                employee TEXT,
+                amount_cents INTEGER NOT NULL DEFAULT 0,
+                description TEXT,
+                status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 创建配置表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS config (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                code TEXT NOT NULL,
+                description TEXT NOT NULL,
+                sap_code TEXT NOT NULL,
+                sap_description TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(key, code, description)
+            )
+        ''')
+        
+        # 创建角色表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS roles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                role_name TEXT NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(role_name)
+            )
+        ''')
+        
+        # 创建权限表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS permissions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                module_name TEXT NOT NULL,
+                permission_name TEXT NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(module_name, permission_name)
+            )
+        ''')
+        
+        # 创建角色权限关联表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS role_permissions (
+                role_id INTEGER,
+                permission_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (role_id) REFERENCES roles (id),
+                FOREIGN KEY (permission_id) REFERENCES permissions (id),
+                PRIMARY KEY (role_id, permission_id)
+            )
+        ''')
+        
+        # 创建用户表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                user_name TEXT NOT NULL,
+                password TEXT NOT NULL,
+                role_id INTEGER,
+                company_code TEXT,
+                department_code TEXT,
+                email TEXT,
+                employee_code TEXT,
+                must_change_password INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_login TIMESTAMP,
+                FOREIGN KEY (role_id) REFERENCES roles (id),
+                UNIQUE(user_id)
+            )
+        ''')
+        
+        # 创建记账记录表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS expense_bookings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                expense_id INTEGER,
+                booking_date DATE,
+                sap_account_code TEXT,
+                sap_account_desc TEXT,
+                sap_cost_center_code TEXT,
+                sap_cost_center_desc TEXT,
+                debit_cents INTEGER NOT NULL DEFAULT 0,
+                credit_cents INTEGER NOT NULL DEFAULT 0,
+                sap_employee_code TEXT,
+                sap_employee_desc TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (expense_id) REFERENCES expenses (id)
+            )
+        ''')
+        
+        # 创建entry表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS entry (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                voucher_no INTEGER,
+                expense_id INTEGER,
+                entry_type TEXT,
+                booking_date DATE,
+                sap_account_code TEXT,
+                sap_account_desc TEXT,
+                sap_cost_center_code TEXT,
+                sap_cost_center_desc TEXT,
+                debit_cents INTEGER NOT NULL DEFAULT 0,
+                credit_cents INTEGER NOT NULL DEFAULT 0,
+                sap_employee_code TEXT,
+                sap_employee_desc TEXT,
+                voucher_date DATE,
+                post_date DATE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        logger.info("数据库表创建成功")
+    
+    def _upgrade_columns(self, conn):
+        """兼容老库：补齐后续版本新增的字段"""
+        for table, column, definition in UPGRADE_COLUMNS:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            # 表还不存在时由后面的建表语句带上该字段
+            if existing and column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                logger.info(f"已为 {table} 表补充字段 {column}")
+    
+    def _backfill_employee_codes(self, conn):
+        """兼容老库：按姓名为用户补上对应的员工编码"""
+        count = conn.execute(EMPLOYEE_CODE_BACKFILL_SQL).rowcount
+        if count:
+            logger.info(f"已按姓名为 {count} 个用户补充员工编码")
+    
+    def _convert_money_columns(self, conn):
+        """兼容老库：金额字段换成以分计的整数，汇总表随后按新字段重建"""
+        pending = []
+        for table, old, new in MONEY_COLUMNS:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if old in existing and new not in existing:
+                pending.append((table, old, new))
+        if not pending:
+            return
+        for sql in MONEY_DERIVED_DROP_SQL:
+            conn.execute(sql)
+        for table, old, new in pending:
+            for sql in money_column_sql(table, old, new):
+                conn.execute(sql)
+            logger.info(f"已将 {table}.{old} 转换为以分计的 {new}")
+    
+    def _create_indexes(self, conn):
+        for ddl in INDEXES:
+            conn.execute(ddl)
+        logger.info("数据库索引创建成功")
+    
+    def _create_summaries(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='expense_summary'"
+        ).fetchone()
+        for ddl in SUMMARY_DDL:
+            conn.execute(ddl)
+        if not exists:
+            # 新建的汇总表按现有明细补齐
+            self._rebuild_summaries(conn)
+    
+    def _rebuild_summaries(self, conn):
+        for sql in SUMMARY_REBUILD_SQL:
+            conn.execute(sql)
+        logger.info("报销汇总表已按明细重算")
+    
+    def _create_budgets(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='budget_consumption'"
+        ).fetchone()
+        for ddl in BUDGET_DDL:
+            conn.execute(ddl)
+        if not exists:
+            # 新建的占用表按现有明细补齐
+            for sql in CONSUMPTION_REBUILD_SQL:
+                conn.execute(sql)
+            logger.info("预算占用已按明细重算")
+    
+    def _create_search_index(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='expenses_fts'"
+        ).fetchone()
+        for ddl in SEARCH_DDL:
+            conn.execute(ddl)
+        if not exists:
+            # 新建的全文索引按原表补齐
+            for sql in SEARCH_REBUILD_SQL:
+                conn.execute(sql)
+            logger.info("全文索引已按原表重建")
+    
+    def _create_sap_postings(self, conn):
+        # 只记录建表之后保存的凭证，已有的历史凭证不补发
+        for ddl in SAP_POSTING_DDL:
+            conn.execute(ddl)
+    
+    def _create_sync_state(self, conn):
+        for ddl in SYNC_STATE_DDL:
+            conn.execute(ddl)
+    
+    def _create_mail_queue(self, conn):
+        for ddl in MAIL_DDL:
+            conn.execute(ddl)
+    
+    def _create_attachments(self, conn):
+        for ddl in ATTACHMENT_DDL:
+            conn.execute(ddl)
+    
+    def rebuild_summaries(self):
+        """按明细重算汇总表和预算占用"""
+        with self.get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._rebuild_summaries(conn)
+                for sql in CONSUMPTION_REBUILD_SQL:
+                    conn.execute(sql)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def _seed_defaults(self, conn):
+        """初始化默认权限、管理员角色和管理员用户"""
+        conn.executemany(
+            "INSERT OR IGNORE INTO permissions (module_name, permission_name, description) VALUES (?, ?, ?)",
+            DEFAULT_PERMISSIONS
+        )
+        
+        # 确保至少有一个管理员角色，并为其分配所有权限
+        admin_role = conn.execute("SELECT id FROM roles WHERE role_name='admin'").fetchone()
+        if not admin_role:
+            conn.execute("INSERT INTO roles (role_name, description) VALUES (?, ?)",
+                         ("admin", "系统管理员"))
+            admin_role_id = conn.execute("SELECT id FROM roles WHERE role_name='admin'").fetchone()[0]
+            conn.execute(
+                "INSERT OR IGNORE INTO role_permissions (role_id, permission_id) SELECT ?, id FROM permissions",
+                (admin_role_id,)
+            )
+        
+        # 确保至少有一个管理员用户：初始密码取 ADMIN_INITIAL_PASSWORD，未配置时随机生成并写入日志，首次登录须修改
+        admin_user = conn.execute("SELECT id, password FROM users WHERE user_id='admin'").fetchone()
+        if not admin_user:
+            admin_role_id = conn.execute("SELECT id FROM roles WHERE role_name='admin'").fetchone()[0]
+            password = config['default'].ADMIN_INITIAL_PASSWORD or secrets.token_urlsafe(12)
+            conn.execute("INSERT INTO users (user_id, user_name, password, role_id, must_change_password) "
+                         "VALUES (?, ?, ?, ?, 1)", ("admin", "管理员", hash_password(password), admin_role_id))
+            if not config['default'].ADMIN_INITIAL_PASSWORD:
+                logger.warning(f"已创建管理员账号 admin，初始密码：{password}，首次登录后须修改")
+        elif _is_default_admin_password(admin_user[1]):
+            # 老版本预置的 admin123 未改过：下次登录时强制修改
+            conn.execute("UPDATE users SET must_change_password = 1 WHERE id = ?", (admin_user[0],))
+            logger.warning("管理员 admin 仍在使用默认密码，下次登录时须修改")
+
+def _is_default_admin_password(stored):
+    """管理员密码是否仍是老版本预置的 admin123（明文或哈希）"""
+    if is_password_hash(stored):
+        return verify_password(LEGACY_ADMIN_PASSWORD, stored)
+    return stored == LEGACY_ADMIN_PASSWORD
+
 
 # 创建全局数据库实例
 db = Database() 
\ No newline at end of file
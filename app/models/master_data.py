@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import namedtuple
+from config import config
+from app.models.database import db
+from app.utils.logger import logger
+
+# 主数据类型：部门、公司、预算科目、报销人
+MASTER_DATA_KEYS = ('department', 'company', 'budget_item', 'employee')
+
+MasterDataEntry = namedtuple('MasterDataEntry', ['code', 'description', 'sap_code', 'sap_description'])
+
+# 其他进程（命令行、定时任务）同步SAP主数据后推进的水位，缓存据此发现库里的主数据已变
+SYNC_WATERMARK_SQL = "SELECT watermark FROM sync_state WHERE source = 'sap_master_data'"
+
+LAST_UPDATED_SQL = "SELECT MAX(updated_at) FROM config"
+
+# updated_at 精确到秒，取 >= 上次的时间点，同一秒内后写入的记录不会漏掉（重复合并不影响结果）
+CHANGED_SINCE_SQL = """
+    SELECT key, code, description, sap_code, sap_description, updated_at
+    FROM config
+    WHERE updated_at >= ?
+"""
+
+
+class MasterDataSet:
+    """同一类主数据的编码/描述双向索引"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.by_code = {}
+        self.by_description = {}
+        for entry in entries:
+            # 与按key查询时的索引顺序一致，重复时保留第一条
+            self.by_code.setdefault(entry.code, entry)
+            self.by_description.setdefault(entry.description, entry)
+
+
+class MasterDataCache:
+    """config表的进程级缓存
+
+    首次访问时一次性加载全部主数据，之后的下拉选项和编码/描述互查都是内存字典查找。
+    任何写config表的地方在提交后必须调用 invalidate()；只改了少量记录时可改用 merge() 就地合并。
+    其他进程同步的SAP主数据没法通知到本进程，访问时最多每 check_interval 秒查一次同步水位，
+    水位变了只把 updated_at 之后变更的记录合并进来，不重新加载整张表。
+    """
+
+    def __init__(self, database, check_interval=30):
+        self._db = database
+        self._lock = threading.Lock()
+        self._sets = None
+        self.version = 0
+        self.check_interval = check_interval
+        self._checked_at = 0.0
+        self._watermark = None
+        self._updated_at = None
+
+    def _load(self):
+        grouped = {}
+        with self._db.get_connection() as conn:
+            # 先记水位和最后修改时间再读全表，读表期间的同步会在下次检查时再合并一次
+            self._watermark, self._updated_at = self._sync_marks(conn)
+            rows = conn.execute("""
+                SELECT key, code, description, sap_code, sap_description
+                FROM config
+                ORDER BY key, code, description
+            """).fetchall()
+        self._checked_at = time.monotonic()
+        for row in rows:
+            grouped.setdefault(row[0], []).append(MasterDataEntry(*tuple(row)[1:]))
+        logger.debug(f"主数据缓存已加载 {len(rows)} 条")
+        return {key: MasterDataSet(entries) for key, entries in grouped.items()}
+
+    @staticmethod
+    def _sync_marks(conn):
+        row = conn.execute(SYNC_WATERMARK_SQL).fetchone()
+        return (row[0] if row else None), conn.execute(LAST_UPDATED_SQL).fetchone()[0]
+
+    def _get(self, key):
+        sets = self._sets
+        if sets is None:
+            with self._lock:
+                if self._sets is None:
+                    self._sets = self._load()
+                sets = self._sets
+        elif self.check_interval and time.monotonic() - self._checked_at >= self.check_interval:
+            sets = self._catch_up()
+        return sets.get(key) or MasterDataSet([])
+
+    def _catch_up(self):
+        """其他进程推进了同步水位时，把之后变更的记录合并进缓存；同一时刻只有一个线程检查"""
+        if not self._lock.acquire(blocking=False):
+            return self._sets
+        try:
+            self._checked_at = time.monotonic()
+            with self._db.get_connection() as conn:
+                watermark, updated_at = self._sync_marks(conn)
+                if watermark == self._watermark or self._sets is None:
+                    return self._sets
+                rows = conn.execute(CHANGED_SINCE_SQL, (self._updated_at or '',)).fetchall()
+            grouped = {}
+            for row in rows:
+                grouped.setdefault(row['key'], []).append(MasterDataEntry(*tuple(row)[1:5]))
+            for key, entries in grouped.items():
+                self._merge_locked(key, entries)
+            self._watermark, self._updated_at = watermark, updated_at
+            logger.info(f"主数据同步水位已推进到 {watermark}，缓存合并了 {len(rows)} 条变更")
+            return self._sets
+        except Exception as e:
+            # 检查失败不影响读缓存，下个间隔再试
+            logger.warning(f"检查主数据同步水位失败: {str(e)}")
+            return self._sets
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """主数据变更后清空缓存，下次访问时重新加载"""
+        with self._lock:
+            self._sets = None
+            self.version += 1
+
+    def merge(self, key, entries):
+        """把新增或变更的记录合并进已加载的缓存（按编码+描述替换），不重新加载整张表"""
+        if not entries:
+            return
+        with self._lock:
+            self._merge_locked(key, entries)
+
+    def _merge_locked(self, key, entries):
+        if self._sets is not None:
+            current = self._sets.get(key)
+            merged = {(entry.code, entry.description): entry for entry in (current.entries if current else [])}
+            merged.update(((entry.code, entry.description), entry) for entry in entries)
+            # 写时复制：正在读旧索引的线程不受影响
+            sets = dict(self._sets)
+            sets[key] = MasterDataSet(sorted(merged.values(), key=lambda entry: (entry.code, entry.description)))
+            self._sets = sets
+        self.version += 1
+
+    def entries(self, key):
+        """某类主数据的全部记录"""
+        return self._get(key).entries
+
+    def options(self, key):
+        """(编码, 描述) 列表"""
+        return [(entry.code, entry.description) for entry in self._get(key).entries]
+
+    def descriptions(self, key):
+        """描述列表，用于下拉框"""
+        return [entry.description for entry in self._get(key).entries]
+
+    def get(self, key, code):
+        """按编码取主数据记录，不存在返回None"""
+        return self._get(key).by_code.get(code)
+
+    def find(self, key, description):
+        """按描述取主数据记录，不存在返回None"""
+        return self._get(key).by_description.get(description)
+
+    def code_of(self, key, description):
+        """描述转编码"""
+        entry = self.find(key, description)
+        return entry.code if entry else None
+
+    def description_of(self, key, code):
+        """编码转描述"""
+        entry = self.get(key, code)
+        return entry.description if entry else None
+
+    def sap_of(self, key, code):
+        """编码对应的 (SAP代码, SAP描述)"""
+        entry = self.get(key, code)
+        return (entry.sap_code, entry.sap_description) if entry else (None, None)
+
+
+# 创建全局主数据缓存
+master_data = MasterDataCache(db, check_interval=config['default'].MASTER_DATA_CHECK_INTERVAL)
@@ -0,0 +1,56 @@
+import threading
+from app.models.database import db
+from app.utils.logger import logger
+
+
+class RolePermissionCache:
+    """角色→权限的进程级缓存
+
+    首次访问时一次性加载 permissions 和 role_permissions：每个权限占一个二进制位（位号即权限id，
+    id自增不复用，位号稳定），每个角色的全部权限合成一个整数位图。登录时按角色取位图存入会话，
+    之后的页面和操作鉴权只是一次位与运算，不查库。
+    任何写 roles/role_permissions 表的地方在提交后必须调用 invalidate()。
+    """
+
+    def __init__(self, database):
+        self._db = database
+        self._lock = threading.Lock()
+        self._data = None
+        self.version = 0
+
+    def _load(self):
+        with self._db.get_connection() as conn:
+            bits = {(row[1], row[2]): 1 << row[0]
+                    for row in conn.execute("SELECT id, module_name, permission_name FROM permissions")}
+            masks = {}
+            for role_id, permission_id in conn.execute("SELECT role_id, permission_id FROM role_permissions"):
+                masks[role_id] = masks.get(role_id, 0) | (1 << permission_id)
+        logger.debug(f"角色权限缓存已加载 {len(bits)} 项权限、{len(masks)} 个角色")
+        return bits, masks
+
+    def _get(self):
+        data = self._data
+        if data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self._load()
+                data = self._data
+        return data
+
+    def invalidate(self):
+        """角色或角色权限变更后清空缓存，已登录会话在下次鉴权时按新版本重新解析"""
+        with self._lock:
+            self._data = None
+            self.version += 1
+
+    def bit(self, module_name, permission_name):
+        """某项权限对应的位，权限不存在时为0"""
+        return self._get()[0].get((module_name, permission_name), 0)
+
+    def mask_of(self, role_id):
+        """角色的权限位图，角色不存在或没有权限时为0"""
+        return self._get()[1].get(role_id, 0)
+
+
+# 创建全局角色权限缓存
+permission_cache = RolePermissionCache(db)
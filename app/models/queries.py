@@ -0,0 +1,378 @@
+import json
+from app.utils.money import to_cents
+
+# 页面热点查询集中在这里维护，tests/unit/test_query_plans.py 会逐条检查执行计划
+# 金额以分存储，合计在SQL里对整数求和，只在输出时除以100转成元
+
+# 报销记录关联主数据描述
+EXPENSE_JOINS = """
+    FROM expenses e
+    LEFT JOIN config d ON e.department = d.code AND d.key = 'department'
+    LEFT JOIN config c ON e.company = c.code AND c.key = 'company'
+    LEFT JOIN config b ON e.budget_item = b.code AND b.key = 'budget_item'
+    LEFT JOIN config em ON e.employee = em.code AND em.key = 'employee'
+"""
+
+# 报销查看
+EXPENSE_SEARCH_SQL = """
+    SELECT e.expense_date AS '日期',
+           d.description AS '部门',
+           c.description AS '公司',
+           b.description AS '预算科目',
+           em.description AS '报销人',
+           e.amount_cents / 100.0 AS '金额',
+           e.description AS '摘要'
+""" + EXPENSE_JOINS
+
+# 报销记账：待记账记录及其SAP映射
+PENDING_SELECT_SQL = """
+    SELECT e.id, e.expense_date, e.amount_cents / 100.0 AS amount, e.amount_cents, e.description,
+           d.description as department,
+           c.description as company,
+           b.description as budget_item,
+           em.description as employee,
+           b.sap_code as sap_account_code,
+           b.sap_description as sap_account_desc,
+           d.sap_code as sap_cost_center_code,
+           d.sap_description as sap_cost_center_desc,
+           em.sap_code as sap_employee_code,
+           em.sap_description as sap_employee_desc
+""" + EXPENSE_JOINS
+
+PENDING_EXPENSES_SQL = PENDING_SELECT_SQL + """
+    WHERE e.status='pending'
+    ORDER BY e.expense_date DESC, e.id DESC
+"""
+
+# 最新凭证号
+LAST_VOUCHER_SQL = "SELECT MAX(voucher_no) FROM entry"
+
+# 凭证号区间内借贷不平的凭证：写入后在同一事务内按分精确核对
+UNBALANCED_VOUCHERS_SQL = """
+    SELECT voucher_no, SUM(debit_cents) AS debit_cents, SUM(credit_cents) AS credit_cents
+    FROM entry
+    WHERE voucher_no BETWEEN ? AND ?
+    GROUP BY voucher_no
+    HAVING SUM(debit_cents) != SUM(credit_cents)
+"""
+
+# 记账查看
+ENTRY_SEARCH_SQL = """
+    SELECT CAST(voucher_no AS TEXT) as '凭证号', entry_type as '借贷方', booking_date as '记账日期',
+           sap_account_code as 'SAP科目', sap_account_desc as '科目描述',
+           sap_cost_center_code as '成本中心', sap_cost_center_desc as '成本中心描述',
+           debit_cents / 100.0 as '借方金额', credit_cents / 100.0 as '贷方金额',
+           sap_employee_code as '员工代码', sap_employee_desc as '员工姓名',
+           voucher_date as '凭证日期', post_date as '过账日期'
+    FROM entry
+    WHERE 1=1
+"""
+
+
+# trigram 分词最短可检索3个字符，更短的关键字退回 LIKE
+FTS_MIN_LENGTH = 3
+
+
+# 命中数不超过该值的关键字由全文索引驱动（按id回表后排序），否则沿日期索引扫描、逐行判断是否命中
+FTS_SELECTIVE_LIMIT = 2000
+
+KEYWORD_PROBE_SQL = "SELECT COUNT(*) FROM (SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH ? LIMIT ?)"
+
+
+def fts_phrase(keyword, column=None):
+    """关键字转成FTS5短语（整体按子串匹配），可限定列"""
+    phrase = '"' + keyword.replace('"', '""') + '"'
+    return f"{column} : {phrase}" if column else phrase
+
+
+def like_pattern(keyword):
+    """关键字转成 LIKE 子串模式，配合 ESCAPE '\\' 使用"""
+    escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def is_selective_keyword(conn, keyword):
+    """摘要关键字命中的报销是否足够少，只探测前 FTS_SELECTIVE_LIMIT 条命中"""
+    keyword = (keyword or '').strip()
+    if len(keyword) < FTS_MIN_LENGTH:
+        return False
+    count = conn.execute(KEYWORD_PROBE_SQL, (fts_phrase(keyword), FTS_SELECTIVE_LIMIT)).fetchone()[0]
+    return count < FTS_SELECTIVE_LIMIT
+
+
+def _expense_filters(owner=None, employee=None, department=None, company=None, budget_item=None,
+                     min_amount=0, max_amount=0, keyword=None):
+    where_clauses = []
+    params = []
+    keyword = (keyword or '').strip()
+    if len(keyword) >= FTS_MIN_LENGTH:
+        where_clauses.append("e.id IN (SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH ?)")
+        params.append(fts_phrase(keyword))
+    elif keyword:
+        where_clauses.append("e.description LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(keyword))
+    if owner is not None:
+        where_clauses.append("e.employee = ?")
+        params.append(owner)
+    for column, value in (('employee', employee), ('department', department),
+                          ('company', company), ('budget_item', budget_item)):
+        if value:
+            where_clauses.append(f"e.{column} = ?")
+            params.append(value)
+    if min_amount > 0:
+        where_clauses.append("e.amount_cents >= ?")
+        params.append(to_cents(min_amount))
+    if max_amount > 0:
+        where_clauses.append("e.amount_cents <= ?")
+        params.append(to_cents(max_amount))
+    return where_clauses, params
+
+
+def build_expense_search(after=None, limit=None, with_id=True, selective=False, **filters):
+    """构造报销查看的查询语句，返回 (sql, params)
+
+    筛选条件均为主数据编码；owner 不为None时只能查到该员工本人的记录；keyword 为摘要关键字。
+    after 为上一页最后一行的 (日期, id)，配合 limit 做键集分页，翻到任何一页都只读取一页的行；
+    with_id=False 时结果不含id列，用于导出。
+    selective=True（见 is_selective_keyword）时排序列加一元+号，不让日期索引承担排序，
+    查询改由全文索引命中的id驱动。
+    """
+    where_clauses, params = _expense_filters(**filters)
+    if after is not None:
+        where_clauses.append("(e.expense_date, e.id) < (?, ?)")
+        params.extend(after)
+    query = EXPENSE_SEARCH_SQL
+    if with_id:
+        # id仅用于键集分页，不展示
+        query = query.replace("SELECT", "SELECT e.id AS id,", 1)
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    if selective:
+        query += " ORDER BY +e.expense_date DESC, +e.id DESC"
+    else:
+        query += " ORDER BY e.expense_date DESC, e.id DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
+def build_expense_summary(**filters):
+    """构造报销查看的汇总语句（笔数、金额合计），返回 (sql, params)"""
+    where_clauses, params = _expense_filters(**filters)
+    query = "SELECT COUNT(*) AS 笔数, COALESCE(SUM(e.amount_cents), 0) / 100.0 AS 金额合计 FROM expenses e"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    return query, params
+
+
+def _pending_filters(company=None, department=None, date_from=None, date_to=None):
+    where_clauses = ["e.status = 'pending'"]
+    params = []
+    for column, value in (('company', company), ('department', department)):
+        if value:
+            where_clauses.append(f"e.{column} = ?")
+            params.append(value)
+    if date_from:
+        where_clauses.append("e.expense_date >= ?")
+        params.append(str(date_from))
+    if date_to:
+        where_clauses.append("e.expense_date <= ?")
+        params.append(str(date_to))
+    return where_clauses, params
+
+
+def build_pending_search(after=None, limit=None, **filters):
+    """构造报销记账待记账列表的分页查询，返回 (sql, params)
+
+    筛选条件为公司/部门编码和期间；after、limit 的含义同 build_expense_search。
+    """
+    where_clauses, params = _pending_filters(**filters)
+    if after is not None:
+        where_clauses.append("(e.expense_date, e.id) < (?, ?)")
+        params.extend(after)
+    query = PENDING_SELECT_SQL + " WHERE " + " AND ".join(where_clauses)
+    query += " ORDER BY e.expense_date DESC, e.id DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
+def build_pending_ids(**filters):
+    """构造“全选筛选结果”的查询，只取id、不关联主数据，返回 (sql, params)"""
+    where_clauses, params = _pending_filters(**filters)
+    query = "SELECT e.id FROM expenses e WHERE " + " AND ".join(where_clauses)
+    return query, params
+
+
+def build_pending_by_ids(ids):
+    """按id取已选中的待记账记录，id列表以JSON数组整体绑定，返回 (sql, params)"""
+    # CROSS JOIN 固定以id列表驱动，按主键逐条定位，而不是扫描全部待记账记录
+    query = PENDING_SELECT_SQL.replace(
+        "FROM expenses e", "FROM json_each(?) s\n    CROSS JOIN expenses e ON e.id = s.value", 1
+    ) + """
+    WHERE e.status = 'pending'
+    ORDER BY e.expense_date DESC, e.id DESC
+"""
+    return query, [json.dumps(sorted(int(i) for i in ids))]
+
+
+def build_auto_booking_source(**filters):
+    """构造自动记账的取数语句：待记账记录的编码和金额，按日期、id顺序，返回 (sql, params)"""
+    where_clauses, params = _pending_filters(**filters)
+    query = """
+    SELECT e.id, e.expense_date, e.company, e.department, e.budget_item, e.employee, e.amount_cents
+    FROM expenses e
+    WHERE """ + " AND ".join(where_clauses) + " ORDER BY e.expense_date, e.id"
+    return query, params
+
+
+# 报销看板：已有数据的期间
+SUMMARY_PERIODS_SQL = "SELECT DISTINCT period FROM expense_summary WHERE expense_count > 0 ORDER BY period DESC"
+
+# 报销看板可用的汇总维度
+SUMMARY_DIMENSIONS = ('period', 'company', 'department', 'budget_item', 'status')
+
+
+def build_spend_summary(dimensions=(), period_from=None, period_to=None, company=None, department=None,
+                        budget_item=None, status=None):
+    """构造报销看板的汇总查询，只读 expense_summary，返回 (sql, params)
+
+    dimensions 为分组维度，期间格式为 YYYY-MM；结果列为各维度编码、笔数、金额。
+    """
+    unknown = [d for d in dimensions if d not in SUMMARY_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"不支持的汇总维度: {', '.join(unknown)}")
+    where_clauses = []
+    params = []
+    if period_from:
+        where_clauses.append("period >= ?")
+        params.append(period_from)
+    if period_to:
+        where_clauses.append("period <= ?")
+        params.append(period_to)
+    for column, value in (('company', company), ('department', department),
+                          ('budget_item', budget_item), ('status', status)):
+        if value:
+            where_clauses.append(f"{column} = ?")
+            params.append(value)
+    columns = list(dimensions) + ["SUM(expense_count) AS 笔数", "SUM(total_cents) / 100.0 AS 金额"]
+    query = "SELECT " + ", ".join(columns) + " FROM expense_summary"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    if dimensions:
+        query += " GROUP BY " + ", ".join(dimensions) + " ORDER BY " + ", ".join(dimensions)
+    return query, params
+
+
+# 提交报销时的预算校验：按主键各取一行，与历史报销数量无关
+BUDGET_CHECK_SQL = """
+    SELECT b.amount_cents, COALESCE(u.pending_cents, 0) + COALESCE(u.booked_cents, 0)
+    FROM budgets b
+    LEFT JOIN budget_consumption u
+      ON u.period = b.period AND u.department = b.department AND u.budget_item = b.budget_item
+    WHERE b.period = ? AND b.department = ? AND b.budget_item = ?
+"""
+
+
+def build_budget_report(period, department=None):
+    """构造预算执行查询：某期间有预算或有占用的 部门×预算科目，返回 (sql, params)
+
+    剩余和执行率在SQL中按分计算；没有预算时剩余为空，预算为0时执行率为空。
+    """
+    condition = "period = ?" + (" AND department = ?" if department else "")
+    keys_params = [period, department] if department else [period]
+    query = f"""
+    SELECT k.department, k.budget_item, b.amount_cents / 100.0 AS budget,
+           COALESCE(u.pending_cents, 0) / 100.0 AS pending, COALESCE(u.booked_cents, 0) / 100.0 AS booked,
+           (b.amount_cents - COALESCE(u.pending_cents, 0) - COALESCE(u.booked_cents, 0)) / 100.0 AS remaining,
+           CASE WHEN b.amount_cents > 0
+                THEN ROUND((COALESCE(u.pending_cents, 0) + COALESCE(u.booked_cents, 0)) * 1.0 / b.amount_cents, 4)
+           END AS rate
+    FROM (SELECT department, budget_item FROM budgets WHERE {condition}
+          UNION
+          SELECT department, budget_item FROM budget_consumption WHERE {condition}) k
+    LEFT JOIN budgets b
+      ON b.period = ? AND b.department = k.department AND b.budget_item = k.budget_item
+    LEFT JOIN budget_consumption u
+      ON u.period = ? AND u.department = k.department AND u.budget_item = k.budget_item
+    ORDER BY k.department, k.budget_item
+"""
+    return query, keys_params * 2 + [period, period]
+
+
+def build_entry_search(voucher_no=None, sap_account_code=None, min_amount=0, max_amount=0,
+                       employee=None, date_from=None, date_to=None, keyword=None):
+    """构造记账查看的查询语句，返回 (sql, params)
+
+    科目、员工姓名和关键字（科目代码/科目描述/员工姓名任一命中）走 entry_fts 全文索引，
+    有关键字时按相关度排序；不足3个字符的条件退回 LIKE。
+    """
+    match_terms = []
+    conditions = []
+    params = []
+    for column, value in (('sap_account_code', sap_account_code), ('sap_employee_desc', employee),
+                          (None, keyword)):
+        value = (value or '').strip()
+        if len(value) >= FTS_MIN_LENGTH:
+            match_terms.append(fts_phrase(value, column))
+        elif value:
+            columns = [column] if column else ['sap_account_code', 'sap_account_desc', 'sap_employee_desc']
+            conditions.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in columns) + ")")
+            params.extend([like_pattern(value)] * len(columns))
+    query = ENTRY_SEARCH_SQL
+    if match_terms:
+        # 先由全文索引取出命中行及相关度，再回表
+        query = query.replace("FROM entry", "FROM entry JOIN (\n        SELECT rowid, rank FROM entry_fts WHERE entry_fts MATCH ?\n"
+                              "    ) m ON m.rowid = entry.id", 1)
+        params.insert(0, " AND ".join(match_terms))
+    query += "".join(" AND " + condition for condition in conditions)
+    if voucher_no:
+        query += " AND voucher_no=?"
+        params.append(voucher_no)
+    if min_amount > 0:
+        query += " AND (debit_cents >= ? OR credit_cents >= ?)"
+        params.extend([to_cents(min_amount)] * 2)
+    if max_amount > 0:
+        query += " AND (debit_cents <= ? OR credit_cents <= ?)"
+        params.extend([to_cents(max_amount)] * 2)
+    if date_from:
+        query += " AND booking_date >= ?"
+        params.append(str(date_from))
+    if date_to:
+        query += " AND booking_date <= ?"
+        params.append(str(date_to))
+    if match_terms and (keyword or '').strip():
+        query += " ORDER BY m.rank, voucher_no DESC, entry.id ASC"
+    else:
+        query += " ORDER BY voucher_no DESC, entry.id ASC"
+    return query, params
+
+
+def build_trial_balance(date_from=None, date_to=None, sap_account_code=None):
+    """构造科目余额表：按SAP科目汇总借方、贷方和余额（借减贷），返回 (sql, params)
+
+    另带以分计的 debit_cents、credit_cents 列，供页面精确合计。
+    """
+    where_clauses = []
+    params = []
+    if date_from:
+        where_clauses.append("booking_date >= ?")
+        params.append(str(date_from))
+    if date_to:
+        where_clauses.append("booking_date <= ?")
+        params.append(str(date_to))
+    if sap_account_code:
+        where_clauses.append("sap_account_code = ?")
+        params.append(sap_account_code)
+    query = """
+    SELECT sap_account_code AS 'SAP科目', MAX(sap_account_desc) AS '科目描述', COUNT(*) AS '行数',
+           SUM(debit_cents) / 100.0 AS '借方金额', SUM(credit_cents) / 100.0 AS '贷方金额',
+           (SUM(debit_cents) - SUM(credit_cents)) / 100.0 AS '余额',
+           SUM(debit_cents) AS debit_cents, SUM(credit_cents) AS credit_cents
+    FROM entry"""
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    query += " GROUP BY sap_account_code ORDER BY sap_account_code"
+    return query, params
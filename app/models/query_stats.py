@@ -0,0 +1,293 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+import pandas as pd
+from config import config
+from app.utils.logger import get_log_context, setup_logger
+
+# 耗时直方图的桶上界（毫秒），最后一个桶收集更慢的语句
+BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+BUCKET_LABELS = [f"≤{b}ms" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+
+# 统计的不同语句数上限，超出后归入同一行，避免动态拼接的SQL撑大内存
+MAX_STATEMENTS = 500
+OTHER_STATEMENT = '（其他语句）'
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_THIS_FILE = os.path.abspath(__file__)
+_IN_LIST = re.compile(r'\?(\s*,\s*\?)+')
+
+
+@lru_cache(maxsize=2048)
+def normalize(sql):
+    """合并空白，IN (?, ?, ...) 不论几个占位符都算同一条语句"""
+    return _IN_LIST.sub('?, ...', ' '.join(sql.split()))
+
+
+@lru_cache(maxsize=1024)
+def _is_library(filename):
+    return os.path.abspath(filename) == _THIS_FILE or 'site-packages' in filename or filename.startswith('<')
+
+
+@lru_cache(maxsize=1024)
+def _relative(filename):
+    return os.path.relpath(filename, _ROOT) if filename.startswith(_ROOT) else os.path.basename(filename)
+
+
+def call_site():
+    """发起查询的项目代码位置（跳过本模块和pandas等第三方库的栈帧）"""
+    frame = sys._getframe(2)
+    while frame is not None and _is_library(frame.f_code.co_filename):
+        frame = frame.f_back
+    if frame is None:
+        return ''
+    return f"{_relative(frame.f_code.co_filename)}:{frame.f_lineno}"
+
+
+class QueryStats:
+    """按语句聚合的查询统计：调用次数、耗时直方图、返回行数、调用位置和页面
+
+    超过 slow_ms 的语句写入慢查询日志，并保留最近的若干条供诊断页查看。
+    """
+
+    def __init__(self, slow_ms=200, slow_logger=None, recent=100):
+        self.slow_ms = slow_ms
+        self._slow_logger = slow_logger
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow = deque(maxlen=recent)
+        self._thread = threading.local()
+        self.started = datetime.now()
+
+    def record(self, sql, elapsed, rows, site, page):
+        elapsed_ms = elapsed * 1000
+        # 按线程累计，页面性能分析用前后差值得到一次重跑的数据库耗时
+        local = self._thread
+        local.calls = getattr(local, 'calls', 0) + 1
+        local.total_ms = getattr(local, 'total_ms', 0.0) + elapsed_ms
+        statement = normalize(sql)
+        bucket = len(BUCKETS_MS)
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                bucket = i
+                break
+        with self._lock:
+            entry = self._stats.get(statement)
+            if entry is None:
+                if len(self._stats) >= MAX_STATEMENTS:
+                    statement = OTHER_STATEMENT
+                    entry = self._stats.get(statement)
+                if entry is None:
+                    entry = self._stats[statement] = {
+                        'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+                        'buckets': [0] * len(BUCKET_LABELS), 'site': '', 'pages': set(),
+                    }
+            entry['calls'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['rows'] += rows
+            entry['buckets'][bucket] += 1
+            entry['site'] = site
+            if page:
+                entry['pages'].add(page)
+            slow = self.slow_ms is not None and elapsed_ms >= self.slow_ms
+            if slow:
+                self._slow.append((datetime.now().strftime('%Y-%m-%d %H:%M:%S'), round(elapsed_ms, 1), rows, site,
+                                   page or '', statement))
+        if slow and self._slow_logger is not None:
+            self._slow_logger.warning(f"慢查询 {elapsed_ms:.1f}毫秒，{rows} 行，{site}：{statement}",
+                                      extra={'duration_ms': round(elapsed_ms, 1)})
+
+    def thread_totals(self):
+        """当前线程累计的 (语句数, 耗时毫秒)，清空统计不影响"""
+        return getattr(self._thread, 'calls', 0), getattr(self._thread, 'total_ms', 0.0)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._slow.clear()
+            self.started = datetime.now()
+
+    @staticmethod
+    def _percentile_ms(buckets, fraction, max_ms):
+        # 直方图只能给出所在桶的上界，落在最后一个桶时用最大值
+        target = sum(buckets) * fraction
+        seen = 0
+        for i, count in enumerate(buckets):
+            seen += count
+            if count and seen >= target:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else round(max_ms, 1)
+        return 0
+
+    def report(self):
+        """按总耗时倒序的语句统计"""
+        with self._lock:
+            items = [(statement, dict(entry, buckets=list(entry['buckets']), pages=sorted(entry['pages'])))
+                     for statement, entry in self._stats.items()]
+        records = [{
+            '语句': statement,
+            '调用次数': entry['calls'],
+            '总耗时(毫秒)': round(entry['total_ms'], 1),
+            '平均(毫秒)': round(entry['total_ms'] / entry['calls'], 2),
+            'P50(毫秒)': self._percentile_ms(entry['buckets'], 0.5, entry['max_ms']),
+            'P95(毫秒)': self._percentile_ms(entry['buckets'], 0.95, entry['max_ms']),
+            '最大(毫秒)': round(entry['max_ms'], 1),
+            '返回行数': entry['rows'],
+            '调用位置': entry['site'],
+            '页面': '、'.join(entry['pages']),
+        } for statement, entry in items]
+        columns = ['语句', '调用次数', '总耗时(毫秒)', '平均(毫秒)', 'P50(毫秒)', 'P95(毫秒)', '最大(毫秒)',
+                   '返回行数', '调用位置', '页面']
+        return pd.DataFrame(records, columns=columns).sort_values('总耗时(毫秒)', ascending=False,
+                                                                  ignore_index=True)
+
+    def histogram(self, statement):
+        """某条语句的耗时分布"""
+        with self._lock:
+            entry = self._stats.get(statement)
+            buckets = list(entry['buckets']) if entry else [0] * len(BUCKET_LABELS)
+        return pd.Series(buckets, index=BUCKET_LABELS, name='调用次数')
+
+    def slow_queries(self):
+        """最近的慢查询，新的在前"""
+        with self._lock:
+            rows = list(self._slow)[::-1]
+        return pd.DataFrame(rows, columns=['时间', '耗时(毫秒)', '返回行数', '调用位置', '页面', '语句'])
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """记录每条语句耗时的游标
+
+    计时只在执行和 fetchone/fetchmany/fetchall 上进行，查询的耗时包括这些取数调用：结果取完、游标关闭、
+    再次执行或被回收时才计入统计。直接迭代游标时不逐行计时（逐行多一次Python调用会拖慢大结果集扫描），
+    只计执行耗时、不计返回行数；需要时用 DB_QUERY_STATS_ROWS 打开逐行统计。
+    """
+
+    _pending = None
+
+    def _finish(self):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            query_stats.record(*pending)
+
+    def _started(self, sql, elapsed, site):
+        page = get_log_context().get('page')
+        if self.description is None:
+            # 增删改和DDL没有结果集，执行完即结束
+            query_stats.record(sql, elapsed, max(self.rowcount, 0), site, page)
+        else:
+            self._pending = [sql, elapsed, 0, site, page]
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        site = call_site()
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._started(sql, time.perf_counter() - start, site)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        site = call_site()
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._started(sql, time.perf_counter() - start, site)
+        return self
+
+    def _fetched(self, elapsed, rows, done):
+        pending = self._pending
+        if pending is not None:
+            pending[1] += elapsed
+            pending[2] += rows
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(time.perf_counter() - start, 0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(time.perf_counter() - start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(time.perf_counter() - start, len(rows), True)
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class RowInstrumentedCursor(InstrumentedCursor):
+    """在 InstrumentedCursor 基础上，直接迭代游标时也逐行计时、计行数"""
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(time.perf_counter() - start, 0, True)
+            raise
+        self._fetched(time.perf_counter() - start, 1, False)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """游标统一使用 InstrumentedCursor，conn.execute() 和 pd.read_sql_query() 都会被统计"""
+
+    cursor_class = InstrumentedCursor
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_class)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class RowInstrumentedConnection(InstrumentedConnection):
+    """游标使用 RowInstrumentedCursor，迭代取数也计入耗时和返回行数"""
+
+    cursor_class = RowInstrumentedCursor
+
+
+def connection_factory():
+    """连接池使用的连接类，DB_QUERY_STATS 关闭时不做统计"""
+    settings = config['default']
+    if not settings.DB_QUERY_STATS:
+        return sqlite3.Connection
+    return RowInstrumentedConnection if settings.DB_QUERY_STATS_ROWS else InstrumentedConnection
+
+
+_slow_logger = setup_logger('expense_app.slow_query', log_file=config['default'].SLOW_QUERY_LOG, console=False)
+_slow_logger.propagate = False
+
+# 创建全局查询统计
+query_stats = QueryStats(slow_ms=config['default'].SLOW_QUERY_MS, slow_logger=_slow_logger)
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from PIL import Image, ImageOps
+from config import config
+from app.utils.logger import logger
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # 未安装时PDF不生成缩略图和预览，仍可下载
+    pdfium = None
+
+# 上传和读取时每次处理的字节数，整个文件不会一次读入内存
+CHUNK_SIZE = 1024 * 1024
+
+# 按文件头识别类型，不信任文件名和浏览器给的类型
+SIGNATURES = [
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+]
+
+ALLOWED_EXTENSIONS = ['pdf', 'png', 'jpg', 'jpeg']
+
+
+class AttachmentError(ValueError):
+    """附件不合法（类型不支持、为空、超过大小限制）"""
+
+
+@dataclass
+class StagedObject:
+    path: str
+    sha256: str
+    size: int
+    content_type: str
+
+
+def sniff_content_type(head):
+    """按文件头判断类型，不支持的返回 None"""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+class AttachmentStore:
+    """按内容寻址的附件存储
+
+    文件按SHA-256存放在 objects/ab/cd/<sha256>，内容相同的文件只存一份；缩略图和预览在第一次
+    查看时生成并缓存到 renditions/ 下。写入分两步：stage() 边读边算哈希写入临时文件（不持锁），
+    commit() 把临时文件移到最终位置，调用方在数据库写事务中调用，避免与删除无引用文件的操作交错。
+    """
+
+    def __init__(self, root, max_size, thumbnail_size=240, preview_size=1200):
+        self.root = root
+        self.max_size = max_size
+        self.sizes = {'thumbnail': thumbnail_size, 'preview': preview_size}
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, 'objects', sha256[:2], sha256[2:4], sha256)
+
+    def rendition_path(self, sha256, kind):
+        return os.path.join(self.root, 'renditions', sha256[:2], f"{sha256}_{self.sizes[kind]}.jpg")
+
+    def stage(self, stream):
+        """从文件对象分块读取，边计算哈希边写入临时文件，返回 StagedObject
+
+        超过 max_size 时立即停止读取并抛出 AttachmentError。
+        """
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        hasher = hashlib.sha256()
+        size = 0
+        content_type = None
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if content_type is None:
+                        content_type = sniff_content_type(chunk)
+                        if content_type is None:
+                            raise AttachmentError("只支持PDF、PNG和JPEG格式的票据")
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise AttachmentError(f"文件超过 {self.max_size // (1024 * 1024)}MB 限制")
+                    hasher.update(chunk)
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            if size == 0:
+                raise AttachmentError("文件为空")
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return StagedObject(tmp_path, hasher.hexdigest(), size, content_type)
+
+    def commit(self, staged):
+        """把临时文件移到内容地址下，已存在相同内容时丢弃临时文件；返回是否新写入"""
+        path = self.object_path(staged.sha256)
+        if os.path.exists(path):
+            self.discard(staged)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged.path, path)
+        return True
+
+    def discard(self, staged):
+        if os.path.exists(staged.path):
+            os.remove(staged.path)
+
+    def open(self, sha256):
+        """以二进制只读方式打开附件，由调用方关闭"""
+        return open(self.object_path(sha256), 'rb')
+
+    def exists(self, sha256):
+        return os.path.exists(self.object_path(sha256))
+
+    def remove(self, sha256):
+        """删除附件和已生成的缩略图、预览，调用方须确认已无引用"""
+        for path in [self.object_path(sha256)] + [self.rendition_path(sha256, kind) for kind in self.sizes]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def rendition(self, sha256, content_type, kind='thumbnail'):
+        """缩略图或预览图的路径，首次访问时生成；无法生成（PDF未装渲染库、文件损坏）时返回 None"""
+        path = self.rendition_path(sha256, kind)
+        if os.path.exists(path):
+            return path
+        source = self.object_path(sha256)
+        if not os.path.exists(source):
+            return None
+        try:
+            image = self._render(source, content_type, self.sizes[kind])
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning(f"附件 {sha256[:12]} 生成{kind}失败: {str(e)}")
+            return None
+        if image is None:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.jpg')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, 'JPEG', quality=85)
+            # 同时生成同一张图时后写的覆盖先写的，内容相同
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return path
+
+    def _render(self, source, content_type, size):
+        if content_type == 'application/pdf':
+            if pdfium is None:
+                return None
+            pdf = pdfium.PdfDocument(source)
+            try:
+                # 只渲染第一页，按目标尺寸缩放，不渲染原始大小
+                page = pdf[0]
+                image = page.render(scale=size / max(page.get_size())).to_pil()
+            finally:
+                pdf.close()
+        else:
+            image = Image.open(source)
+            # JPEG按目标尺寸解码，大照片不用先解出全尺寸位图
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        return image
+
+
+# 创建全局附件存储
+attachment_store = AttachmentStore(
+    config['default'].UPLOAD_FOLDER,
+    config['default'].MAX_CONTENT_LENGTH,
+    thumbnail_size=config['default'].ATTACHMENT_THUMBNAIL_SIZE,
+    preview_size=config['default'].ATTACHMENT_PREVIEW_SIZE,
+)
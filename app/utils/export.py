@@ -0,0 +1,120 @@
+import csv
+import io
+import os
+import tempfile
+import time
+from openpyxl import Workbook
+from config import config
+from app.utils.logger import logger
+
+# 每次从游标读取的行数
+EXPORT_CHUNK_SIZE = 5000
+
+EXPORT_FORMATS = {
+    'xlsx': ('Excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('CSV', 'text/csv'),
+}
+
+# Excel单个工作表最多 1,048,576 行（含表头），超出的数据续写到新工作表
+XLSX_MAX_ROWS = 1048576
+
+# 导出文件统一放在临时目录，不进数据库也不进 session_state
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'expense_app_exports')
+
+
+def iter_cursor(cursor, chunk_size=EXPORT_CHUNK_SIZE):
+    """分块读取游标，任何时刻内存中最多一块数据"""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def _write_xlsx(path, columns, rows, sheet_name):
+    # write_only 模式逐行写入磁盘，不在内存中保留单元格对象
+    workbook = Workbook(write_only=True)
+    per_sheet = XLSX_MAX_ROWS - 1
+    sheet = None
+    count = 0
+    for row in rows:
+        if count % per_sheet == 0:
+            # 每个工作表都带表头；名称最长31个字符，续表加序号
+            suffix = f"_{count // per_sheet + 1}" if count else ''
+            sheet = workbook.create_sheet(sheet_name[:31 - len(suffix)] + suffix)
+            sheet.append(columns)
+        sheet.append(list(row))
+        count += 1
+    if sheet is None:
+        workbook.create_sheet(sheet_name).append(columns)
+    workbook.save(path)
+    return count
+
+
+def _write_csv(path, columns, rows):
+    count = 0
+    # utf-8-sig 让Excel直接打开中文不乱码
+    with io.open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def sweep_exports(max_age, now=None):
+    """删除导出目录中超过 max_age 秒的文件（进程异常退出等原因没删掉的），返回删除数量"""
+    now = time.time() if now is None else now
+    count = 0
+    try:
+        entries = list(os.scandir(EXPORT_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < now - max_age:
+                os.remove(entry.path)
+                count += 1
+        except OSError:
+            # 其他进程刚删掉或正在使用，下次再清理
+            pass
+    if count:
+        logger.info(f"已清理 {count} 个过期的导出文件")
+    return count
+
+
+def export_query(conn, query, params=(), fmt='xlsx', sheet_name='Sheet1', chunk_size=EXPORT_CHUNK_SIZE):
+    """把查询结果流式写入导出文件
+
+    返回 (文件路径, 行数)，调用方负责在用完后调用 remove_export() 删除文件。
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    sweep_exports(config['default'].EXPORT_TTL)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}', dir=EXPORT_DIR)
+    os.close(fd)
+    start = time.perf_counter()
+    try:
+        cursor = conn.execute(query, params)
+        columns = [d[0] for d in cursor.description]
+        rows = iter_cursor(cursor, chunk_size)
+        if fmt == 'xlsx':
+            count = _write_xlsx(path, columns, rows, sheet_name)
+        else:
+            count = _write_csv(path, columns, rows)
+    except Exception:
+        remove_export(path)
+        raise
+    elapsed = time.perf_counter() - start
+    logger.info(f"导出 {count} 行到 {path}，耗时 {elapsed:.2f}秒", extra={'duration_ms': round(elapsed * 1000, 1)})
+    return path, count
+
+
+def remove_export(path):
+    """删除导出文件"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,41 +1,157 @@
+import atexit
+import contextvars
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from config import config
 
-def setup_logger():
+# 当前脚本线程的日志上下文（用户、页面），由页面每次重跑时设置
+_context = contextvars.ContextVar('log_context', default={})
+
+# 结构化输出时附加到每行的上下文字段
+CONTEXT_FIELDS = ('user', 'page', 'duration_ms')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def set_log_context(**fields):
+    """设置当前线程后续日志携带的上下文字段，如 user、page"""
+    _context.set(fields)
+
+
+def get_log_context():
+    """当前线程的日志上下文字段"""
+    return _context.get()
+
+
+class ContextFilter(logging.Filter):
+    """在调用线程中把上下文字段写到日志记录上（后台写入线程取不到调用方的上下文）"""
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """DEBUG级别按比例抽样，INFO及以上全部保留"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃日志并计数，不阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logger(name='expense_app', log_file=None, log_format=None, debug_sample_rate=None, console=True):
+    """创建日志记录器：调用线程只做过滤和入队，文件和控制台输出由后台线程完成
+
+    同一记录器重复调用（模块被重新导入）时直接返回，不会重复添加处理器。
+    """
+    logger = logging.getLogger(name)
+    if getattr(logger, 'queue_listener', None) is not None:
+        return logger
+    settings = config['default']
+    log_file = log_file or settings.LOG_FILE
+    log_format = log_format or settings.LOG_FORMAT
+    debug_sample_rate = settings.LOG_DEBUG_SAMPLE_RATE if debug_sample_rate is None else debug_sample_rate
+    level = getattr(logging, settings.LOG_LEVEL)
+
     # 创建日志目录
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-    
-    # 创建日志记录器
-    logger = logging.getLogger('expense_app')
-    logger.setLevel(getattr(logging, config['default'].LOG_LEVEL))
-    
-    # 创建文件处理器
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+
+    logger.setLevel(level)
+
+    # 文件处理器和控制台处理器只在后台线程中执行
     file_handler = RotatingFileHandler(
-        config['default'].LOG_FILE,
+        log_file,
         maxBytes=10*1024*1024,  # 10MB
-        backupCount=5
+        backupCount=5,
+        encoding='utf-8'
     )
-    file_handler.setLevel(getattr(logging, config['default'].LOG_LEVEL))
-    
-    # 创建控制台处理器
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(getattr(logging, config['default'].LOG_LEVEL))
-    
-    # 创建格式化器
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    # 添加处理器到记录器
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
+    file_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(debug_sample_rate))
+    queue_handler.addFilter(ContextFilter())
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+
+    logger.addHandler(queue_handler)
+    logger.queue_listener = listener
+    # 进程退出时把队列中剩余的日志写完
+    atexit.register(shutdown_logger, logger)
     return logger
 
+
+def shutdown_logger(logger):
+    """停止后台写入线程并写完队列中剩余的日志，重复调用无影响"""
+    listener = getattr(logger, 'queue_listener', None)
+    if listener is None:
+        return
+    logger.queue_listener = None
+    listener.stop()
+    for handler in [h for h in logger.handlers if isinstance(h, DroppingQueueHandler)]:
+        logger.removeHandler(handler)
+    for handler in listener.handlers:
+        handler.close()
+
+
+def log_stats():
+    """日志队列状态：排队条数和因队列满丢弃的条数"""
+    handlers = [h for h in logger.handlers if isinstance(h, DroppingQueueHandler)]
+    return {
+        'queued': sum(h.queue.qsize() for h in handlers),
+        'dropped': sum(h.dropped for h in handlers),
+    }
+
+
 # 创建全局日志记录器
-logger = setup_logger() 
\ No newline at end of file
+logger = setup_logger()
@@ -0,0 +1,43 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# 金额在数据库中统一以“分”为单位的整数存储，页面输入和展示仍以“元”为单位
+
+CENT = Decimal('0.01')
+
+
+def to_cents(value):
+    """元转成分（int），按四舍五入保留两位小数，None 返回 None
+
+    浮点数按其十进制表示换算（100.1 -> 10010），不受二进制误差影响。
+    """
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        amount = value
+    elif isinstance(value, int):
+        amount = Decimal(value)
+    else:
+        try:
+            amount = Decimal(str(value).strip().replace(',', ''))
+        except InvalidOperation:
+            raise ValueError(f"无效的金额: {value}")
+    if not amount.is_finite():
+        raise ValueError(f"无效的金额: {value}")
+    return int(amount.quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+
+
+def to_yuan(cents):
+    """分转成元（Decimal，两位小数），None 返回 None"""
+    if cents is None:
+        return None
+    return (Decimal(int(cents)) / 100).quantize(CENT)
+
+
+def format_amount(cents):
+    """分格式化为带千分位的元，如 123456 -> '1,234.56'"""
+    return f"{to_yuan(cents or 0):,.2f}"
+
+
+def sum_cents(values):
+    """一组以元计的金额精确求和，返回分"""
+    return sum(to_cents(value) or 0 for value in values)
@@ -0,0 +1,162 @@
+import cProfile
+import io
+import os
+import pickle
+import pstats
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+from config import config
+from app.models.query_stats import query_stats
+from app.utils.logger import logger
+
+# 页面提前结束的原因（Streamlit 用异常中断脚本）
+OUTCOMES = {
+    'RerunException': '重跑',
+    'StopException': '停止',
+}
+
+RUN_COLUMNS = ['时间', '用户', '页面', '结果', '总耗时(毫秒)', '数据库耗时(毫秒)', '语句数', '控件数',
+               '会话键数', '会话大小(KB)', '最大会话键', '分析文件']
+
+
+def _size_of(value):
+    # 会话状态按序列化后的字节数估算，不能序列化的对象退回浅层大小
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+def session_size(session_state):
+    """会话状态的 (键数, 总字节数, 最大的键)"""
+    if session_state is None:
+        return 0, 0, ''
+    sizes = {str(key): _size_of(value) for key, value in session_state.items()}
+    largest = max(sizes, key=sizes.get) if sizes else ''
+    return len(sizes), sum(sizes.values()), largest
+
+
+class PageProfiler:
+    """页面重跑性能分析：每次重跑的总耗时、数据库耗时、控件数和会话状态大小
+
+    enabled 和 capture 在进程内共享，由管理员在系统诊断页开关；capture 打开时
+    同时用 cProfile 记录调用耗时，保存为 .pstats 文件。
+    """
+
+    def __init__(self, enabled=False, capture=False, history=500, profile_dir='logs/profiles', keep=50):
+        self.enabled = enabled
+        self.capture = capture
+        self.profile_dir = profile_dir
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._runs = deque(maxlen=history)
+
+    @contextmanager
+    def profile(self, page, user=None, session_state=None, widget_count=None):
+        """记录 with 块内一次页面重跑；widget_count 返回本次重跑创建的控件数"""
+        if not self.enabled:
+            yield
+            return
+        profiler = cProfile.Profile() if self.capture else None
+        calls_before, db_ms_before = query_stats.thread_totals()
+        outcome = '完成'
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        except BaseException as e:
+            outcome = OUTCOMES.get(type(e).__name__, '异常')
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall_ms = (time.perf_counter() - start) * 1000
+            calls, db_ms = query_stats.thread_totals()
+            try:
+                self._record(page, user, outcome, wall_ms, db_ms - db_ms_before, calls - calls_before,
+                             widget_count() if widget_count else 0, session_state, profiler)
+            except Exception as e:
+                # 分析本身出错不影响页面
+                logger.warning(f"页面性能记录失败: {str(e)}")
+
+    def _record(self, page, user, outcome, wall_ms, db_ms, calls, widgets, session_state, profiler):
+        keys, size, largest = session_size(session_state)
+        filename = self._save_profile(profiler, page) if profiler is not None else ''
+        with self._lock:
+            self._runs.append((datetime.now().strftime('%Y-%m-%d %H:%M:%S'), user or '', page, outcome,
+                               round(wall_ms, 1), round(db_ms, 1), calls, widgets, keys, round(size / 1024, 1),
+                               largest, filename))
+        logger.debug(f"页面 {page} {outcome}，数据库 {db_ms:.1f}毫秒/{calls} 条语句，{widgets} 个控件，"
+                     f"会话状态 {size / 1024:.1f}KB", extra={'duration_ms': round(wall_ms, 1)})
+
+    def _save_profile(self, profiler, page):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        filename = f"{datetime.now():%Y%m%d_%H%M%S_%f}_{page}.pstats"
+        profiler.dump_stats(os.path.join(self.profile_dir, filename))
+        # 只保留最近的若干个文件
+        for old in self.profile_files()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.profile_dir, old))
+            except OSError:
+                pass
+        return filename
+
+    def reset(self):
+        with self._lock:
+            self._runs.clear()
+
+    def runs(self):
+        """最近的重跑记录，新的在前"""
+        with self._lock:
+            rows = list(self._runs)[::-1]
+        return pd.DataFrame(rows, columns=RUN_COLUMNS)
+
+    def summary(self):
+        """按页面汇总，平均耗时倒序"""
+        runs = self.runs()
+        columns = ['页面', '重跑次数', '平均耗时(毫秒)', 'P95耗时(毫秒)', '最大耗时(毫秒)', '平均数据库耗时(毫秒)',
+                   '平均语句数', '最大控件数', '平均会话大小(KB)']
+        if runs.empty:
+            return pd.DataFrame(columns=columns)
+        grouped = runs.groupby('页面')
+        summary = pd.DataFrame({
+            '重跑次数': grouped.size(),
+            '平均耗时(毫秒)': grouped['总耗时(毫秒)'].mean(),
+            'P95耗时(毫秒)': grouped['总耗时(毫秒)'].quantile(0.95),
+            '最大耗时(毫秒)': grouped['总耗时(毫秒)'].max(),
+            '平均数据库耗时(毫秒)': grouped['数据库耗时(毫秒)'].mean(),
+            '平均语句数': grouped['语句数'].mean(),
+            '最大控件数': grouped['控件数'].max(),
+            '平均会话大小(KB)': grouped['会话大小(KB)'].mean(),
+        }).round(1).reset_index()
+        return summary[columns].sort_values('平均耗时(毫秒)', ascending=False, ignore_index=True)
+
+    def profile_files(self):
+        """已保存的 .pstats 文件名，新的在前"""
+        if not os.path.isdir(self.profile_dir):
+            return []
+        return sorted((name for name in os.listdir(self.profile_dir) if name.endswith('.pstats')), reverse=True)
+
+    def profile_path(self, filename):
+        # 只允许访问分析目录内的文件
+        return os.path.join(self.profile_dir, os.path.basename(filename))
+
+    def top_functions(self, filename, sort='cumulative', limit=30):
+        """某次采集中耗时最多的函数（pstats 文本）"""
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile_path(filename), stream=stream)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+# 创建全局页面性能分析器
+page_profiler = PageProfiler(enabled=config['default'].PAGE_PROFILE,
+                             history=config['default'].PAGE_PROFILE_HISTORY,
+                             profile_dir=config['default'].PAGE_PROFILE_DIR,
+                             keep=config['default'].PAGE_PROFILE_KEEP)
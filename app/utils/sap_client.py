@@ -0,0 +1,53 @@
+import base64
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class SapError(Exception):
+    """SAP接口调用失败（网络、超时、非200响应），稍后重试"""
+
+
+class SapClient:
+    """SAP接口客户端：凭证过账（POST /postings）和主数据变更拉取（GET /master-data/changes）"""
+
+    def __init__(self, host, user='', password='', timeout=30):
+        base = host if '://' in host else f"https://{host}"
+        self.url = base.rstrip('/')
+        self.timeout = timeout
+        self._auth = None
+        if user:
+            token = base64.b64encode(f"{user}:{password}".encode('utf-8')).decode('ascii')
+            self._auth = f"Basic {token}"
+
+    def _request(self, path, payload=None, params=None):
+        url = self.url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        body = None if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(url, data=body, method='GET' if body is None else 'POST',
+                                         headers={'Content-Type': 'application/json; charset=utf-8'})
+        if self._auth:
+            request.add_header('Authorization', self._auth)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            raise SapError(f"SAP接口返回 {e.code}: {e.read().decode('utf-8', 'replace')[:200]}") from e
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise SapError(f"SAP接口调用失败: {str(e)}") from e
+
+    def post(self, batch_id, documents):
+        """提交一批凭证，返回 {幂等键: 结果}；调用失败抛出 SapError"""
+        payload = self._request('/postings', {'batch_id': batch_id, 'documents': documents})
+        return {result.get('idempotency_key'): result for result in payload.get('results', [])}
+
+    def master_data_changes(self, since, objects, limit):
+        """拉取水位之后的主数据变更，返回 (变更记录列表, 新水位, 是否还有更多)
+
+        水位是SAP返回的不透明游标（变更指针序号），首次同步传空字符串。
+        """
+        params = {'since': since or '', 'objects': ','.join(objects), 'limit': limit}
+        payload = self._request('/master-data/changes', params=params)
+        return payload.get('records', []), str(payload.get('watermark') or since or ''), bool(payload.get('has_more'))
@@ -4,16 +4,28 @@ from datetime import datetime, timedelta
 from config import config
 from app.utils.logger import logger
 
-def hash_password(password):
-    """对密码进行哈希处理"""
+def hash_password(password, rounds=None):
+    """对密码进行哈希处理，成本因子默认取配置 BCRYPT_ROUNDS"""
     try:
-        salt = bcrypt.gensalt()
+        salt = bcrypt.gensalt(rounds or config['default'].BCRYPT_ROUNDS)
         hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
         return hashed.decode('utf-8')
     except Exception as e:
         logger.error(f"密码哈希处理失败: {str(e)}")
         raise
 
+def is_password_hash(stored):
+    """库中保存的是否为bcrypt哈希（否则为老版本遗留的明文密码）"""
+    return isinstance(stored, str) and stored[:4] in ('$2a$', '$2b$', '$2y$') and len(stored) == 60
+
+def needs_rehash(hashed, rounds=None):
+    """哈希的成本因子与当前配置不一致时需要重算"""
+    rounds = rounds or config['default'].BCRYPT_ROUNDS
+    try:
+        return int(hashed.split('$')[2]) != rounds
+    except (IndexError, ValueError):
+        return True
+
 def verify_password(password, hashed):
     """验证密码"""
     try:
@@ -48,12 +60,18 @@ def verify_token(token):
         logger.error(f"无效的令牌: {str(e)}")
         return None
 
-def check_permission(user_role, required_permission):
-    """检查用户权限"""
+def check_permission(permission_mask, required_permission):
+    """检查用户权限
+
+    permission_mask 为登录时按角色解析出的权限位图（见 permission_cache.mask_of），
+    required_permission 为 '模块.权限'，如 'expense.book'；只做一次位运算，不查库。
+    """
+    # 延迟导入：导入本模块（如初始化脚本只用 hash_password）不连接数据库
+    from app.models.permissions import permission_cache
     try:
-        # 这里需要实现具体的权限检查逻辑
-        # 可以从数据库查询用户角色的权限
-        return True
+        module_name, permission_name = required_permission.split('.', 1)
+        bit = permission_cache.bit(module_name, permission_name)
+        return bit != 0 and permission_mask & bit == bit
     except Exception as e:
         logger.error(f"权限检查失败: {str(e)}")
-        return False 
\ No newline at end of file
+        return False
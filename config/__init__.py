@@ -11,31 +11,91 @@ class Config:
     
     # 数据库配置
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///expenses.db')
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 20))  # 连接池最大连接数
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # 等待空闲连接的秒数
+    DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', 5000))  # 写锁等待毫秒数
+    DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', -20000))  # 负数表示KB，约20MB
+    DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))  # 256MB
+    DB_QUERY_STATS = os.getenv('DB_QUERY_STATS', 'True').lower() == 'true'  # 按语句统计耗时，系统诊断页查看
+    DB_QUERY_STATS_ROWS = os.getenv('DB_QUERY_STATS_ROWS', 'False').lower() == 'true'  # 迭代游标时也逐行计时、计行数，大结果集扫描会变慢
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))  # 超过该毫秒数的语句写入慢查询日志
+    SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'logs/slow_query.log')
     
     # 日志配置
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text 或 json（日志文件每行一条JSON，带用户、页面、耗时字段）
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))  # DEBUG日志的保留比例
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # 待写日志队列上限，满时丢弃
+
+    # 页面性能分析（系统诊断页可随时开关）
+    PAGE_PROFILE = os.getenv('PAGE_PROFILE', 'False').lower() == 'true'  # 启动时即记录每次重跑的耗时
+    PAGE_PROFILE_HISTORY = int(os.getenv('PAGE_PROFILE_HISTORY', 500))  # 保留的重跑记录条数
+    PAGE_PROFILE_DIR = os.getenv('PAGE_PROFILE_DIR', 'logs/profiles')  # cProfile 结果（.pstats）保存目录
+    PAGE_PROFILE_KEEP = int(os.getenv('PAGE_PROFILE_KEEP', 50))  # 最多保留的 .pstats 文件数
     
     # 安全配置
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
     PERMANENT_SESSION_LIFETIME = 3600  # 1小时
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))  # bcrypt成本因子，存量哈希不一致时登录成功后自动重算
+    LOGIN_WORKERS = int(os.getenv('LOGIN_WORKERS', 2))  # 同时进行密码校验的线程数，限制登录高峰占用的CPU
+    LOGIN_TIMEOUT = float(os.getenv('LOGIN_TIMEOUT', 15))  # 排队等待密码校验的最长秒数
+    ADMIN_INITIAL_PASSWORD = os.getenv('ADMIN_INITIAL_PASSWORD', '')  # 新库管理员 admin 的初始密码，不填则随机生成并写入日志
     
     # 上传文件配置
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
-    UPLOAD_FOLDER = 'uploads'
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 单个票据附件上限，默认16MB
+    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')  # 票据附件按内容哈希存放的目录
+    ATTACHMENT_THUMBNAIL_SIZE = int(os.getenv('ATTACHMENT_THUMBNAIL_SIZE', 240))  # 缩略图最长边像素
+    ATTACHMENT_PREVIEW_SIZE = int(os.getenv('ATTACHMENT_PREVIEW_SIZE', 1200))  # 预览图最长边像素
+    EXPORT_TTL = float(os.getenv('EXPORT_TTL', 3600))  # 临时目录中的导出文件超过该秒数未删除时清理
     
     # SAP配置
-    SAP_HOST = os.getenv('SAP_HOST', '')
+    SAP_HOST = os.getenv('SAP_HOST', '')  # 过账接口地址，如 https://sap.example.com:8443；为空时凭证只进队列不发送
     SAP_USER = os.getenv('SAP_USER', '')
     SAP_PASSWORD = os.getenv('SAP_PASSWORD', '')
+    SAP_SOURCE_SYSTEM = os.getenv('SAP_SOURCE_SYSTEM', 'EXPENSE')  # 幂等键前缀，多套环境对接同一SAP时须不同
+    SAP_CURRENCY = os.getenv('SAP_CURRENCY', 'CNY')
+    SAP_BATCH_SIZE = int(os.getenv('SAP_BATCH_SIZE', 200))  # 每次请求发送的凭证数
+    SAP_WORKERS = int(os.getenv('SAP_WORKERS', 4))  # 同时发送的请求数
+    SAP_TIMEOUT = float(os.getenv('SAP_TIMEOUT', 30))  # 单次请求超时秒数
+    SAP_MAX_ATTEMPTS = int(os.getenv('SAP_MAX_ATTEMPTS', 8))  # 发送失败的重试上限，超过后标记为失败
+    SAP_RETRY_BASE = float(os.getenv('SAP_RETRY_BASE', 10))  # 重试间隔秒数，每次失败翻倍
+    SAP_RETRY_MAX = float(os.getenv('SAP_RETRY_MAX', 1800))  # 重试间隔上限秒数
+    SAP_POLL_INTERVAL = float(os.getenv('SAP_POLL_INTERVAL', 5))  # 队列为空时的轮询间隔秒数
+    SAP_LEASE_SECONDS = float(os.getenv('SAP_LEASE_SECONDS', 300))  # 发送中的凭证超过该秒数未回写结果时重新发送
+    SAP_WORKER_IN_APP = os.getenv('SAP_WORKER_IN_APP', 'True').lower() == 'true'  # 在应用进程内启动发送线程
+    SAP_SYNC_OBJECTS = os.getenv('SAP_SYNC_OBJECTS', 'cost_center,gl_account,company_code,employee')  # 增量同步的主数据对象
+    SAP_SYNC_CREATE = os.getenv('SAP_SYNC_CREATE', 'employee')  # SAP新增时自动建本地主数据的类型，其余只更新已映射的记录
+    SAP_SYNC_PAGE_SIZE = int(os.getenv('SAP_SYNC_PAGE_SIZE', 5000))  # 每次拉取的变更条数，每页一个事务
+    SAP_SYNC_INTERVAL = float(os.getenv('SAP_SYNC_INTERVAL', 0))  # 应用进程内定时同步的间隔秒数，0为不定时同步
+    MASTER_DATA_CHECK_INTERVAL = float(os.getenv('MASTER_DATA_CHECK_INTERVAL', 30))  # 检查其他进程同步主数据的间隔秒数，0为不检查
+    
+    # 预算控制：off 不校验，warn 超预算时提示但允许提交，block 超预算时拒绝提交
+    BUDGET_CONTROL = os.getenv('BUDGET_CONTROL', 'warn')
+    
+    # 自动记账配置
+    AUTO_BOOKING_GROUP_BY = os.getenv('AUTO_BOOKING_GROUP_BY', 'company,employee')  # 每张凭证的分组维度
+    AUTO_BOOKING_CREDIT_ACCOUNT = os.getenv('AUTO_BOOKING_CREDIT_ACCOUNT', '22411')  # 贷方科目
+    AUTO_BOOKING_CREDIT_ACCOUNT_DESC = os.getenv('AUTO_BOOKING_CREDIT_ACCOUNT_DESC', '其他应付款-员工')
+    AUTO_BOOKING_BATCH_SIZE = int(os.getenv('AUTO_BOOKING_BATCH_SIZE', 200))  # 每个事务写入的凭证数
     
     # 邮件配置
-    MAIL_SERVER = os.getenv('MAIL_SERVER', '')
+    MAIL_SERVER = os.getenv('MAIL_SERVER', '')  # SMTP服务器；为空时不记录报销通知、不发送邮件
     MAIL_PORT = int(os.getenv('MAIL_PORT', 587))
     MAIL_USE_TLS = os.getenv('MAIL_USE_TLS', 'True').lower() == 'true'
     MAIL_USERNAME = os.getenv('MAIL_USERNAME', '')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD', '')
+    MAIL_SENDER = os.getenv('MAIL_SENDER', '')  # 发件人地址，为空时用 MAIL_USERNAME
+    MAIL_TIMEOUT = float(os.getenv('MAIL_TIMEOUT', 30))  # SMTP连接和发送的超时秒数
+    MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', 50))  # 每批领取的邮件数，同一批复用一个SMTP连接
+    MAIL_DIGEST_INTERVAL = float(os.getenv('MAIL_DIGEST_INTERVAL', 3600))  # 最早一条未汇总的通知等待多少秒后生成摘要邮件
+    MAIL_DIGEST_MAX_ITEMS = int(os.getenv('MAIL_DIGEST_MAX_ITEMS', 20))  # 摘要邮件中逐笔列出的报销条数
+    MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 5))  # 发送失败的重试上限，超过后标记为失败
+    MAIL_RETRY_BASE = float(os.getenv('MAIL_RETRY_BASE', 60))  # 重试间隔秒数，每次失败翻倍
+    MAIL_POLL_INTERVAL = float(os.getenv('MAIL_POLL_INTERVAL', 10))  # 发件箱为空时的轮询间隔秒数
+    MAIL_IDLE_TIMEOUT = float(os.getenv('MAIL_IDLE_TIMEOUT', 60))  # SMTP连接空闲超过该秒数后断开
+    MAIL_WORKER_IN_APP = os.getenv('MAIL_WORKER_IN_APP', 'True').lower() == 'true'  # 在应用进程内启动发送线程
     
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -5,7 +5,8 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from app.models.database import db
+# 导入时 Database.bootstrap 会建好基础表，迁移脚本只处理其后的结构变更
+from app.models.database import db  # noqa: F401
 from config import config as app_config
 
 # this is the Alembic Config object, which provides
@@ -19,7 +20,8 @@ if config.config_file_name is not None:
 
 # add your model's MetaData object here
 # for 'autogenerate' support
-target_metadata = db.metadata
+# 项目直接使用sqlite3建表（见 Database.bootstrap），没有ORM元数据，迁移脚本需手写
+target_metadata = None
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -0,0 +1,42 @@
+"""add hot query indexes
+
+Revision ID: abb4c955b5b7
+Revises: 
+Create Date: 2026-10-18 01:36:01.412093+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'abb4c955b5b7'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'idx_expenses_status_date': "expenses (status, expense_date)",
+    'idx_expenses_date': "expenses (expense_date)",
+    'idx_expenses_employee_date': "expenses (employee, expense_date)",
+    'idx_expenses_department_date': "expenses (department, expense_date)",
+    'idx_expenses_company_date': "expenses (company, expense_date)",
+    'idx_expenses_budget_item_date': "expenses (budget_item, expense_date)",
+    'idx_config_lookup': "config (key, code, description, sap_code, sap_description)",
+    'idx_config_key_description': "config (key, description, code)",
+    'idx_entry_voucher': "entry (voucher_no DESC, id)",
+    'idx_entry_booking_date': "entry (booking_date)",
+    'idx_entry_expense': "entry (expense_id)",
+    'idx_expense_bookings_expense': "expense_bookings (expense_id)",
+}
+
+
+def upgrade() -> None:
+    for name, target in INDEXES.items():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    op.execute("ANALYZE")
+
+
+def downgrade() -> None:
+    for name in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
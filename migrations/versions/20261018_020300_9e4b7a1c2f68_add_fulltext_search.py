@@ -0,0 +1,93 @@
+"""add fts5 full-text search over expenses and entry
+
+Revision ID: 9e4b7a1c2f68
+Revises: 3c1f0e9a7d52
+Create Date: 2026-10-18 02:03:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b7a1c2f68'
+down_revision = '3c1f0e9a7d52'
+branch_labels = None
+depends_on = None
+
+# 本版本的全文索引和同步触发器，不引用应用代码，之后的结构变更由后续迁移完成
+SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+        description, content='expenses', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_insert AFTER INSERT ON expenses BEGIN
+        INSERT INTO expenses_fts (rowid, description) VALUES (NEW.id, NEW.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_delete AFTER DELETE ON expenses BEGIN
+        INSERT INTO expenses_fts (expenses_fts, rowid, description) VALUES ('delete', OLD.id, OLD.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_update AFTER UPDATE OF description ON expenses BEGIN
+        INSERT INTO expenses_fts (expenses_fts, rowid, description) VALUES ('delete', OLD.id, OLD.description);
+        INSERT INTO expenses_fts (rowid, description) VALUES (NEW.id, NEW.description);
+    END
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS entry_fts USING fts5(
+        sap_account_code, sap_account_desc, sap_employee_desc,
+        content='entry', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_entry_fts_insert AFTER INSERT ON entry BEGIN
+        INSERT INTO entry_fts (rowid, sap_account_code, sap_account_desc, sap_employee_desc)
+        VALUES (NEW.id, NEW.sap_account_code, NEW.sap_account_desc, NEW.sap_employee_desc);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_entry_fts_delete AFTER DELETE ON entry BEGIN
+        INSERT INTO entry_fts (entry_fts, rowid, sap_account_code, sap_account_desc, sap_employee_desc)
+        VALUES ('delete', OLD.id, OLD.sap_account_code, OLD.sap_account_desc, OLD.sap_employee_desc);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_entry_fts_update
+    AFTER UPDATE OF sap_account_code, sap_account_desc, sap_employee_desc ON entry BEGIN
+        INSERT INTO entry_fts (entry_fts, rowid, sap_account_code, sap_account_desc, sap_employee_desc)
+        VALUES ('delete', OLD.id, OLD.sap_account_code, OLD.sap_account_desc, OLD.sap_employee_desc);
+        INSERT INTO entry_fts (rowid, sap_account_code, sap_account_desc, sap_employee_desc)
+        VALUES (NEW.id, NEW.sap_account_code, NEW.sap_account_desc, NEW.sap_employee_desc);
+    END
+    """,
+]
+
+SEARCH_REBUILD_SQL = [
+    "INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')",
+    "INSERT INTO entry_fts (entry_fts) VALUES ('rebuild')",
+]
+
+TRIGGERS = [
+    'trg_expenses_fts_insert', 'trg_expenses_fts_delete', 'trg_expenses_fts_update',
+    'trg_entry_fts_insert', 'trg_entry_fts_delete', 'trg_entry_fts_update',
+]
+
+
+def upgrade() -> None:
+    for ddl in SEARCH_DDL:
+        op.execute(ddl)
+    # rebuild 按原表重建，可重复执行
+    for sql in SEARCH_REBUILD_SQL:
+        op.execute(sql)
+
+
+def downgrade() -> None:
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.execute("DROP TABLE IF EXISTS expenses_fts")
+    op.execute("DROP TABLE IF EXISTS entry_fts")
@@ -0,0 +1,201 @@
+"""store money as integer cents
+
+Revision ID: 5d2c8e61b3a9
+Revises: 9e4b7a1c2f68
+Create Date: 2026-10-18 02:15:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2c8e61b3a9'
+down_revision = '9e4b7a1c2f68'
+branch_labels = None
+depends_on = None
+
+# 本版本以分计的金额字段、汇总和预算占用的结构，不引用应用代码，之后的结构变更由后续迁移完成
+MONEY_COLUMNS = [
+    ('expenses', 'amount', 'amount_cents'),
+    ('expense_bookings', 'debit_amount', 'debit_cents'),
+    ('expense_bookings', 'credit_amount', 'credit_cents'),
+    ('entry', 'debit_amount', 'debit_cents'),
+    ('entry', 'credit_amount', 'credit_cents'),
+    ('budgets', 'amount', 'amount_cents'),
+]
+
+MONEY_DERIVED_DROP_SQL = [
+    "DROP TRIGGER IF EXISTS trg_expense_summary_insert",
+    "DROP TRIGGER IF EXISTS trg_expense_summary_delete",
+    "DROP TRIGGER IF EXISTS trg_expense_summary_update",
+    "DROP TRIGGER IF EXISTS trg_budget_consumption_insert",
+    "DROP TRIGGER IF EXISTS trg_budget_consumption_delete",
+    "DROP TRIGGER IF EXISTS trg_budget_consumption_update",
+    "DROP TABLE IF EXISTS expense_summary",
+    "DROP TABLE IF EXISTS budget_consumption",
+]
+
+SUMMARY_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS expense_summary (
+        period TEXT NOT NULL,
+        company TEXT NOT NULL,
+        department TEXT NOT NULL,
+        budget_item TEXT NOT NULL,
+        status TEXT NOT NULL,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        total_cents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, company, department, budget_item, status)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expense_summary_insert AFTER INSERT ON expenses BEGIN
+        INSERT INTO expense_summary (period, company, department, budget_item, status, expense_count, total_cents)
+        VALUES (substr(NEW.expense_date, 1, 7), COALESCE(NEW.company, ''), COALESCE(NEW.department, ''), COALESCE(NEW.budget_item, ''), COALESCE(NEW.status, 'pending'), 1, COALESCE(NEW.amount_cents, 0))
+        ON CONFLICT (period, company, department, budget_item, status) DO UPDATE SET
+            expense_count = expense_count + 1,
+            total_cents = total_cents + excluded.total_cents;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expense_summary_delete AFTER DELETE ON expenses BEGIN
+        UPDATE expense_summary SET
+            expense_count = expense_count - 1,
+            total_cents = total_cents - COALESCE(OLD.amount_cents, 0)
+        WHERE (period, company, department, budget_item, status) = (substr(OLD.expense_date, 1, 7), COALESCE(OLD.company, ''), COALESCE(OLD.department, ''), COALESCE(OLD.budget_item, ''), COALESCE(OLD.status, 'pending'));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expense_summary_update AFTER UPDATE OF expense_date, company, department, budget_item, status, amount_cents ON expenses BEGIN
+        UPDATE expense_summary SET
+            expense_count = expense_count - 1,
+            total_cents = total_cents - COALESCE(OLD.amount_cents, 0)
+        WHERE (period, company, department, budget_item, status) = (substr(OLD.expense_date, 1, 7), COALESCE(OLD.company, ''), COALESCE(OLD.department, ''), COALESCE(OLD.budget_item, ''), COALESCE(OLD.status, 'pending'));
+        INSERT INTO expense_summary (period, company, department, budget_item, status, expense_count, total_cents)
+        VALUES (substr(NEW.expense_date, 1, 7), COALESCE(NEW.company, ''), COALESCE(NEW.department, ''), COALESCE(NEW.budget_item, ''), COALESCE(NEW.status, 'pending'), 1, COALESCE(NEW.amount_cents, 0))
+        ON CONFLICT (period, company, department, budget_item, status) DO UPDATE SET
+            expense_count = expense_count + 1,
+            total_cents = total_cents + excluded.total_cents;
+    END
+    """,
+]
+
+SUMMARY_REBUILD_SQL = [
+    "DELETE FROM expense_summary",
+    """
+    INSERT INTO expense_summary (period, company, department, budget_item, status, expense_count, total_cents)
+    SELECT substr(e.expense_date, 1, 7), COALESCE(e.company, ''), COALESCE(e.department, ''), COALESCE(e.budget_item, ''), COALESCE(e.status, 'pending'), COUNT(*), COALESCE(SUM(e.amount_cents), 0)
+    FROM expenses e
+    GROUP BY 1, 2, 3, 4, 5
+    """,
+]
+
+BUDGET_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS budgets (
+        period TEXT NOT NULL,
+        department TEXT NOT NULL,
+        budget_item TEXT NOT NULL,
+        amount_cents INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (period, department, budget_item)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS budget_consumption (
+        period TEXT NOT NULL,
+        department TEXT NOT NULL,
+        budget_item TEXT NOT NULL,
+        pending_cents INTEGER NOT NULL DEFAULT 0,
+        booked_cents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, department, budget_item)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_budget_consumption_insert AFTER INSERT ON expenses BEGIN
+        INSERT INTO budget_consumption (period, department, budget_item, pending_cents, booked_cents)
+        VALUES (substr(NEW.expense_date, 1, 7), COALESCE(NEW.department, ''), COALESCE(NEW.budget_item, ''), CASE WHEN NEW.status = 'booked' THEN 0 ELSE COALESCE(NEW.amount_cents, 0) END, CASE WHEN NEW.status = 'booked' THEN COALESCE(NEW.amount_cents, 0) ELSE 0 END)
+        ON CONFLICT (period, department, budget_item) DO UPDATE SET
+            pending_cents = pending_cents + excluded.pending_cents,
+            booked_cents = booked_cents + excluded.booked_cents;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_budget_consumption_delete AFTER DELETE ON expenses BEGIN
+        UPDATE budget_consumption SET
+            pending_cents = pending_cents - CASE WHEN OLD.status = 'booked' THEN 0 ELSE COALESCE(OLD.amount_cents, 0) END,
+            booked_cents = booked_cents - CASE WHEN OLD.status = 'booked' THEN COALESCE(OLD.amount_cents, 0) ELSE 0 END
+        WHERE (period, department, budget_item) = (substr(OLD.expense_date, 1, 7), COALESCE(OLD.department, ''), COALESCE(OLD.budget_item, ''));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_budget_consumption_update AFTER UPDATE OF expense_date, department, budget_item, status, amount_cents ON expenses BEGIN
+        UPDATE budget_consumption SET
+            pending_cents = pending_cents - CASE WHEN OLD.status = 'booked' THEN 0 ELSE COALESCE(OLD.amount_cents, 0) END,
+            booked_cents = booked_cents - CASE WHEN OLD.status = 'booked' THEN COALESCE(OLD.amount_cents, 0) ELSE 0 END
+        WHERE (period, department, budget_item) = (substr(OLD.expense_date, 1, 7), COALESCE(OLD.department, ''), COALESCE(OLD.budget_item, ''));
+        INSERT INTO budget_consumption (period, department, budget_item, pending_cents, booked_cents)
+        VALUES (substr(NEW.expense_date, 1, 7), COALESCE(NEW.department, ''), COALESCE(NEW.budget_item, ''), CASE WHEN NEW.status = 'booked' THEN 0 ELSE COALESCE(NEW.amount_cents, 0) END, CASE WHEN NEW.status = 'booked' THEN COALESCE(NEW.amount_cents, 0) ELSE 0 END)
+        ON CONFLICT (period, department, budget_item) DO UPDATE SET
+            pending_cents = pending_cents + excluded.pending_cents,
+            booked_cents = booked_cents + excluded.booked_cents;
+    END
+    """,
+]
+
+CONSUMPTION_REBUILD_SQL = [
+    "DELETE FROM budget_consumption",
+    """
+    INSERT INTO budget_consumption (period, department, budget_item, pending_cents, booked_cents)
+    SELECT substr(e.expense_date, 1, 7), COALESCE(e.department, ''), COALESCE(e.budget_item, ''),
+           COALESCE(SUM(CASE WHEN e.status = 'booked' THEN 0 ELSE e.amount_cents END), 0),
+           COALESCE(SUM(CASE WHEN e.status = 'booked' THEN e.amount_cents ELSE 0 END), 0)
+    FROM expenses e
+    GROUP BY 1, 2, 3
+    """,
+]
+
+
+def money_column_sql(table, old, new):
+    """把一个以元计的REAL字段换成以分计的INTEGER字段：先按两位小数四舍五入再乘100"""
+    return [
+        f"ALTER TABLE {table} ADD COLUMN {new} INTEGER NOT NULL DEFAULT 0",
+        f"UPDATE {table} SET {new} = COALESCE(CAST(ROUND(ROUND({old}, 2) * 100) AS INTEGER), 0)",
+        f"ALTER TABLE {table} DROP COLUMN {old}",
+    ]
+
+
+def _columns(table):
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    # bootstrap 已转换过的库只重建汇总，可重复执行
+    pending = [(table, old, new) for table, old, new in MONEY_COLUMNS
+               if old in _columns(table) and new not in _columns(table)]
+    if pending:
+        for sql in MONEY_DERIVED_DROP_SQL:
+            op.execute(sql)
+        for table, old, new in pending:
+            for sql in money_column_sql(table, old, new):
+                op.execute(sql)
+    for ddl in SUMMARY_DDL + BUDGET_DDL:
+        op.execute(ddl)
+    for sql in SUMMARY_REBUILD_SQL + CONSUMPTION_REBUILD_SQL:
+        op.execute(sql)
+
+
+def downgrade() -> None:
+    for sql in MONEY_DERIVED_DROP_SQL:
+        op.execute(sql)
+    for table, old, new in MONEY_COLUMNS:
+        if new in _columns(table):
+            op.execute(f"ALTER TABLE {table} ADD COLUMN {old} REAL")
+            op.execute(f"UPDATE {table} SET {old} = {new} / 100.0")
+            op.execute(f"ALTER TABLE {table} DROP COLUMN {new}")
+    # 汇总表已删除，让旧版本程序启动时按自己的结构重新初始化
+    op.execute("PRAGMA user_version=0")
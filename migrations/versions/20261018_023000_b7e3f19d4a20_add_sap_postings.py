@@ -0,0 +1,45 @@
+"""add sap posting outbox
+
+Revision ID: b7e3f19d4a20
+Revises: 5d2c8e61b3a9
+Create Date: 2026-10-18 02:30:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3f19d4a20'
+down_revision = '5d2c8e61b3a9'
+branch_labels = None
+depends_on = None
+
+# 本版本的SAP过账队列表，不引用应用代码，之后的结构变更由后续迁移完成
+SAP_POSTING_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS sap_postings (
+        voucher_no INTEGER PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        batch_id TEXT,
+        sap_document TEXT,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_sap_postings_due ON sap_postings (status, next_attempt_at)",
+]
+
+
+def upgrade() -> None:
+    # 建表语句带 IF NOT EXISTS，bootstrap 已建过时可重复执行
+    for ddl in SAP_POSTING_DDL:
+        op.execute(ddl)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_sap_postings_due")
+    op.execute("DROP TABLE IF EXISTS sap_postings")
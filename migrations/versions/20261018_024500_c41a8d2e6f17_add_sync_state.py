@@ -0,0 +1,40 @@
+"""add sync watermark table for SAP master data
+
+Revision ID: c41a8d2e6f17
+Revises: b7e3f19d4a20
+Create Date: 2026-10-18 02:45:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41a8d2e6f17'
+down_revision = 'b7e3f19d4a20'
+branch_labels = None
+depends_on = None
+
+# 本版本的主数据同步水位表，不引用应用代码，之后的结构变更由后续迁移完成
+SYNC_STATE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS sync_state (
+        source TEXT PRIMARY KEY,
+        watermark TEXT NOT NULL DEFAULT '',
+        synced_at TIMESTAMP,
+        last_result TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_config_sap_code ON config (key, sap_code, sap_description)",
+]
+
+
+def upgrade() -> None:
+    # 建表语句带 IF NOT EXISTS，bootstrap 已建过时可重复执行
+    for ddl in SYNC_STATE_DDL:
+        op.execute(ddl)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_config_sap_code")
+    op.execute("DROP TABLE IF EXISTS sync_state")
@@ -0,0 +1,68 @@
+"""add users.email and mail notification queue
+
+Revision ID: e2f58b7c0a91
+Revises: c41a8d2e6f17
+Create Date: 2026-10-18 03:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f58b7c0a91'
+down_revision = 'c41a8d2e6f17'
+branch_labels = None
+depends_on = None
+
+# 本版本的通知事件表和发件箱，不引用应用代码，之后的结构变更由后续迁移完成
+MAIL_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS mail_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        employee TEXT,
+        expense_id INTEGER,
+        voucher_no INTEGER,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS mail_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipient TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_mail_outbox_due ON mail_outbox (status, next_attempt_at)",
+]
+
+
+def _columns(table):
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    # bootstrap 已补过字段、建过表时可重复执行
+    if 'email' not in _columns('users'):
+        op.execute("ALTER TABLE users ADD COLUMN email TEXT")
+    for ddl in MAIL_DDL:
+        op.execute(ddl)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_mail_outbox_due")
+    op.execute("DROP TABLE IF EXISTS mail_outbox")
+    op.execute("DROP TABLE IF EXISTS mail_events")
+    if 'email' in _columns('users'):
+        op.execute("ALTER TABLE users DROP COLUMN email")
@@ -0,0 +1,48 @@
+"""add expense attachment metadata
+
+Revision ID: 7a9c3e5d1b26
+Revises: e2f58b7c0a91
+Create Date: 2026-10-18 03:15:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a9c3e5d1b26'
+down_revision = 'e2f58b7c0a91'
+branch_labels = None
+depends_on = None
+
+# 本版本的附件元数据表，不引用应用代码，之后的结构变更由后续迁移完成
+ATTACHMENT_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS expense_attachments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        expense_id INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        content_type TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        uploaded_by TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (expense_id) REFERENCES expenses (id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_expense_attachments_expense ON expense_attachments (expense_id, sha256)",
+    "CREATE INDEX IF NOT EXISTS idx_expense_attachments_sha256 ON expense_attachments (sha256)",
+]
+
+
+def upgrade() -> None:
+    # 建表语句带 IF NOT EXISTS，bootstrap 已建过时可重复执行
+    for ddl in ATTACHMENT_DDL:
+        op.execute(ddl)
+
+
+def downgrade() -> None:
+    # 只删元数据，UPLOAD_FOLDER 下的文件需另行清理
+    op.execute("DROP INDEX IF EXISTS idx_expense_attachments_sha256")
+    op.execute("DROP INDEX IF EXISTS idx_expense_attachments_expense")
+    op.execute("DROP TABLE IF EXISTS expense_attachments")
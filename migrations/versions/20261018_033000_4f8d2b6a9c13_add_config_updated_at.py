@@ -0,0 +1,34 @@
+"""add config.updated_at for databases created before it existed
+
+Revision ID: 4f8d2b6a9c13
+Revises: 7a9c3e5d1b26
+Create Date: 2026-10-18 03:30:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8d2b6a9c13'
+down_revision = '7a9c3e5d1b26'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    # 主数据同步按SAP代码更新时写 updated_at；早期建的库（包括随仓库分发的 expenses.db）没有这个字段
+    if 'updated_at' not in _columns('config'):
+        op.execute("ALTER TABLE config ADD COLUMN updated_at TIMESTAMP")
+
+
+def downgrade() -> None:
+    # 新建的库本来就有该字段，降级时保留
+    pass
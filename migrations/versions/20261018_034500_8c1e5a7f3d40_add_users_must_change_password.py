@@ -0,0 +1,52 @@
+"""add users.must_change_password and flag the legacy default admin password
+
+Revision ID: 8c1e5a7f3d40
+Revises: 4f8d2b6a9c13
+Create Date: 2026-10-18 03:45:00.000000+00:00
+
+"""
+from alembic import op
+import bcrypt
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5a7f3d40'
+down_revision = '4f8d2b6a9c13'
+branch_labels = None
+depends_on = None
+
+# 老版本预置的管理员密码，不引用应用代码
+LEGACY_ADMIN_PASSWORD = 'admin123'
+
+
+def _columns(table):
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def _is_default_admin_password(stored):
+    """管理员密码是否仍是 admin123：老库为明文，已迁移的为bcrypt哈希"""
+    if isinstance(stored, str) and stored[:4] in ('$2a$', '$2b$', '$2y$') and len(stored) == 60:
+        try:
+            return bcrypt.checkpw(LEGACY_ADMIN_PASSWORD.encode('utf-8'), stored.encode('utf-8'))
+        except ValueError:
+            return False
+    return stored == LEGACY_ADMIN_PASSWORD
+
+
+def upgrade() -> None:
+    # bootstrap 已补过字段时可重复执行
+    if 'must_change_password' not in _columns('users'):
+        op.execute("ALTER TABLE users ADD COLUMN must_change_password INTEGER NOT NULL DEFAULT 0")
+    bind = op.get_bind()
+    admin = bind.execute(sa.text("SELECT id, password FROM users WHERE user_id = 'admin'")).fetchone()
+    if admin is not None and _is_default_admin_password(admin[1]):
+        bind.execute(sa.text("UPDATE users SET must_change_password = 1 WHERE id = :id"), {'id': admin[0]})
+
+
+def downgrade() -> None:
+    if 'must_change_password' in _columns('users'):
+        op.execute("ALTER TABLE users DROP COLUMN must_change_password")
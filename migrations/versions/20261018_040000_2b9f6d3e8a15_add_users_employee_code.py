@@ -0,0 +1,44 @@
+"""add users.employee_code and back-fill it from unambiguous employee names
+
+Revision ID: 2b9f6d3e8a15
+Revises: 8c1e5a7f3d40
+Create Date: 2026-10-18 04:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b9f6d3e8a15'
+down_revision = '8c1e5a7f3d40'
+branch_labels = None
+depends_on = None
+
+# 本版本按姓名回填员工编码的语句，只回填姓名唯一对应一个员工的；不引用应用代码
+EMPLOYEE_CODE_BACKFILL_SQL = """
+    UPDATE users SET employee_code = (
+        SELECT c.code FROM config c WHERE c.key = 'employee' AND c.description = users.user_name
+    )
+    WHERE employee_code IS NULL
+      AND (SELECT COUNT(*) FROM config c WHERE c.key = 'employee' AND c.description = users.user_name) = 1
+"""
+
+
+def _columns(table):
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    # bootstrap 已补过字段时可重复执行；回填只处理员工编码为空的用户
+    if 'employee_code' not in _columns('users'):
+        op.execute("ALTER TABLE users ADD COLUMN employee_code TEXT")
+    op.execute(EMPLOYEE_CODE_BACKFILL_SQL)
+
+
+def downgrade() -> None:
+    if 'employee_code' in _columns('users'):
+        op.execute("ALTER TABLE users DROP COLUMN employee_code")
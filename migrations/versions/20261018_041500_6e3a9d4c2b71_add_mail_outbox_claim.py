@@ -0,0 +1,34 @@
+"""add mail_outbox.claim so expired claims cannot write results back
+
+Revision ID: 6e3a9d4c2b71
+Revises: 2b9f6d3e8a15
+Create Date: 2026-10-18 04:15:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e3a9d4c2b71'
+down_revision = '2b9f6d3e8a15'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    # bootstrap 已补过字段时可重复执行
+    if 'claim' not in _columns('mail_outbox'):
+        op.execute("ALTER TABLE mail_outbox ADD COLUMN claim TEXT")
+
+
+def downgrade() -> None:
+    if 'claim' in _columns('mail_outbox'):
+        op.execute("ALTER TABLE mail_outbox DROP COLUMN claim")
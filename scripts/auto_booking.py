@@ -0,0 +1,54 @@
+"""批量自动记账
+
+用法（在项目根目录执行）：
+    python -m scripts.auto_booking --company COMP001 --date-from 2025-01-01 --date-to 2025-01-31 --dry-run
+"""
+import argparse
+import sys
+from datetime import date
+from app.controllers.auto_booking import plan_auto_booking, post_auto_booking
+from app.controllers.booking import BookingError
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="为公司/部门/期间内全部待记账报销批量生成凭证")
+    parser.add_argument('--company', help="公司编码，不填为全部公司")
+    parser.add_argument('--department', help="部门编码，不填为全部部门")
+    parser.add_argument('--date-from', type=date.fromisoformat, help="报销日期从（YYYY-MM-DD）")
+    parser.add_argument('--date-to', type=date.fromisoformat, help="报销日期至（YYYY-MM-DD）")
+    parser.add_argument('--group-by', help="分组维度，逗号分隔，可选 company,department,employee,budget_item")
+    parser.add_argument('--posting-date', type=date.fromisoformat, help="凭证日期/过账日期，默认今天")
+    parser.add_argument('--batch-size', type=int, help="每个事务写入的凭证数")
+    parser.add_argument('--dry-run', action='store_true', help="只输出方案，不写库")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    plan = plan_auto_booking(args.company, args.date_from, args.date_to, args.group_by, args.posting_date,
+                             args.department)
+    print(f"待生成凭证 {len(plan.vouchers)} 张，{plan.lines} 行，{plan.expenses} 笔报销，金额合计 {plan.amount:.2f}")
+    if plan.skipped:
+        print(f"跳过 {len(plan.skipped)} 笔：")
+        print(plan.skipped_report().to_string(index=False))
+    if args.dry_run:
+        if plan.vouchers:
+            print(plan.report().to_string(index=False))
+        return 0
+    if not plan.vouchers:
+        return 0
+
+    def progress(done, total):
+        print(f"\r已过账 {done}/{total} 张凭证", end='', flush=True)
+
+    try:
+        result = post_auto_booking(plan, args.batch_size, progress)
+    except BookingError as e:
+        print(f"\n{e}")
+        return 1
+    print(f"\n完成：凭证号 {result.first_voucher_no} - {result.last_voucher_no}，耗时 {result.elapsed:.2f}秒")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""各页面数据路径的基准测试
+
+按指定规模生成（或复用已生成的）压测数据库，逐项计时报销查看、报销记账、保存凭证、记账查看、
+报销看板、主数据导入和导出，结果写入 benchmarks/results/，可保存为基线并与基线比较。
+
+用法（在项目根目录执行）：
+    python -m scripts.benchmark --expenses 1000000 --entries 5000000 --employees 50000 --save-baseline
+    python -m scripts.benchmark --expenses 1000000 --entries 5000000 --employees 50000 --compare
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from io import BytesIO
+
+# 中位数比基线慢超过该比例、且绝对差超过 NOISE_MS 毫秒时判为性能回归
+DEFAULT_TOLERANCE = 0.25
+NOISE_MS = 2.0
+
+
+@dataclass
+class Case:
+    name: str
+    # run(准备好的参数) 返回处理的行数
+    run: object
+    # 每次计时前调用（不计时），返回传给 run 的参数
+    setup: object = None
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def time_case(case, repeat, warmup=1):
+    """执行 warmup 次预热后计时 repeat 次，返回毫秒统计"""
+    timings = []
+    rows = 0
+    for i in range(warmup + repeat):
+        args = case.setup() if case.setup else ()
+        start = time.perf_counter()
+        rows = case.run(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        if i >= warmup:
+            timings.append(elapsed)
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'p90_ms': round(_percentile(timings, 0.9), 3),
+        'max_ms': round(max(timings), 3),
+        'rows': rows,
+        'repeat': repeat,
+    }
+
+
+def compare_results(current, baseline, tolerance=DEFAULT_TOLERANCE, noise_ms=NOISE_MS):
+    """逐项比较中位数，返回 [(用例, 基线毫秒, 本次毫秒, 比值, 状态)]，状态为 回归/改善/持平/新增"""
+    report = []
+    for name, result in current['cases'].items():
+        base = baseline['cases'].get(name)
+        if base is None:
+            report.append((name, None, result['median_ms'], None, '新增'))
+            continue
+        before, after = base['median_ms'], result['median_ms']
+        ratio = after / before if before else float('inf')
+        if after - before > noise_ms and ratio > 1 + tolerance:
+            status = '回归'
+        elif before - after > noise_ms and ratio < 1 / (1 + tolerance):
+            status = '改善'
+        else:
+            status = '持平'
+        report.append((name, before, after, round(ratio, 2), status))
+    return report
+
+
+def dataset_name(args):
+    return f"bench_{args.expenses}_{args.entries or 0}_{args.employees}_{args.seed}.db"
+
+
+def _remove_db(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def prepare_database(args):
+    """准备本次运行使用的数据库：基础数据只生成一次，每次运行复制一份，写操作不影响下次运行"""
+    os.makedirs(args.data_dir, exist_ok=True)
+    base = os.path.join(args.data_dir, dataset_name(args))
+    work = os.path.join(args.data_dir, 'work.db')
+    _remove_db(work)
+    if os.path.exists(base):
+        shutil.copyfile(base, work)
+    # 必须在导入 app 模块之前设置，全局数据库对象按此路径创建
+    os.environ['DATABASE_URL'] = f"sqlite:///{work}"
+    from app.models.database import db
+    from scripts.init_data import generate_data
+    if not os.path.exists(base):
+        print(f"生成压测数据 {base} ...")
+
+        def progress(table, done, total):
+            print(f"\r{table}: {done}/{total}", end='', flush=True)
+
+        with db.get_connection() as conn:
+            counts = generate_data(conn, expenses=args.expenses, entries=args.entries, employees=args.employees,
+                                   seed=args.seed, progress=progress)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"\n生成完成，耗时 {counts['elapsed']:.1f}秒")
+        shutil.copyfile(work, base)
+    return work
+
+
+def build_cases(conn):
+    """按数据库中的实际数据挑选查询参数，构造全部用例"""
+    import pandas as pd
+    from app.controllers.auto_booking import plan_auto_booking
+    from app.controllers.booking import save_voucher
+    from app.controllers.budget import budget_report
+    from app.controllers.expense import submit_expense
+    from app.controllers.master_data_import import IMPORT_COLUMNS, import_master_data
+    from app.models.queries import (
+        build_entry_search, build_expense_search, build_expense_summary, build_pending_by_ids, build_pending_ids,
+        build_pending_search, build_spend_summary, build_trial_balance, is_selective_keyword
+    )
+    from app.utils.export import export_query, remove_export
+    from app.utils.money import sum_cents, to_yuan
+
+    def scalar(sql, params=()):
+        return conn.execute(sql, params).fetchone()[0]
+
+    def read(query_params):
+        return len(pd.read_sql_query(query_params[0], conn, params=query_params[1]))
+
+    employee = scalar("SELECT employee FROM expenses GROUP BY employee ORDER BY COUNT(*) DESC LIMIT 1")
+    department = scalar("SELECT department FROM expenses GROUP BY department ORDER BY COUNT(*) DESC LIMIT 1")
+    company = scalar("SELECT company FROM expenses GROUP BY company ORDER BY COUNT(*) DESC LIMIT 1")
+    budget_item = scalar("SELECT budget_item FROM expenses WHERE department=? LIMIT 1", (department,))
+    middle = conn.execute("SELECT expense_date, id FROM expenses ORDER BY expense_date DESC, id DESC LIMIT 1 OFFSET ?",
+                          (scalar("SELECT COUNT(*) FROM expenses") // 2,)).fetchone()
+    after = (middle[0], middle[1])
+    voucher_no = scalar("SELECT voucher_no FROM entry ORDER BY id DESC LIMIT 1 OFFSET ?",
+                        (scalar("SELECT COUNT(*) FROM entry") // 3,))
+    account = scalar("SELECT sap_account_code FROM entry WHERE entry_type='debit' LIMIT 1")
+    employee_name = scalar("SELECT sap_employee_desc FROM entry ORDER BY id DESC LIMIT 1")
+    last_month = (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+    month_end = date.today().replace(day=1) - timedelta(days=1)
+    period = f"{last_month:%Y-%m}"
+    pending_ids = [row[0] for row in conn.execute(*build_pending_ids())]
+    selected = pending_ids[:200]
+
+    # 保存凭证每次取不同的20笔待记账报销
+    voucher_batches = iter([pending_ids[i:i + 20] for i in range(len(pending_ids) - 20, 0, -20)])
+
+    def voucher_rows():
+        ids = next(voucher_batches)
+        query, params = build_pending_by_ids(ids)
+        df = pd.read_sql_query(query, conn, params=params)
+        rows = [{
+            'type': 'debit', 'sap_account_code': r.sap_account_code, 'sap_account_desc': r.sap_account_desc,
+            'sap_cost_center_code': r.sap_cost_center_code, 'sap_cost_center_desc': r.sap_cost_center_desc,
+            'debit_amount': float(r.amount), 'credit_amount': 0.0,
+            'sap_employee_code': r.sap_employee_code, 'sap_employee_desc': r.sap_employee_desc,
+            'voucher_date': date.today(), 'post_date': date.today(), 'expense_id': int(r.id),
+        } for r in df.itertuples()]
+        rows.append(dict(rows[0], type='credit', sap_account_code='22411', sap_account_desc='其他应付款-员工',
+                         debit_amount=0.0, credit_amount=float(to_yuan(sum_cents(r['debit_amount'] for r in rows))),
+                         expense_id=None))
+        return (rows,)
+
+    def save(rows):
+        return save_voucher(rows).lines
+
+    # 主数据导入每次使用新的编码
+    import_round = iter(range(1, 1000))
+
+    def import_file():
+        n = next(import_round)
+        df = pd.DataFrame([(f'BENCH{n:03d}{i:05d}', f'压测员工{n}-{i}', f'B{n:03d}{i:05d}', f'压测员工{n}-{i}')
+                           for i in range(5000)], columns=IMPORT_COLUMNS['employee'])
+        output = BytesIO()
+        df.to_excel(output, index=False)
+        return (output.getvalue(),)
+
+    def submit():
+        submit_expense(date.today(), department, company, budget_item, employee, 12.34, '压测提交', control='off')
+        return 1
+
+    def run_export(query_params, fmt):
+        path, count = export_query(conn, query_params[0], query_params[1], fmt=fmt)
+        remove_export(path)
+        return count
+
+    def keyword_search(keyword):
+        selective = is_selective_keyword(conn, keyword)
+        return read(build_expense_search(limit=51, keyword=keyword, selective=selective))
+
+    return [
+        Case('报销查看-首页', lambda: read(build_expense_search(limit=51))),
+        Case('报销查看-本人', lambda: read(build_expense_search(limit=51, owner=employee))),
+        Case('报销查看-部门+科目', lambda: read(build_expense_search(limit=51, department=department,
+                                                               budget_item=budget_item))),
+        Case('报销查看-中间页', lambda: read(build_expense_search(after=after, limit=51))),
+        Case('报销查看-金额区间', lambda: read(build_expense_search(limit=51, min_amount=5000, max_amount=6000))),
+        Case('报销查看-关键字（大量命中）', lambda: keyword_search('差旅费')),
+        Case('报销查看-关键字（少量命中）', lambda: keyword_search('供应商考察培训费')),
+        Case('报销查看-部门汇总', lambda: read(build_expense_summary(department=department))),
+        Case('报销记账-待记账首页', lambda: read(build_pending_search(limit=51))),
+        Case('报销记账-公司全选', lambda: read(build_pending_ids(company=company))),
+        Case('报销记账-已选200笔', lambda: read(build_pending_by_ids(selected))),
+        Case('报销记账-保存凭证（20笔）', save, voucher_rows),
+        Case('自动记账-公司试运行', lambda: plan_auto_booking(company=company).lines),
+        Case('记账查看-凭证号', lambda: read(build_entry_search(voucher_no=voucher_no))),
+        Case('记账查看-科目+月份', lambda: read(build_entry_search(sap_account_code=account, date_from=last_month,
+                                                               date_to=month_end))),
+        Case('记账查看-员工姓名', lambda: read(build_entry_search(employee=employee_name))),
+        Case('记账查看-科目余额表（月）', lambda: read(build_trial_balance(last_month, month_end))),
+        Case('报销看板-部门×科目（年）', lambda: read(build_spend_summary(
+            ('department', 'budget_item'), period_from=f"{date.today().year - 1}-01", period_to=period))),
+        Case('主数据管理-预算执行', lambda: len(budget_report(period, department))),
+        Case('报销采集-提交', submit),
+        Case('主数据导入-5000名员工', lambda data: import_master_data('employee', data).inserted, import_file),
+        Case('导出-部门CSV', lambda: run_export(build_expense_search(with_id=False, department=department), 'csv')),
+        Case('导出-本人Excel', lambda: run_export(build_expense_search(with_id=False, owner=employee), 'xlsx')),
+    ]
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="按规模生成压测数据并对各页面数据路径计时")
+    parser.add_argument('--expenses', type=int, default=100000, help="报销记录数")
+    parser.add_argument('--entries', type=int, help="凭证行数")
+    parser.add_argument('--employees', type=int, default=5000, help="员工数")
+    parser.add_argument('--seed', type=int, default=42, help="随机种子")
+    parser.add_argument('--repeat', type=int, default=5, help="每个用例的计时次数")
+    parser.add_argument('--only', help="只运行名称匹配该正则的用例")
+    parser.add_argument('--data-dir', default=os.path.join('benchmarks', 'data'), help="压测数据库目录")
+    parser.add_argument('--results-dir', default=os.path.join('benchmarks', 'results'), help="结果目录")
+    parser.add_argument('--baseline', default=os.path.join('benchmarks', 'baseline.json'), help="基线文件")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为基线")
+    parser.add_argument('--compare', action='store_true', help="与基线比较，有回归时返回非0")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="判为回归的变慢比例")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    prepare_database(args)
+    from app.models.database import db
+    conn = db.connection()
+    cases = build_cases(conn)
+    if args.only:
+        cases = [case for case in cases if re.search(args.only, case.name)]
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'dataset': {'expenses': args.expenses, 'entries': args.entries, 'employees': args.employees,
+                    'seed': args.seed},
+        'environment': environment(),
+        'cases': {},
+    }
+    for case in cases:
+        result = time_case(case, args.repeat)
+        results['cases'][case.name] = result
+        print(f"{case.name:<28} 中位 {result['median_ms']:>10.2f}毫秒  最快 {result['min_ms']:>10.2f}  "
+              f"最慢 {result['max_ms']:>10.2f}  行数 {result['rows']}")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {path}")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        shutil.copyfile(path, args.baseline)
+        print(f"已保存为基线 {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"基线文件 {args.baseline} 不存在")
+            return 1
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['dataset'] != results['dataset'] or baseline['environment'] != results['environment']:
+            print("注意：基线的数据规模或运行环境与本次不同，比较结果仅供参考")
+        report = compare_results(results, baseline, args.tolerance)
+        for name, before, after, ratio, status in report:
+            before_text = '-' if before is None else f"{before:.2f}"
+            print(f"{status}  {name:<28} 基线 {before_text:>10}  本次 {after:>10.2f}  比值 {ratio or '-'}")
+        if any(status == '回归' for *_, status in report):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,22 @@
+"""初始化示例数据，或按指定规模生成压测数据
+
+用法（在项目根目录执行，数据库须已建表）：
+    python -m scripts.init_data
+    python -m scripts.init_data --expenses 1000000 --entries 5000000 --employees 50000
+"""
+import argparse
+import math
+import random
 import sqlite3
-from datetime import date
+import sys
+import time
+from datetime import date, timedelta
 from app.utils.security import hash_password
+from app.utils.money import to_cents
 
-def init_database():
+def init_database(db_path='expenses.db'):
     """初始化示例数据"""
-    conn = sqlite3.connect('expenses.db')
+    conn = sqlite3.connect(db_path)
     c = conn.cursor()
     
     # 初始化部门数据
@@ -117,22 +129,257 @@ def init_database():
             VALUES (?, ?, ?, ?)
         ''', (user[0], user[1], hash_password(user[2]), role_id))
     
-    # 初始化示例报销记录
+    # 初始化示例报销记录（金额以分计）
     expenses = [
-        (date.today(), 'DEPT001', 'COMP001', 'BUDGET001', 'EMP001', 1000.00, '差旅费报销'),
-        (date.today(), 'DEPT002', 'COMP001', 'BUDGET002', 'EMP002', 500.00, '办公用品'),
-        (date.today(), 'DEPT003', 'COMP002', 'BUDGET003', 'EMP003', 2000.00, '业务招待')
+        (date.today(), 'DEPT001', 'COMP001', 'BUDGET001', 'EMP001', to_cents(1000.00), '差旅费报销'),
+        (date.today(), 'DEPT002', 'COMP001', 'BUDGET002', 'EMP002', to_cents(500.00), '办公用品'),
+        (date.today(), 'DEPT003', 'COMP002', 'BUDGET003', 'EMP003', to_cents(2000.00), '业务招待')
     ]
     
     for exp in expenses:
         c.execute('''
-            INSERT INTO expenses (expense_date, department, company, budget_item, employee, amount, description)
+            INSERT INTO expenses (expense_date, department, company, budget_item, employee, amount_cents, description)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', exp)
     
     conn.commit()
     conn.close()
 
+
+# ---- 压测数据 ----
+
+# 每批写入的行数
+GENERATE_BATCH_SIZE = 20000
+
+CITIES = ['北京', '上海', '广州', '深圳', '杭州', '南京', '成都', '武汉', '西安', '雅加达', '泗水', '新加坡', '香港',
+          '天津', '重庆', '苏州', '厦门', '青岛', '长沙', '郑州']
+DEPARTMENT_NAMES = ['财务部', '人事部', 'IT部', '市场部', '销售部', '采购部', '生产部', '质量部', '研发部', '物流部',
+                    '行政部', '法务部', '审计部', '客服部', '仓储部']
+# (预算科目, SAP核算科目, 金额中位数（元）)：越靠前的科目报销越频繁
+BUDGET_ITEM_TYPES = [
+    ('差旅费', '660201', 800), ('交通费', '660202', 60), ('业务招待费', '660203', 600), ('办公费', '660204', 150),
+    ('通讯费', '660205', 100), ('会议费', '660206', 2000), ('培训费', '660207', 1500), ('快递费', '660208', 40),
+    ('印刷费', '660209', 300), ('租赁费', '660210', 5000), ('维修费', '660211', 900), ('咨询费', '660212', 8000),
+    ('广告费', '660213', 10000), ('福利费', '660214', 500), ('车辆费', '660215', 400), ('软件服务费', '660216', 3000),
+]
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤'
+GIVEN_CHARS = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超霞平刚桂华建国志文斌浩宇鑫鹏飞俊凯雪梅琳晨阳辉玉兰红波亮成'
+PURPOSES = ['拜访客户', '项目实施', '年度审计', '供应商考察', '市场调研', '展会', '内部培训', '季度会议', '系统上线',
+            '客户招待', '办公采购', '设备维修', '招聘面试', '合同谈判', '售后服务']
+CREDIT_ACCOUNT = ('22411', '其他应付款-员工')
+
+
+def _unique_names(rng, count):
+    names, seen = [], set()
+    for i in range(count):
+        name = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_CHARS) for _ in range(rng.choice((1, 2, 2))))
+        if name in seen:
+            name = f"{name}{i}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def _master_data(rng, companies, departments, budget_items, employees):
+    """生成主数据；部门归属公司、员工归属部门，员工报销频率和科目使用频率都呈长尾分布"""
+    company_rows = [(f'COMP{i:03d}', f'{CITIES[i % len(CITIES)]}{"分公司" if i else "总公司"}{i // len(CITIES) or ""}',
+                     f'C{i:03d}') for i in range(companies)]
+    department_rows = [(f'DEPT{i:04d}', f'{DEPARTMENT_NAMES[i % len(DEPARTMENT_NAMES)]}{i // len(DEPARTMENT_NAMES) + 1:02d}',
+                        f'CC{i:04d}', i % companies) for i in range(departments)]
+    item_rows = []
+    for i in range(budget_items):
+        name, account, median = BUDGET_ITEM_TYPES[i % len(BUDGET_ITEM_TYPES)]
+        suffix = '' if i < len(BUDGET_ITEM_TYPES) else f'{i // len(BUDGET_ITEM_TYPES) + 1}'
+        item_rows.append((f'BUDGET{i:03d}', f'{name}{suffix}', f'{account}{suffix}', median))
+    employee_rows = [(f'EMP{i:06d}', name, f'E{i:06d}', rng.randrange(departments), rng.paretovariate(1.2))
+                     for i, name in enumerate(_unique_names(rng, employees))]
+    return company_rows, department_rows, item_rows, employee_rows
+
+
+def _insert_master_data(conn, company_rows, department_rows, item_rows, employee_rows):
+    rows = [('company', code, desc, sap, desc) for code, desc, sap in company_rows]
+    rows += [('department', code, desc, sap, f'{desc}成本中心') for code, desc, sap, _ in department_rows]
+    rows += [('budget_item', code, desc, sap, desc) for code, desc, sap, _ in item_rows]
+    rows += [('employee', code, name, sap, name) for code, name, sap, _, _ in employee_rows]
+    conn.executemany("INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) "
+                     "VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def _voucher_rows(voucher_no, booking_date, expenses, items, departments, employee):
+    """一张凭证：每笔报销一行借方，按员工汇总一行贷方"""
+    code, name, sap_employee = employee
+    lines = []
+    for expense_id, budget_item, department, cents in expenses:
+        _, item_desc, account, _ = items[budget_item]
+        _, dept_desc, cost_center, _ = departments[department]
+        lines.append((voucher_no, expense_id, 'debit', booking_date, account, item_desc, cost_center,
+                      f'{dept_desc}成本中心', cents, 0, sap_employee, name, booking_date, booking_date))
+    total = sum(cents for _, _, _, cents in expenses)
+    lines.append((voucher_no, None, 'credit', booking_date, CREDIT_ACCOUNT[0], CREDIT_ACCOUNT[1], '', '', 0, total,
+                  sap_employee, name, booking_date, booking_date))
+    return lines
+
+
+def _write_vouchers(conn, lines):
+    conn.executemany("""
+        INSERT INTO entry (voucher_no, expense_id, entry_type, booking_date, sap_account_code, sap_account_desc,
+                           sap_cost_center_code, sap_cost_center_desc, debit_cents, credit_cents,
+                           sap_employee_code, sap_employee_desc, voucher_date, post_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, lines)
+    conn.executemany("""
+        INSERT INTO expense_bookings (expense_id, booking_date, sap_account_code, sap_account_desc,
+                                      sap_cost_center_code, sap_cost_center_desc, debit_cents, credit_cents,
+                                      sap_employee_code, sap_employee_desc)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [line[1:2] + line[3:12] for line in lines if line[1] is not None])
+
+
+def generate_data(conn, expenses=100000, entries=None, employees=5000, departments=200, companies=10,
+                  budget_items=30, days=1095, pending_days=45, seed=42, progress=None):
+    """按规模生成压测数据，同一 seed 生成的数据完全相同
+
+    报销日期均匀分布在最近 days 天内，金额按科目取对数正态分布；pending_days 天以前的报销绝大多数已记账，
+    已记账的报销按员工合并成凭证（每笔一行借方、每张凭证一行贷方）。entries 大于这些凭证的行数时，
+    不足部分补成不关联报销的历史凭证。返回各表写入的行数。
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    company_rows, department_rows, item_rows, employee_rows = _master_data(
+        rng, companies, departments, budget_items, employees)
+    _insert_master_data(conn, company_rows, department_rows, item_rows, employee_rows)
+    conn.commit()
+
+    employee_weights = []
+    total = 0
+    for row in employee_rows:
+        total += row[4]
+        employee_weights.append(total)
+    # 科目频率按名次的倒数
+    item_weights = []
+    total = 0
+    for i in range(len(item_rows)):
+        total += 1 / (i + 1)
+        item_weights.append(total)
+    today = date.today()
+    first_day = today - timedelta(days=days)
+    booked_before = today - timedelta(days=pending_days)
+    expense_id = (conn.execute("SELECT MAX(id) FROM expenses").fetchone()[0] or 0) + 1
+    voucher_no = max(conn.execute("SELECT MAX(voucher_no) FROM entry").fetchone()[0] or 0, 99999) + 1
+    counts = {'expenses': 0, 'entry': 0, 'vouchers': 0}
+
+    while counts['expenses'] < expenses:
+        size = min(GENERATE_BATCH_SIZE, expenses - counts['expenses'])
+        batch, booked = [], {}
+        employee_idx = rng.choices(range(len(employee_rows)), cum_weights=employee_weights, k=size)
+        item_idx = rng.choices(range(len(item_rows)), cum_weights=item_weights, k=size)
+        for emp, item in zip(employee_idx, item_idx):
+            code, _, _, department, _ = employee_rows[emp]
+            expense_date = first_day + timedelta(days=rng.randrange(days + 1))
+            median = item_rows[item][3]
+            cents = max(100, min(int(rng.lognormvariate(math.log(median), 0.9) * 100), 50000000))
+            city = rng.choice(CITIES)
+            description = f"{city}{rng.choice(PURPOSES)}{item_rows[item][1]} 发票{rng.randrange(10 ** 8):08d}"
+            status = 'booked' if expense_date < booked_before and rng.random() < 0.97 else 'pending'
+            batch.append((expense_id, str(expense_date), department_rows[department][0],
+                          company_rows[department_rows[department][3]][0], item_rows[item][0], code, cents,
+                          description, status))
+            if status == 'booked':
+                booked.setdefault(emp, []).append((expense_id, item, department, cents, expense_date))
+            expense_id += 1
+        conn.executemany("""
+            INSERT INTO expenses (id, expense_date, department, company, budget_item, employee, amount_cents,
+                                  description, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, batch)
+        lines = []
+        for emp, rows in booked.items():
+            rows.sort(key=lambda r: r[4])
+            while rows:
+                take = rng.randint(1, 6)
+                group, rows = rows[:take], rows[take:]
+                booking_date = str(min(group[-1][4] + timedelta(days=rng.randint(3, 30)), today))
+                lines += _voucher_rows(voucher_no, booking_date, [r[:4] for r in group], item_rows,
+                                       department_rows, employee_rows[emp][:3])
+                voucher_no += 1
+                counts['vouchers'] += 1
+        _write_vouchers(conn, lines)
+        conn.commit()
+        counts['expenses'] += size
+        counts['entry'] += len(lines)
+        if progress:
+            progress('expenses', counts['expenses'], expenses)
+
+    # 历史凭证：不关联报销，日期在报销数据之前
+    while entries and counts['entry'] < entries:
+        lines = []
+        while len(lines) < GENERATE_BATCH_SIZE and counts['entry'] + len(lines) < entries:
+            emp = rng.choices(range(len(employee_rows)), cum_weights=employee_weights)[0]
+            booking_date = first_day - timedelta(days=rng.randrange(1, days + 1))
+            group = [(None, rng.choices(range(len(item_rows)), cum_weights=item_weights)[0], employee_rows[emp][3],
+                      max(100, int(rng.lognormvariate(math.log(300), 0.9) * 100)))
+                     for _ in range(rng.randint(1, 8))]
+            lines += _voucher_rows(voucher_no, str(booking_date), group, item_rows, department_rows,
+                                   employee_rows[emp][:3])
+            voucher_no += 1
+            counts['vouchers'] += 1
+        _write_vouchers(conn, lines)
+        conn.commit()
+        counts['entry'] += len(lines)
+        if progress:
+            progress('entry', counts['entry'], entries)
+
+    # 最近一年每个部门、科目的月度预算
+    periods = []
+    year, month = today.year, today.month
+    for _ in range(12):
+        periods.append(f"{year}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    conn.executemany("INSERT OR REPLACE INTO budgets (period, department, budget_item, amount_cents) VALUES (?, ?, ?, ?)",
+                     [(period, dept[0], item[0], item[3] * 100 * rng.randint(5, 50))
+                      for period in periods for dept in department_rows for item in item_rows])
+    conn.commit()
+    counts['budgets'] = len(periods) * len(department_rows) * len(item_rows)
+    counts['employees'] = len(employee_rows)
+    counts['elapsed'] = time.perf_counter() - start
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="初始化示例数据；指定 --expenses 时按规模生成压测数据")
+    parser.add_argument('--db', default='expenses.db', help="SQLite数据库文件")
+    parser.add_argument('--expenses', type=int, help="报销记录数")
+    parser.add_argument('--entries', type=int, help="凭证行数（不足部分补历史凭证）")
+    parser.add_argument('--employees', type=int, default=5000, help="员工数")
+    parser.add_argument('--departments', type=int, default=200, help="部门数")
+    parser.add_argument('--companies', type=int, default=10, help="公司数")
+    parser.add_argument('--budget-items', type=int, default=30, help="预算科目数")
+    parser.add_argument('--days', type=int, default=1095, help="报销日期跨越的天数")
+    parser.add_argument('--seed', type=int, default=42, help="随机种子")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.expenses:
+        init_database(args.db)
+        print("示例数据初始化完成！")
+        return 0
+
+    def progress(table, done, total):
+        print(f"\r{table}: {done}/{total}", end='', flush=True)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        counts = generate_data(conn, expenses=args.expenses, entries=args.entries, employees=args.employees,
+                               departments=args.departments, companies=args.companies,
+                               budget_items=args.budget_items, days=args.days, seed=args.seed, progress=progress)
+    finally:
+        conn.close()
+    print(f"\n生成完成：报销 {counts['expenses']} 笔，凭证 {counts['vouchers']} 张 / {counts['entry']} 行，"
+          f"员工 {counts['employees']} 人，预算 {counts['budgets']} 项，耗时 {counts['elapsed']:.1f}秒")
+    return 0
+
+
 if __name__ == '__main__':
-    init_database()
-    print("示例数据初始化完成！") 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""在独立进程中生成报销通知摘要并发送邮件
+
+应用进程内默认已启动发送线程（MAIL_WORKER_IN_APP）；多实例部署时可关闭该选项，改由本脚本统一发送。
+
+用法（在项目根目录执行）：
+    MAIL_SERVER=smtp.example.com python -m scripts.mail_worker
+    python -m scripts.mail_worker --once            # 生成到期的摘要、发送一遍发件箱后退出
+    python -m scripts.mail_worker --once --digest-now  # 不等摘要间隔，立即汇总全部通知
+    python -m scripts.mail_worker --retry-failed    # 失败的邮件重新排队
+"""
+import argparse
+import sys
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="发送报销通知邮件")
+    parser.add_argument('--once', action='store_true', help="发送一遍当前到期的邮件后退出")
+    parser.add_argument('--digest-now', action='store_true', help="立即把全部未汇总的通知生成摘要邮件")
+    parser.add_argument('--retry-failed', action='store_true', help="先把失败的邮件重新排队")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from app.models.database import db
+    from app.controllers.notification import mail_sender, outbox_summary, retry_failed_mail
+    if not mail_sender.server:
+        print("未配置 MAIL_SERVER，无法发送")
+        return 1
+    db.bootstrap()
+    if args.retry_failed:
+        print(f"{retry_failed_mail()} 封失败的邮件已重新排队")
+    if args.once:
+        start = time.perf_counter()
+        count = mail_sender.run_once(force_digest=args.digest_now)
+        with db.get_connection() as conn:
+            summary = outbox_summary(conn)
+        print(f"处理 {count} 封邮件，耗时 {time.perf_counter() - start:.1f}秒；"
+              f"待发送 {summary['pending']}，失败 {summary['failed']}，待汇总通知 {summary['events']}")
+        return 0
+    mail_sender.start()
+    print(f"邮件通知发送已启动：{mail_sender.server}:{mail_sender.port}，Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mail_sender.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""本地SAP接口桩，离线联调和测试用
+
+接口与 app/utils/sap_client.py 中的 SapClient 一致：
+- POST /postings 提交一批凭证，按幂等键逐张返回过账结果；同一幂等键重复提交返回原凭证号，不重复过账。
+  可模拟延迟、整批失败（503）和单张拒绝。
+- GET /master-data/changes?since=&objects=&limit= 按变更序号返回主数据变更，水位即最后一条的序号。
+  change_master_data() 追加变更，--employees 可预置一批员工模拟首次全量同步。
+
+用法（在项目根目录执行）：
+    python -m scripts.sap_stub --port 8765 --latency-ms 50 --fail-rate 0.05 --employees 50000
+    SAP_HOST=http://127.0.0.1:8765 streamlit run app.py
+"""
+import argparse
+import base64
+import json
+import random
+import sys
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# 模拟的SAP会计凭证号起始值
+FIRST_DOCUMENT_NO = 5100000000
+
+
+class SapStub:
+    """模拟SAP过账接口，start() 后在后台线程中监听"""
+
+    def __init__(self, host='127.0.0.1', port=8765, user='', password='', latency_ms=0, fail_rate=0.0,
+                 reject_rate=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.reject_rate = reject_rate
+        self.documents = {}  # 幂等键 -> SAP凭证号
+        self.requests = 0
+        self.changes = []  # 主数据变更日志，序号从1开始
+        self._random = random.Random(seed)
+        self._next_document = FIRST_DOCUMENT_NO
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        handler = type('SapStubHandler', (_Handler,), {'stub': self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        # 端口传0时由系统分配
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='sap-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def authorized(self, header):
+        if not self.user:
+            return True
+        expected = base64.b64encode(f"{self.user}:{self.password}".encode('utf-8')).decode('ascii')
+        return header == f"Basic {expected}"
+
+    def handle(self, payload):
+        """处理一批凭证，返回 (HTTP状态码, 响应体)"""
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self.fail_rate:
+                return 503, {'error': '服务暂不可用'}
+            results = [self._post(document) for document in payload.get('documents', [])]
+        return 200, {'batch_id': payload.get('batch_id'), 'results': results}
+
+    def change_master_data(self, object_type, code, description='', deleted=False):
+        """记录一条主数据变更（新建、改名、删除），返回变更序号"""
+        with self._lock:
+            self.changes.append({'seq': len(self.changes) + 1, 'object': object_type, 'code': str(code),
+                                 'description': description, 'deleted': deleted})
+            return len(self.changes)
+
+    def master_data_changes(self, since='', objects=None, limit=5000):
+        """返回序号大于 since 的变更，返回 (HTTP状态码, 响应体)"""
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        try:
+            since = int(since or 0)
+            limit = max(1, int(limit))
+        except ValueError:
+            return 400, {'error': '水位或条数不是整数'}
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self.fail_rate:
+                return 503, {'error': '服务暂不可用'}
+            # 序号连续，从水位处直接切片
+            pending = [change for change in self.changes[since:] if not objects or change['object'] in objects]
+        records = pending[:limit]
+        watermark = records[-1]['seq'] if len(pending) > limit else len(self.changes)
+        return 200, {'records': records, 'watermark': str(max(watermark, since)), 'has_more': len(pending) > limit}
+
+    def _post(self, document):
+        # 调用方需持有锁
+        key = document.get('idempotency_key')
+        if key in self.documents:
+            return {'idempotency_key': key, 'status': 'posted', 'document_no': self.documents[key],
+                    'duplicate': True}
+        try:
+            debit = sum(Decimal(line['debit']) for line in document['lines'])
+            credit = sum(Decimal(line['credit']) for line in document['lines'])
+        except (KeyError, TypeError, InvalidOperation):
+            return {'idempotency_key': key, 'status': 'rejected', 'message': '行项目金额格式错误'}
+        if not document['lines'] or debit != credit:
+            return {'idempotency_key': key, 'status': 'rejected', 'message': f"借贷不平：借方 {debit}，贷方 {credit}"}
+        if self._random.random() < self.reject_rate:
+            return {'idempotency_key': key, 'status': 'rejected', 'message': '模拟拒绝：成本中心已冻结'}
+        document_no = str(self._next_document)
+        self._next_document += 1
+        self.documents[key] = document_no
+        return {'idempotency_key': key, 'status': 'posted', 'document_no': document_no}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stub = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/master-data/changes':
+            return self._reply(404, {'error': '接口不存在'})
+        if not self.stub.authorized(self.headers.get('Authorization')):
+            return self._reply(401, {'error': '用户名或密码错误'})
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        objects = [item for item in params.get('objects', '').split(',') if item]
+        self._reply(*self.stub.master_data_changes(params.get('since', ''), objects, params.get('limit', 5000)))
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/postings':
+            return self._reply(404, {'error': '接口不存在'})
+        if not self.stub.authorized(self.headers.get('Authorization')):
+            return self._reply(401, {'error': '用户名或密码错误'})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        except ValueError:
+            return self._reply(400, {'error': '请求不是合法的JSON'})
+        self._reply(*self.stub.handle(payload))
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="本地SAP接口桩")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--user', default='', help="要求的Basic认证用户名，为空时不校验")
+    parser.add_argument('--password', default='')
+    parser.add_argument('--latency-ms', type=float, default=0, help="每次请求的模拟延迟")
+    parser.add_argument('--fail-rate', type=float, default=0, help="整批返回503的比例")
+    parser.add_argument('--reject-rate', type=float, default=0, help="单张凭证被拒绝的比例")
+    parser.add_argument('--employees', type=int, default=0, help="预置的员工主数据变更条数")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stub = SapStub(args.host, args.port, args.user, args.password, args.latency_ms, args.fail_rate,
+                   args.reject_rate).start()
+    for i in range(args.employees):
+        stub.change_master_data('employee', f"{i + 1:08d}", f"员工{i + 1:05d}")
+    print(f"SAP接口桩已启动：{stub.url}，主数据变更 {len(stub.changes)} 条，Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"已处理 {stub.requests} 次请求，过账 {len(stub.documents)} 张凭证")
+    except KeyboardInterrupt:
+        stub.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
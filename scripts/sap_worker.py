@@ -0,0 +1,51 @@
+"""在独立进程中发送SAP过账队列
+
+应用进程内默认已启动发送线程（SAP_WORKER_IN_APP）；多实例部署时可关闭该选项，改由本脚本统一发送。
+多个发送进程同时运行也不会重复过账：领取批次加写锁，SAP按幂等键去重。
+
+用法（在项目根目录执行）：
+    SAP_HOST=http://127.0.0.1:8765 python -m scripts.sap_worker
+    python -m scripts.sap_worker --once          # 发送一遍当前到期的凭证后退出
+    python -m scripts.sap_worker --retry-failed  # 失败的凭证重新排队
+"""
+import argparse
+import sys
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="发送SAP过账队列")
+    parser.add_argument('--once', action='store_true', help="发送一遍当前到期的凭证后退出")
+    parser.add_argument('--retry-failed', action='store_true', help="先把失败的凭证重新排队")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from app.models.database import db
+    from app.controllers.sap_posting import posting_summary, retry_failed, sap_worker
+    if sap_worker.client is None:
+        print("未配置 SAP_HOST，无法发送")
+        return 1
+    if args.retry_failed:
+        print(f"{retry_failed()} 张失败的凭证已重新排队")
+    if args.once:
+        start = time.perf_counter()
+        count = sap_worker.run_once()
+        with db.get_connection() as conn:
+            summary = posting_summary(conn)
+        print(f"处理 {count} 张凭证，耗时 {time.perf_counter() - start:.1f}秒；"
+              f"待发送 {summary['pending']}，失败 {summary['failed']}")
+        return 0
+    sap_worker.start()
+    print(f"SAP过账发送已启动：{sap_worker.client.url}，Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sap_worker.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
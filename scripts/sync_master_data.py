@@ -0,0 +1,52 @@
+"""从SAP增量同步成本中心、核算科目、公司代码和员工主数据
+
+只拉取上次水位之后的变更，按SAP代码批量更新config；适合由定时任务每晚或每小时执行。
+也可在应用进程内设置 SAP_SYNC_INTERVAL 定时同步，或在“主数据管理”页手动同步。
+
+用法（在项目根目录执行）：
+    SAP_HOST=http://127.0.0.1:8765 python -m scripts.sync_master_data
+    python -m scripts.sync_master_data --reset     # 清空水位，下次从头全量同步
+    python -m scripts.sync_master_data --status    # 查看上次同步的水位和结果
+"""
+import argparse
+import sys
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SAP主数据增量同步")
+    parser.add_argument('--page-size', type=int, default=None, help="每次拉取的变更条数")
+    parser.add_argument('--reset', action='store_true', help="清空水位后退出")
+    parser.add_argument('--status', action='store_true', help="查看上次同步的水位和结果后退出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from app.models.database import db
+    from app.controllers.master_data_sync import (
+        SYNC_SOURCE, MasterDataSyncError, sync_master_data, sync_state
+    )
+    from app.utils.sap_client import SapError
+    db.bootstrap()
+    if args.status or args.reset:
+        with db.get_connection() as conn:
+            if args.reset:
+                conn.execute("DELETE FROM sync_state WHERE source = ?", (SYNC_SOURCE,))
+                conn.commit()
+                print("水位已清空，下次同步从头开始")
+            else:
+                print(sync_state(conn) or "尚未同步过")
+        return 0
+    try:
+        result = sync_master_data(page_size=args.page_size)
+    except (SapError, MasterDataSyncError) as e:
+        print(f"同步失败：{str(e)}")
+        return 1
+    print(f"同步完成：{result.pages} 页，收到 {result.received} 条变更，更新 {result.updated} 条，"
+          f"新增 {result.inserted} 条，未映射 {result.unmapped} 条，删除 {result.deleted} 条（未删本地），"
+          f"水位 {result.watermark}，耗时 {result.elapsed:.1f}秒")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
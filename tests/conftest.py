@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# 测试使用临时数据库，避免改动仓库中的 expenses.db（必须在导入 config 之前设置）
+_test_dir = tempfile.mkdtemp(prefix='expense_app_test_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_test_dir, 'test.db')}"
+os.environ['LOG_FILE'] = os.path.join(_test_dir, 'app.log')
+os.environ['SLOW_QUERY_LOG'] = os.path.join(_test_dir, 'slow_query.log')
+os.environ['UPLOAD_FOLDER'] = os.path.join(_test_dir, 'uploads')
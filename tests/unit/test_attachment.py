@@ -0,0 +1,130 @@
+import hashlib
+import io
+import os
+import sqlite3
+import pytest
+from PIL import Image
+from app.models.database import db
+from app.controllers.attachment import (
+    add_attachment, attachment_counts, attachments_of, delete_attachment, preview_of, thumbnail_of
+)
+from app.utils.attachment_store import CHUNK_SIZE, AttachmentError, attachment_store
+from tests.unit.test_booking import add_expenses
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    yield
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM expense_attachments")
+        conn.execute("DELETE FROM expenses")
+        conn.commit()
+
+
+class ChunkedUpload(io.BytesIO):
+    """记录每次读取的字节数，确认上传是分块读取的"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+def png_bytes(width=1600, height=900, color='red'):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(output, 'PNG')
+    return output.getvalue()
+
+
+def stored_files():
+    return [name for _, _, names in os.walk(os.path.join(attachment_store.root, 'objects')) for name in names]
+
+
+def test_upload_streamed_and_deduplicated_by_content():
+    """测试上传分块写入按哈希分片的目录，相同内容只存一份；超限和不支持的类型不留临时文件"""
+    first, second = add_expenses(2)
+    data = png_bytes()
+    upload = ChunkedUpload(data, 'receipt.png')
+    attachment_id = add_attachment(first, upload, 'receipt.png', 'employee1')
+    assert upload.reads and all(size == CHUNK_SIZE for size in upload.reads)
+    add_attachment(second, ChunkedUpload(data, 'copy.png'), 'copy.png')
+    assert add_attachment(first, ChunkedUpload(data, 'again.png'), 'again.png') == attachment_id
+    with db.get_connection() as conn:
+        row, = attachments_of(conn, first)
+        assert (row['file_name'], row['content_type'], row['size']) == ('receipt.png', 'image/png', len(data))
+        assert attachment_counts(conn, [first, second, 0]) == {first: 1, second: 1}
+    sha256 = row['sha256']
+    assert stored_files() == [sha256]
+    assert attachment_store.object_path(sha256).endswith(os.path.join(sha256[:2], sha256[2:4], sha256))
+
+    with pytest.raises(AttachmentError):
+        add_attachment(first, io.BytesIO(b'%PDF-' + b'0' * (attachment_store.max_size + 1)), 'huge.pdf')
+    with pytest.raises(AttachmentError):
+        add_attachment(first, io.BytesIO(b'MZ\x90\x00'), 'invoice.exe')
+    assert os.listdir(os.path.join(attachment_store.root, 'tmp')) == []
+
+
+def test_renditions_generated_lazily_and_files_removed_with_last_reference():
+    """测试缩略图和预览首次查看时生成并缓存；最后一个引用删除后文件一并删除"""
+    first, second = add_expenses(2)
+    data = png_bytes(3000, 2000, 'blue')
+    add_attachment(first, io.BytesIO(data), 'a.png')
+    add_attachment(second, io.BytesIO(data), 'b.png')
+    with db.get_connection() as conn:
+        row_a, = attachments_of(conn, first)
+        row_b, = attachments_of(conn, second)
+    assert not os.path.exists(attachment_store.rendition_path(row_a['sha256'], 'thumbnail'))
+    thumbnail = thumbnail_of(row_a)
+    assert max(Image.open(thumbnail).size) == attachment_store.sizes['thumbnail']
+    modified = os.path.getmtime(thumbnail)
+    assert thumbnail_of(row_b) == thumbnail and os.path.getmtime(thumbnail) == modified
+    assert max(Image.open(preview_of(row_a)).size) == attachment_store.sizes['preview']
+
+    assert delete_attachment(row_a['id'])
+    assert attachment_store.exists(row_a['sha256'])
+    assert delete_attachment(row_b['id'])
+    assert not attachment_store.exists(row_a['sha256']) and not os.path.exists(thumbnail)
+    assert not delete_attachment(row_b['id'])
+
+
+def test_file_removed_only_after_record_deletion_committed(monkeypatch):
+    """测试删除记录提交之后才删文件；文件删除失败不影响已删除的记录"""
+    expense_id, = add_expenses(1)
+    add_attachment(expense_id, io.BytesIO(png_bytes(200, 100)), 'a.png')
+    with db.get_connection() as conn:
+        row, = attachments_of(conn, expense_id)
+    remove = attachment_store.remove
+    committed = []
+
+    def checked_remove(sha256):
+        # 另开连接只能看到已提交的数据
+        other = sqlite3.connect(db.pool.db_path)
+        try:
+            committed.append(other.execute("SELECT COUNT(*) FROM expense_attachments WHERE sha256 = ?",
+                                           (sha256,)).fetchone()[0] == 0)
+        finally:
+            other.close()
+        raise OSError("disk busy")
+
+    monkeypatch.setattr(attachment_store, 'remove', checked_remove)
+    assert delete_attachment(row['id'])
+    assert committed == [True] and attachment_store.exists(row['sha256'])
+    with db.get_connection() as conn:
+        assert attachments_of(conn, expense_id) == []
+    remove(row['sha256'])
+
+
+def test_failed_insert_leaves_no_stored_file(monkeypatch):
+    """测试INSERT失败时文件不移入附件存储，也不留临时文件"""
+    expense_id, = add_expenses(1)
+    from app.controllers import attachment
+    monkeypatch.setattr(attachment, 'INSERT_SQL', attachment.INSERT_SQL.replace('expense_attachments', 'missing_table'))
+    data = png_bytes(200, 100, 'green')
+    with pytest.raises(sqlite3.OperationalError):
+        add_attachment(expense_id, io.BytesIO(data), 'a.png')
+    assert not attachment_store.exists(hashlib.sha256(data).hexdigest())
+    assert os.listdir(os.path.join(attachment_store.root, 'tmp')) == []
@@ -0,0 +1,153 @@
+import time
+import pytest
+from config import config
+from app.models.database import db, ConnectionPool
+from app.controllers.auth import (
+    LoginBusyError, authenticate, change_password, invalidate_users, refresh_identity, run_bounded
+)
+from app.models.master_data import master_data
+from app.utils.security import hash_password, verify_password
+from tests.unit.test_database import LEGACY_DDL
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    """测试用低成本因子，并准备一个明文密码的老用户"""
+    monkeypatch.setattr(config['default'], 'BCRYPT_ROUNDS', 4)
+    with db.get_connection() as conn:
+        role_id = conn.execute("SELECT id FROM roles WHERE role_name='admin'").fetchone()[0]
+        conn.execute("INSERT INTO users (user_id, user_name, password, role_id) VALUES ('u1', '张三', 'secret', ?)",
+                     (role_id,))
+        conn.commit()
+    yield
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM users WHERE user_id='u1'")
+        conn.commit()
+
+
+def stored_password():
+    with db.get_connection() as conn:
+        return conn.execute("SELECT password FROM users WHERE user_id='u1'").fetchone()[0]
+
+
+def test_plaintext_password_migrated_on_first_login():
+    """测试明文密码首次登录成功后换成bcrypt哈希"""
+    assert authenticate('u1', 'wrong') is None
+    assert stored_password() == 'secret'
+    user = authenticate('u1', 'secret')
+    assert (user.user_id, user.user_name, user.role_name) == ('u1', '张三', 'admin')
+    assert stored_password().startswith('$2b$04$')
+    assert authenticate('u1', 'secret') is not None
+    assert authenticate('nobody', 'secret') is None
+
+
+def test_rehash_when_cost_changes():
+    """测试存量哈希的成本因子与配置不一致时登录后重算"""
+    with db.get_connection() as conn:
+        conn.execute("UPDATE users SET password=? WHERE user_id='u1'", (hash_password('secret', rounds=5),))
+        conn.commit()
+    assert authenticate('u1', 'secret') is not None
+    assert stored_password().startswith('$2b$04$')
+
+
+def test_identity_refreshed_only_after_change():
+    """测试会话身份在登录时解析，用户修改并失效后才重新解析"""
+    identity = authenticate('u1', 'secret')
+    assert identity.is_admin and identity.has_permission('expense.view')
+    assert refresh_identity(identity) is identity
+    with db.get_connection() as conn:
+        conn.execute("UPDATE users SET department_code='D01' WHERE user_id='u1'")
+        conn.commit()
+    assert refresh_identity(identity) is identity
+    invalidate_users()
+    refreshed = refresh_identity(identity)
+    assert refreshed.department_code == 'D01'
+    assert refresh_identity(refreshed) is refreshed
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM users WHERE user_id='u1'")
+        conn.commit()
+    invalidate_users()
+    assert refresh_identity(refreshed) is None
+
+
+def test_admin_seeded_without_default_password(tmp_path, monkeypatch):
+    """测试新库管理员用配置的初始密码（哈希保存），老库仍是 admin123 的管理员都须修改密码"""
+    monkeypatch.setattr(config['default'], 'ADMIN_INITIAL_PASSWORD', 'first-login-1')
+    for name, ddl in (('new.db', []), ('legacy.db', LEGACY_DDL)):
+        pool = ConnectionPool(str(tmp_path / name), max_size=1)
+        conn = pool.acquire()
+        try:
+            for sql in ddl:
+                conn.execute(sql)
+            if ddl:
+                conn.execute("INSERT INTO users (user_id, user_name, password) VALUES ('admin', '管理员', 'admin123')")
+                conn.commit()
+            db._apply_schema(conn)
+            password, flag = conn.execute(
+                "SELECT password, must_change_password FROM users WHERE user_id='admin'"
+            ).fetchone()
+            assert flag == 1
+            if not ddl:
+                assert verify_password('first-login-1', password)
+        finally:
+            pool.release(conn)
+            pool.close_all()
+
+
+def test_must_change_password_cleared_after_change():
+    """测试须修改密码的用户改密码后标记清除，新密码可登录"""
+    with db.get_connection() as conn:
+        conn.execute("UPDATE users SET must_change_password=1 WHERE user_id='u1'")
+        conn.commit()
+    identity = authenticate('u1', 'secret')
+    assert identity.must_change_password
+    change_password(identity, 'new-secret')
+    assert not refresh_identity(identity).must_change_password
+    assert authenticate('u1', 'secret') is None and authenticate('u1', 'new-secret') is not None
+
+
+def test_employee_code_stored_on_user_not_matched_by_name(tmp_path):
+    """测试报销人取用户上保存的员工编码：重名员工不串号，改名不影响；老库只回填姓名唯一的用户"""
+    with db.get_connection() as conn:
+        conn.executemany("INSERT INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
+                         [('employee', 'E1', '张三', 'P1', '张三'), ('employee', 'E2', '张三', 'P2', '张三')])
+        conn.execute("UPDATE users SET employee_code='E2' WHERE user_id='u1'")
+        conn.commit()
+    master_data.invalidate()
+    try:
+        assert authenticate('u1', 'secret').employee_code == 'E2'
+        with db.get_connection() as conn:
+            conn.execute("UPDATE users SET user_name='张三丰' WHERE user_id='u1'")
+            conn.commit()
+        assert authenticate('u1', 'secret').employee_code == 'E2'
+    finally:
+        with db.get_connection() as conn:
+            conn.execute("DELETE FROM config")
+            conn.commit()
+        master_data.invalidate()
+
+    pool = ConnectionPool(str(tmp_path / 'legacy.db'), max_size=1)
+    conn = pool.acquire()
+    try:
+        for sql in LEGACY_DDL + ["CREATE TABLE config (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL,"
+                                 " code TEXT NOT NULL, description TEXT NOT NULL, sap_code TEXT NOT NULL,"
+                                 " sap_description TEXT NOT NULL)"]:
+            conn.execute(sql)
+        conn.executemany("INSERT INTO config (key, code, description, sap_code, sap_description) "
+                         "VALUES ('employee', ?, ?, '', '')", [('E1', '张三'), ('E2', '张三'), ('E3', '李四')])
+        conn.executemany("INSERT INTO users (user_id, user_name, password) VALUES (?, ?, 'x')",
+                         [('zhangsan', '张三'), ('lisi', '李四')])
+        conn.commit()
+        db._apply_schema(conn)
+        assert dict(conn.execute("SELECT user_id, employee_code FROM users WHERE user_id <> 'admin'").fetchall()) == {
+            'zhangsan': None, 'lisi': 'E3'}
+    finally:
+        pool.release(conn)
+        pool.close_all()
+
+
+def test_queue_timeout_raises_busy(monkeypatch):
+    """测试排队超时提示登录繁忙"""
+    monkeypatch.setattr(config['default'], 'LOGIN_TIMEOUT', 0.01)
+    with pytest.raises(LoginBusyError):
+        run_bounded(time.sleep, 0.2)
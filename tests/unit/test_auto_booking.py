@@ -0,0 +1,88 @@
+from datetime import date
+import pytest
+from app.models.database import db
+from app.models.master_data import master_data
+from app.controllers.auto_booking import parse_group_by, plan_auto_booking, post_auto_booking
+
+
+@pytest.fixture(autouse=True)
+def data():
+    """两家公司、三个员工的待记账数据，其中一笔预算科目没有SAP映射"""
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)", [
+                ('company', 'C1', '总公司', 'S1', '总公司'),
+                ('company', 'C2', '分公司', 'S2', '分公司'),
+                ('department', 'D1', '财务部', 'CC01', '财务成本中心'),
+                ('budget_item', 'B1', '差旅费', '660201', '差旅费'),
+                ('budget_item', 'B2', '未映射', '', ''),
+                ('employee', 'E1', '张三', 'P001', '张三'),
+                ('employee', 'E2', '李四', 'P002', '李四'),
+                ('employee', 'E3', '王五', 'P003', '王五'),
+            ])
+        conn.executemany(
+            "INSERT INTO expenses (expense_date, department, company, budget_item, employee, amount_cents) "
+            "VALUES (?, 'D1', ?, ?, ?, ?)", [
+                ('2025-01-05', 'C1', 'B1', 'E1', 10010),
+                ('2025-01-06', 'C1', 'B1', 'E1', 20020),
+                ('2025-01-07', 'C1', 'B1', 'E2', 5000),
+                ('2025-01-08', 'C2', 'B1', 'E3', 8000),
+                ('2025-01-09', 'C1', 'B2', 'E2', 3000),
+                ('2025-02-01', 'C1', 'B1', 'E1', 99900),
+            ])
+        conn.commit()
+    master_data.invalidate()
+    yield
+    with db.get_connection() as conn:
+        for table in ('entry', 'expense_bookings', 'expenses', 'config'):
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+    master_data.invalidate()
+
+
+def test_dry_run_plans_balanced_vouchers_without_writing():
+    """测试试运行按分组生成平衡凭证且不写库"""
+    plan = plan_auto_booking(company='C1', date_from=date(2025, 1, 1), date_to=date(2025, 1, 31),
+                             group_by='company,employee')
+    assert [group for group, _ in plan.vouchers] == [('C1', 'E1'), ('C1', 'E2')]
+    for _, rows in plan.vouchers:
+        assert round(sum(r['debit_amount'] for r in rows) - sum(r['credit_amount'] for r in rows), 2) == 0
+    credit = plan.vouchers[0][1][-1]
+    assert (credit['sap_account_code'], credit['sap_employee_code'], credit['credit_amount']) == ('22411', 'P001', 300.3)
+    assert list(plan.report()['金额']) == [300.3, 50.0]
+    assert list(plan.skipped_report()['原因']) == ['预算科目缺少SAP核算科目']
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM entry").fetchone()[0] == 0
+
+
+def test_plan_limited_to_department():
+    """测试按部门筛选时只为该部门的报销生成凭证"""
+    with db.get_connection() as conn:
+        conn.execute("INSERT INTO expenses (expense_date, department, company, budget_item, employee, amount_cents) "
+                     "VALUES ('2025-01-10', 'D2', 'C1', 'B1', 'E3', 7000)")
+        conn.commit()
+    plan = plan_auto_booking(company='C1', group_by='company,employee', department='D2')
+    assert [group for group, _ in plan.vouchers] == [('C1', 'E3')]
+    assert (plan.expenses, plan.amount, plan.skipped) == (1, 70.0, [])
+    assert plan_auto_booking(company='C1', group_by='company,employee', department='D1').expenses == 4
+
+
+def test_post_writes_vouchers_in_batches():
+    """测试分批过账、凭证号连续且报销状态更新"""
+    plan = plan_auto_booking(group_by=['employee'])
+    done = []
+    result = post_auto_booking(plan, batch_size=2, progress=lambda posted, total: done.append((posted, total)))
+    assert done == [(2, 3), (3, 3)]
+    assert (result.vouchers, result.expenses, result.first_voucher_no, result.last_voucher_no) == (3, 5, 100000, 100002)
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(DISTINCT voucher_no) FROM entry").fetchone()[0] == 3
+        pending = conn.execute("SELECT budget_item FROM expenses WHERE status='pending'").fetchall()
+    assert [row[0] for row in pending] == ['B2']
+    assert plan_auto_booking().vouchers == []
+
+
+def test_parse_group_by_rejects_unknown_keys():
+    """测试分组维度校验"""
+    assert parse_group_by(' company , budget_item ') == ('company', 'budget_item')
+    with pytest.raises(ValueError):
+        parse_group_by('company,amount')
@@ -0,0 +1,40 @@
+import sqlite3
+import pytest
+from app.models.database import db
+from scripts.benchmark import compare_results
+from scripts.init_data import generate_data
+
+
+@pytest.fixture
+def bench_conn(tmp_path):
+    """独立的空库，生成的压测数据不影响其他测试"""
+    conn = sqlite3.connect(str(tmp_path / 'bench.db'))
+    conn.row_factory = sqlite3.Row
+    db._apply_schema(conn)
+    yield conn
+    conn.close()
+
+
+def test_generate_data_is_consistent(bench_conn):
+    """测试生成的数据：凭证借贷平衡、已记账报销都有借方行、补足指定的凭证行数"""
+    counts = generate_data(bench_conn, expenses=3000, entries=6000, employees=200, departments=20, companies=3,
+                           budget_items=10, seed=1)
+    assert bench_conn.execute("SELECT COUNT(*) FROM expenses").fetchone()[0] == 3000
+    assert bench_conn.execute("SELECT COUNT(*) FROM entry").fetchone()[0] == counts['entry'] >= 6000
+    assert bench_conn.execute("""
+        SELECT COUNT(*) FROM (SELECT voucher_no FROM entry GROUP BY voucher_no
+                              HAVING SUM(debit_cents) != SUM(credit_cents))
+    """).fetchone()[0] == 0
+    booked = bench_conn.execute("SELECT COUNT(*) FROM expenses WHERE status='booked'").fetchone()[0]
+    assert 0 < booked < 3000
+    assert bench_conn.execute("SELECT COUNT(DISTINCT expense_id) FROM entry").fetchone()[0] == booked
+    assert bench_conn.execute("SELECT SUM(expense_count) FROM expense_summary").fetchone()[0] == 3000
+
+
+def test_compare_results_flags_regressions():
+    """测试基线比较：超出容差且超过噪声下限才算回归"""
+    baseline = {'cases': {'a': {'median_ms': 10.0}, 'b': {'median_ms': 0.5}, 'c': {'median_ms': 100.0}}}
+    current = {'cases': {'a': {'median_ms': 20.0}, 'b': {'median_ms': 1.5}, 'c': {'median_ms': 50.0},
+                         'd': {'median_ms': 1.0}}}
+    status = {name: s for name, *_, s in compare_results(current, baseline, tolerance=0.25, noise_ms=2.0)}
+    assert status == {'a': '回归', 'b': '持平', 'c': '改善', 'd': '新增'}
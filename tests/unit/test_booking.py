@@ -0,0 +1,85 @@
+from datetime import date
+import pytest
+from app.models.database import db
+from app.controllers.booking import BookingError, save_voucher, write_vouchers
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    """每个用例后清空报销和记账数据"""
+    yield
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM entry")
+        conn.execute("DELETE FROM expense_bookings")
+        conn.execute("DELETE FROM expenses")
+        conn.commit()
+
+
+def add_expenses(count):
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO expenses (expense_date, department, company, budget_item, employee, amount_cents, description) "
+            "VALUES ('2026-10-01', 'D1', 'C1', 'B1', 'E1', ?, '差旅')",
+            [(10000,)] * count
+        )
+        conn.commit()
+        return [row[0] for row in conn.execute("SELECT id FROM expenses ORDER BY id")]
+
+
+def make_line(expense_id, debit=0.0, credit=0.0):
+    return {
+        'type': 'debit' if debit else 'credit',
+        'sap_account_code': '660201', 'sap_account_desc': '差旅费',
+        'sap_cost_center_code': 'CC01', 'sap_cost_center_desc': '财务部',
+        'debit_amount': debit, 'credit_amount': credit,
+        'sap_employee_code': 'E1', 'sap_employee_desc': '张三',
+        'voucher_date': date(2026, 10, 1), 'post_date': date(2026, 10, 1),
+        'expense_id': expense_id,
+    }
+
+
+def test_save_voucher_writes_lines_and_books_expenses():
+    """测试整张凭证写入并批量更新报销状态"""
+    ids = add_expenses(300)
+    rows = [make_line(eid, debit=100.0) for eid in ids] + [make_line(None, credit=30000.0)]
+    first = save_voucher(rows)
+    assert (first.voucher_no, first.lines, first.expenses) == (100000, 301, 300)
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM entry WHERE voucher_no=100000").fetchone()[0] == 301
+        assert conn.execute("SELECT COUNT(*) FROM expense_bookings").fetchone()[0] == 301
+        assert conn.execute("SELECT COUNT(*) FROM expenses WHERE status='pending'").fetchone()[0] == 0
+    second = save_voucher([make_line(None, debit=1.0), make_line(None, credit=1.0)])
+    assert second.voucher_no == 100001
+
+
+def test_save_voucher_rolls_back_when_expense_already_booked():
+    """测试报销已被记账时整张凭证回滚"""
+    ids = add_expenses(2)
+    save_voucher([make_line(ids[0], debit=100.0), make_line(None, credit=100.0)])
+    with pytest.raises(BookingError):
+        save_voucher([make_line(ids[0], debit=100.0), make_line(ids[1], debit=100.0),
+                      make_line(None, credit=200.0)])
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM entry").fetchone()[0] == 2
+        assert conn.execute("SELECT status FROM expenses WHERE id=?", (ids[1],)).fetchone()[0] == 'pending'
+
+
+def test_save_voucher_rejects_unbalanced():
+    """测试借贷不平不写库"""
+    with pytest.raises(BookingError):
+        save_voucher([make_line(None, debit=100.0), make_line(None, credit=99.0)])
+
+
+def test_balance_is_checked_in_cents():
+    """测试金额按分入库，借贷核对不受浮点误差影响"""
+    result = save_voucher([make_line(None, debit=0.1), make_line(None, debit=0.2), make_line(None, credit=0.3)])
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT SUM(debit_cents), SUM(credit_cents) FROM entry WHERE voucher_no=?",
+                            (result.voucher_no,)).fetchone()[:] == (30, 30)
+        # 绕过页面校验直接写入不平的凭证，SQL核对拒绝并由调用方回滚
+        conn.execute("BEGIN IMMEDIATE")
+        with pytest.raises(BookingError, match="借贷不平"):
+            write_vouchers(conn, [(result.voucher_no + 1, [make_line(None, debit=0.3),
+                                                           make_line(None, credit=0.29)])], '2026-10-01')
+        conn.rollback()
+        assert conn.execute("SELECT COUNT(*) FROM entry").fetchone()[0] == 3
@@ -0,0 +1,70 @@
+from datetime import date
+import pytest
+from app.models.database import db
+from app.controllers.budget import BudgetExceededError, budget_report, check_budget, save_budgets
+from app.controllers.expense import submit_expense
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    """每个用例后清空报销和预算"""
+    yield
+    with db.get_connection() as conn:
+        for table in ('expenses', 'budgets', 'budget_consumption', 'expense_summary'):
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+
+
+def consumption(period='2025-03'):
+    with db.get_connection() as conn:
+        row = conn.execute("SELECT pending_cents, booked_cents FROM budget_consumption "
+                           "WHERE period=? AND department='D1' AND budget_item='B1'", (period,)).fetchone()
+    return tuple(row) if row else None
+
+
+def test_consumption_follows_submit_booking_and_edits():
+    """测试提交、记账、改金额和删除时预算占用增量更新"""
+    first, _ = submit_expense(date(2025, 3, 1), 'D1', 'C1', 'B1', 'E1', 100.0, '差旅')
+    submit_expense(date(2025, 3, 2), 'D1', 'C1', 'B1', 'E1', 40.0, '差旅')
+    assert consumption() == (14000, 0)
+    with db.get_connection() as conn:
+        conn.execute("UPDATE expenses SET status='booked' WHERE id=?", (first,))
+        conn.execute("UPDATE expenses SET amount_cents=6000 WHERE id!=?", (first,))
+        conn.commit()
+    assert consumption() == (6000, 10000)
+    with db.get_connection() as conn:
+        conn.execute("UPDATE expenses SET expense_date='2025-04-01' WHERE id=?", (first,))
+        conn.execute("DELETE FROM expenses WHERE id!=?", (first,))
+        conn.commit()
+    assert consumption() == (0, 0)
+    assert consumption('2025-04') == (0, 10000)
+
+
+def test_submit_checks_budget():
+    """测试提交时预算校验：warn 提示、block 拒绝、无预算不校验"""
+    assert submit_expense(date(2025, 3, 1), 'D1', 'C1', 'B1', 'E1', 500.0, '', control='block')[1] is None
+    save_budgets('2025-03', 'D1', {'B1': 800.0, 'B2': 100.0})
+    _, check = submit_expense(date(2025, 3, 5), 'D1', 'C1', 'B1', 'E1', 200.0, '', control='block')
+    assert (check.budget, check.consumed, check.exceeded) == (80000, 50000, False)
+    with pytest.raises(BudgetExceededError):
+        submit_expense(date(2025, 3, 6), 'D1', 'C1', 'B1', 'E1', 100.01, '', control='block')
+    _, check = submit_expense(date(2025, 3, 6), 'D1', 'C1', 'B1', 'E1', 150.0, '', control='warn')
+    assert check.exceeded and check.remaining == 10000
+    assert consumption() == (85000, 0)
+
+    save_budgets('2025-03', 'D1', {'B2': None})
+    report = budget_report('2025-03', 'D1')
+    assert list(report['预算科目']) == ['B1']
+    assert report['执行率'].iloc[0] == pytest.approx(850 / 800, abs=1e-4)
+    assert report['剩余'].iloc[0] == -50.0
+    with db.get_connection() as conn:
+        assert check_budget(conn, '2025-03', 'D1', 'B2', 1.0) is None
+
+
+def test_submit_without_employee_rejected():
+    """测试报销人为空时不写入报销"""
+    for employee in (None, ''):
+        with pytest.raises(ValueError):
+            submit_expense(date(2025, 3, 1), 'D1', 'C1', 'B1', employee, 100.0, '差旅')
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM expenses").fetchone()[0] == 0
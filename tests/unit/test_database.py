@@ -0,0 +1,129 @@
+import threading
+import pytest
+from app.models.database import db, ConnectionPool, PoolExhaustedError, SCHEMA_VERSION, DEFAULT_PERMISSIONS
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """创建独立的连接池"""
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=2, timeout=0.2)
+    yield pool
+    pool.close_all()
+
+
+def test_connection_pragmas(pool):
+    """测试连接使用WAL及调优参数"""
+    conn = pool.acquire()
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == pool.busy_timeout
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == pool.cache_size
+    finally:
+        pool.release(conn)
+
+
+def test_release_reuses_connection_and_rolls_back(pool):
+    """测试归还的连接被复用且未提交事务被回滚"""
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.commit()
+    conn.execute("INSERT INTO t VALUES (1)")
+    pool.release(conn)
+
+    again = pool.acquire()
+    assert again is conn
+    assert again.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    pool.release(again)
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['reused'] == 1
+
+
+def test_thread_bound_connection_reclaimed(pool):
+    """测试线程绑定连接在线程结束后被回收"""
+    seen = []
+
+    def worker():
+        conn = pool.connection()
+        seen.append(conn)
+        assert pool.connection() is conn
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+
+    stats = pool.stats()
+    assert stats['thread_bound'] == 0
+    assert stats['reclaimed'] == 1
+    assert pool.acquire() is seen[0]
+
+
+def test_pool_exhausted(pool):
+    """测试连接耗尽时等待超时"""
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(PoolExhaustedError):
+        pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_database_pool_stats():
+    """测试全局数据库实例暴露连接池统计"""
+    with db.get_connection() as conn:
+        conn.execute("SELECT 1")
+        assert db.pool_stats()['in_use'] >= 1
+
+
+LEGACY_DDL = [
+    "CREATE TABLE expenses (id INTEGER PRIMARY KEY AUTOINCREMENT, expense_date DATE, department TEXT,"
+    " company TEXT, budget_item TEXT, employee TEXT, amount REAL, description TEXT)",
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, user_name TEXT NOT NULL,"
+    " password TEXT NOT NULL, role_id INTEGER, UNIQUE(user_id))",
+]
+
+
+def test_bootstrap_upgrades_legacy_database(pool):
+    """测试老库升级：补齐字段、初始化默认数据并记录结构版本"""
+    conn = pool.acquire()
+    try:
+        for ddl in LEGACY_DDL:
+            conn.execute(ddl)
+        conn.executemany("INSERT INTO expenses (expense_date, company, amount) VALUES (?, 'C1', ?)",
+                         [('2025-01-05', 10.0), ('2025-01-20', 5.5), ('2025-02-01', 1.0)])
+        conn.commit()
+
+        assert db._apply_schema(conn) is True
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+        assert {'company_code', 'department_code'} <= columns
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert conn.execute("SELECT COUNT(*) FROM permissions").fetchone()[0] == len(DEFAULT_PERMISSIONS)
+        assert conn.execute("SELECT role_name FROM roles r JOIN users u ON u.role_id = r.id "
+                            "WHERE u.user_id='admin'").fetchone()[0] == 'admin'
+        # 金额从元转换为分，原字段删除
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(expenses)")}
+        assert 'amount_cents' in columns and 'amount' not in columns
+        assert [row[0] for row in conn.execute("SELECT amount_cents FROM expenses ORDER BY id")] == [1000, 550, 100]
+        # 老库已有的明细补进汇总表
+        assert [tuple(row) for row in conn.execute(
+            "SELECT period, company, status, expense_count, total_cents FROM expense_summary ORDER BY period"
+        )] == [('2025-01', 'C1', 'pending', 2, 1550), ('2025-02', 'C1', 'pending', 1, 100)]
+    finally:
+        pool.release(conn)
+
+
+def test_bootstrap_runs_once(monkeypatch):
+    """测试已是当前版本的库不再执行DDL或写操作"""
+    def fail(conn):
+        raise AssertionError("不应重复建表")
+
+    monkeypatch.setattr(db, '_create_tables', fail)
+    assert db.bootstrap() is False
+
+    # 模拟新进程：进程内标记丢失，但库已是当前版本
+    monkeypatch.setattr(db, '_schema_version', None)
+    with db.get_connection() as conn:
+        changes = conn.total_changes
+    assert db.bootstrap() is False
+    with db.get_connection() as conn:
+        assert conn.total_changes == changes
@@ -22,11 +22,11 @@ def test_create_expense(test_db):
         cursor.execute('''
             INSERT INTO expenses (
                 expense_date, department, company, budget_item,
-                employee, amount, description
+                employee, amount_cents, description
             ) VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             date.today(), 'DEPT001', 'COMP001',
-            'BUDGET001', 'EMP001', 100.00, '测试费用'
+            'BUDGET001', 'EMP001', 10000, '测试费用'
         ))
         conn.commit()
         
@@ -34,7 +34,7 @@ def test_create_expense(test_db):
         cursor.execute("SELECT * FROM expenses WHERE description = ?", ('测试费用',))
         result = cursor.fetchone()
         assert result is not None
-        assert result['amount'] == 100.00
+        assert result['amount_cents'] == 10000
         assert result['status'] == 'pending'
 
 def test_update_expense(test_db):
@@ -45,27 +45,27 @@ def test_update_expense(test_db):
         cursor.execute('''
             INSERT INTO expenses (
                 expense_date, department, company, budget_item,
-                employee, amount, description
+                employee, amount_cents, description
             ) VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             date.today(), 'DEPT001', 'COMP001',
-            'BUDGET001', 'EMP001', 100.00, '测试费用'
+            'BUDGET001', 'EMP001', 10000, '测试费用'
         ))
         conn.commit()
         
         # 更新记录
         cursor.execute('''
             UPDATE expenses
-            SET amount = ?, description = ?
+            SET amount_cents = ?, description = ?
             WHERE description = ?
-        ''', (200.00, '更新后的费用', '测试费用'))
+        ''', (20000, '更新后的费用', '测试费用'))
         conn.commit()
         
         # 验证更新是否成功
         cursor.execute("SELECT * FROM expenses WHERE description = ?", ('更新后的费用',))
         result = cursor.fetchone()
         assert result is not None
-        assert result['amount'] == 200.00
+        assert result['amount_cents'] == 20000
 
 def test_delete_expense(test_db):
     """测试删除费用记录"""
@@ -75,11 +75,11 @@ def test_delete_expense(test_db):
         cursor.execute('''
             INSERT INTO expenses (
                 expense_date, department, company, budget_item,
-                employee, amount, description
+                employee, amount_cents, description
             ) VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             date.today(), 'DEPT001', 'COMP001',
-            'BUDGET001', 'EMP001', 100.00, '测试费用'
+            'BUDGET001', 'EMP001', 10000, '测试费用'
         ))
         conn.commit()
         
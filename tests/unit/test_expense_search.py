@@ -0,0 +1,69 @@
+import pytest
+from app.models.database import db
+from app.models.queries import (
+    build_expense_search, build_expense_summary, build_pending_search, build_pending_ids, build_pending_by_ids
+)
+
+
+@pytest.fixture
+def expenses():
+    """准备同一日期有多条记录的测试数据"""
+    rows = [(f"2025-01-0{i % 3 + 1}", 'EMP001' if i % 2 else 'EMP002', 1000 * (i + 1)) for i in range(11)]
+    with db.get_connection() as conn:
+        conn.executemany("INSERT INTO expenses (expense_date, employee, amount_cents) VALUES (?, ?, ?)", rows)
+        conn.commit()
+    yield rows
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM expenses")
+        conn.commit()
+
+
+def fetch_all_pages(conn, page_size, **filters):
+    pages = []
+    after = None
+    while True:
+        query, params = build_expense_search(after=after, limit=page_size, **filters)
+        rows = conn.execute(query, params).fetchall()
+        if not rows:
+            return pages
+        pages.append([row['id'] for row in rows])
+        after = (rows[-1]['日期'], rows[-1]['id'])
+
+
+def test_keyset_pages_cover_all_rows_once(expenses):
+    """测试键集分页按日期倒序不重不漏"""
+    with db.get_connection() as conn:
+        full = [row['id'] for row in conn.execute(*build_expense_search())]
+        pages = fetch_all_pages(conn, 4)
+    assert [len(page) for page in pages] == [4, 4, 3]
+    assert sum(pages, []) == full
+
+
+def test_summary_matches_filter(expenses):
+    """测试汇总与筛选条件一致"""
+    with db.get_connection() as conn:
+        count, total = conn.execute(*build_expense_summary(owner='EMP001')).fetchone()
+        pages = fetch_all_pages(conn, 2, owner='EMP001')
+    mine = [amount for _, employee, amount in expenses if employee == 'EMP001']
+    assert count == len(mine) == len(sum(pages, []))
+    assert total == sum(mine) / 100
+
+
+def test_pending_selection_works_on_ids(expenses):
+    """测试待记账分页、全选筛选结果和按id取已选记录"""
+    with db.get_connection() as conn:
+        conn.execute("UPDATE expenses SET status='booked' WHERE amount_cents > 8000")
+        conn.commit()
+        filters = {'date_from': '2025-01-02', 'date_to': '2025-01-03'}
+        pages, after = [], None
+        while True:
+            rows = conn.execute(*build_pending_search(after=after, limit=2, **filters)).fetchall()
+            if not rows:
+                break
+            pages.append([row['id'] for row in rows])
+            after = (rows[-1]['expense_date'], rows[-1]['id'])
+        matching = [row[0] for row in conn.execute(*build_pending_ids(**filters))]
+        selected = conn.execute(*build_pending_by_ids(matching + [99999])).fetchall()
+    expected = [amount for day, _, amount in expenses if day != '2025-01-01' and amount <= 8000]
+    assert sorted(sum(pages, [])) == sorted(matching)
+    assert sorted(row['amount_cents'] for row in selected) == sorted(expected)
@@ -0,0 +1,66 @@
+import pytest
+from app.models.database import db
+from app.models.queries import build_spend_summary
+
+
+@pytest.fixture(autouse=True)
+def clean_expenses():
+    """每个用例后清空报销明细（汇总表随触发器归零）"""
+    yield
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM expenses")
+        conn.execute("DELETE FROM expense_summary")
+        conn.commit()
+
+
+def summary(conn):
+    return [tuple(row) for row in conn.execute("""
+        SELECT period, company, department, budget_item, status, expense_count, total_cents
+        FROM expense_summary WHERE expense_count != 0 ORDER BY 1, 2, 3, 4, 5
+    """)]
+
+
+def rebuilt(conn):
+    """按明细重算的结果，用来核对触发器维护的汇总"""
+    return [tuple(row) for row in conn.execute("""
+        SELECT substr(expense_date, 1, 7), COALESCE(company, ''), COALESCE(department, ''),
+               COALESCE(budget_item, ''), status, COUNT(*), SUM(amount_cents)
+        FROM expenses GROUP BY 1, 2, 3, 4, 5 ORDER BY 1, 2, 3, 4, 5
+    """)]
+
+
+def test_triggers_keep_summary_in_sync():
+    """测试新增、记账、修改、删除后汇总表与明细一致"""
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO expenses (expense_date, company, department, budget_item, employee, amount_cents) "
+            "VALUES (?, 'C1', ?, 'B1', 'E1', ?)",
+            [('2025-01-05', 'D1', 10000), ('2025-01-06', 'D1', 5025), ('2025-02-01', 'D2', 3000),
+             ('2025-02-02', None, 700)]
+        )
+        assert summary(conn) == rebuilt(conn)
+        conn.execute("UPDATE expenses SET status='booked' WHERE department='D1'")
+        conn.execute("UPDATE expenses SET amount_cents=amount_cents * 2, expense_date='2025-03-01' WHERE department='D2'")
+        conn.execute("DELETE FROM expenses WHERE department IS NULL")
+        conn.commit()
+        assert summary(conn) == rebuilt(conn) == [
+            ('2025-01', 'C1', 'D1', 'B1', 'booked', 2, 15025),
+            ('2025-03', 'C1', 'D2', 'B1', 'pending', 1, 6000),
+        ]
+
+
+def test_spend_summary_groups_by_dimensions():
+    """测试看板汇总查询只读汇总表并按维度分组"""
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO expenses (expense_date, company, department, budget_item, amount_cents) VALUES (?, 'C1', ?, ?, ?)",
+            [('2025-01-05', 'D1', 'B1', 1000), ('2025-01-06', 'D1', 'B2', 2000), ('2025-02-01', 'D2', 'B1', 500)]
+        )
+        conn.commit()
+        rows = conn.execute(*build_spend_summary(('department',), period_from='2025-01', period_to='2025-01')).fetchall()
+        assert [tuple(row) for row in rows] == [('D1', 2, 30.0)]
+        rows = conn.execute(*build_spend_summary(('period', 'budget_item'), company='C1')).fetchall()
+        assert [tuple(row) for row in rows] == [('2025-01', 'B1', 1, 10.0), ('2025-01', 'B2', 1, 20.0),
+                                                ('2025-02', 'B1', 1, 5.0)]
+    with pytest.raises(ValueError):
+        build_spend_summary(('amount',))
@@ -0,0 +1,74 @@
+import csv
+import os
+import sqlite3
+import time
+import pytest
+from openpyxl import load_workbook
+from app.utils import export
+from app.utils.export import export_query, remove_export, sweep_exports
+
+
+@pytest.fixture
+def conn():
+    """准备导出用的内存数据库"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE entry (voucher_no INTEGER, sap_employee_desc TEXT, debit_amount REAL)")
+    conn.executemany("INSERT INTO entry VALUES (?, ?, ?)",
+                     [(100000 + i, f'员工{i}', i * 1.5) for i in range(2500)])
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('fmt', ['xlsx', 'csv'])
+def test_export_streams_all_rows(conn, fmt):
+    """测试分块导出全部行"""
+    path, count = export_query(conn, "SELECT voucher_no AS 凭证号, sap_employee_desc AS 员工姓名, "
+                                     "debit_amount AS 借方金额 FROM entry ORDER BY voucher_no",
+                               fmt=fmt, chunk_size=100)
+    try:
+        assert count == 2500
+        if fmt == 'xlsx':
+            rows = list(load_workbook(path, read_only=True).active.iter_rows(values_only=True))
+        else:
+            with open(path, encoding='utf-8-sig', newline='') as f:
+                rows = list(csv.reader(f))
+        assert list(rows[0]) == ['凭证号', '员工姓名', '借方金额']
+        assert len(rows) == 2501
+        assert rows[-1][1] == '员工2499'
+    finally:
+        remove_export(path)
+
+
+def test_xlsx_rolls_over_to_new_sheet_at_row_limit(conn, monkeypatch):
+    """测试超过工作表行数上限时续写到新工作表，每个表都带表头"""
+    monkeypatch.setattr(export, 'XLSX_MAX_ROWS', 1001)
+    path, count = export_query(conn, "SELECT voucher_no, sap_employee_desc FROM entry ORDER BY voucher_no",
+                               sheet_name='凭证', chunk_size=300)
+    try:
+        workbook = load_workbook(path, read_only=True)
+        assert count == 2500 and workbook.sheetnames == ['凭证', '凭证_2', '凭证_3']
+        sheets = [list(workbook[name].iter_rows(values_only=True)) for name in workbook.sheetnames]
+        assert [len(rows) for rows in sheets] == [1001, 1001, 501]
+        assert all(rows[0] == ('voucher_no', 'sap_employee_desc') for rows in sheets)
+        assert sheets[1][1][0] == 101000 and sheets[2][-1][0] == 102499
+    finally:
+        remove_export(path)
+
+
+def test_export_rejects_unknown_format(conn):
+    """测试不支持的导出格式"""
+    with pytest.raises(ValueError):
+        export_query(conn, "SELECT * FROM entry", fmt='pdf')
+
+
+def test_sweep_removes_only_expired_exports(conn):
+    """测试只清理超过保留时间的导出文件"""
+    old_path, _ = export_query(conn, "SELECT * FROM entry LIMIT 10", fmt='csv')
+    new_path, _ = export_query(conn, "SELECT * FROM entry LIMIT 10", fmt='csv')
+    try:
+        now = time.time()
+        os.utime(old_path, (now - 7200, now - 7200))
+        assert sweep_exports(3600, now) == 1
+        assert not os.path.exists(old_path) and os.path.exists(new_path)
+    finally:
+        remove_export(new_path)
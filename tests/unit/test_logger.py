@@ -0,0 +1,34 @@
+import json
+import logging
+import time
+from app.utils.logger import DroppingQueueHandler, set_log_context, setup_logger, shutdown_logger
+
+
+def test_setup_is_idempotent(tmp_path):
+    """测试重复初始化不会重复添加处理器"""
+    logger = setup_logger('expense_app_test_idempotent', log_file=str(tmp_path / 'app.log'))
+    try:
+        assert setup_logger('expense_app_test_idempotent') is logger
+        assert len(logger.handlers) == 1 and isinstance(logger.handlers[0], DroppingQueueHandler)
+    finally:
+        shutdown_logger(logger)
+
+
+def test_json_lines_with_context_and_sampling(tmp_path):
+    """测试JSON日志带上下文字段，DEBUG按比例抽样"""
+    path = tmp_path / 'app.log'
+    logger = setup_logger('expense_app_test_json', log_file=str(path), log_format='json', debug_sample_rate=0)
+    logger.setLevel(logging.DEBUG)
+    set_log_context(user='u1', page='报销采集')
+    try:
+        start = time.perf_counter()
+        logger.info("凭证保存成功", extra={'duration_ms': 1.5})
+        logger.debug("被抽样丢弃")
+        assert time.perf_counter() - start < 0.1
+    finally:
+        set_log_context()
+        shutdown_logger(logger)
+    lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert len(lines) == 1
+    assert lines[0]['message'] == "凭证保存成功"
+    assert (lines[0]['user'], lines[0]['page'], lines[0]['duration_ms']) == ('u1', '报销采集', 1.5)
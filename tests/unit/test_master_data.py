@@ -0,0 +1,48 @@
+import pytest
+from app.models.database import db
+from app.models.master_data import MasterDataCache
+
+
+@pytest.fixture
+def cache():
+    """创建主数据缓存并准备测试数据"""
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
+            [
+                ('department', 'DEPT002', '人事部', 'CC002', '人事成本中心'),
+                ('department', 'DEPT001', '财务部', 'CC001', '财务成本中心'),
+                ('employee', 'EMP001', '张三', 'E001', '张三'),
+            ]
+        )
+        conn.commit()
+    yield MasterDataCache(db)
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM config")
+        conn.commit()
+
+
+def test_bidirectional_lookup(cache):
+    """测试编码和描述双向查找"""
+    assert cache.descriptions('department') == ['财务部', '人事部']
+    assert cache.code_of('department', '人事部') == 'DEPT002'
+    assert cache.description_of('employee', 'EMP001') == '张三'
+    assert cache.sap_of('department', 'DEPT001') == ('CC001', '财务成本中心')
+    assert cache.code_of('department', '不存在') is None
+    assert cache.options('budget_item') == []
+
+
+def test_invalidate_reloads(cache):
+    """测试写入后失效缓存能读到新数据"""
+    assert cache.code_of('company', '总公司') is None
+    with db.get_connection() as conn:
+        conn.execute(
+            "INSERT INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
+            ('company', 'COMP001', '总公司', 'C001', '总公司')
+        )
+        conn.commit()
+    # 未失效前仍是旧数据
+    assert cache.code_of('company', '总公司') is None
+    cache.invalidate()
+    assert cache.code_of('company', '总公司') == 'COMP001'
+    assert cache.version == 1
@@ -0,0 +1,68 @@
+from io import BytesIO
+import pytest
+from openpyxl import Workbook
+from app.models.database import db
+from app.models.master_data import master_data
+from app.controllers.master_data_import import ImportFormatError, import_master_data
+
+
+def make_excel(rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    output = BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def clean_config():
+    """每个用例前后清空主数据"""
+    yield
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM config")
+        conn.commit()
+    master_data.invalidate()
+
+
+def test_import_writes_rows_and_reports_rejects():
+    """测试批量导入并返回逐行拒绝原因"""
+    data = make_excel([
+        ["报销人编码", "报销人姓名", "SAP员工代码", "SAP员工姓名"],
+        ["EMP001", "张三", "E001", "张三"],
+        [2, "李四", 1002.0, "李四"],
+        ["EMP001", "张三丰", "E009", "张三丰"],
+        ["EMP003", None, "E003", "王五"],
+    ])
+    result = import_master_data('employee', data)
+    assert (result.total, result.inserted, result.skipped) == (4, 2, 0)
+    assert list(result.rejects['行号']) == [4, 5]
+    assert list(result.rejects['原因']) == ['文件内编码重复', '必填项为空']
+    # 数字编码按文本保存，写入后缓存已失效
+    assert master_data.sap_of('employee', '2') == ('1002', '李四')
+
+
+def test_reimport_skips_existing_and_rejects_conflicts():
+    """测试重复导入只跳过已存在行，编码相同描述不同的行被拒绝"""
+    header = ["部门编码", "部门描述", "SAP成本中心", "SAP成本中心描述"]
+    import_master_data('department', make_excel([
+        header,
+        ["DEPT001", "财务部", "CC001", "财务成本中心"],
+        ["DEPT003", "市场部", "CC003", "市场成本中心"],
+    ]))
+    result = import_master_data('department', make_excel([
+        header,
+        ["DEPT001", "财务部", "CC001", "财务成本中心"],
+        ["DEPT002", "人事部", "CC002", "人事成本中心"],
+        ["DEPT003", "销售部", "CC005", "销售成本中心"],
+    ]))
+    assert (result.inserted, result.skipped) == (1, 1)
+    assert list(result.rejects['原因']) == ['编码已存在且描述不同']
+
+
+def test_import_rejects_wrong_template():
+    """测试缺少模板列时报错且不写入"""
+    with pytest.raises(ImportFormatError):
+        import_master_data('company', make_excel([["公司编码", "公司描述"], ["COMP001", "总公司"]]))
+    assert master_data.entries('company') == []
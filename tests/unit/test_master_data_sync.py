@@ -0,0 +1,124 @@
+import pytest
+from app.models.database import db, ConnectionPool
+from app.models.master_data import MasterDataCache, master_data
+from app.controllers.master_data_sync import apply_changes, sync_master_data, sync_state
+from app.utils.sap_client import SapClient
+from scripts.sap_stub import SapStub
+from tests.unit.test_database import LEGACY_DDL
+
+
+@pytest.fixture(autouse=True)
+def clean_config():
+    """每个用例前后清空主数据和同步水位"""
+    yield
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM config")
+        conn.execute("DELETE FROM sync_state")
+        conn.commit()
+    master_data.invalidate()
+
+
+@pytest.fixture
+def stub():
+    stub = SapStub(port=0, user='rfc', password='secret', seed=1).start()
+    yield stub
+    stub.stop()
+
+
+def add_config(rows):
+    with db.get_connection() as conn:
+        conn.executemany("INSERT INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
+                         rows)
+        conn.commit()
+    master_data.invalidate()
+
+
+def sync(stub, **kwargs):
+    return sync_master_data(SapClient(stub.url, 'rfc', 'secret', timeout=5), **kwargs)
+
+
+def test_delta_sync_pages_from_watermark(stub):
+    """测试按水位分页拉取变更：已映射的按SAP代码更新，新员工自动新建，未映射的成本中心不建"""
+    add_config([
+        ('department', 'D01', '财务部', 'CC1000', '财务成本中心'),
+        ('department', 'D02', '财务二部', 'CC1000', '财务成本中心'),
+        ('employee', 'E001', '张三', 'E001', '张三'),
+    ])
+    for i in range(5):
+        stub.change_master_data('employee', f"E10{i}", f"新员工{i}")
+    stub.change_master_data('cost_center', 'CC1000', '财务共享中心')
+    stub.change_master_data('cost_center', 'CC9999', '新成本中心')
+    stub.change_master_data('employee', 'E001', '张三（离职）', deleted=True)
+    result = sync(stub, page_size=3)
+    assert (result.pages, result.received, result.watermark) == (3, 8, '8')
+    assert (result.updated, result.inserted, result.unmapped, result.deleted) == (2, 5, 1, 1)
+    assert master_data.sap_of('department', 'D02') == ('CC1000', '财务共享中心')
+    assert master_data.description_of('employee', 'E104') == '新员工4'
+    assert master_data.description_of('employee', 'E001') == '张三'
+    assert master_data.get('department', 'CC9999') is None
+    with db.get_connection() as conn:
+        assert sync_state(conn)['watermark'] == '8'
+
+    # 再次同步只拉取水位之后的变更
+    requests = stub.requests
+    stub.change_master_data('gl_account', '660201', '差旅费-国内')
+    result = sync(stub)
+    assert (result.received, result.watermark, stub.requests - requests) == (1, '9', 1)
+
+
+def test_sync_merges_into_loaded_cache_without_reload(stub, monkeypatch):
+    """测试同步后变更的记录合并进已加载的缓存，不重新加载整张表"""
+    add_config([('budget_item', 'B01', '差旅费', '660201', '差旅费')])
+    assert master_data.sap_of('budget_item', 'B01') == ('660201', '差旅费')
+    version = master_data.version
+    monkeypatch.setattr(master_data, '_load', lambda: pytest.fail("同步后不应重新加载主数据"))
+    stub.change_master_data('gl_account', '660201', '差旅费-国内')
+    stub.change_master_data('employee', 'E200', '李四')
+    sync(stub)
+    assert master_data.sap_of('budget_item', 'B01') == ('660201', '差旅费-国内')
+    assert master_data.code_of('employee', '李四') == 'E200'
+    assert master_data.version > version
+
+
+def test_sync_on_upgraded_legacy_database(tmp_path):
+    """测试早期建的库（config 没有 updated_at）升级后可以直接同步"""
+    pool = ConnectionPool(str(tmp_path / 'legacy.db'), max_size=1)
+    conn = pool.acquire()
+    try:
+        for ddl in LEGACY_DDL + ["CREATE TABLE config (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL,"
+                                 " code TEXT NOT NULL, description TEXT NOT NULL, sap_code TEXT NOT NULL,"
+                                 " sap_description TEXT NOT NULL)"]:
+            conn.execute(ddl)
+        conn.execute("INSERT INTO config (key, code, description, sap_code, sap_description) "
+                     "VALUES ('department', 'D01', '财务部', 'CC1000', '财务成本中心')")
+        conn.commit()
+        assert db._apply_schema(conn) is True
+        counts, changed = apply_changes(conn, [{'object': 'cost_center', 'code': 'CC1000', 'description': '财务共享中心'}])
+        conn.commit()
+        assert counts['updated'] == 1 and changed['department'][0].sap_description == '财务共享中心'
+        assert conn.execute("SELECT updated_at FROM config WHERE code = 'D01'").fetchone()[0] is not None
+    finally:
+        pool.release(conn)
+        pool.close_all()
+
+
+def test_cache_in_other_process_catches_up_after_sync(stub, monkeypatch):
+    """测试别的进程同步后，已加载的缓存按水位只合并变更的记录，不重新加载整张表"""
+    add_config([('budget_item', 'B01', '差旅费', '660201', '差旅费'), ('budget_item', 'B02', '办公费', '660301', '办公费')])
+    cache = MasterDataCache(db, check_interval=3600)
+    assert cache.sap_of('budget_item', 'B01') == ('660201', '差旅费')
+    monkeypatch.setattr(cache, '_load', lambda: pytest.fail("不应重新加载主数据"))
+    stub.change_master_data('gl_account', '660201', '差旅费-国内')
+    stub.change_master_data('employee', 'E300', '赵六')
+    sync(stub)
+    # 未到检查间隔仍用缓存
+    assert cache.sap_of('budget_item', 'B01') == ('660201', '差旅费')
+    cache._checked_at = 0
+    assert cache.sap_of('budget_item', 'B01') == ('660201', '差旅费-国内')
+    assert cache.code_of('employee', '赵六') == 'E300'
+    assert cache.sap_of('budget_item', 'B02') == ('660301', '办公费')
+    version = cache.version
+    # 水位没变时只查水位，不合并
+    cache._checked_at = 0
+    cache.get('budget_item', 'B01')
+    assert cache.version == version
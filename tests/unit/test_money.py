@@ -0,0 +1,28 @@
+from decimal import Decimal
+import pytest
+from app.utils.money import format_amount, sum_cents, to_cents, to_yuan
+
+
+def test_to_cents_rounds_half_up_on_decimal_value():
+    """测试元转分按十进制四舍五入，不受浮点误差影响"""
+    assert to_cents(100.1) == 10010
+    assert to_cents(0.285) == 29
+    assert to_cents(1.005) == 101
+    assert to_cents(-2.675) == -268
+    assert to_cents('1,234.5') == 123450
+    assert to_cents(Decimal('0.004')) == 0
+    assert to_cents(7) == 700
+    assert to_cents(None) is None
+    with pytest.raises(ValueError):
+        to_cents(float('nan'))
+    with pytest.raises(ValueError):
+        to_cents('abc')
+
+
+def test_cents_round_trip_and_sum():
+    """测试分转元、格式化和精确求和"""
+    assert to_yuan(10010) == Decimal('100.10')
+    assert float(to_yuan(30)) == 0.3
+    assert format_amount(123456789) == '1,234,567.89'
+    assert format_amount(None) == '0.00'
+    assert sum_cents([0.1, 0.2, None]) == 30
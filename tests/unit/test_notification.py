@@ -0,0 +1,130 @@
+import smtplib
+import time
+from datetime import date
+import pytest
+from config import config
+from app.models.database import db
+from app.models.master_data import master_data
+from app.controllers.booking import save_voucher
+from app.controllers.expense import submit_expense
+from app.controllers.notification import LEASE_SECONDS, MailSender, claim_messages, outbox_summary
+from tests.unit.test_booking import add_expenses, make_line
+
+
+class FakeSMTP:
+    """记录发出的邮件；fail_after 封之后断开连接"""
+    connections = []
+    fail_after = None
+
+    def __init__(self, host, port, timeout=None):
+        self.messages = []
+        FakeSMTP.connections.append(self)
+
+    def starttls(self, context=None):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def send_message(self, message):
+        if message['To'] == 'bad@example.com':
+            raise smtplib.SMTPRecipientsRefused({message['To']: (550, b'no such user')})
+        if FakeSMTP.fail_after is not None and len(self.messages) >= FakeSMTP.fail_after:
+            raise smtplib.SMTPServerDisconnected("connection lost")
+        self.messages.append(message)
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def mail_enabled(monkeypatch):
+    monkeypatch.setattr(config['default'], 'MAIL_SERVER', 'smtp.example.com')
+    FakeSMTP.connections, FakeSMTP.fail_after = [], None
+    with db.get_connection() as conn:
+        conn.executemany("INSERT INTO config (key, code, description, sap_code, sap_description) VALUES (?, ?, ?, ?, ?)",
+                         [('employee', 'E1', '张三', 'E1', '张三'), ('employee', 'E2', '李四', 'E2', '李四'),
+                          ('employee', 'E3', '王五', 'E3', '王五')])
+        conn.executemany("INSERT INTO users (user_id, user_name, password, employee_code, email) VALUES (?, ?, 'x', ?, ?)",
+                         [('zhangsan', '张三', 'E1', 'zhangsan@example.com'), ('lisi', '李四', 'E2', 'bad@example.com'),
+                          ('wangwu', '王五', 'E3', None)])
+        conn.commit()
+    master_data.invalidate()
+    yield
+    with db.get_connection() as conn:
+        for table in ('mail_events', 'mail_outbox', 'sap_postings', 'entry', 'expense_bookings', 'expenses', 'config'):
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute("DELETE FROM users WHERE user_id IN ('zhangsan', 'lisi', 'wangwu')")
+        conn.commit()
+    master_data.invalidate()
+
+
+def make_sender(**kwargs):
+    return MailSender('smtp.example.com', username='notify@example.com', smtp_factory=FakeSMTP, batch_size=10,
+                      **kwargs)
+
+
+def test_events_digested_per_recipient_and_sent_on_one_connection():
+    """测试提交和记账只写通知事件；摘要按报销人汇总，一批邮件复用一个连接，被拒收的直接失败"""
+    for employee in ('E1', 'E2', 'E3'):
+        submit_expense(date(2026, 10, 1), 'D1', 'C1', 'B1', employee, 88.5, '出租车', control='off')
+    # add_expenses 返回表中全部报销，去掉前面提交的3笔
+    ids = add_expenses(12)[3:]
+    save_voucher([make_line(eid, debit=100.0) for eid in ids] + [make_line(None, credit=1200.0)])
+    with db.get_connection() as conn:
+        assert outbox_summary(conn) == {'pending': 0, 'sending': 0, 'failed': 0, 'events': 15}
+
+    sender = make_sender(digest_interval=3600, digest_max_items=5)
+    # 未到摘要间隔不生成邮件
+    assert sender.run_once() == 0
+    assert sender.run_once(force_digest=True) == 2
+    assert len(FakeSMTP.connections) == 1
+    message, = FakeSMTP.connections[0].messages
+    assert message['To'] == 'zhangsan@example.com' and message['Subject'] == "报销通知：12 笔已记账，1 笔已提交"
+    body = message.get_content()
+    assert "以下 12 笔报销已记账，合计 1,200.00 元" in body and "另有 7 笔未列出" in body
+    with db.get_connection() as conn:
+        assert outbox_summary(conn) == {'pending': 0, 'sending': 0, 'failed': 1, 'events': 0}
+    assert sender.stats()['sent'] == 1
+
+
+def test_disconnect_retries_rest_of_batch_with_backoff():
+    """测试连接中途断开时本批剩余邮件退避后重发"""
+    with db.get_connection() as conn:
+        conn.executemany("INSERT INTO mail_outbox (recipient, subject, body) VALUES (?, '报销通知', '正文')",
+                         [(f"user{i}@example.com",) for i in range(4)])
+        conn.commit()
+    FakeSMTP.fail_after = 2
+    sender = make_sender(retry_base=60)
+    assert sender.run_once() == 4
+    with db.get_connection() as conn:
+        rows = conn.execute("SELECT status, attempts, last_error FROM mail_outbox ORDER BY id").fetchall()
+        assert [row['status'] for row in rows] == ['sent', 'sent', 'pending', 'pending']
+        assert 'connection lost' in rows[2]['last_error']
+        conn.execute("UPDATE mail_outbox SET next_attempt_at = 0")
+        conn.commit()
+    FakeSMTP.fail_after = None
+    assert sender.run_once() == 2
+    assert len(FakeSMTP.connections) == 2 and sender.stats()['sent'] == 4
+
+
+def test_result_of_expired_claim_not_written_back():
+    """测试租约过期被重新领取后，旧批次的发送结果不覆盖新批次"""
+    with db.get_connection() as conn:
+        conn.execute("INSERT INTO mail_outbox (recipient, subject, body) VALUES ('user@example.com', '报销通知', '正文')")
+        conn.commit()
+        now = time.time()
+        first = claim_messages(conn, 10, now)
+        second = claim_messages(conn, 10, now + LEASE_SECONDS + 1)
+    assert [message[0] for message in first] == [message[0] for message in second]
+    sender = make_sender()
+    assert sender.send(first) == (0, 0)
+    assert sender.stats()['stale'] == 1
+    with db.get_connection() as conn:
+        assert tuple(conn.execute("SELECT status, attempts FROM mail_outbox").fetchone()) == ('sending', 2)
+    assert sender.send(second) == (1, 0)
+    with db.get_connection() as conn:
+        assert outbox_summary(conn) == {'pending': 0, 'sending': 0, 'failed': 0, 'events': 0}
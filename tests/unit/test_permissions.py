@@ -0,0 +1,55 @@
+import pytest
+from app.models.database import db
+from app.models.permissions import RolePermissionCache
+from app.utils.security import check_permission
+
+
+@pytest.fixture
+def cache():
+    """新建一个只有查看权限的角色"""
+    with db.get_connection() as conn:
+        conn.execute("INSERT INTO roles (role_name, description) VALUES ('viewer', '只读')")
+        conn.execute("""
+            INSERT INTO role_permissions (role_id, permission_id)
+            SELECT r.id, p.id FROM roles r, permissions p
+            WHERE r.role_name = 'viewer' AND p.module_name = 'expense' AND p.permission_name = 'view'
+        """)
+        conn.commit()
+        role_id = conn.execute("SELECT id FROM roles WHERE role_name='viewer'").fetchone()[0]
+    yield RolePermissionCache(db), role_id
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM role_permissions WHERE role_id=?", (role_id,))
+        conn.execute("DELETE FROM roles WHERE id=?", (role_id,))
+        conn.commit()
+
+
+def test_role_mask_resolves_permissions(cache, monkeypatch):
+    """测试角色权限位图与按位鉴权"""
+    cache, role_id = cache
+    monkeypatch.setattr('app.models.permissions.permission_cache', cache)
+    with db.get_connection() as conn:
+        admin_id = conn.execute("SELECT id FROM roles WHERE role_name='admin'").fetchone()[0]
+    admin = cache.mask_of(admin_id)
+    viewer = cache.mask_of(role_id)
+    assert check_permission(admin, 'expense.book') and check_permission(admin, 'role.manage')
+    assert check_permission(viewer, 'expense.view')
+    assert not check_permission(viewer, 'expense.book')
+    assert not check_permission(admin, 'expense.delete')
+    assert not check_permission(admin, 'expense')
+    assert cache.mask_of(-1) == 0
+
+
+def test_invalidate_reloads_role_permissions(cache):
+    """测试角色权限修改后失效缓存才生效"""
+    cache, role_id = cache
+    before = cache.mask_of(role_id)
+    with db.get_connection() as conn:
+        conn.execute("""
+            INSERT INTO role_permissions (role_id, permission_id)
+            SELECT ?, id FROM permissions WHERE module_name = 'expense' AND permission_name = 'export'
+        """, (role_id,))
+        conn.commit()
+    assert cache.mask_of(role_id) == before
+    cache.invalidate()
+    assert cache.version == 1
+    assert cache.mask_of(role_id) == before | cache.bit('expense', 'export')
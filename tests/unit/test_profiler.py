@@ -0,0 +1,53 @@
+import sqlite3
+import pytest
+from app.models import query_stats as qs
+from app.models.query_stats import InstrumentedConnection, QueryStats
+from app.utils.profiler import PageProfiler
+
+
+class RerunException(BaseException):
+    """与 Streamlit 同名的重跑异常"""
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = QueryStats(slow_ms=None)
+    monkeypatch.setattr(qs, 'query_stats', stats)
+    monkeypatch.setattr('app.utils.profiler.query_stats', stats)
+    return stats
+
+
+def test_rerun_recorded_with_db_time_and_session_size(stats, tmp_path):
+    """测试每次重跑记录数据库语句数、控件数和会话状态，提前中断的重跑也记录"""
+    profiler = PageProfiler(enabled=True, profile_dir=str(tmp_path))
+    conn = sqlite3.connect(':memory:', factory=InstrumentedConnection)
+    session = {'identity': 'u1', 'rows': list(range(10000))}
+    with profiler.profile('报销查看', 'u1', session, lambda: 7):
+        conn.execute("SELECT 1").fetchall()
+        conn.execute("SELECT 2").fetchall()
+    with pytest.raises(RerunException):
+        with profiler.profile('报销记账', 'u1', session):
+            raise RerunException()
+    runs = profiler.runs()
+    assert runs['页面'].tolist() == ['报销记账', '报销查看']
+    assert runs['结果'].tolist() == ['重跑', '完成']
+    first = runs.iloc[1]
+    assert (first['语句数'], first['控件数'], first['会话键数'], first['最大会话键']) == (2, 7, 2, 'rows')
+    assert first['总耗时(毫秒)'] >= first['数据库耗时(毫秒)']
+    assert profiler.summary().set_index('页面')['重跑次数'].to_dict() == {'报销查看': 1, '报销记账': 1}
+    conn.close()
+
+
+def test_capture_saves_pstats_and_prunes(stats, tmp_path):
+    """测试采集 cProfile 时保存 .pstats 文件，只保留最近的若干个；关闭时不记录"""
+    profiler = PageProfiler(enabled=True, capture=True, profile_dir=str(tmp_path), keep=2)
+    for _ in range(3):
+        with profiler.profile('报销看板'):
+            sorted(range(1000), key=lambda x: -x)
+    files = profiler.profile_files()
+    assert len(files) == 2 and files == profiler.runs()['分析文件'].head(2).tolist()
+    assert 'sorted' in profiler.top_functions(files[0])
+    profiler.enabled = False
+    with profiler.profile('报销看板'):
+        pass
+    assert len(profiler.runs()) == 3
@@ -0,0 +1,79 @@
+import re
+import pytest
+from datetime import date
+from app.models.database import db
+from app.models.queries import (
+    PENDING_EXPENSES_SQL, LAST_VOUCHER_SQL, build_expense_search, build_expense_summary, build_entry_search,
+    build_pending_search, build_pending_ids, build_pending_by_ids, build_auto_booking_source,
+    build_spend_summary, build_budget_report, build_trial_balance, BUDGET_CHECK_SQL, UNBALANCED_VOUCHERS_SQL
+)
+
+# (用例名, (sql, params), 主表必须使用的索引)
+HOT_QUERIES = [
+    ('报销查看-全部', build_expense_search(), 'idx_expenses_date'),
+    ('报销查看-本人', build_expense_search(owner='EMP001'), 'idx_expenses_employee_date'),
+    ('报销查看-部门', build_expense_search(department='DEPT001'), 'idx_expenses_department_date'),
+    ('报销查看-公司', build_expense_search(company='COMP001'), 'idx_expenses_company_date'),
+    ('报销查看-预算科目', build_expense_search(budget_item='BUDGET001'), 'idx_expenses_budget_item_date'),
+    ('报销查看-金额', build_expense_search(min_amount=100, max_amount=500), 'idx_expenses_date'),
+    ('报销查看-翻页', build_expense_search(after=('2025-01-31', 100), limit=51), 'idx_expenses_date'),
+    ('报销查看-本人翻页', build_expense_search(after=('2025-01-31', 100), limit=51, owner='EMP001'),
+     'idx_expenses_employee_date'),
+    ('报销查看-部门汇总', build_expense_summary(department='DEPT001'), 'idx_expenses_department_date'),
+    ('报销记账-待记账', (PENDING_EXPENSES_SQL, []), 'idx_expenses_status_date'),
+    ('报销记账-期间翻页', build_pending_search(after=('2025-01-31', 100), limit=51, company='COMP001',
+                                          date_from=date(2025, 1, 1), date_to=date(2025, 1, 31)),
+     'idx_expenses_company_date'),
+    ('报销记账-全选', build_pending_ids(department='DEPT001'), 'idx_expenses_department_date'),
+    ('报销记账-期间全选', build_pending_ids(date_from=date(2025, 1, 1)), 'idx_expenses_status_date'),
+    ('报销记账-已选', build_pending_by_ids([3, 1, 2]), 'INTEGER PRIMARY KEY'),
+    ('自动记账-公司期间', build_auto_booking_source(company='COMP001', date_from=date(2025, 1, 1),
+                                              date_to=date(2025, 1, 31)), 'idx_expenses_company_date'),
+    ('自动记账-期间', build_auto_booking_source(date_from=date(2025, 1, 1)), 'idx_expenses_status_date'),
+    ('报销看板-期间', build_spend_summary(('department', 'budget_item'), period_from='2025-01', period_to='2025-12'),
+     'PRIMARY KEY'),
+    ('报销采集-预算校验', (BUDGET_CHECK_SQL, ['2025-01', 'DEPT001', 'BUDGET001']), 'PRIMARY KEY'),
+    ('主数据管理-预算执行', build_budget_report('2025-01', 'DEPT001'), 'PRIMARY KEY'),
+    ('报销查看-摘要关键字', build_expense_search(limit=51, keyword='客户招待'), 'idx_expenses_date'),
+    ('报销查看-摘要关键字（少量命中）', build_expense_search(limit=51, keyword='客户招待', selective=True),
+     'INTEGER PRIMARY KEY'),
+    ('记账查看-关键字', build_entry_search(keyword='差旅费', employee='张三丰'), 'INTEGER PRIMARY KEY'),
+    ('报销记账-最新凭证号', (LAST_VOUCHER_SQL, []), 'idx_entry_voucher'),
+    ('记账查看-全部', build_entry_search(), 'idx_entry_voucher'),
+    ('记账查看-凭证号', build_entry_search(voucher_no='100001'), 'idx_entry_voucher'),
+    ('记账查看-日期', build_entry_search(date_from=date(2025, 1, 1), date_to=date(2025, 1, 31)),
+     'idx_entry_booking_date'),
+    ('记账查看-科目余额表', build_trial_balance(date(2025, 1, 1), date(2025, 1, 31)), 'idx_entry_booking_date'),
+    ('报销记账-借贷核对', (UNBALANCED_VOUCHERS_SQL, [100000, 100199]), 'idx_entry_voucher'),
+]
+
+
+def explain(sql, params):
+    with db.get_connection() as conn:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+@pytest.mark.parametrize('name, query, index', HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(name, query, index):
+    """测试热点查询不退化为全表扫描"""
+    plan = explain(*query)
+    # 不带索引的 SCAN 即全表扫描；扫描子查询结果（CO-ROUTINE/MATERIALIZE）不算
+    subqueries = {m.group(1) for line in plan for m in [re.match(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)$', line)] if m}
+    full_scans = [line for line in plan if re.match(r'^SCAN (\w+)$', line) and line[5:] not in subqueries]
+    assert not full_scans, f"{name} 出现全表扫描: {plan}"
+    assert any(index in line for line in plan), f"{name} 未使用 {index}: {plan}"
+
+
+def test_config_joins_use_covering_index():
+    """测试四路主数据关联走覆盖索引"""
+    plan = explain(*build_expense_search())
+    joins = [line for line in plan if 'LEFT-JOIN' in line]
+    assert len(joins) == 4
+    assert all('COVERING INDEX idx_config_lookup' in line for line in joins)
+
+
+def test_unfiltered_listings_need_no_sort():
+    """测试无筛选的列表直接按索引顺序输出，不需要临时排序"""
+    for sql, params in (build_expense_search(), (PENDING_EXPENSES_SQL, []), build_pending_search(limit=51),
+                        build_entry_search()):
+        assert not any('TEMP B-TREE' in line for line in explain(sql, params))
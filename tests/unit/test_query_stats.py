@@ -0,0 +1,66 @@
+import sqlite3
+import pandas as pd
+import pytest
+from app.models import query_stats as qs
+from app.models.query_stats import InstrumentedConnection, QueryStats, RowInstrumentedConnection
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    """每个测试使用独立的统计对象和内存库"""
+    stats = QueryStats(slow_ms=None)
+    monkeypatch.setattr(qs, 'query_stats', stats)
+    conn = sqlite3.connect(':memory:', factory=InstrumentedConnection)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO t (name) VALUES (?)", [('a',), ('b',), ('c',)])
+    yield stats, conn
+    conn.close()
+
+
+def row_of(stats, statement):
+    report = stats.report().set_index('语句')
+    return report.loc[statement]
+
+
+def test_statements_counted_with_rows_and_site(stats):
+    """测试语句按规范化文本聚合，查询的返回行数在取数后计入"""
+    stats, conn = stats
+    conn.execute("SELECT * FROM t WHERE id IN (?, ?)", (1, 2)).fetchall()
+    conn.execute("SELECT *   FROM t WHERE id IN (?,?,?)", (1, 2, 3)).fetchall()
+    for _ in conn.execute("SELECT name FROM t"):
+        pass
+    pd.read_sql_query("SELECT name FROM t", conn)
+    row = row_of(stats, "SELECT * FROM t WHERE id IN (?, ...)")
+    assert (row['调用次数'], row['返回行数']) == (2, 5)
+    assert row['调用位置'].startswith('tests/unit/test_query_stats.py:')
+    # 直接迭代的游标不逐行计数，只计执行
+    row = row_of(stats, "SELECT name FROM t")
+    assert (row['调用次数'], row['返回行数']) == (2, 3)
+    assert row_of(stats, "INSERT INTO t (name) VALUES (?)")['返回行数'] == 3
+
+
+def test_row_instrumentation_opt_in(stats, monkeypatch):
+    """测试逐行统计默认关闭，打开后迭代取数也计入返回行数"""
+    stats, _ = stats
+    assert qs.connection_factory() is InstrumentedConnection
+    monkeypatch.setattr(qs.config['default'], 'DB_QUERY_STATS_ROWS', True)
+    assert qs.connection_factory() is RowInstrumentedConnection
+    conn = sqlite3.connect(':memory:', factory=RowInstrumentedConnection)
+    try:
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT INTO t (id) VALUES (?)", [(1,), (2,), (3,)])
+        for _ in conn.execute("SELECT id FROM t"):
+            pass
+        assert row_of(stats, "SELECT id FROM t")['返回行数'] == 3
+    finally:
+        conn.close()
+
+
+def test_slow_queries_logged(stats):
+    """测试超过阈值的语句进入慢查询列表"""
+    stats, conn = stats
+    stats.slow_ms = 0
+    conn.execute("UPDATE t SET name = 'x' WHERE id = 1")
+    slow = stats.slow_queries()
+    assert slow['语句'].tolist() == ["UPDATE t SET name = 'x' WHERE id = 1"]
+    assert stats.histogram("UPDATE t SET name = 'x' WHERE id = 1").sum() == 1
@@ -0,0 +1,119 @@
+import time
+import pytest
+from app.models.database import db
+from app.controllers.booking import save_voucher
+from app.controllers.sap_posting import SapClient, SapPostingWorker, idempotency_key, posting_summary, retry_failed
+from scripts.sap_stub import SapStub
+from tests.unit.test_booking import add_expenses, make_line
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    yield
+    with db.get_connection() as conn:
+        for table in ('sap_postings', 'entry', 'expense_bookings', 'expenses'):
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+
+
+@pytest.fixture
+def stub():
+    stub = SapStub(port=0, user='rfc', password='secret', seed=1).start()
+    yield stub
+    stub.stop()
+
+
+def make_worker(stub, **kwargs):
+    client = SapClient(stub.url, 'rfc', 'secret', timeout=5)
+    return SapPostingWorker(client, batch_size=kwargs.pop('batch_size', 2), workers=2, **kwargs)
+
+
+def postings():
+    with db.get_connection() as conn:
+        return {row['voucher_no']: dict(row) for row in conn.execute("SELECT * FROM sap_postings")}
+
+
+def save_vouchers(count):
+    ids = add_expenses(count)
+    return [save_voucher([make_line(eid, debit=100.0), make_line(None, credit=100.0)]).voucher_no for eid in ids]
+
+
+def test_vouchers_posted_in_batches_once(stub):
+    """测试保存的凭证进入队列，分批过账并记录SAP凭证号；重发同一凭证SAP不重复过账"""
+    voucher_nos = save_vouchers(5)
+    assert {row['status'] for row in postings().values()} == {'pending'}
+    worker = make_worker(stub)
+    assert worker.run_once() == 5
+    rows = postings()
+    assert {row['status'] for row in rows.values()} == {'posted'}
+    assert stub.requests == 3 and len(stub.documents) == 5
+    assert rows[voucher_nos[0]]['sap_document'] == stub.documents[idempotency_key(voucher_nos[0])]
+    # 回写结果前进程退出：租约到期后重新领取发送，SAP按幂等键返回原凭证号
+    with db.get_connection() as conn:
+        conn.execute("UPDATE sap_postings SET status='sending', next_attempt_at=0, sap_document=NULL")
+        conn.commit()
+    assert worker.run_once() == 5
+    assert len(stub.documents) == 5
+    assert postings()[voucher_nos[0]]['sap_document'] == stub.documents[idempotency_key(voucher_nos[0])]
+
+
+def test_late_result_after_lease_expiry_not_written_back(stub):
+    """测试租约过期被其他批次重新领取后，原批次迟到的结果不覆盖新批次的状态"""
+    voucher_no, = save_vouchers(1)
+    worker = make_worker(stub, lease_seconds=60)
+    now = time.time()
+    late = worker._claim(now)
+    current = worker._claim(now + 61)
+    assert late.batch_id != current.batch_id
+    assert worker.send(late) == (0, 0)
+    row = postings()[voucher_no]
+    assert (row['status'], row['batch_id'], row['sap_document']) == ('sending', current.batch_id, None)
+    assert worker.stats()['stale'] == 1
+    assert worker.send(current) == (1, 0)
+    assert postings()[voucher_no]['status'] == 'posted' and len(stub.documents) == 1
+
+
+def test_failures_retried_with_backoff_then_marked_failed(stub):
+    """测试接口不可用时按退避重试，超过次数标记失败；SAP拒绝的凭证直接失败，可手工重新排队"""
+    voucher_no, = save_vouchers(1)
+    worker = make_worker(stub, max_attempts=2, retry_base=60)
+    stub.fail_rate = 1
+    worker.run_once()
+    row = postings()[voucher_no]
+    assert (row['status'], row['attempts']) == ('pending', 1)
+    assert 30 <= row['next_attempt_at'] - time.time() <= 60 and '503' in row['last_error']
+    # 未到重试时间不会领取
+    assert worker.run_once() == 0
+    with db.get_connection() as conn:
+        conn.execute("UPDATE sap_postings SET next_attempt_at=0")
+        conn.commit()
+    worker.run_once()
+    assert (postings()[voucher_no]['status'], postings()[voucher_no]['attempts']) == ('failed', 2)
+
+    stub.fail_rate, stub.reject_rate = 0, 1
+    assert retry_failed() == 1
+    worker.run_once()
+    row = postings()[voucher_no]
+    assert (row['status'], row['last_error']) == ('failed', '模拟拒绝：成本中心已冻结')
+    stub.reject_rate = 0
+    retry_failed([voucher_no])
+    worker.run_once()
+    assert postings()[voucher_no]['status'] == 'posted'
+    with db.get_connection() as conn:
+        assert posting_summary(conn) == {'pending': 0, 'sending': 0, 'failed': 0, 'oldest': None}
+
+
+def test_background_worker_posts_after_notify(stub):
+    """测试后台线程被唤醒后并发发送"""
+    worker = make_worker(stub, poll_interval=5)
+    assert worker.start()
+    try:
+        save_vouchers(6)
+        worker.notify()
+        deadline = time.time() + 5
+        while time.time() < deadline and any(row['status'] != 'posted' for row in postings().values()):
+            time.sleep(0.05)
+        assert {row['status'] for row in postings().values()} == {'posted'}
+    finally:
+        worker.stop()
+    assert not worker.running and worker.stats()['posted'] == 6
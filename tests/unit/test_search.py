@@ -0,0 +1,66 @@
+import pytest
+from app.models.database import db
+from app.models.queries import build_expense_search, build_entry_search, is_selective_keyword
+
+
+@pytest.fixture(autouse=True)
+def data():
+    """报销摘要和记账分录的检索样例"""
+    with db.get_connection() as conn:
+        conn.executemany("INSERT INTO expenses (expense_date, amount_cents, description) VALUES (?, ?, ?)", [
+            ('2025-01-01', 1000, '北京出差住宿费'),
+            ('2025-01-02', 2000, '上海客户招待餐费'),
+            ('2025-01-03', 3000, '北京客户招待餐费'),
+            ('2025-01-04', 4000, '折扣100%_返还'),
+        ])
+        conn.executemany("""
+            INSERT INTO entry (voucher_no, entry_type, sap_account_code, sap_account_desc, sap_employee_desc)
+            VALUES (?, ?, ?, ?, ?)
+        """, [
+            (100000, 'debit', '660201', '差旅费', '张三丰'),
+            (100000, 'credit', '22411', '其他应付款-员工', '张三丰'),
+            (100001, 'debit', '660301', '业务招待费', '张三'),
+            (100001, 'credit', '22411', '其他应付款-员工', '张三'),
+        ])
+        conn.commit()
+    yield
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM expenses")
+        conn.execute("DELETE FROM entry")
+        conn.commit()
+
+
+def descriptions(keyword, **kwargs):
+    with db.get_connection() as conn:
+        return [row['摘要'] for row in conn.execute(*build_expense_search(keyword=keyword, **kwargs))]
+
+
+def test_expense_keyword_search_follows_changes():
+    """测试摘要检索（全文索引与短关键字LIKE）随增删改同步"""
+    assert descriptions('客户招待') == ['北京客户招待餐费', '上海客户招待餐费']
+    assert descriptions('客户招待', selective=True) == ['北京客户招待餐费', '上海客户招待餐费']
+    assert descriptions('北京') == ['北京客户招待餐费', '北京出差住宿费']
+    assert descriptions('0%_') == ['折扣100%_返还']
+    with db.get_connection() as conn:
+        conn.execute("UPDATE expenses SET description='上海培训报名费' WHERE description LIKE '上海%'")
+        conn.execute("DELETE FROM expenses WHERE description='北京出差住宿费'")
+        conn.commit()
+        assert is_selective_keyword(conn, '客户招待')
+        assert not is_selective_keyword(conn, '北京')
+    assert descriptions('客户招待') == ['北京客户招待餐费']
+    assert descriptions('培训报名') == ['上海培训报名费']
+    assert descriptions('出差住宿') == []
+
+
+def test_entry_search_uses_fts_and_ranks_keyword():
+    """测试记账查看按科目/员工检索，关键字按相关度排序"""
+    with db.get_connection() as conn:
+        def accounts(**filters):
+            return [(row['SAP科目'], row['员工姓名']) for row in conn.execute(*build_entry_search(**filters))]
+
+        assert accounts(sap_account_code='6602') == [('660201', '张三丰')]
+        assert accounts(employee='张三丰') == [('660201', '张三丰'), ('22411', '张三丰')]
+        # 两个字的姓名退回LIKE，张三丰也包含“张三”
+        assert len(accounts(employee='张三')) == 4
+        assert accounts(keyword='招待费') == [('660301', '张三')]
+        assert accounts(keyword='其他应付', employee='张三丰') == [('22411', '张三丰')]